@@ -1,15 +1,50 @@
-import datetime
+import asyncio
+import fastapi
 import gradio as gr
 import ollama
-import re
+import os
+import secrets
 import sys
+import threading
+import time
+import uuid
 import yaml
 
+from contextlib import aclosing
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pathlib import Path
-from typing import Iterator
-
-from memory import Memory
+from typing import Any, AsyncIterator
+
+from backend_pool import AsyncPoolClient, BackendPool, PoolClient, create_backend_pool
+from compare import CompareResult, fan_out
+from conversation_log import ConversationStore
+from memory import Memory, MessageView
+from metrics import MetricsRegistry, MetricsServer
+from model_catalogue import ModelCatalogue
 from ollama_llm import OllamaLLM
+from openai_api import (
+    ApiSession,
+    ApiSessionStore,
+    ChatRequest,
+    finish_reason,
+    format_chunk,
+    format_completion,
+    format_error,
+    format_event,
+    format_usage_chunk,
+    new_completion_id,
+    parse_chat_request,
+)
+from prompt_builder import PromptBuilder
+from residency import ResidencyManager
+from response_cache import ResponseCache
+from retrieval import HashingEmbedder, OllamaEmbedder, Retriever
+from scheduler import QueueFullError, RequestScheduler, Ticket
+from session_manager import SessionManager
+from streaming import ResponseBuffer, StreamCoalescer, render_response
+from summarizer import ConversationSummarizer
+from token_estimator import TokenCalibrator
 
 
 # 读取 config.yaml 文件内容，并据此初始化默认配置（DEFAULT_CONFIG）
@@ -36,18 +71,316 @@ except Exception as e:
     sys.exit(1)
 
 
-# 创建 Ollama 客户端，并检查 Ollama 服务端是否可访问
-OLLAMA_CLIENT: ollama.Client = ollama.Client(
-    host=f"http://{str(DEFAULT_CONFIG["ip"])}:{int(DEFAULT_CONFIG["port"])}",
-    headers={"x-some-header": "some-value"},
+# 创建 Ollama 节点池，在后台检查节点是否可访问，不阻塞启动
+# config.yaml 中没有 backends 配置项时，只使用 ip / port 指定的一个节点
+BACKEND_POOL: BackendPool = create_backend_pool(DEFAULT_CONFIG)
+# 代替 ollama.Client / ollama.AsyncClient，每次请求发送到负载最低的健康节点
+OLLAMA_CLIENT: PoolClient = PoolClient(BACKEND_POOL)
+# 异步客户端，所有会话在同一个事件循环上流式生成
+OLLAMA_ASYNC_CLIENT: AsyncPoolClient = AsyncPoolClient(BACKEND_POOL)
+
+
+def get_health() -> dict[str, Any]:
+    """获取应用的健康状态，供容器的就绪检查使用
+
+    :return: status 为节点池的状态（starting / ready / degraded / unavailable），
+        ready 为是否至少有一个健康的节点，backends 为每个节点的地址和健康状态
+    :rtype: dict[str, Any]
+    """
+    state: str = BACKEND_POOL.get_state()
+
+    return {
+        "status": state,
+        "ready": state in ("ready", "degraded"),
+        "backends": [
+            {"host": stats["host"], "healthy": stats["healthy"]}
+            for stats in BACKEND_POOL.get_stats()
+        ],
+    }
+
+
+def get_backend_status() -> str:
+    """生成界面顶部显示的 Ollama 服务状态
+
+    :return: 所有节点健康时为空字符串，否则为提示信息
+    :rtype: str
+    """
+    health: dict[str, Any] = get_health()
+    healthy: int = sum(backend["healthy"] for backend in health["backends"])
+    total: int = len(health["backends"])
+
+    if health["status"] == "starting":
+        return "*Connecting to the Ollama service...*"
+    if health["status"] == "degraded":
+        return f"*Ollama service is degraded: {healthy}/{total} backends are available*"
+    if health["status"] == "unavailable":
+        return "*Ollama service is unavailable, retrying in the background*"
+
+    return ""
+
+
+# 界面顶部的 Ollama 服务状态的刷新间隔（秒），每个打开的页面各自定时刷新
+BACKEND_STATUS_INTERVAL: float = 15.0
+
+
+def refresh_backend_status(current: str) -> str | dict:
+    """定时刷新界面顶部显示的 Ollama 服务状态
+
+    :param current: 页面上正在显示的状态
+    :type current: str
+    :return: 状态有变化时为新的提示信息，否则为 gr.skip()，不更新页面
+    :rtype: str | dict
+    """
+    status: str = get_backend_status()
+
+    return gr.skip() if status == current else status
+
+
+# 模型目录缓存，所有会话共享，新会话创建 OllamaLLM 时不再每次请求模型列表
+CATALOGUE_CONFIG: dict = DEFAULT_CONFIG.get("catalogue") or {}
+MODEL_CATALOGUE: ModelCatalogue = ModelCatalogue(
+    OLLAMA_CLIENT, float(CATALOGUE_CONFIG.get("ttl_seconds", 60))
 )
 
-try:
-    OLLAMA_CLIENT.list()  # 如果 Ollama 服务端可以访问，则不会抛出异常
-    print(f"[INFO] Ollama service is available")
-except Exception as e:
-    print(f"[ERROR] Ollama service is unavailable: {e}")
-    sys.exit(1)
+
+# 模型驻留的配置，config.yaml 中没有 residency 配置项时使用默认值
+RESIDENCY_CONFIG: dict = DEFAULT_CONFIG.get("residency") or {}
+# 让非思考模型和思考模型常驻在每个节点上，在后台预热，不阻塞启动
+RESIDENCY_MANAGER: ResidencyManager = ResidencyManager(
+    BACKEND_POOL,
+    [DEFAULT_CONFIG["model"]["instruct"], DEFAULT_CONFIG["model"]["thinking"]],
+    RESIDENCY_CONFIG.get("keep_alive", "30m"),
+    DEFAULT_CONFIG["model"]["options"],
+    bool(RESIDENCY_CONFIG.get("preload", True)),
+    bool(RESIDENCY_CONFIG.get("pin", True)),
+    bool(RESIDENCY_CONFIG.get("unload_on_exit", False)),
+    float(RESIDENCY_CONFIG.get("check_interval_seconds", 30)),
+)
+
+
+# 提示词构建的配置，config.yaml 中没有 prompt 配置项时使用默认值
+PROMPT_CONFIG: dict = DEFAULT_CONFIG.get("prompt") or {}
+# 时间上下文的粒度，为 None 时不注入时间上下文
+TIME_GRANULARITY: str | None = PROMPT_CONFIG.get("time_granularity", "hour")
+# 上下文窗口滑动时重新填充的预算比例
+CONTEXT_REFILL: float = float(PROMPT_CONFIG.get("context_refill", 0.75))
+
+
+# 界面刷新的配置，config.yaml 中没有 ui 配置项时使用默认值
+UI_CONFIG: dict = DEFAULT_CONFIG.get("ui") or {}
+# 两次刷新对话窗口的最短时间间隔（秒）
+FLUSH_INTERVAL: float = float(UI_CONFIG.get("flush_interval_ms", 50)) / 1000
+# 累积多少个 token 后立即刷新对话窗口
+FLUSH_TOKENS: int = int(UI_CONFIG.get("flush_tokens", 32))
+
+
+# 生成超时的配置，config.yaml 中没有 timeout 配置项时使用默认值，配置项留空表示不限制
+TIMEOUT_CONFIG: dict = DEFAULT_CONFIG.get("timeout") or {}
+# 等待 Ollama 下一个分块（包括加载模型和首个 token）的最长时间（秒）
+IDLE_TIMEOUT: float | None = TIMEOUT_CONFIG.get("idle_seconds", 120)
+# 一次生成的最长时间（秒）
+TOTAL_TIMEOUT: float | None = TIMEOUT_CONFIG.get("total_seconds", 600)
+
+
+# 请求调度的配置，config.yaml 中没有 scheduler 配置项时使用默认值
+SCHEDULER_CONFIG: dict = DEFAULT_CONFIG.get("scheduler") or {}
+# 所有会话共享的请求调度器，限制同时发送给 Ollama 的生成请求数，并按会话公平排队
+REQUEST_SCHEDULER: RequestScheduler = RequestScheduler(
+    int(SCHEDULER_CONFIG.get("max_concurrency", 4)),
+    int(SCHEDULER_CONFIG.get("max_queue", 64)),
+)
+# 排队时刷新排队位置的时间间隔（秒）
+QUEUE_POLL_INTERVAL: float = 0.5
+
+
+# 对比模式的配置，config.yaml 中没有 compare 配置项时对比非思考模型和思考模型
+COMPARE_CONFIG: dict = DEFAULT_CONFIG.get("compare") or {}
+# 对比模式同时询问的 (模型, 思考模式开关)
+COMPARE_MODELS: list[tuple[str, bool]] = [
+    (entry["model"], bool(entry.get("think", False)))
+    for entry in COMPARE_CONFIG.get("models")
+    or [
+        {"model": DEFAULT_CONFIG["model"]["instruct"], "think": False},
+        {"model": DEFAULT_CONFIG["model"]["thinking"], "think": True},
+    ]
+]
+
+
+# 回答缓存的配置，config.yaml 中没有 cache 配置项时不启用
+CACHE_CONFIG: dict = DEFAULT_CONFIG.get("cache") or {}
+# 所有会话共享的回答缓存，只缓存温度为 0 的请求，为 None 时不缓存
+RESPONSE_CACHE: ResponseCache | None = None
+if CACHE_CONFIG.get("enabled", False):
+    RESPONSE_CACHE = ResponseCache(
+        int(CACHE_CONFIG.get("max_entries", 1024)),
+        CACHE_CONFIG.get("ttl_seconds", 3600),
+        (
+            Path(CACHE_CONFIG["directory"]).expanduser()
+            if CACHE_CONFIG.get("directory")
+            else None
+        ),
+    )
+
+
+# 生成指标的配置，config.yaml 中没有 metrics 配置项时使用默认值
+METRICS_CONFIG: dict = DEFAULT_CONFIG.get("metrics") or {}
+# 所有会话共享的生成指标，为 None 时不记录
+METRICS: MetricsRegistry | None = None
+# 指标端点，为 None 时不提供端点
+METRICS_SERVER: MetricsServer | None = None
+if METRICS_CONFIG.get("enabled", True):
+    METRICS = MetricsRegistry(
+        (
+            Path(METRICS_CONFIG["log_file"]).expanduser()
+            if METRICS_CONFIG.get("log_file")
+            else None
+        ),
+        bool(METRICS_CONFIG.get("log", True)),
+    )
+    # 指标端点只监听本机
+    if METRICS_CONFIG.get("port", 9464) is not None:
+        METRICS_SERVER = MetricsServer(
+            METRICS,
+            METRICS_CONFIG.get("host", "127.0.0.1"),
+            int(METRICS_CONFIG.get("port", 9464)),
+            get_health,
+            BACKEND_POOL.get_stats,
+            # 基准测试会替换 REQUEST_SCHEDULER，每次都读取当前的调度器
+            lambda: REQUEST_SCHEDULER.get_metrics(),
+            RESIDENCY_MANAGER.get_stats,
+            RESPONSE_CACHE.get_stats if RESPONSE_CACHE is not None else None,
+        )
+
+
+# 会话管理的配置，config.yaml 中没有 session 配置项时使用默认值
+SESSION_CONFIG: dict = DEFAULT_CONFIG.get("session") or {}
+# 所有会话共享的会话管理器，将闲置的会话换出到磁盘，限制所有会话常驻的内存
+SESSION_MANAGER: SessionManager = SessionManager(
+    (Path(SESSION_CONFIG["spill_dir"]) if SESSION_CONFIG.get("spill_dir") else None),
+    SESSION_CONFIG.get("idle_seconds", 600),
+    SESSION_CONFIG.get("max_chars", 50_000_000),
+    float(SESSION_CONFIG.get("check_interval_seconds", 30)),
+)
+
+
+# 滚动摘要的配置，config.yaml 中没有 summary 配置项时使用默认值
+SUMMARY_CONFIG: dict = DEFAULT_CONFIG.get("summary") or {}
+# 所有会话共享的滚动摘要，用非思考模型压缩移出上下文窗口的消息，为 None 时直接丢弃
+# 由 start_summarizer 在 Ollama 可用、能检查摘要模型后创建
+SUMMARIZER: ConversationSummarizer | None = None
+
+
+def start_summarizer() -> None:
+    """等待节点池发现健康的节点，检查摘要模型后启用滚动摘要
+
+    在后台线程中运行，不阻塞启动；摘要模型不存在时不启用滚动摘要，移出上下文窗口的消息直接丢弃
+
+    :returns: 无
+    :rtype: None
+    """
+    global SUMMARIZER
+
+    if not SUMMARY_CONFIG.get("enabled", True):
+        return
+
+    max_tokens: int = int(SUMMARY_CONFIG.get("max_tokens", 512))
+    max_input_tokens: int = int(SUMMARY_CONFIG.get("max_input_tokens", 4096))
+    summary_ollama_llm: OllamaLLM = OllamaLLM(
+        OLLAMA_CLIENT,
+        OLLAMA_ASYNC_CLIENT,
+        IDLE_TIMEOUT,
+        TOTAL_TIMEOUT,
+        RESIDENCY_MANAGER.get_keep_alive(),
+        MODEL_CATALOGUE,
+        RESPONSE_CACHE,
+    )
+    BACKEND_POOL.wait_available()
+    try:
+        summary_ollama_llm.set_model(DEFAULT_CONFIG["model"]["instruct"])
+        # 容纳提示词、待压缩的消息、当前摘要和新摘要
+        summary_ollama_llm.set_num_ctx(
+            max(2048, max_input_tokens + 2 * max_tokens + 512)
+        )
+    except ValueError as e:
+        print(f"[WARNING] Rolling summaries are disabled: {e}")
+        return
+    summary_ollama_llm.set_temperature(0.0)
+
+    SUMMARIZER = ConversationSummarizer(
+        summary_ollama_llm,
+        REQUEST_SCHEDULER,
+        max_tokens,
+        max_input_tokens,
+        session_manager=SESSION_MANAGER,
+    )
+
+
+# 检索记忆的配置，config.yaml 中没有 retrieval 配置项时不启用
+RETRIEVAL_CONFIG: dict = DEFAULT_CONFIG.get("retrieval") or {}
+# 所有会话共享的检索记忆，为 None 时不检索移出上下文窗口的早期对话
+RETRIEVER: Retriever | None = None
+if RETRIEVAL_CONFIG.get("enabled", False):
+    # 没有配置嵌入模型时使用本地的词袋向量
+    RETRIEVER = Retriever(
+        (
+            OllamaEmbedder(OLLAMA_ASYNC_CLIENT, RETRIEVAL_CONFIG["model"])
+            if RETRIEVAL_CONFIG.get("model")
+            else HashingEmbedder()
+        ),
+        # 嵌入请求与生成请求一样通过调度器排队，本地的词袋向量不占用 Ollama
+        REQUEST_SCHEDULER if RETRIEVAL_CONFIG.get("model") else None,
+        int(RETRIEVAL_CONFIG.get("top_k", 4)),
+        int(RETRIEVAL_CONFIG.get("max_tokens", 1024)),
+        float(RETRIEVAL_CONFIG.get("min_score", 0.5)),
+        int(RETRIEVAL_CONFIG.get("batch_size", 32)),
+        session_manager=SESSION_MANAGER,
+    )
+
+
+# 记忆模块的配置，config.yaml 中没有 memory 配置项时使用默认值
+MEMORY_CONFIG: dict = DEFAULT_CONFIG.get("memory") or {}
+# 每个会话保存的消息总字符数（包括思考过程）的上限，为 None 时不限制
+MEMORY_MAX_CHARS: int | None = MEMORY_CONFIG.get("max_chars", 1_000_000)
+
+
+def load_history_secret(directory: Path) -> str:
+    """读取对话目录中的密钥，不存在时生成一个
+
+    密钥文件只允许当前用户读写，已存在的密钥文件权限过宽时收紧为 0o600
+
+    :param directory: 对话日志所在的目录
+    :type directory: Path
+    :return: 密钥
+    :rtype: str
+    """
+    secret_path: Path = directory / ".secret"
+    try:
+        fd: int = os.open(secret_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        if secret_path.stat().st_mode & 0o077:
+            secret_path.chmod(0o600)
+    else:
+        with open(fd, "w", encoding="utf-8") as f:
+            f.write(secrets.token_hex(32))
+
+    return secret_path.read_text(encoding="utf-8").strip()
+
+
+# 对话日志的配置，config.yaml 中没有 history 配置项时使用默认值
+HISTORY_CONFIG: dict = DEFAULT_CONFIG.get("history") or {}
+# 所有会话共享的对话存储，为 None 时不保存对话日志
+CONVERSATION_STORE: ConversationStore | None = None
+if HISTORY_CONFIG.get("enabled", True):
+    CONVERSATION_STORE = ConversationStore(
+        Path(HISTORY_CONFIG.get("directory") or "~/.ollama-chat/history").expanduser(),
+        float(HISTORY_CONFIG.get("fsync_interval_ms", 1000)) / 1000,
+    )
+# 浏览器中保存对话 id 时使用的密钥，由 start_services 从对话目录读取，为 None 时 Gradio 随机生成
+HISTORY_SECRET: str | None = None
+
+
+# token 估计校准器，所有会话共享，按模型在线学习修正系数
+TOKEN_CALIBRATOR: TokenCalibrator = TokenCalibrator()
 
 
 # 隐藏 Chatbot 组件右上角的“垃圾桶”图标（适配中文界面和英文界面）
@@ -65,10 +398,10 @@ def create_memory() -> Memory:
     :return: 新创建的 Memory 实例，用从 system_prompt.md 读取的默认系统提示词做初始化
     :rtype: Memory
     """
-    memory: Memory = Memory()
+    memory: Memory = Memory(TOKEN_CALIBRATOR, MEMORY_MAX_CHARS)
     memory.set_system_message(DEFAULT_SYSTEM_PROMPT)
 
-    return memory
+    return SESSION_MANAGER.register(memory)
 
 
 def create_instruct_ollama_llm() -> OllamaLLM:
@@ -79,7 +412,15 @@ def create_instruct_ollama_llm() -> OllamaLLM:
     :return: 新创建的 OllamaLLM 实例，用从 config.yaml 读取的默认参数做初始化
     :rtype: OllamaLLM
     """
-    instruct_ollama_llm: OllamaLLM = OllamaLLM(OLLAMA_CLIENT)
+    instruct_ollama_llm: OllamaLLM = OllamaLLM(
+        OLLAMA_CLIENT,
+        OLLAMA_ASYNC_CLIENT,
+        IDLE_TIMEOUT,
+        TOTAL_TIMEOUT,
+        RESIDENCY_MANAGER.get_keep_alive(),
+        MODEL_CATALOGUE,
+        RESPONSE_CACHE,
+    )
     instruct_ollama_llm.set_model(DEFAULT_CONFIG["model"]["instruct"])
     instruct_ollama_llm.set_num_ctx(DEFAULT_CONFIG["model"]["options"]["num_ctx"])
     instruct_ollama_llm.set_temperature(
@@ -97,7 +438,15 @@ def create_thinking_ollama_llm() -> OllamaLLM:
     :return: 新创建的 OllamaLLM 实例，用从 config.yaml 读取的默认参数做初始化
     :rtype: OllamaLLM
     """
-    thinking_ollama_llm: OllamaLLM = OllamaLLM(OLLAMA_CLIENT)
+    thinking_ollama_llm: OllamaLLM = OllamaLLM(
+        OLLAMA_CLIENT,
+        OLLAMA_ASYNC_CLIENT,
+        IDLE_TIMEOUT,
+        TOTAL_TIMEOUT,
+        RESIDENCY_MANAGER.get_keep_alive(),
+        MODEL_CATALOGUE,
+        RESPONSE_CACHE,
+    )
     thinking_ollama_llm.set_model(DEFAULT_CONFIG["model"]["thinking"])
     thinking_ollama_llm.set_num_ctx(DEFAULT_CONFIG["model"]["options"]["num_ctx"])
     thinking_ollama_llm.set_temperature(
@@ -107,104 +456,463 @@ def create_thinking_ollama_llm() -> OllamaLLM:
     return thinking_ollama_llm
 
 
-def get_current_time_context() -> str:
-    """获取当前时间的上下文信息
+def create_compare_ollama_llm(model: str, instruct_ollama_llm: OllamaLLM) -> OllamaLLM:
+    """为对比模式的一个模型创建 OllamaLLM 实例
 
-    :returns: 当前时间的上下文信息字符串，包括日期（精确到日）、时间（精确到秒）、星期和周数
-    :rtype: str
+    :param model: ollama 模型 id
+    :type model: str
+    :param instruct_ollama_llm: 会话的非思考模型，沿用它在设置界面中设置的上下文窗口大小和温度
+    :type instruct_ollama_llm: OllamaLLM
+    :return: 新创建的 OllamaLLM 实例
+    :rtype: OllamaLLM
+    """
+    compare_ollama_llm: OllamaLLM = OllamaLLM(
+        OLLAMA_CLIENT,
+        OLLAMA_ASYNC_CLIENT,
+        IDLE_TIMEOUT,
+        TOTAL_TIMEOUT,
+        RESIDENCY_MANAGER.get_keep_alive(),
+        MODEL_CATALOGUE,
+        RESPONSE_CACHE,
+    )
+    compare_ollama_llm.set_model(model)
+    compare_ollama_llm.set_num_ctx(instruct_ollama_llm.get_num_ctx())
+    compare_ollama_llm.set_temperature(instruct_ollama_llm.get_temperature())
+
+    return compare_ollama_llm
+
+
+def create_prompt_builder() -> PromptBuilder:
+    """为会话创建 PromptBuilder 实例
+
+    :return: 新创建的 PromptBuilder 实例，用从 config.yaml 读取的时间粒度做初始化
+    :rtype: PromptBuilder
     """
-    now = datetime.datetime.now()
+    return PromptBuilder(TIME_GRANULARITY)
 
+
+def create_session() -> tuple[Memory, PromptBuilder, OllamaLLM, OllamaLLM]:
+    """打开页面时为会话创建记忆模块、提示词构建器、非思考模型和思考模型
+
+    :return: (记忆模块, 提示词构建器, 非思考模型, 思考模型)
+    :rtype: tuple[Memory, PromptBuilder, OllamaLLM, OllamaLLM]
+    """
     return (
-        f"# Time Context\n\n"
-        + f"Current date and time: {now.strftime('%Y-%m-%d %H:%M:%S')} "
-        + f"({now.strftime('%A')}, Week {now.strftime('%U')})."
+        create_memory(),
+        create_prompt_builder(),
+        create_instruct_ollama_llm(),
+        create_thinking_ollama_llm(),
+    )
+
+
+def calibrate_memory(memory: Memory, ollama_llm: OllamaLLM) -> None:
+    """用最近一次生成的 prompt_eval_count 校准记忆模块的 token 估计
+
+    :param memory: 记忆模块
+    :type memory: Memory
+    :param ollama_llm: 刚完成生成的模型
+    :type ollama_llm: OllamaLLM
+    :returns: 无
+    :rtype: None
+    """
+    prompt_eval_count: int | str | None = ollama_llm.get_last_stats().get(
+        "prompt_eval_count"
     )
 
+    if isinstance(prompt_eval_count, int):
+        memory.calibrate(ollama_llm.get_model(), prompt_eval_count)
+
+
+def record_generation(
+    ollama_llm: OllamaLLM,
+    notice: str | None,
+    timings: dict[str, float],
+    reuse: dict[str, int] | None = None,
+) -> None:
+    """记录一次生成的指标
+
+    :param ollama_llm: 生成回答的模型
+    :type ollama_llm: OllamaLLM
+    :param notice: 生成被中断的原因，正常结束时为 None
+    :type notice: str | None
+    :param timings: 应用测量的耗时（秒），指标名称 -> 值
+    :type timings: dict[str, float]
+    :param reuse: PromptBuilder.get_last_reuse 返回的前缀复用情况，与首 token 延迟一起记录，为 None 时不记录
+    :type reuse: dict[str, int] | None
+    :returns: 无
+    :rtype: None
+    """
+    if METRICS is None:
+        return
+
+    values: dict[str, float | int] = dict(timings)
+    if reuse:
+        values.update(reuse)
+        if reuse["total_chars"]:
+            values["prefix_reuse_ratio"] = reuse["reused_chars"] / reuse["total_chars"]
+    outcome: str = "interrupted"
+    if notice == "Generation timed out":
+        outcome = "timeout"
+    elif notice is None:
+        outcome = "cached" if ollama_llm.is_last_cached() else "ok"
+        # 被中断时 Ollama 没有返回统计信息
+        stats: dict[str, int | str] = ollama_llm.get_last_stats()
+        for count_field, duration_field, name in (
+            ("prompt_eval_count", "prompt_eval_duration", "prefill"),
+            ("eval_count", "eval_duration", "decode"),
+        ):
+            count: int | str | None = stats.get(count_field)
+            duration: int | str | None = stats.get(duration_field)
+            if not isinstance(count, int):
+                continue
+            values[f"{'prompt' if name == 'prefill' else 'completion'}_tokens"] = count
+            if isinstance(duration, int) and duration > 0:
+                values[f"{name}_tokens_per_second"] = count / (duration / 1e9)
+        load_duration: int | str | None = stats.get("load_duration")
+        if isinstance(load_duration, int):
+            values["load_seconds"] = load_duration / 1e9
+
+    METRICS.record(ollama_llm.get_model(), outcome, values)
+
+
+def commit_response(
+    memory: Memory, response: ResponseBuffer, notice: str | None
+) -> str:
+    """将 AI 响应保存到记忆模块
+
+    生成被中断时，在回答末尾追加提示；还没有生成回答时，用提示代替回答，
+    保证用户消息和 AI 消息始终交替出现
 
-def chat_stream(
+    :param memory: 记忆模块
+    :type memory: Memory
+    :param response: AI 响应缓冲区
+    :type response: ResponseBuffer
+    :param notice: 生成被中断的原因，正常结束时为 None
+    :type notice: str | None
+    :return: gradio.Chatbot 组件显示的 AI 响应
+    :rtype: str
+    """
+    thinking: str = response.get_thinking()
+    answer: str = response.get_answer()
+
+    if notice is not None:
+        answer = f"{answer}\n\n*[{notice}]*" if answer.strip() else f"*[{notice}]*"
+
+    # 回答和思考过程分开保存，只有回答发送给模型
+    memory.add_assistant_message(answer, thinking)
+
+    return render_response(thinking, answer)
+
+
+async def chat_stream(
     message: str,
     think: bool,
     memory: Memory,
+    prompt_builder: PromptBuilder,
     instruct_ollama_llm: OllamaLLM,
     thinking_ollama_llm: OllamaLLM,
-) -> Iterator[tuple[list[dict[str, str]], Memory, OllamaLLM, OllamaLLM]]:
+    request: gr.Request | None = None,
+) -> AsyncIterator[
+    tuple[list[dict[str, str]], Memory, PromptBuilder, OllamaLLM, OllamaLLM]
+]:
     """生成 AI 响应流
 
     返回 gradio.Chatbot 组件需要的输入
 
+    异步生成器，等待 Ollama 输出时不占用 Gradio 的工作线程；
+    token 按时间间隔和数量合并后再刷新对话窗口，首个 token 立即刷新；
+    点击停止按钮、关闭页面或超时都会关闭到 Ollama 的流，已生成的部分回答照常保存到记忆模块；
+    生成前先向请求调度器申请执行槽位，排队期间在对话窗口显示排队位置
+
     :param message: 用户消息
     :type message: str
     :param think: 思考模式开关
     :type think: bool
     :param memory: 记忆模块
     :type memory: Memory
+    :param prompt_builder: 提示词构建器
+    :type prompt_builder: PromptBuilder
     :param instruct_ollama_llm: 非思考模型
     :type instruct_ollama_llm: OllamaLLM
     :param thinking_ollama_llm: 思考模型
     :type thinking_ollama_llm: OllamaLLM
-    :return: (gradio.Chatbot 组件输入, 记忆模块, 非思考模型, 思考模型)
-    :rtype: Iterator[tuple[list[dict[str, str]], Memory, OllamaLLM, OllamaLLM]]
+    :param request: Gradio 自动传入的请求，用会话 id 区分排队的会话
+    :type request: gradio.Request | None
+    :return: (gradio.Chatbot 组件输入, 记忆模块, 提示词构建器, 非思考模型, 思考模型)
+    :rtype: AsyncIterator[tuple[list[dict[str, str]], Memory, PromptBuilder, OllamaLLM, OllamaLLM]]
+    :raises gradio.Error: 如果排队的请求数已达上限
     """
-    memory.add_user_message(message)
-    # 往系统提示词注入时间的上下文信息
-    system_prompt: str = memory.get_system_message()["content"]
-    system_prompt = f"{get_current_time_context()}\n\n" + system_prompt
-    memory.set_system_message(system_prompt)
-    # 根据对话历史列表更新 gradio.Chatbot 组件
-    history: list[dict[str, str]] = memory.get_history()
-    # 根据上下文窗口限制下获取的消息列表生成 AI 响应
-    context: list[dict[str, str]] = memory.get_context(
-        instruct_ollama_llm.get_num_ctx()
+    session_id: str = (
+        request.session_hash
+        if request is not None and request.session_hash
+        else str(id(memory))
     )
-    history.append({"role": "assistant", "content": ""})
-
-    yield (history, memory, instruct_ollama_llm, thinking_ollama_llm)
+    submitted: float = time.perf_counter()
+    # 应用测量的各阶段耗时（秒），生成结束时记录到生成指标
+    timings: dict[str, float] = {}
+    ollama_llm: OllamaLLM = thinking_ollama_llm if think else instruct_ollama_llm
+
+    # 使用期间会话不会被换出到磁盘
+    with SESSION_MANAGER.use(memory):
+        # 消息为空或放不下上下文窗口时立即报错，不修改记忆模块，也不占用排队位置
+        try:
+            memory.check_user_message(
+                message,
+                instruct_ollama_llm.get_num_ctx(),
+                ollama_llm.get_model(),
+                RETRIEVER.get_max_tokens() if RETRIEVER is not None else 0,
+            )
+        except ValueError as e:
+            raise gr.Error(str(e))
+        # 排队已满时立即拒绝，不修改记忆模块
+        try:
+            ticket = REQUEST_SCHEDULER.submit(session_id)
+        except QueueFullError:
+            raise gr.Error("The server is busy, please try again later")
+
+        history: list[dict[str, str]] = []
+        coalescer: StreamCoalescer = StreamCoalescer(FLUSH_INTERVAL, FLUSH_TOKENS)
+        # 思考过程和回答分别累积，刷新时才拼接成对话窗口显示的内容
+        response: ResponseBuffer = ResponseBuffer()
+        # 生成被中断的原因，正常结束时置为 None
+        notice: str | None = "Generation interrupted"
+        # 本次构建的消息列表复用上一次前缀的情况
+        reuse: dict[str, int] | None = None
+
+        # 从提交排队凭证起的任何异常都会经过 finally，释放执行槽位
+        try:
+            memory.add_user_message(message)
+            # 根据对话历史列表更新 gradio.Chatbot 组件
+            history = memory.get_history()
+            history.append({"role": "assistant", "content": ""})
+            prompt_started: float = time.perf_counter()
+            # 根据上下文窗口限制下获取的消息列表生成 AI 响应，按实际使用的模型校准 token 估计数
+            context: MessageView = memory.get_context(
+                instruct_ollama_llm.get_num_ctx(),
+                ollama_llm.get_model(),
+                CONTEXT_REFILL,
+                RETRIEVER.get_max_tokens() if RETRIEVER is not None else 0,
+            )
+            # 与上下文一起获取，生成摘要的后台任务可能在排队期间更新摘要
+            summary_message: dict[str, str] | None = memory.get_summary_message()
+            timings["prompt_build_seconds"] = time.perf_counter() - prompt_started
+
+            # 排队期间定时刷新排队位置，获得执行槽位后再开始生成
+            # 定时 yield 也让 Gradio 能及时发现页面已关闭并关闭生成器，放弃排队
+            while True:
+                position: int = REQUEST_SCHEDULER.position(ticket)
+                history[-1]["content"] = (
+                    f"*[Queued: position {position}]*" if position else ""
+                )
 
-    messages: list[dict[str, str]] = [memory.get_system_message()] + context
-    if not think:
-        for _, answer_word in instruct_ollama_llm.chat(messages, False):
-            history[-1]["content"] += answer_word
+                yield (
+                    history,
+                    memory,
+                    prompt_builder,
+                    instruct_ollama_llm,
+                    thinking_ollama_llm,
+                )
 
-            yield (history, memory, instruct_ollama_llm, thinking_ollama_llm)
+                if await REQUEST_SCHEDULER.wait(ticket, QUEUE_POLL_INTERVAL):
+                    break
 
-        # 没有思考过程，所以 AI 消息和 AI 响应相同
-        memory.add_assistant_message(history[-1]["content"])
-        memory.add_assistant_response(history[-1]["content"])
+            timings["queue_wait_seconds"] = time.perf_counter() - submitted
+            prompt_started = time.perf_counter()
+            # 获得执行槽位后才检索移出上下文窗口的早期对话，计算查询向量的请求不绕过调度器
+            retrieved_message: dict[str, str] | None = (
+                await RETRIEVER.retrieve(memory, message)
+                if RETRIEVER is not None
+                else None
+            )
+            # 系统提示词和历史消息构成稳定前缀，时间上下文放在末尾，方便 Ollama 复用 KV 缓存
+            messages: list[dict[str, str]] = prompt_builder.build(
+                memory.get_system_message(),
+                context,
+                summary_message,
+                retrieved_message,
+            )
+            reuse = prompt_builder.get_last_reuse()
+            timings["prompt_build_seconds"] += time.perf_counter() - prompt_started
+            timings["ui_stream_seconds"] = 0.0
+            # 生成器被取消或关闭时，aclosing 保证到 Ollama 的流随之关闭
+            async with aclosing(ollama_llm.achat(messages, think)) as stream:
+                async for think_word, answer_word in stream:
+                    response.add(think_word, answer_word)
+                    if "ttft_seconds" not in timings and (think_word or answer_word):
+                        timings["ttft_seconds"] = time.perf_counter() - submitted
+
+                    if not coalescer.push():
+                        continue
+
+                    flush_started: float = time.perf_counter()
+                    history[-1]["content"] = response.render()
+
+                    yield (
+                        history,
+                        memory,
+                        prompt_builder,
+                        instruct_ollama_llm,
+                        thinking_ollama_llm,
+                    )
+
+                    timings["ui_stream_seconds"] += time.perf_counter() - flush_started
+
+            notice = None
+        except TimeoutError:
+            notice = "Generation timed out"
+            gr.Warning(notice)
+        except ValueError as e:
+            # 摘要在检查之后变长等情况下上下文仍可能放不下，用提示作为 AI 消息
+            notice = "Generation failed"
+            raise gr.Error(str(e))
+        except ConnectionError:
+            notice = "Generation failed"
+            raise gr.Error("No Ollama backend is available, please try again later")
+        except ollama.ResponseError as e:
+            notice = "Generation failed"
+            raise gr.Error(f"Ollama failed to generate a response: {e.error}")
+        finally:
+            REQUEST_SCHEDULER.release(ticket)
+            # 停止、断开连接时不会再执行后面的代码，在这里保存已生成的部分回答；
+            # 用户消息已添加时总是补上 AI 消息，保证两者交替出现
+            if history:
+                history[-1]["content"] = commit_response(memory, response, notice)
+                timings["total_seconds"] = time.perf_counter() - submitted
+                record_generation(ollama_llm, notice, timings, reuse)
+
+        if notice is None:
+            calibrate_memory(memory, ollama_llm)
+            # 统计生成时遇到的冷加载
+            RESIDENCY_MANAGER.observe(ollama_llm.get_last_stats())
+
+        # 在后台将移出上下文窗口的消息压缩为摘要，下一轮对话使用
+        if SUMMARIZER is not None:
+            SUMMARIZER.schedule(memory, session_id)
+        # 在后台计算新消息的嵌入向量，下一轮对话检索时不再计算
+        if RETRIEVER is not None:
+            RETRIEVER.schedule(memory, session_id)
+
+        yield (
+            history,
+            memory,
+            prompt_builder,
+            instruct_ollama_llm,
+            thinking_ollama_llm,
+        )
 
-        yield (history, memory, instruct_ollama_llm, thinking_ollama_llm)
-    else:
-        thinking_process: str = ""
-        for think_word, answer_word in thinking_ollama_llm.chat(messages, True):
-            if think_word:
-                thinking_process += think_word
-                # 将思考过程包括在 <details> 标签内
-                history[-1]["content"] = (
-                    "<details>\n"
-                    + "<summary>Thinking</summary>\n"
-                    + thinking_process
-                    + "\n<hr>\n</details>\n\n"
-                )
 
-            if answer_word:
-                history[-1]["content"] += answer_word
+async def compare_stream(
+    message: str,
+    memory: Memory,
+    instruct_ollama_llm: OllamaLLM,
+    request: gr.Request | None = None,
+) -> AsyncIterator[list[Any]]:
+    """对比模式：将同一个问题同时发送给 COMPARE_MODELS 中的所有模型
 
-            yield (history, memory, instruct_ollama_llm, thinking_ollama_llm)
+    以聊天界面的对话为上下文，只构建一次消息列表，同时发送给各个模型，
+    每个模型的回答流式显示在各自的窗口中，下方显示首 token 延迟和生成速度；
+    各模型分别向请求调度器申请执行槽位，总耗时接近最慢的模型。
+    问题和回答都不保存到记忆模块，也不检索早期对话
 
-        # AI 消息不包括思考过程
-        memory.add_assistant_message(
-            re.sub(
-                r"<details[^>]*>.*?</details>",
-                "",
-                history[-1]["content"],
-                count=1,
-                flags=re.DOTALL,
-            )
+    :param message: 用户消息
+    :type message: str
+    :param memory: 记忆模块
+    :type memory: Memory
+    :param instruct_ollama_llm: 非思考模型，各模型沿用它的上下文窗口大小和温度
+    :type instruct_ollama_llm: OllamaLLM
+    :param request: Gradio 自动传入的请求，用会话 id 区分排队的会话
+    :type request: gradio.Request | None
+    :return: 各模型的 gradio.Chatbot 组件输入，之后是各模型的指标
+    :rtype: AsyncIterator[list[Any]]
+    """
+    session_id: str = (
+        request.session_hash
+        if request is not None and request.session_hash
+        else str(id(memory))
+    )
+    question: dict[str, str] = {"role": "user", "content": message}
+    # 设置模型和上下文长度时模型目录缓存过期会请求 Ollama，在线程中创建，不阻塞事件循环
+    compare_ollama_llms: list[OllamaLLM] = await asyncio.gather(
+        *(
+            asyncio.to_thread(create_compare_ollama_llm, model, instruct_ollama_llm)
+            for model, _ in COMPARE_MODELS
+        )
+    )
+    results: list[CompareResult] = [
+        CompareResult(compare_ollama_llm, think)
+        for compare_ollama_llm, (_, think) in zip(compare_ollama_llms, COMPARE_MODELS)
+    ]
+
+    def render() -> list[Any]:
+        return [
+            [question, {"role": "assistant", "content": result.render()}]
+            for result in results
+        ] + [result.render_stats() for result in results]
+
+    prompt_started: float = time.perf_counter()
+    with SESSION_MANAGER.use(memory):
+        # 按修正系数最大的模型估计 token 数，上下文对所有模型都放得下
+        context: list[dict[str, str]] = memory.preview_context(
+            message,
+            instruct_ollama_llm.get_num_ctx(),
+            max(
+                (model for model, _ in COMPARE_MODELS), key=TOKEN_CALIBRATOR.get_factor
+            ),
         )
-        # AI 响应包括思考过程
-        memory.add_assistant_response(history[-1]["content"])
+        # 不使用会话的提示词构建器，不影响聊天界面的前缀复用统计；
+        # 前缀与聊天界面相同，Ollama 仍能复用 KV 缓存
+        messages: list[dict[str, str]] = PromptBuilder(TIME_GRANULARITY).build(
+            memory.get_system_message(), context, memory.get_summary_message()
+        )
+    prompt_build_seconds: float = time.perf_counter() - prompt_started
+
+    yield render()
+
+    coalescer: StreamCoalescer = StreamCoalescer(FLUSH_INTERVAL, FLUSH_TOKENS)
+    try:
+        async with aclosing(
+            fan_out(results, messages, REQUEST_SCHEDULER, session_id)
+        ) as updates:
+            async for _ in updates:
+                if coalescer.push():
+                    yield render()
+    finally:
+        for result in results:
+            result.timings["prompt_build_seconds"] = prompt_build_seconds
+            record_generation(result.ollama_llm, result.notice, result.timings)
+            if result.notice is None:
+                RESIDENCY_MANAGER.observe(result.ollama_llm.get_last_stats())
+
+    yield render()
+
+
+def resume_conversation(
+    conversation_id: str | None, memory: Memory, instruct_ollama_llm: OllamaLLM
+) -> tuple[list[dict[str, str]], Memory, str | None]:
+    """打开页面时，从对话日志恢复浏览器上一次的对话
+
+    浏览器中没有保存对话 id 时创建新的对话；同一个浏览器打开多个页面时，最后打开的页面继续写入对话日志
+
+    :param conversation_id: 浏览器中保存的对话 id
+    :type conversation_id: str | None
+    :param memory: 记忆模块
+    :type memory: Memory
+    :param instruct_ollama_llm: 非思考模型，用它的上下文窗口大小决定恢复多少轮对话
+    :type instruct_ollama_llm: OllamaLLM
+    :return: (gradio.Chatbot 组件输入, 记忆模块, 对话 id)
+    :rtype: tuple[list[dict[str, str]], Memory, str | None]
+    """
+    if CONVERSATION_STORE is None:
+        return ([], memory, conversation_id)
 
-        yield (history, memory, instruct_ollama_llm, thinking_ollama_llm)
+    with SESSION_MANAGER.use(memory):
+        try:
+            log = CONVERSATION_STORE.open(conversation_id or uuid.uuid4().hex)
+        except ValueError:
+            log = CONVERSATION_STORE.open(uuid.uuid4().hex)
+        memory.attach_log(log, instruct_ollama_llm.get_num_ctx())
+
+        return (memory.get_history(), memory, log.get_id())
 
 
 def clear_chat_history(memory: Memory) -> tuple[list, Memory]:
@@ -215,7 +923,8 @@ def clear_chat_history(memory: Memory) -> tuple[list, Memory]:
     :return: (空列表, 清空消息列表和对话历史列表的记忆模块)
     :rtype: tuple[list, Memory]
     """
-    memory.clear()
+    with SESSION_MANAGER.use(memory):
+        memory.clear()
 
     return ([], memory)
 
@@ -257,11 +966,19 @@ def save_settings(
     :type thinking_ollama_llm: OllamaLLM
     :return: (更新的记忆模块, 更新的非思考模型, 更新的思考模型)
     :rtype: tuple[Memory, OllamaLLM, OllamaLLM]
+    :raises gradio.Error: 如果上下文窗口大小超过任一模型支持的最大上下文长度
     """
     # 如果系统提示词为空，则采用默认的系统提示词
     if not system_prompt.strip():
         system_prompt = DEFAULT_SYSTEM_PROMPT
 
+    # 先检查两个模型，避免只更新了其中一个
+    try:
+        instruct_ollama_llm.check_num_ctx(num_ctx)
+        thinking_ollama_llm.check_num_ctx(num_ctx)
+    except ValueError as e:
+        raise gr.Error(str(e))
+
     memory.set_system_message(system_prompt)
     instruct_ollama_llm.set_num_ctx(num_ctx)
     instruct_ollama_llm.set_temperature(temperature)
@@ -316,136 +1033,711 @@ def reset_settings(
     )
 
 
-with gr.Blocks(title="Ollama Chat", css=CSS) as demo:
-    # 记忆模块，每个会话一个实例
-    memory_state: gr.State = gr.State(value=create_memory)
-    # 非思考模型，每个会话一个实例
-    instruct_ollama_llm_state: gr.State = gr.State(value=create_instruct_ollama_llm)
-    # 思考模型，每个会话一个实例
-    thinking_ollama_llm_state: gr.State = gr.State(value=create_thinking_ollama_llm)
-    # 介绍
-    gr.HTML('<h3 align="center">Chatbot based on Ollama</h3>')
-
-    """聊天界面设计"""
-    with gr.Tab("Chat"):
-        with gr.Group():
-            # 对话窗口
-            chat_history_windows: gr.Chatbot = gr.Chatbot(
-                type="messages", show_label=False
+def create_api_session() -> ApiSession:
+    """为 API 的请求创建会话
+
+    :return: 新创建的会话，用 config.yaml 和 system_prompt.md 的默认配置做初始化
+    :rtype: ApiSession
+    """
+    return ApiSession(
+        create_memory(),
+        create_prompt_builder(),
+        create_instruct_ollama_llm(),
+        create_thinking_ollama_llm(),
+    )
+
+
+# OpenAI 兼容 API 的配置，config.yaml 中没有 api 配置项时不启用
+API_CONFIG: dict = DEFAULT_CONFIG.get("api") or {}
+# API 的服务端会话，请求头 X-Session-Id 或请求体 session_id 指定会话
+API_SESSIONS: ApiSessionStore = ApiSessionStore(
+    create_api_session, int(API_CONFIG.get("max_sessions", 1024))
+)
+
+
+async def generate_api_response(
+    session: ApiSession,
+    chat_request: ChatRequest,
+) -> AsyncIterator[tuple[str, str]]:
+    """为 API 的请求生成 AI 响应流
+
+    与 chat_stream 使用相同的记忆模块、提示词构建器和请求调度器，但不经过 Gradio 的队列和 websocket；
+    无状态请求用请求中的消息列表填充临时的记忆模块，服务端会话只追加最新用户消息
+
+    检查请求并提交排队凭证后先产生一个空分块，调用方取得它之后再发送响应，
+    检查失败和排队已满都在发送响应之前抛出；排队凭证在同一个 try / finally 中提交和释放，
+    流在任何位置被关闭（包括客户端在第一个分块之前断开连接）都会释放执行槽位
+
+    :param session: 会话
+    :type session: ApiSession
+    :param chat_request: 解析后的请求
+    :type chat_request: ChatRequest
+    :return: (思考流, 内容流) 的异步迭代器，第一个元素为 ("", "")
+    :rtype: AsyncIterator[tuple[str, str]]
+    :raises ValueError: 如果最新用户消息放不下上下文窗口
+    :raises QueueFullError: 如果排队的请求数已达上限
+    :raises TimeoutError: 如果生成超时
+    :raises ConnectionError: 如果没有可用的 Ollama 节点
+    :raises ollama.ResponseError: 如果 Ollama 返回错误
+    """
+    submitted: float = time.perf_counter()
+    timings: dict[str, float] = {}
+    memory: Memory = session.memory
+    ollama_llm: OllamaLLM = (
+        session.thinking_ollama_llm
+        if chat_request.think
+        else session.instruct_ollama_llm
+    )
+    query: str = chat_request.messages[-1]["content"]
+
+    # 同一会话的请求依次执行，排队期间不占用记忆模块
+    async with session.lock:
+        with SESSION_MANAGER.use(memory):
+            if chat_request.system is not None:
+                memory.set_system_message(chat_request.system)
+            # 放不下上下文窗口或排队已满时立即报错，不修改记忆模块
+            memory.check_user_message(
+                query,
+                ollama_llm.get_num_ctx(),
+                ollama_llm.get_model(),
+                RETRIEVER.get_max_tokens() if RETRIEVER is not None else 0,
             )
-            # 输入框
-            input_textbox: gr.Textbox = gr.Textbox(
-                label="Input field", lines=5, max_lines=10
+            ticket: Ticket = REQUEST_SCHEDULER.submit(
+                f"api:{chat_request.session_id or id(session)}"
             )
 
-        with gr.Row():
-            # 思考模式开关
-            think_mode: gr.Checkbox = gr.Checkbox(label="Think")
-            # 发送按钮
-            send_button: gr.Button = gr.Button(value="Send", interactive=False)
-            # 清空按钮
-            clear_button: gr.Button = gr.Button(value="Clear")
-
-        # 临时变量，点击发送按钮后，在清空输入框前保存输入框内容
-        tmp_text: gr.Text = gr.Text(visible=False)
-
-    """聊天界面功能实现"""
-    # 输入框内不为空，则激活发送按钮
-    input_textbox.change(
-        fn=activate_button, inputs=[input_textbox], outputs=[send_button]
+            added: bool = False
+            response: ResponseBuffer = ResponseBuffer()
+            notice: str | None = "Generation interrupted"
+            reuse: dict[str, int] | None = None
+
+            # 从提交排队凭证起的任何异常和关闭都会经过 finally，释放执行槽位
+            try:
+                yield ("", "")
+
+                if chat_request.session_id is None:
+                    for message in chat_request.messages[:-1]:
+                        if message["role"] == "user":
+                            memory.add_user_message(message["content"])
+                        else:
+                            memory.add_assistant_message(message["content"])
+                memory.add_user_message(query)
+                added = True
+
+                prompt_started: float = time.perf_counter()
+                context: MessageView = memory.get_context(
+                    ollama_llm.get_num_ctx(),
+                    ollama_llm.get_model(),
+                    CONTEXT_REFILL,
+                    RETRIEVER.get_max_tokens() if RETRIEVER is not None else 0,
+                )
+                summary_message: dict[str, str] | None = memory.get_summary_message()
+                timings["prompt_build_seconds"] = time.perf_counter() - prompt_started
+
+                await REQUEST_SCHEDULER.wait(ticket)
+                timings["queue_wait_seconds"] = time.perf_counter() - submitted
+                prompt_started = time.perf_counter()
+                # 与 chat_stream 相同，获得执行槽位后才检索
+                retrieved_message: dict[str, str] | None = (
+                    await RETRIEVER.retrieve(memory, query)
+                    if RETRIEVER is not None
+                    else None
+                )
+                messages: list[dict[str, str]] = session.prompt_builder.build(
+                    memory.get_system_message(),
+                    context,
+                    summary_message,
+                    retrieved_message,
+                )
+                reuse = session.prompt_builder.get_last_reuse()
+                timings["prompt_build_seconds"] += time.perf_counter() - prompt_started
+
+                # 温度只作用于本次请求，不修改会话共享的模型
+                async with aclosing(
+                    ollama_llm.achat(
+                        messages, chat_request.think, chat_request.temperature
+                    )
+                ) as stream:
+                    async for think_word, answer_word in stream:
+                        response.add(think_word, answer_word)
+                        if "ttft_seconds" not in timings and (
+                            think_word or answer_word
+                        ):
+                            timings["ttft_seconds"] = time.perf_counter() - submitted
+                        yield (think_word or "", answer_word or "")
+
+                notice = None
+            except TimeoutError:
+                notice = "Generation timed out"
+                raise
+            except (ValueError, ConnectionError, ollama.ResponseError):
+                notice = "Generation failed"
+                raise
+            finally:
+                REQUEST_SCHEDULER.release(ticket)
+                # 用户消息已添加时总是补上 AI 消息，保证两者交替出现
+                if added:
+                    commit_response(memory, response, notice)
+                    timings["total_seconds"] = time.perf_counter() - submitted
+                    record_generation(ollama_llm, notice, timings, reuse)
+
+            if notice is None:
+                calibrate_memory(memory, ollama_llm)
+                RESIDENCY_MANAGER.observe(ollama_llm.get_last_stats())
+
+            # 无状态请求的临时记忆模块用完即弃，不需要压缩和检索
+            if chat_request.session_id is not None:
+                if SUMMARIZER is not None:
+                    SUMMARIZER.schedule(memory, f"api:{chat_request.session_id}")
+                if RETRIEVER is not None:
+                    RETRIEVER.schedule(memory, f"api:{chat_request.session_id}")
+
+
+def backend_error(error: Exception) -> tuple[dict[str, Any], int]:
+    """将 Ollama 的错误转换为 OpenAI 格式的错误对象和状态码
+
+    :param error: 生成时抛出的 ConnectionError（没有可用的节点）或 ollama.ResponseError（Ollama 返回错误）
+    :type error: Exception
+    :return: (错误对象, 状态码)，没有可用的节点时为 503，Ollama 返回错误时为 502
+    :rtype: tuple[dict[str, Any], int]
+    """
+    if isinstance(error, ollama.ResponseError):
+        return (
+            format_error(
+                f"Ollama failed to generate a response: {error.error}", "upstream_error"
+            ),
+            502,
+        )
+
+    return (
+        format_error(
+            "No Ollama backend is available, please try again later",
+            "service_unavailable",
+        ),
+        503,
     )
-    # 按下发送按钮后，先清空输入框，再生成 AI 响应并更新前端界面
-    send_button.click(
-        fn=lambda x: ("", x),
-        inputs=[input_textbox],
-        outputs=[input_textbox, tmp_text],
-    ).then(
-        fn=chat_stream,
-        inputs=[
-            tmp_text,
-            think_mode,
-            memory_state,
-            instruct_ollama_llm_state,
-            thinking_ollama_llm_state,
-        ],
-        outputs=[
-            chat_history_windows,
-            memory_state,
-            instruct_ollama_llm_state,
-            thinking_ollama_llm_state,
-        ],
-    ).then(
-        fn=lambda: "", inputs=None, outputs=[tmp_text]
+
+
+async def stream_api_response(
+    stream: AsyncIterator[tuple[str, str]],
+    chat_request: ChatRequest,
+    ollama_llm: OllamaLLM,
+) -> AsyncIterator[str]:
+    """将 AI 响应流转换为 SSE 事件流
+
+    :param stream: generate_api_response 返回的 AI 响应流，已取得第一个分块
+    :type stream: AsyncIterator[tuple[str, str]]
+    :param chat_request: 解析后的请求
+    :type chat_request: ChatRequest
+    :param ollama_llm: 生成回答的模型，结束后读取统计信息
+    :type ollama_llm: OllamaLLM
+    :return: SSE 事件的异步迭代器
+    :rtype: AsyncIterator[str]
+    """
+    completion_id: str = new_completion_id()
+    created: int = int(time.time())
+
+    # 客户端断开连接时 Starlette 关闭本生成器，aclosing 保证到 Ollama 的流随之关闭、执行槽位随之释放
+    async with aclosing(stream):
+        yield format_chunk(
+            completion_id, created, chat_request.model, {"role": "assistant"}
+        )
+
+        try:
+            async for think_word, answer_word in stream:
+                delta: dict[str, str] = {}
+                if think_word:
+                    delta["reasoning_content"] = think_word
+                if answer_word:
+                    delta["content"] = answer_word
+                if delta:
+                    yield format_chunk(
+                        completion_id, created, chat_request.model, delta
+                    )
+        except TimeoutError as e:
+            yield format_event(format_error(str(e), "timeout_error"))
+            yield format_event("[DONE]")
+            return
+        except ValueError as e:
+            yield format_event(format_error(str(e), "invalid_request_error"))
+            yield format_event("[DONE]")
+            return
+        except (ConnectionError, ollama.ResponseError) as e:
+            # 响应头已经发送，只能用错误事件报告
+            yield format_event(backend_error(e)[0])
+            yield format_event("[DONE]")
+            return
+
+    stats: dict[str, int | str] = ollama_llm.get_last_stats()
+    yield format_chunk(
+        completion_id, created, chat_request.model, {}, finish_reason(stats)
     )
-    # 按下清空按钮后，清空记忆模块的消息列表、对话窗口和输入框
-    clear_button.click(
-        fn=clear_chat_history,
-        inputs=[memory_state],
-        outputs=[chat_history_windows, memory_state],
-    ).then(fn=lambda: "", inputs=None, outputs=[input_textbox])
-
-    """设置界面设计"""
-    with gr.Tab("Settings"):
-        # 输入系统提示词的文本框
-        system_prompt_textbox: gr.Textbox = gr.Textbox(
-            label="System prompt",
-            info="System prompt is a hidden instruction preset for a LLM, guiding it to generate responses that meet expectations",
-            lines=5,
-            max_lines=10,
+    if chat_request.include_usage:
+        yield format_usage_chunk(completion_id, created, chat_request.model, stats)
+    yield format_event("[DONE]")
+
+
+async def api_chat_completions(request: fastapi.Request) -> fastapi.Response:
+    """POST /v1/chat/completions，OpenAI 兼容的 chat completions 接口
+
+    :param request: HTTP 请求
+    :type request: fastapi.Request
+    :return: stream 为 true 时为 SSE 事件流，否则为 chat.completion 对象
+    :rtype: fastapi.Response
+    """
+    try:
+        body: Any = await request.json()
+        chat_request: ChatRequest = parse_chat_request(
+            body,
+            DEFAULT_CONFIG["model"]["instruct"],
+            DEFAULT_CONFIG["model"]["thinking"],
+            request.headers.get("x-session-id"),
         )
-        # 调整上下文窗口大小的滑块
-        num_ctx_slider: gr.Slider = gr.Slider(
-            label="Size of context windows",
-            info="Sets the size of the context window used to generate the next token",
-            value=DEFAULT_CONFIG["model"]["options"]["num_ctx"],
-            minimum=2048,
-            maximum=128 * 1024,
-            step=512,
+    except ValueError as e:
+        return JSONResponse(format_error(str(e), "invalid_request_error"), 400)
+
+    # 创建会话时设置模型和上下文长度，模型目录缓存过期时会请求 Ollama，不阻塞事件循环
+    session: ApiSession = await (
+        asyncio.to_thread(API_SESSIONS.get, chat_request.session_id)
+        if chat_request.session_id is not None
+        else asyncio.to_thread(create_api_session)
+    )
+    ollama_llm: OllamaLLM = (
+        session.thinking_ollama_llm
+        if chat_request.think
+        else session.instruct_ollama_llm
+    )
+
+    stream: AsyncIterator[tuple[str, str]] = generate_api_response(
+        session, chat_request
+    )
+    # 取得第一个分块时请求已通过检查并进入排队，失败时生成器已经结束，不占用执行槽位
+    try:
+        await anext(stream)
+    except ValueError as e:
+        return JSONResponse(format_error(str(e), "invalid_request_error"), 400)
+    except QueueFullError:
+        return JSONResponse(
+            format_error("The server is busy, please try again later", "rate_limit"),
+            429,
         )
-        # 调整温度大小的滑块
-        temperature_slider: gr.Slider = gr.Slider(
-            label="Temperature",
-            info="The temperature of the model. Increasing the temperature will make the model answer more creatively",
-            value=DEFAULT_CONFIG["model"]["options"]["temperature"],
-            minimum=0.0,
-            maximum=1.0,
-            step=0.1,
+
+    if chat_request.stream:
+        # 客户端在第一个 SSE 事件之前断开连接时 stream_api_response 可能不会开始执行，
+        # 响应结束后总是关闭 AI 响应流，释放执行槽位；已关闭时不产生影响
+        return StreamingResponse(
+            stream_api_response(stream, chat_request, ollama_llm),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache"},
+            background=BackgroundTask(stream.aclose),
         )
 
-        with gr.Row():
-            # 保存按钮
-            save_button: gr.Button = gr.Button(value="Save")
-            # 重置按钮
-            reset_button: gr.Button = gr.Button(value="Reset")
-
-    """设置界面功能实现"""
-    # 按下保存按钮后，更新记忆模块、非思考模型和思考模型
-    save_button.click(
-        fn=save_settings,
-        inputs=[
-            system_prompt_textbox,
-            num_ctx_slider,
-            temperature_slider,
-            memory_state,
-            instruct_ollama_llm_state,
-            thinking_ollama_llm_state,
-        ],
-        outputs=[memory_state, instruct_ollama_llm_state, thinking_ollama_llm_state],
+    thinking_parts: list[str] = []
+    content_parts: list[str] = []
+    try:
+        async with aclosing(stream):
+            async for think_word, answer_word in stream:
+                thinking_parts.append(think_word)
+                content_parts.append(answer_word)
+    except TimeoutError as e:
+        return JSONResponse(format_error(str(e), "timeout_error"), 504)
+    except ValueError as e:
+        return JSONResponse(format_error(str(e), "invalid_request_error"), 400)
+    except (ConnectionError, ollama.ResponseError) as e:
+        return JSONResponse(*backend_error(e))
+
+    stats: dict[str, int | str] = ollama_llm.get_last_stats()
+    return JSONResponse(
+        format_completion(
+            new_completion_id(),
+            int(time.time()),
+            chat_request.model,
+            "".join(thinking_parts),
+            "".join(content_parts),
+            finish_reason(stats),
+            stats,
+        )
     )
-    # 按下重置按钮后，重置记忆模块、非思考模型和思考模型，恢复设置界面到默认状态
-    reset_button.click(
-        fn=reset_settings,
-        inputs=[memory_state, instruct_ollama_llm_state, thinking_ollama_llm_state],
-        outputs=[
-            system_prompt_textbox,
-            num_ctx_slider,
-            temperature_slider,
-            memory_state,
-            instruct_ollama_llm_state,
-            thinking_ollama_llm_state,
+
+
+async def api_list_models() -> dict[str, Any]:
+    """GET /v1/models，列出可用的模型
+
+    :return: 配置的非思考模型和思考模型
+    :rtype: dict[str, Any]
+    """
+    return {
+        "object": "list",
+        "data": [
+            {"id": model, "object": "model", "created": 0, "owned_by": "ollama"}
+            for model in (
+                DEFAULT_CONFIG["model"]["instruct"],
+                DEFAULT_CONFIG["model"]["thinking"],
+            )
         ],
+    }
+
+
+async def api_health() -> JSONResponse:
+    """GET /health，应用的健康状态
+
+    :return: 至少有一个健康的 Ollama 节点时返回 200，否则返回 503
+    :rtype: JSONResponse
+    """
+    health: dict[str, Any] = get_health()
+
+    return JSONResponse(health, status_code=200 if health["ready"] else 503)
+
+
+async def api_delete_session(session_id: str) -> fastapi.Response:
+    """DELETE /v1/sessions/{session_id}，删除服务端会话
+
+    :param session_id: 会话 id
+    :type session_id: str
+    :return: 会话存在时返回 204，否则返回 404
+    :rtype: fastapi.Response
+    """
+    if not API_SESSIONS.delete(session_id):
+        return JSONResponse(
+            format_error(f"session_id={session_id} not found", "not_found_error"),
+            404,
+        )
+
+    return fastapi.Response(status_code=204)
+
+
+def start_services() -> None:
+    """启动所有会话共享的后台服务
+
+    导入 app 模块时只读取 config.yaml 和 system_prompt.md、创建所有会话共享的对象，不启动线程、不监听端口、
+    不打开或写入数据文件，也不构建网页界面；gradio 和 fastapi 仍在导入时加载，读取配置失败时导入即退出。
+    由 __main__ 在启动服务器前调用：
+
+    - 节点池的主动检查，Ollama 暂时不可用时照常启动界面，后台按指数退避重试，恢复后自动使用
+    - 模型驻留的预热和定时检查
+    - 会话换出和对话日志的批量 fsync
+    - 指标端点，端口被占用时只记录指标，不提供端点
+    - 清理磁盘上过期的回答缓存
+    - 滚动摘要，Ollama 可用后在后台检查摘要模型
+
+    :returns: 无
+    :rtype: None
+    """
+    global HISTORY_SECRET
+
+    BACKEND_POOL.start()
+    RESIDENCY_MANAGER.start()
+    SESSION_MANAGER.start()
+
+    if CONVERSATION_STORE is not None:
+        CONVERSATION_STORE.start()
+        # 浏览器中保存对话 id 时使用的密钥，重启后不变，才能继续读取浏览器中保存的对话 id
+        HISTORY_SECRET = load_history_secret(CONVERSATION_STORE.get_directory())
+
+    if METRICS_SERVER is not None:
+        try:
+            METRICS_SERVER.start()
+            print(
+                "[INFO] Metrics are available on "
+                + f"http://{METRICS_CONFIG.get('host', '127.0.0.1')}:{METRICS_SERVER.get_port()}/metrics"
+            )
+        except OSError as e:
+            print(f"[WARNING] Failed to start the metrics endpoint: {e}")
+
+    if RESPONSE_CACHE is not None:
+        RESPONSE_CACHE.purge()
+
+    threading.Thread(target=start_summarizer, daemon=True).start()
+
+
+def stop_services() -> None:
+    """停止 start_services 启动的后台服务
+
+    服务器退出后由 __main__ 调用：对话日志 fsync 剩余的消息，
+    residency.unload_on_exit 为 True 时卸载常驻的模型
+
+    :returns: 无
+    :rtype: None
+    """
+    if METRICS_SERVER is not None:
+        METRICS_SERVER.stop()
+    RESIDENCY_MANAGER.stop()
+    SESSION_MANAGER.stop()
+    if CONVERSATION_STORE is not None:
+        CONVERSATION_STORE.stop()
+    BACKEND_POOL.stop()
+
+
+def create_server_app(favicon_path: str | None = None) -> fastapi.FastAPI:
+    """创建同时提供网页界面和 OpenAI 兼容 API 的应用
+
+    API 和 Gradio 运行在同一个进程和事件循环中，共享记忆模块、请求调度器和生成指标。
+    应在 start_services 之后调用，挂载时才能带上对话日志目录中的密钥
+
+    :param favicon_path: 网页图标的路径
+    :type favicon_path: str | None
+    :return: 挂载了 Gradio 界面的 FastAPI 应用
+    :rtype: fastapi.FastAPI
+    """
+    server_app: fastapi.FastAPI = fastapi.FastAPI()
+    server_app.add_api_route(
+        "/v1/chat/completions", api_chat_completions, methods=["POST"]
+    )
+    server_app.add_api_route("/v1/models", api_list_models, methods=["GET"])
+    server_app.add_api_route(
+        "/v1/sessions/{session_id}", api_delete_session, methods=["DELETE"]
+    )
+    server_app.add_api_route("/health", api_health, methods=["GET"])
+
+    return gr.mount_gradio_app(
+        server_app, create_demo(), path="", favicon_path=favicon_path
     )
 
+
+def create_demo() -> gr.Blocks:
+    """构建网页界面
+
+    导入 app 时不构建界面，由 __main__ 和 create_server_app 在 start_services 之后调用，
+    构建时才能带上对话日志目录中的密钥
+
+    :return: 网页界面
+    :rtype: gr.Blocks
+    """
+    with gr.Blocks(title="Ollama Chat", css=CSS) as demo:
+        # 每个会话一个实例的记忆模块、提示词构建器、非思考模型和思考模型在打开页面时由 create_session 创建，
+        # gr.State 的初始值为函数时 Gradio 在构建界面时就会调用一次，构建界面时会请求 Ollama 检查模型
+        # 记忆模块
+        memory_state: gr.State = gr.State(delete_callback=SESSION_MANAGER.discard)
+        # 浏览器中保存的对话 id，重新打开页面或重启后从对话日志恢复对话
+        conversation_state: gr.BrowserState = gr.BrowserState(
+            None, storage_key="ollama-chat-conversation", secret=HISTORY_SECRET
+        )
+        # 提示词构建器
+        prompt_builder_state: gr.State = gr.State()
+        # 非思考模型
+        instruct_ollama_llm_state: gr.State = gr.State()
+        # 思考模型
+        thinking_ollama_llm_state: gr.State = gr.State()
+        # 介绍
+        gr.HTML('<h3 align="center">Chatbot based on Ollama</h3>')
+        # Ollama 服务不可用时显示提示，定时刷新，状态没有变化时不更新页面
+        backend_status: gr.Markdown = gr.Markdown(value=get_backend_status)
+        gr.Timer(BACKEND_STATUS_INTERVAL).tick(
+            fn=refresh_backend_status,
+            inputs=[backend_status],
+            outputs=[backend_status],
+            queue=False,
+            show_progress="hidden",
+        )
+
+        """聊天界面设计"""
+        with gr.Tab("Chat"):
+            with gr.Group():
+                # 对话窗口
+                chat_history_windows: gr.Chatbot = gr.Chatbot(
+                    type="messages", show_label=False
+                )
+                # 输入框
+                input_textbox: gr.Textbox = gr.Textbox(
+                    label="Input field", lines=5, max_lines=10
+                )
+
+            with gr.Row():
+                # 思考模式开关
+                think_mode: gr.Checkbox = gr.Checkbox(label="Think")
+                # 发送按钮
+                send_button: gr.Button = gr.Button(value="Send", interactive=False)
+                # 停止按钮
+                stop_button: gr.Button = gr.Button(value="Stop")
+                # 清空按钮
+                clear_button: gr.Button = gr.Button(value="Clear")
+
+            # 临时变量，点击发送按钮后，在清空输入框前保存输入框内容
+            tmp_text: gr.Text = gr.Text(visible=False)
+
+        """聊天界面功能实现"""
+        # 输入框内不为空，则激活发送按钮
+        input_textbox.change(
+            fn=activate_button, inputs=[input_textbox], outputs=[send_button]
+        )
+        # 按下发送按钮后，先清空输入框，再生成 AI 响应并更新前端界面
+        chat_event = send_button.click(
+            fn=lambda x: ("", x),
+            inputs=[input_textbox],
+            outputs=[input_textbox, tmp_text],
+        ).then(
+            fn=chat_stream,
+            inputs=[
+                tmp_text,
+                think_mode,
+                memory_state,
+                prompt_builder_state,
+                instruct_ollama_llm_state,
+                thinking_ollama_llm_state,
+            ],
+            outputs=[
+                chat_history_windows,
+                memory_state,
+                prompt_builder_state,
+                instruct_ollama_llm_state,
+                thinking_ollama_llm_state,
+            ],
+            # 异步生成器不占用工作线程，不限制同时生成的会话数
+            concurrency_limit=None,
+        )
+        chat_event.then(fn=lambda: "", inputs=None, outputs=[tmp_text])
+        # 按下停止按钮后，取消正在生成的 AI 响应，已生成的部分回答保存到记忆模块
+        stop_button.click(fn=None, inputs=None, outputs=None, cancels=[chat_event])
+        # 按下清空按钮后，清空记忆模块的消息列表、对话窗口和输入框
+        clear_button.click(
+            fn=clear_chat_history,
+            inputs=[memory_state],
+            outputs=[chat_history_windows, memory_state],
+        ).then(fn=lambda: "", inputs=None, outputs=[input_textbox])
+
+        # 打开页面后，创建会话的实例，再从对话日志恢复上一次的对话
+        demo.load(
+            fn=create_session,
+            inputs=None,
+            outputs=[
+                memory_state,
+                prompt_builder_state,
+                instruct_ollama_llm_state,
+                thinking_ollama_llm_state,
+            ],
+        ).then(
+            fn=resume_conversation,
+            inputs=[conversation_state, memory_state, instruct_ollama_llm_state],
+            outputs=[chat_history_windows, memory_state, conversation_state],
+        )
+
+        """对比界面设计"""
+        with gr.Tab("Compare"):
+            with gr.Row():
+                compare_windows: list[gr.Chatbot] = []
+                compare_stats: list[gr.Markdown] = []
+                for model, think in COMPARE_MODELS:
+                    with gr.Column():
+                        # 每个模型一个对话窗口
+                        compare_windows.append(
+                            gr.Chatbot(
+                                type="messages",
+                                label=f"{model} (think)" if think else model,
+                            )
+                        )
+                        # 首 token 延迟和生成速度
+                        compare_stats.append(gr.Markdown())
+
+            with gr.Group():
+                # 输入框
+                compare_textbox: gr.Textbox = gr.Textbox(
+                    label="Input field",
+                    info="The question is answered by every model with the conversation in the Chat tab as context, and is not added to the conversation",
+                    lines=3,
+                    max_lines=10,
+                )
+
+            with gr.Row():
+                # 发送按钮
+                compare_send_button: gr.Button = gr.Button(
+                    value="Send", interactive=False
+                )
+                # 停止按钮
+                compare_stop_button: gr.Button = gr.Button(value="Stop")
+
+            # 临时变量，点击发送按钮后，在清空输入框前保存输入框内容
+            compare_tmp_text: gr.Text = gr.Text(visible=False)
+
+        """对比界面功能实现"""
+        # 输入框内不为空，则激活发送按钮
+        compare_textbox.change(
+            fn=activate_button, inputs=[compare_textbox], outputs=[compare_send_button]
+        )
+        # 按下发送按钮后，先清空输入框，再同时生成各模型的回答
+        compare_event = compare_send_button.click(
+            fn=lambda x: ("", x),
+            inputs=[compare_textbox],
+            outputs=[compare_textbox, compare_tmp_text],
+        ).then(
+            fn=compare_stream,
+            inputs=[compare_tmp_text, memory_state, instruct_ollama_llm_state],
+            outputs=compare_windows + compare_stats,
+            concurrency_limit=None,
+        )
+        # 按下停止按钮后，取消所有模型的生成
+        compare_stop_button.click(
+            fn=None, inputs=None, outputs=None, cancels=[compare_event]
+        )
+
+        """设置界面设计"""
+        with gr.Tab("Settings"):
+            # 输入系统提示词的文本框
+            system_prompt_textbox: gr.Textbox = gr.Textbox(
+                label="System prompt",
+                info="System prompt is a hidden instruction preset for a LLM, guiding it to generate responses that meet expectations",
+                lines=5,
+                max_lines=10,
+            )
+            # 调整上下文窗口大小的滑块
+            num_ctx_slider: gr.Slider = gr.Slider(
+                label="Size of context windows",
+                info="Sets the size of the context window used to generate the next token",
+                value=DEFAULT_CONFIG["model"]["options"]["num_ctx"],
+                minimum=2048,
+                maximum=128 * 1024,
+                step=512,
+            )
+            # 调整温度大小的滑块
+            temperature_slider: gr.Slider = gr.Slider(
+                label="Temperature",
+                info="The temperature of the model. Increasing the temperature will make the model answer more creatively",
+                value=DEFAULT_CONFIG["model"]["options"]["temperature"],
+                minimum=0.0,
+                maximum=1.0,
+                step=0.1,
+            )
+
+            with gr.Row():
+                # 保存按钮
+                save_button: gr.Button = gr.Button(value="Save")
+                # 重置按钮
+                reset_button: gr.Button = gr.Button(value="Reset")
+
+        """设置界面功能实现"""
+        # 按下保存按钮后，更新记忆模块、非思考模型和思考模型
+        save_button.click(
+            fn=save_settings,
+            inputs=[
+                system_prompt_textbox,
+                num_ctx_slider,
+                temperature_slider,
+                memory_state,
+                instruct_ollama_llm_state,
+                thinking_ollama_llm_state,
+            ],
+            outputs=[
+                memory_state,
+                instruct_ollama_llm_state,
+                thinking_ollama_llm_state,
+            ],
+        )
+        # 按下重置按钮后，重置记忆模块、非思考模型和思考模型，恢复设置界面到默认状态
+        reset_button.click(
+            fn=reset_settings,
+            inputs=[memory_state, instruct_ollama_llm_state, thinking_ollama_llm_state],
+            outputs=[
+                system_prompt_textbox,
+                num_ctx_slider,
+                temperature_slider,
+                memory_state,
+                instruct_ollama_llm_state,
+                thinking_ollama_llm_state,
+            ],
+        )
+
+    return demo
+
+
 if __name__ == "__main__":
     FAVICON_PATH: str | None = (Path(__file__).parent / "ollama-logo.png").as_posix()
 
@@ -453,4 +1745,18 @@ if __name__ == "__main__":
         print("[WARNING] Favicon not found, launching without favicon")
         FAVICON_PATH = None
 
-    demo.launch(favicon_path=FAVICON_PATH)
+    start_services()
+
+    try:
+        if API_CONFIG.get("enabled", False):
+            import uvicorn
+
+            uvicorn.run(
+                create_server_app(FAVICON_PATH),
+                host=API_CONFIG.get("host", "127.0.0.1"),
+                port=int(API_CONFIG.get("port", 7860)),
+            )
+        else:
+            create_demo().launch(favicon_path=FAVICON_PATH)
+    finally:
+        stop_services()
@@ -0,0 +1,779 @@
+import asyncio
+import httpx
+import itertools
+import ollama
+import threading
+
+from contextlib import aclosing, closing
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator
+
+
+def is_backend_failure(error: BaseException) -> bool:
+    """判断异常是否说明 Ollama 节点不可用
+
+    连接失败、读写中断、超时和 5xx 响应视为节点故障；4xx 响应（例如模型不存在）是请求本身的问题
+
+    :param error: 请求 Ollama 时抛出的异常
+    :type error: BaseException
+    :returns: 是否为节点故障
+    :rtype: bool
+    """
+    if isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError)):
+        return True
+    if isinstance(error, ollama.ResponseError):
+        return error.status_code >= 500
+
+    return False
+
+
+def stream_error(error: BaseException) -> BaseException:
+    """获取流式生成中断时应记录的异常
+
+    超时通过取消任务打断等待，取消消息为 TimeoutError 时记录该超时；
+    调用方关闭流（GeneratorExit）或取消任务时原样返回，节点池不把它记为成功或节点故障
+
+    :param error: 流式生成中抛出的异常
+    :type error: BaseException
+    :returns: 应传给 BackendPool.release 的异常
+    :rtype: BaseException
+    """
+    if (
+        isinstance(error, asyncio.CancelledError)
+        and error.args
+        and isinstance(error.args[0], TimeoutError)
+    ):
+        return error.args[0]
+
+    return error
+
+
+class ConnectionStats:
+    """一个节点的 HTTP 连接统计
+
+    通过 httpcore 的 trace 扩展观察每个请求：建立了 TCP 连接的请求记为新建连接，否则记为复用空闲连接；
+    从发送请求头到响应关闭之间记为占用一个连接。连接频繁新建说明连接池太小或空闲连接过早关闭
+
+    同一节点的同步客户端和异步客户端共用一个实例，线程安全
+    """
+
+    def __init__(self) -> None:
+        self._lock: threading.Lock = threading.Lock()
+        # 正在使用的连接数
+        self._in_use: int = 0
+        # 累计新建的连接数、复用空闲连接的请求数
+        self._opened: int = 0
+        self._reused: int = 0
+
+    def on_request(self, request: httpx.Request) -> None:
+        """httpx.Client 的 request 事件钩子，为请求挂上 trace 回调
+
+        :param request: 即将发送的请求
+        :type request: httpx.Request
+        :returns: 无
+        :rtype: None
+        """
+        request.extensions["trace"] = self._create_trace()
+
+    async def aon_request(self, request: httpx.Request) -> None:
+        """httpx.AsyncClient 的 request 事件钩子，为请求挂上 trace 回调
+
+        :param request: 即将发送的请求
+        :type request: httpx.Request
+        :returns: 无
+        :rtype: None
+        """
+        trace: Callable[[str, dict[str, Any]], None] = self._create_trace()
+
+        async def atrace(name: str, info: dict[str, Any]) -> None:
+            trace(name, info)
+
+        request.extensions["trace"] = atrace
+
+    def _create_trace(self) -> Callable[[str, dict[str, Any]], None]:
+        # 本次请求是否建立了新的 TCP 连接
+        connected: bool = False
+
+        def trace(name: str, info: dict[str, Any]) -> None:
+            nonlocal connected
+            if name == "connection.connect_tcp.complete":
+                connected = True
+            elif name.endswith(".send_request_headers.started"):
+                with self._lock:
+                    self._in_use += 1
+                    if connected:
+                        self._opened += 1
+                    else:
+                        self._reused += 1
+            elif name.endswith(".response_closed.complete") or name.endswith(
+                ".response_closed.failed"
+            ):
+                with self._lock:
+                    self._in_use -= 1
+
+        return trace
+
+    def get_stats(self) -> dict[str, int]:
+        """获取连接统计
+
+        :returns: in_use 为正在使用的连接数，opened 为累计新建的连接数，reused 为累计复用空闲连接的请求数
+        :rtype: dict[str, int]
+        """
+        with self._lock:
+            return {
+                "in_use": self._in_use,
+                "opened": self._opened,
+                "reused": self._reused,
+            }
+
+
+class Backend:
+    """一个 Ollama 节点
+
+    持有该节点的同步客户端、异步客户端和健康检查专用的客户端，以及由 BackendPool 维护的状态。
+    三个客户端使用相同的连接池上限和保活设置，连接统计汇总到同一个 ConnectionStats
+    """
+
+    def __init__(
+        self,
+        host: str,
+        headers: dict[str, str] | None = None,
+        probe_timeout: float = 5.0,
+        limits: httpx.Limits | None = None,
+        timeout: httpx.Timeout | None = None,
+    ) -> None:
+        """
+        :param host: 节点地址，例如 http://127.0.0.1:11434
+        :type host: str
+        :param headers: 每个请求附带的 HTTP 头
+        :type headers: dict[str, str] | None
+        :param probe_timeout: 健康检查请求的超时时间（秒）
+        :type probe_timeout: float
+        :param limits: 每个客户端的最大连接数、保持的空闲连接数和空闲连接的保持时间，为 None 时使用 httpx 的默认值
+        :type limits: httpx.Limits | None
+        :param timeout: 生成等请求的连接、读写和等待空闲连接的超时时间，为 None 时不超时
+        :type timeout: httpx.Timeout | None
+        """
+        # 传给 httpx 客户端的参数，limits 为 None 时使用 httpx 的默认值
+        options: dict[str, Any] = {} if limits is None else {"limits": limits}
+        self.host: str = host
+        self.connections: ConnectionStats = ConnectionStats()
+        self.client: ollama.Client = ollama.Client(
+            host=host,
+            headers=headers,
+            timeout=timeout,
+            event_hooks={"request": [self.connections.on_request]},
+            **options,
+        )
+        self.async_client: ollama.AsyncClient = ollama.AsyncClient(
+            host=host,
+            headers=headers,
+            timeout=timeout,
+            event_hooks={"request": [self.connections.aon_request]},
+            **options,
+        )
+        self.probe_client: ollama.Client = ollama.Client(
+            host=host,
+            headers=headers,
+            timeout=probe_timeout,
+            event_hooks={"request": [self.connections.on_request]},
+            **options,
+        )
+        # 第一次健康检查之前视为健康
+        self.healthy: bool = True
+        # 正在进行的请求数
+        self.in_flight: int = 0
+        # 节点上已拉取的模型，None 表示还没有检查过
+        self.models: set[str] | None = None
+        # 节点上已加载到内存中的模型
+        self.resident: set[str] = set()
+        # 连续失败的请求数
+        self.failures: int = 0
+        # 累计请求数、失败数
+        self.requests: int = 0
+        self.errors: int = 0
+
+
+class BackendPool:
+    """Ollama 节点池
+
+    每次请求按以下顺序选择节点，前面的节点失败（且还没有返回任何分块）时依次尝试后面的节点：
+
+    1. 健康、已拉取所请求模型的节点，已加载该模型的优先，其次按正在进行的请求数从少到多，
+       相同时轮流选择
+    2. 不健康但已拉取该模型的节点，作为最后的尝试
+
+    健康状态有两个来源：
+
+    - 被动检查：请求因节点故障失败时累计连续失败次数，达到 failure_threshold 即标记为不健康；请求成功时清零
+    - 主动检查：后台线程每隔 check_interval 秒请求每个节点的 /api/ps 和 /api/tags，
+      同时刷新已加载和已拉取的模型；失败即标记为不健康，成功即恢复。
+      有节点不健康时从 retry_interval 秒开始按指数退避提前重试，最长不超过 check_interval 秒
+
+    后台线程启动后立即做第一次检查，不阻塞启动；Ollama 暂时不可用时应用照常启动，
+    get_state 报告节点池的状态，节点恢复后自动重新使用
+
+    所有会话共享同一个实例，线程安全
+    """
+
+    def __init__(
+        self,
+        backends: list[Backend],
+        check_interval: float = 10.0,
+        failure_threshold: int = 3,
+        retry_interval: float = 1.0,
+    ) -> None:
+        """
+        :param backends: Ollama 节点
+        :type backends: list[Backend]
+        :param check_interval: 主动检查的时间间隔（秒）
+        :type check_interval: float
+        :param failure_threshold: 被动检查中连续失败多少次后标记为不健康
+        :type failure_threshold: int
+        :param retry_interval: 有节点不健康时第一次重试的等待时间（秒），之后每次翻倍
+        :type retry_interval: float
+        :raises ValueError: 如果 backends 为空、check_interval 或 retry_interval 不大于 0，或 failure_threshold 小于 1
+        """
+        if not backends:
+            raise ValueError("[ERROR] The list of backends is empty")
+        if check_interval <= 0.0:
+            raise ValueError(
+                f"[ERROR] The number of check_interval={check_interval} is not positive"
+            )
+        if failure_threshold < 1:
+            raise ValueError(
+                f"[ERROR] The number of failure_threshold={failure_threshold} is too small"
+            )
+        if retry_interval <= 0.0:
+            raise ValueError(
+                f"[ERROR] The number of retry_interval={retry_interval} is not positive"
+            )
+
+        self._backends: list[Backend] = backends
+        self._check_interval: float = check_interval
+        self._failure_threshold: int = failure_threshold
+        self._retry_interval: float = retry_interval
+        self._lock: threading.Lock = threading.Lock()
+        # 已完成的主动检查次数
+        self._checks: int = 0
+        # 负载相同时轮流选择
+        self._rotation: itertools.count = itertools.count()
+        # 主动检查的后台线程
+        self._thread: threading.Thread | None = None
+        self._stopped: threading.Event = threading.Event()
+        # 最近一次主动检查是否有健康的节点
+        self._available: threading.Event = threading.Event()
+
+    def get_backends(self) -> list[Backend]:
+        """获取所有节点
+
+        :returns: 节点列表
+        :rtype: list[Backend]
+        """
+        return list(self._backends)
+
+    def candidates(self, model: str) -> list[Backend]:
+        """按优先顺序列出可以处理该模型请求的节点
+
+        :param model: ollama 模型 id
+        :type model: str
+        :returns: 节点列表，第一个为首选节点
+        :rtype: list[Backend]
+        """
+        with self._lock:
+            offset: int = next(self._rotation) % len(self._backends)
+            # 先轮转再稳定排序，负载相同的节点轮流排在前面
+            rotated: list[Backend] = self._backends[offset:] + self._backends[:offset]
+            pulled: list[Backend] = [
+                backend
+                for backend in rotated
+                if backend.models is None or model in backend.models
+            ]
+
+            return sorted(
+                pulled,
+                key=lambda backend: (
+                    not backend.healthy,
+                    model not in backend.resident,
+                    backend.in_flight,
+                ),
+            )
+
+    def acquire(self, backend: Backend) -> None:
+        """记录一个请求开始
+
+        :param backend: 处理请求的节点
+        :type backend: Backend
+        :returns: 无
+        :rtype: None
+        """
+        with self._lock:
+            backend.in_flight += 1
+            backend.requests += 1
+
+    def release(
+        self,
+        backend: Backend,
+        model: str,
+        error: BaseException | None = None,
+        loads_model: bool = True,
+    ) -> None:
+        """记录一个请求结束，并据此做被动健康检查
+
+        :param backend: 处理请求的节点
+        :type backend: Backend
+        :param model: 请求的 ollama 模型 id
+        :type model: str
+        :param error: 请求失败时抛出的异常，成功时为 None
+        :type error: BaseException | None
+        :param loads_model: 请求成功后节点是否会加载该模型，例如生成请求会，查询元数据的请求不会
+        :type loads_model: bool
+        :returns: 无
+        :rtype: None
+        """
+        with self._lock:
+            backend.in_flight -= 1
+
+            if error is None:
+                backend.failures = 0
+                backend.healthy = True
+                if loads_model:
+                    backend.resident.add(model)
+            elif is_backend_failure(error):
+                backend.errors += 1
+                backend.failures += 1
+                if backend.failures >= self._failure_threshold:
+                    backend.healthy = False
+
+    def set_resident(self, backend: Backend, model: str, resident: bool) -> None:
+        """记录节点加载或卸载了模型
+
+        :param backend: 节点
+        :type backend: Backend
+        :param model: ollama 模型 id
+        :type model: str
+        :param resident: 是否已加载
+        :type resident: bool
+        :returns: 无
+        :rtype: None
+        """
+        with self._lock:
+            if resident:
+                backend.resident.add(model)
+            else:
+                backend.resident.discard(model)
+
+    def call(
+        self,
+        model: str,
+        request: Callable[[Backend], Any],
+        loads_model: bool = True,
+    ) -> Any:
+        """在选中的节点上执行一个非流式请求，节点故障时换下一个节点重试
+
+        :param model: 请求的 ollama 模型 id
+        :type model: str
+        :param request: 接收节点、返回响应的函数
+        :type request: Callable[[Backend], Any]
+        :param loads_model: 请求成功后节点是否会加载该模型
+        :type loads_model: bool
+        :returns: request 的返回值
+        :rtype: Any
+        :raises ConnectionError: 如果没有可用的节点
+        """
+        last_error: BaseException | None = None
+
+        for backend in self.candidates(model):
+            self.acquire(backend)
+            error: BaseException | None = None
+            try:
+                return request(backend)
+            except Exception as e:
+                error = e
+                if not is_backend_failure(e):
+                    raise
+                last_error = e
+            finally:
+                self.release(backend, model, error, loads_model)
+
+        raise ConnectionError(
+            f"[ERROR] No Ollama backend is available for model={model}"
+        ) from last_error
+
+    def list_models(self) -> ollama.ListResponse:
+        """列出健康节点上已拉取的模型
+
+        :returns: 与 ollama.Client.list 相同格式的模型列表，按模型 id 去重
+        :rtype: ollama.ListResponse
+        :raises ConnectionError: 如果没有健康的节点
+        """
+        self.ensure_available()
+
+        models: set[str] = set()
+        with self._lock:
+            for backend in self._backends:
+                if backend.healthy and backend.models is not None:
+                    models |= backend.models
+
+        return ollama.ListResponse(
+            models=[ollama.ListResponse.Model(model=model) for model in sorted(models)]
+        )
+
+    def ensure_available(self) -> None:
+        """在查询模型列表、元数据等请求之前确认至少有一个健康的节点
+
+        后台线程已启动时不等待第一次检查，直接失败，避免 Ollama 无响应时阻塞调用方（例如应用启动）；
+        后台线程没有启动且还没有检查过时，立即检查一次
+
+        :returns: 无
+        :rtype: None
+        :raises ConnectionError: 如果还没有完成第一次检查，或没有健康的节点
+        """
+        with self._lock:
+            unchecked: bool = self._checks == 0 and self._thread is None
+        if unchecked:
+            self.check()
+
+        state: str = self.get_state()
+        if state == "starting":
+            raise ConnectionError("[ERROR] Ollama backends have not been checked yet")
+        if state == "unavailable":
+            raise ConnectionError("[ERROR] No Ollama backend is healthy")
+
+    def check(self) -> int:
+        """立即对所有节点做一次主动检查
+
+        :returns: 健康的节点数
+        :rtype: int
+        """
+        for backend in self._backends:
+            try:
+                resident: set[str] = {
+                    model.model for model in backend.probe_client.ps().models
+                }
+                models: set[str] = {
+                    model.model for model in backend.probe_client.list().models
+                }
+            except Exception:
+                with self._lock:
+                    backend.healthy = False
+                continue
+
+            with self._lock:
+                backend.resident = resident
+                backend.models = models
+                backend.failures = 0
+                backend.healthy = True
+
+        with self._lock:
+            self._checks += 1
+            healthy: int = sum(backend.healthy for backend in self._backends)
+
+        if healthy:
+            self._available.set()
+        else:
+            self._available.clear()
+
+        return healthy
+
+    def wait_available(self, timeout: float | None = None) -> bool:
+        """等待主动检查发现至少一个健康的节点
+
+        :param timeout: 最长等待时间（秒），为 None 时一直等待
+        :type timeout: float | None
+        :returns: 是否有健康的节点，超时为 False
+        :rtype: bool
+        """
+        return self._available.wait(timeout)
+
+    def get_state(self) -> str:
+        """获取节点池的状态
+
+        :returns: starting 表示还没有完成第一次主动检查，ready 表示所有节点健康，
+            degraded 表示部分节点健康，unavailable 表示没有健康的节点
+        :rtype: str
+        """
+        with self._lock:
+            if self._checks == 0:
+                return "starting"
+            healthy: int = sum(backend.healthy for backend in self._backends)
+
+        if healthy == len(self._backends):
+            return "ready"
+
+        return "degraded" if healthy else "unavailable"
+
+    def start(self) -> None:
+        """启动主动检查的后台线程，立即开始第一次检查
+
+        :returns: 无
+        :rtype: None
+        """
+        if self._thread is not None:
+            return
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """停止主动检查的后台线程
+
+        :returns: 无
+        :rtype: None
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def get_stats(self) -> list[dict[str, Any]]:
+        """获取每个节点的状态
+
+        :returns: 每个节点的地址、健康状态、正在进行的请求数、累计请求数和失败数、已加载的模型和 HTTP 连接统计
+        :rtype: list[dict[str, Any]]
+        """
+        with self._lock:
+            return [
+                {
+                    "host": backend.host,
+                    "healthy": backend.healthy,
+                    "in_flight": backend.in_flight,
+                    "requests": backend.requests,
+                    "errors": backend.errors,
+                    "resident": sorted(backend.resident),
+                    "connections": backend.connections.get_stats(),
+                }
+                for backend in self._backends
+            ]
+
+    def _run(self) -> None:
+        """主动检查的后台线程"""
+        total: int = len(self._backends)
+        previous: int | None = None
+        # 连续有节点不健康的检查次数，决定退避时间
+        retries: int = 0
+
+        while True:
+            healthy: int = self.check()
+            if healthy != previous:
+                if healthy:
+                    print(
+                        f"[INFO] Ollama service is available on {healthy}/{total} backends"
+                    )
+                else:
+                    print(
+                        f"[WARNING] Ollama service is unavailable on all {total} backends"
+                    )
+                previous = healthy
+
+            if healthy == total:
+                retries = 0
+                interval: float = self._check_interval
+            else:
+                interval = min(self._check_interval, self._retry_interval * 2**retries)
+                retries = min(retries + 1, 16)
+
+            if self._stopped.wait(interval):
+                return
+
+
+def create_backend_pool(config: dict) -> BackendPool:
+    """根据 config.yaml 的配置创建 Ollama 节点池，不启动后台线程
+
+    没有 backends 配置项时只使用 ip / port 指定的一个节点；pool 和 http 配置项缺失时使用默认值，
+    到每个节点的同步和异步客户端使用相同的 HTTP 连接池设置
+
+    :param config: config.yaml 的内容
+    :type config: dict
+    :returns: 节点池
+    :rtype: BackendPool
+    """
+    backends_config: list[dict] = config.get("backends") or [
+        {"ip": config["ip"], "port": config["port"]}
+    ]
+    pool_config: dict = config.get("pool") or {}
+    http_config: dict = config.get("http") or {}
+    limits: httpx.Limits = httpx.Limits(
+        max_connections=int(http_config.get("max_connections", 64)),
+        max_keepalive_connections=int(http_config.get("max_keepalive_connections", 32)),
+        keepalive_expiry=float(http_config.get("keepalive_expiry_seconds", 60)),
+    )
+    timeout: httpx.Timeout = httpx.Timeout(
+        float(http_config.get("read_timeout_seconds", 300)),
+        connect=float(http_config.get("connect_timeout_seconds", 5)),
+        pool=float(http_config.get("pool_timeout_seconds", 30)),
+    )
+
+    return BackendPool(
+        [
+            Backend(
+                f"http://{str(backend['ip'])}:{int(backend['port'])}",
+                limits=limits,
+                timeout=timeout,
+            )
+            for backend in backends_config
+        ],
+        float(pool_config.get("check_interval_seconds", 10)),
+        int(pool_config.get("failure_threshold", 3)),
+        float(pool_config.get("retry_interval_seconds", 1)),
+    )
+
+
+class PoolClient:
+    """在节点池上实现 ollama.Client 的 list、show、chat 和 embed
+
+    OllamaLLM 和 ModelCatalogue 只用到这些方法，因此可以直接代替 ollama.Client
+    """
+
+    def __init__(self, pool: BackendPool) -> None:
+        self._pool: BackendPool = pool
+
+    def list(self) -> ollama.ListResponse:
+        """与 ollama.Client.list 相同"""
+        return self._pool.list_models()
+
+    def show(self, model: str) -> ollama.ShowResponse:
+        """与 ollama.Client.show 相同，请求发送到已拉取该模型的节点
+
+        使用健康检查专用的客户端，节点无响应时按健康检查的超时时间失败
+        """
+        self._pool.ensure_available()
+
+        return self._pool.call(
+            model, lambda backend: backend.probe_client.show(model), loads_model=False
+        )
+
+    def embed(self, **kwargs) -> ollama.EmbedResponse:
+        """与 ollama.Client.embed 相同，请求发送到已拉取嵌入模型的节点"""
+        return self._pool.call(
+            kwargs.get("model", ""), lambda backend: backend.client.embed(**kwargs)
+        )
+
+    def chat(self, **kwargs) -> ollama.ChatResponse | Iterator[ollama.ChatResponse]:
+        """与 ollama.Client.chat 相同，请求发送到节点池选中的节点
+
+        流式请求在返回第一个分块之前失败时换下一个节点重试；已经返回分块后失败则直接抛出异常
+        """
+        if kwargs.get("stream"):
+            return self._stream(kwargs)
+
+        return self._pool.call(
+            kwargs.get("model", ""), lambda backend: backend.client.chat(**kwargs)
+        )
+
+    def _stream(self, kwargs: dict) -> Iterator[ollama.ChatResponse]:
+        model: str = kwargs.get("model", "")
+        last_error: BaseException | None = None
+
+        for backend in self._pool.candidates(model):
+            self._pool.acquire(backend)
+            error: BaseException | None = None
+            started: bool = False
+            try:
+                with closing(backend.client.chat(**kwargs)) as stream:
+                    for part in stream:
+                        started = True
+                        yield part
+                return
+            except BaseException as e:
+                error = stream_error(e)
+                if started or not isinstance(e, Exception) or not is_backend_failure(e):
+                    raise
+                last_error = e
+            finally:
+                self._pool.release(backend, model, error)
+
+        raise ConnectionError(
+            f"[ERROR] No Ollama backend is available for model={model}"
+        ) from last_error
+
+
+class AsyncPoolClient:
+    """在节点池上实现 ollama.AsyncClient 的 chat 和 embed
+
+    与 PoolClient 共享同一个节点池，可以直接代替 ollama.AsyncClient 传给 OllamaLLM
+    """
+
+    def __init__(self, pool: BackendPool) -> None:
+        self._pool: BackendPool = pool
+
+    async def chat(
+        self, **kwargs
+    ) -> ollama.ChatResponse | AsyncIterator[ollama.ChatResponse]:
+        """与 ollama.AsyncClient.chat 相同，请求发送到节点池选中的节点
+
+        流式请求在返回第一个分块之前失败时换下一个节点重试；已经返回分块后失败则直接抛出异常
+        """
+        if kwargs.get("stream"):
+            return self._stream(kwargs)
+
+        return await self._call(
+            kwargs.get("model", ""), lambda backend: backend.async_client.chat(**kwargs)
+        )
+
+    async def embed(self, **kwargs) -> ollama.EmbedResponse:
+        """与 ollama.AsyncClient.embed 相同，请求发送到已拉取嵌入模型的节点"""
+        return await self._call(
+            kwargs.get("model", ""),
+            lambda backend: backend.async_client.embed(**kwargs),
+        )
+
+    async def _call(
+        self, model: str, request: Callable[[Backend], Awaitable[Any]]
+    ) -> Any:
+        """在选中的节点上执行一个非流式请求，节点故障时换下一个节点重试
+
+        :param model: 请求的 ollama 模型 id
+        :type model: str
+        :param request: 接收节点、返回协程的函数
+        :type request: Callable[[Backend], Awaitable[Any]]
+        :returns: 协程的返回值
+        :rtype: Any
+        :raises ConnectionError: 如果没有可用的节点
+        """
+        last_error: BaseException | None = None
+
+        for backend in self._pool.candidates(model):
+            self._pool.acquire(backend)
+            error: BaseException | None = None
+            try:
+                return await request(backend)
+            except Exception as e:
+                error = e
+                if not is_backend_failure(e):
+                    raise
+                last_error = e
+            finally:
+                self._pool.release(backend, model, error)
+
+        raise ConnectionError(
+            f"[ERROR] No Ollama backend is available for model={model}"
+        ) from last_error
+
+    async def _stream(self, kwargs: dict) -> AsyncIterator[ollama.ChatResponse]:
+        model: str = kwargs.get("model", "")
+        last_error: BaseException | None = None
+
+        for backend in self._pool.candidates(model):
+            self._pool.acquire(backend)
+            error: BaseException | None = None
+            started: bool = False
+            try:
+                async with aclosing(
+                    await backend.async_client.chat(**kwargs)
+                ) as stream:
+                    async for part in stream:
+                        started = True
+                        yield part
+                return
+            except BaseException as e:
+                error = stream_error(e)
+                if started or not isinstance(e, Exception) or not is_backend_failure(e):
+                    raise
+                last_error = e
+            finally:
+                self._pool.release(backend, model, error)
+
+        raise ConnectionError(
+            f"[ERROR] No Ollama backend is available for model={model}"
+        ) from last_error
@@ -0,0 +1,516 @@
+"""批量评测
+
+从 JSONL 文件逐行读取对话和提示词，用 config.yaml 的模型参数和 system_prompt.md 的系统提示词，
+经过记忆模块按上下文窗口截取对话历史后，由固定数量的工作线程并发调用 OllamaLLM.chat 生成回答，
+每完成一条就追加写入输出的 JSONL 文件，记录回答、耗时和 token 数
+
+输出文件同时是检查点：中断后用相同的参数重新运行，已成功的条目被跳过，失败的条目重新生成，
+同一 id 有多条结果时以最后一条为准
+
+输入的每一行是一个 JSON 对象：
+
+    {"id": "q1", "prompt": "Hello", "history": [{"role": "user", "content": "..."},
+     {"role": "assistant", "content": "..."}], "system": "...", "think": false,
+     "model": "qwen3:4b-instruct", "temperature": 0.0}
+
+只有 prompt 是必需的；也可以用 OpenAI 格式的 messages 代替 prompt / history / system。
+没有 id 时用行号作为 id
+
+用法：
+
+    python batch_eval.py prompts.jsonl results.jsonl --workers 4
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Iterator, TextIO
+
+import yaml
+
+from backend_pool import BackendPool, PoolClient, create_backend_pool
+from memory import Memory
+from model_catalogue import ModelCatalogue
+from ollama_llm import OllamaLLM
+from prompt_builder import PromptBuilder
+from token_estimator import TokenCalibrator
+
+
+class BatchItem:
+    """一条评测条目"""
+
+    def __init__(
+        self,
+        id: str,
+        prompt: str,
+        history: list[dict[str, str]],
+        system: str | None,
+        think: bool,
+        model: str | None,
+        temperature: float | None,
+    ) -> None:
+        """
+        :param id: 条目 id
+        :type id: str
+        :param prompt: 最新用户消息
+        :type prompt: str
+        :param history: 之前的对话，用户消息和 AI 消息交替出现
+        :type history: list[dict[str, str]]
+        :param system: 系统提示词，为 None 时使用 system_prompt.md
+        :type system: str | None
+        :param think: 思考模式开关
+        :type think: bool
+        :param model: ollama 模型 id，为 None 时按思考模式开关使用 config.yaml 中的模型
+        :type model: str | None
+        :param temperature: 温度，为 None 时使用 config.yaml 中的温度
+        :type temperature: float | None
+        """
+        self.id: str = id
+        self.prompt: str = prompt
+        self.history: list[dict[str, str]] = history
+        self.system: str | None = system
+        self.think: bool = think
+        self.model: str | None = model
+        self.temperature: float | None = temperature
+
+
+def parse_item(data: Any, line_number: int) -> BatchItem:
+    """解析输入文件的一行
+
+    :param data: 一行 JSON
+    :type data: Any
+    :param line_number: 行号，从 1 开始，没有 id 时用作 id
+    :type line_number: int
+    :returns: 评测条目
+    :rtype: BatchItem
+    :raises ValueError: 如果条目不合法
+    """
+    if not isinstance(data, dict):
+        raise ValueError("[ERROR] The item is not a JSON object")
+
+    system: Any = data.get("system")
+    history: Any = data.get("history") or []
+    prompt: Any = data.get("prompt")
+
+    if "messages" in data:
+        messages: Any = data["messages"]
+        if not isinstance(messages, list) or not messages:
+            raise ValueError("[ERROR] messages must be a non-empty list")
+        if isinstance(messages[0], dict) and messages[0].get("role") == "system":
+            system = messages[0].get("content")
+            messages = messages[1:]
+        if not messages or not isinstance(messages[-1], dict):
+            raise ValueError("[ERROR] The last message must be a user message")
+        history, prompt = messages[:-1], messages[-1].get("content")
+
+    if not isinstance(prompt, str):
+        raise ValueError("[ERROR] prompt must be a string")
+    if system is not None and not isinstance(system, str):
+        raise ValueError("[ERROR] system must be a string")
+    if not isinstance(history, list):
+        raise ValueError("[ERROR] history must be a list")
+    for i, message in enumerate(history):
+        expected: str = "user" if i % 2 == 0 else "assistant"
+        if (
+            not isinstance(message, dict)
+            or message.get("role") != expected
+            or not isinstance(message.get("content"), str)
+        ):
+            raise ValueError(
+                f"[ERROR] history[{i}] must be a {expected} message with a string content"
+            )
+    if len(history) % 2:
+        raise ValueError("[ERROR] history must end with an assistant message")
+
+    temperature: Any = data.get("temperature")
+    if temperature is not None and not isinstance(temperature, (int, float)):
+        raise ValueError("[ERROR] temperature must be a number")
+
+    return BatchItem(
+        str(data.get("id", f"line-{line_number}")),
+        prompt,
+        history,
+        system,
+        bool(data.get("think", False)),
+        data.get("model"),
+        float(temperature) if temperature is not None else None,
+    )
+
+
+def read_items(path: Path) -> Iterator[BatchItem | tuple[str, str]]:
+    """逐行读取输入文件，不一次性读入内存
+
+    :param path: 输入的 JSONL 文件
+    :type path: Path
+    :returns: 评测条目；不合法的行为 (id, 错误信息)
+    :rtype: Iterator[BatchItem | tuple[str, str]]
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            data: Any = None
+            try:
+                data = json.loads(line)
+                yield parse_item(data, line_number)
+            except ValueError as e:
+                item_id: str = f"line-{line_number}"
+                if isinstance(data, dict) and "id" in data:
+                    item_id = str(data["id"])
+                yield (item_id, str(e))
+
+
+def load_checkpoint(path: Path) -> set[str]:
+    """读取已有的输出文件，截断中断时写了一半的最后一行
+
+    :param path: 输出的 JSONL 文件
+    :type path: Path
+    :returns: 已成功生成的条目 id，同一 id 以最后一条结果为准
+    :rtype: set[str]
+    """
+    done: dict[str, bool] = {}
+    if not path.exists():
+        return set()
+
+    valid_size: int = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                result: dict = json.loads(line)
+            except ValueError:
+                break
+            done[str(result["id"])] = result.get("error") is None
+            valid_size += len(line)
+
+    if valid_size < path.stat().st_size:
+        print(f"[WARNING] Truncating a partial record at the end of {path}")
+        os.truncate(path, valid_size)
+
+    return {item_id for item_id, ok in done.items() if ok}
+
+
+class BatchEvaluator:
+    """批量评测器
+
+    每个工作线程独立生成，共享 Ollama 节点池、模型目录和 token 估计校准器
+    """
+
+    def __init__(
+        self,
+        config: dict,
+        system_prompt: str,
+        client: PoolClient,
+        catalogue: ModelCatalogue,
+    ) -> None:
+        """
+        :param config: config.yaml 的内容
+        :type config: dict
+        :param system_prompt: 默认系统提示词
+        :type system_prompt: str
+        :param client: Ollama 同步客户端
+        :type client: PoolClient
+        :param catalogue: 模型目录缓存
+        :type catalogue: ModelCatalogue
+        """
+        timeout_config: dict = config.get("timeout") or {}
+        self._config: dict = config
+        self._system_prompt: str = system_prompt
+        self._client: PoolClient = client
+        self._catalogue: ModelCatalogue = catalogue
+        self._idle_timeout: float | None = timeout_config.get("idle_seconds", 120)
+        self._total_timeout: float | None = timeout_config.get("total_seconds", 600)
+        self._calibrator: TokenCalibrator = TokenCalibrator()
+
+    def evaluate(self, item: BatchItem) -> dict[str, Any]:
+        """生成一条评测条目的回答
+
+        :param item: 评测条目
+        :type item: BatchItem
+        :returns: 结果，生成失败时 error 为错误信息
+        :rtype: dict[str, Any]
+        """
+        model_config: dict = self._config["model"]
+        model: str = item.model or (
+            model_config["thinking"] if item.think else model_config["instruct"]
+        )
+        result: dict[str, Any] = {"id": item.id, "model": model, "think": item.think}
+        started: float = time.perf_counter()
+
+        try:
+            ollama_llm: OllamaLLM = OllamaLLM(
+                self._client,
+                None,
+                self._idle_timeout,
+                self._total_timeout,
+                catalogue=self._catalogue,
+            )
+            ollama_llm.set_model(model)
+            ollama_llm.set_num_ctx(model_config["options"]["num_ctx"])
+            ollama_llm.set_temperature(
+                item.temperature
+                if item.temperature is not None
+                else model_config["options"]["temperature"]
+            )
+
+            # 与网页界面一样由记忆模块按上下文窗口截取对话历史，不注入时间上下文，便于复现
+            memory: Memory = Memory(self._calibrator)
+            memory.set_system_message(
+                item.system if item.system is not None else self._system_prompt
+            )
+            for message in item.history:
+                if message["role"] == "user":
+                    memory.add_user_message(message["content"])
+                else:
+                    memory.add_assistant_message(message["content"])
+            memory.add_user_message(item.prompt)
+            context = memory.get_context(ollama_llm.get_num_ctx(), model)
+            messages: list[dict[str, str]] = PromptBuilder(None).build(
+                memory.get_system_message(), context
+            )
+
+            thinking_parts: list[str] = []
+            content_parts: list[str] = []
+            ttft: float | None = None
+            for think_word, answer_word in ollama_llm.chat(messages, item.think):
+                if ttft is None and (think_word or answer_word):
+                    ttft = time.perf_counter() - started
+                thinking_parts.append(think_word or "")
+                content_parts.append(answer_word or "")
+
+            stats: dict[str, int | str] = ollama_llm.get_last_stats()
+            prompt_eval_count: int | str | None = stats.get("prompt_eval_count")
+            if isinstance(prompt_eval_count, int):
+                memory.calibrate(model, prompt_eval_count)
+            eval_count: int | str | None = stats.get("eval_count")
+            eval_duration: int | str | None = stats.get("eval_duration")
+
+            result.update(
+                {
+                    "thinking": "".join(thinking_parts),
+                    "content": "".join(content_parts),
+                    "context_messages": len(context),
+                    "ttft_seconds": ttft,
+                    "total_seconds": time.perf_counter() - started,
+                    "prompt_tokens": prompt_eval_count,
+                    "completion_tokens": eval_count,
+                    "decode_tokens_per_second": (
+                        eval_count / (eval_duration / 1e9)
+                        if isinstance(eval_count, int)
+                        and isinstance(eval_duration, int)
+                        and eval_duration > 0
+                        else None
+                    ),
+                    "done_reason": stats.get("done_reason"),
+                    "error": None,
+                }
+            )
+        except Exception as e:
+            result.update(
+                {"total_seconds": time.perf_counter() - started, "error": str(e)}
+            )
+
+        return result
+
+
+class ResultWriter:
+    """逐条追加写入结果，定时刷新到磁盘作为检查点"""
+
+    def __init__(self, path: Path, fsync_interval: float = 5.0) -> None:
+        """
+        :param path: 输出的 JSONL 文件
+        :type path: Path
+        :param fsync_interval: 刷新到磁盘的时间间隔（秒）
+        :type fsync_interval: float
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._file: TextIO = open(path, "a", encoding="utf-8")
+        self._fsync_interval: float = fsync_interval
+        self._synced: float = time.monotonic()
+        self._lock: threading.Lock = threading.Lock()
+
+    def write(self, result: dict[str, Any]) -> None:
+        """追加一条结果
+
+        :param result: 结果
+        :type result: dict[str, Any]
+        :returns: 无
+        :rtype: None
+        """
+        line: str = json.dumps(result, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            if time.monotonic() - self._synced > self._fsync_interval:
+                os.fsync(self._file.fileno())
+                self._synced = time.monotonic()
+
+    def close(self) -> None:
+        """刷新到磁盘并关闭文件
+
+        :returns: 无
+        :rtype: None
+        """
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+
+def run(
+    evaluator: BatchEvaluator,
+    input_path: Path,
+    output_path: Path,
+    workers: int,
+    progress_interval: float = 10.0,
+) -> dict[str, int]:
+    """运行批量评测
+
+    提交的条目数不超过工作线程数的两倍，输入文件再大也只占用固定的内存
+
+    :param evaluator: 批量评测器
+    :type evaluator: BatchEvaluator
+    :param input_path: 输入的 JSONL 文件
+    :type input_path: Path
+    :param output_path: 输出的 JSONL 文件，同时是检查点
+    :type output_path: Path
+    :param workers: 工作线程数
+    :type workers: int
+    :param progress_interval: 输出进度的时间间隔（秒）
+    :type progress_interval: float
+    :returns: done / skipped / failed 为本次完成 / 跳过 / 失败的条目数
+    :rtype: dict[str, int]
+    :raises ValueError: 如果 workers 不大于 0
+    """
+    if workers <= 0:
+        raise ValueError(f"[ERROR] The number of workers={workers} is not positive")
+
+    completed: set[str] = load_checkpoint(output_path)
+    seen: set[str] = set()
+    counts: dict[str, int] = {"done": 0, "skipped": 0, "failed": 0}
+    writer: ResultWriter = ResultWriter(output_path)
+    started: float = time.monotonic()
+    reported: float = started
+
+    def collect(futures: set[Future], block: bool) -> set[Future]:
+        """写入已完成的结果，返回未完成的任务"""
+        nonlocal reported
+        finished, pending = wait(
+            futures, timeout=None if block else 0, return_when=FIRST_COMPLETED
+        )
+        for future in finished:
+            result: dict[str, Any] = future.result()
+            writer.write(result)
+            counts["failed" if result["error"] else "done"] += 1
+
+        now: float = time.monotonic()
+        if now - reported > progress_interval:
+            reported = now
+            processed: int = counts["done"] + counts["failed"]
+            print(
+                f"[INFO] {processed} done ({counts['failed']} failed), "
+                + f"{counts['skipped']} skipped, {processed / (now - started):.2f} items/s"
+            )
+
+        return pending
+
+    executor: ThreadPoolExecutor = ThreadPoolExecutor(workers)
+    futures: set[Future] = set()
+    try:
+        for item in read_items(input_path):
+            item_id: str = item.id if isinstance(item, BatchItem) else item[0]
+            if item_id in completed or item_id in seen:
+                if item_id in seen:
+                    print(f"[WARNING] Skipping duplicate id={item_id}")
+                counts["skipped"] += 1
+                continue
+            seen.add(item_id)
+
+            if not isinstance(item, BatchItem):
+                writer.write({"id": item_id, "error": item[1]})
+                counts["failed"] += 1
+                continue
+
+            futures.add(executor.submit(evaluator.evaluate, item))
+            while len(futures) >= 2 * workers:
+                futures = collect(futures, True)
+
+        while futures:
+            futures = collect(futures, True)
+    finally:
+        # Ctrl+C 时不再开始新的条目，等待正在生成的条目写入后退出
+        executor.shutdown(wait=True, cancel_futures=True)
+        for future in futures:
+            if future.done() and not future.cancelled():
+                result: dict[str, Any] = future.result()
+                writer.write(result)
+                counts["failed" if result["error"] else "done"] += 1
+        writer.close()
+
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", type=Path, help="input JSONL file")
+    parser.add_argument("output", type=Path, help="output JSONL file and checkpoint")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--config", type=Path, default=Path(__file__).parent / "config.yaml"
+    )
+    parser.add_argument(
+        "--system-prompt",
+        type=Path,
+        default=Path(__file__).parent / "system_prompt.md",
+    )
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config: dict = yaml.safe_load(f)
+    with open(args.system_prompt, "r", encoding="utf-8") as f:
+        system_prompt: str = f.read()
+
+    backend_pool: BackendPool = create_backend_pool(config)
+    if backend_pool.check() == 0:
+        total: int = len(backend_pool.get_backends())
+        print(f"[ERROR] Ollama service is unavailable on all {total} backends")
+        sys.exit(1)
+    backend_pool.start()
+
+    client: PoolClient = PoolClient(backend_pool)
+    evaluator: BatchEvaluator = BatchEvaluator(
+        config,
+        system_prompt,
+        client,
+        ModelCatalogue(
+            client, float((config.get("catalogue") or {}).get("ttl_seconds", 60))
+        ),
+    )
+
+    started: float = time.perf_counter()
+    try:
+        counts: dict[str, int] = run(evaluator, args.input, args.output, args.workers)
+    except KeyboardInterrupt:
+        print(
+            f"[WARNING] Interrupted, rerun the same command to resume from {args.output}"
+        )
+        sys.exit(130)
+    finally:
+        backend_pool.stop()
+
+    print(
+        f"[INFO] {counts['done']} done, {counts['failed']} failed, "
+        + f"{counts['skipped']} skipped in {time.perf_counter() - started:.1f} s"
+    )
+    sys.exit(1 if counts["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
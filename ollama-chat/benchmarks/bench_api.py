@@ -0,0 +1,156 @@
+"""OpenAI 兼容 API 与 Gradio 界面的逐 token 开销对比
+
+在 config.yaml 配置的 Ollama 地址上启动替身服务端（token 速率不限），在同一个进程中用 uvicorn 启动
+挂载了 Gradio 界面的 API 服务，依次测量：
+
+- direct：直接用 OllamaLLM.achat 请求替身服务端，作为基准
+- api：通过 /v1/chat/completions 的 SSE 流
+- gradio：通过 gradio_client 调用 chat_stream，经过 Gradio 的队列和事件流
+
+输出每次生成的平均耗时、客户端收到的更新数，以及扣除基准后平均到每个 token 的开销
+
+用法：
+
+    python benchmarks/bench_api.py --requests 20 --tokens 500
+"""
+
+import argparse
+import asyncio
+import sys
+import threading
+import time
+
+from pathlib import Path
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+
+import yaml  # noqa: E402
+
+from fake_ollama import FakeOllamaServer  # noqa: E402
+
+CONFIG_PATH: Path = Path(__file__).resolve().parent.parent / "config.yaml"
+
+
+def run_direct(host: str, model: str, requests: int) -> tuple[float, int]:
+    """直接请求替身服务端，返回 (平均耗时, 平均分块数)"""
+    import ollama
+
+    from ollama_llm import OllamaLLM
+
+    async def run() -> tuple[float, int]:
+        llm = OllamaLLM(ollama.Client(host=host), ollama.AsyncClient(host=host))
+        llm.set_model(model)
+        chunks: int = 0
+        started: float = 0.0
+        # 第一次请求建立连接，不计时
+        for i in range(requests + 1):
+            if i == 1:
+                started, chunks = time.perf_counter(), 0
+            async for _ in llm.achat([{"role": "user", "content": "Hello"}], False):
+                chunks += 1
+        return time.perf_counter() - started, chunks
+
+    elapsed, chunks = asyncio.run(run())
+
+    return elapsed / requests, chunks // requests
+
+
+def run_api(url: str, requests: int) -> tuple[float, int]:
+    """通过 SSE 流请求 API，返回 (平均耗时, 平均事件数)"""
+    import httpx
+
+    events: int = 0
+    started: float = 0.0
+    with httpx.Client(base_url=url, timeout=60) as client:
+        # 第一次请求建立连接，不计时
+        for i in range(requests + 1):
+            if i == 1:
+                started, events = time.perf_counter(), 0
+            with client.stream(
+                "POST",
+                "/v1/chat/completions",
+                json={
+                    "messages": [{"role": "user", "content": "Hello"}],
+                    "stream": True,
+                },
+            ) as response:
+                events += sum(1 for line in response.iter_lines() if line)
+        elapsed: float = time.perf_counter() - started
+
+    return elapsed / requests, events // requests
+
+
+def run_gradio(url: str, requests: int) -> tuple[float, int]:
+    """通过 gradio_client 调用 chat_stream，返回 (平均耗时, 平均更新数)"""
+    from gradio_client import Client
+
+    client = Client(url, verbose=False)
+    # 浏览器打开页面时由 load 事件初始化会话状态，gradio_client 需要手动触发
+    client.predict(api_name="/create_session")
+    updates: int = 0
+    started: float = 0.0
+    # 第一次请求建立连接，不计时
+    for i in range(requests + 1):
+        if i == 1:
+            started, updates = time.perf_counter(), 0
+        job = client.submit("Hello", False, api_name="/chat_stream")
+        updates += sum(1 for _ in job)
+        # 每轮对话后清空，提示词长度保持不变
+        client.predict(api_name="/clear_chat_history")
+    elapsed: float = time.perf_counter() - started
+
+    return elapsed / requests, updates // requests
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--tokens", type=int, default=500)
+    parser.add_argument("--port", type=int, default=7861)
+    args = parser.parse_args()
+
+    with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+        config: dict = yaml.safe_load(f)
+
+    with FakeOllamaServer(
+        host=config["ip"], port=config["port"], content_tokens=args.tokens
+    ) as fake_server:
+        import uvicorn
+
+        import app
+
+        app.start_services()
+        app.BACKEND_POOL.wait_available(10)
+        server = uvicorn.Server(
+            uvicorn.Config(
+                app.create_server_app(),
+                host="127.0.0.1",
+                port=args.port,
+                log_level="warning",
+            )
+        )
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.05)
+        url: str = f"http://127.0.0.1:{args.port}"
+
+        base, _ = run_direct(
+            fake_server.host, config["model"]["instruct"], args.requests
+        )
+        print(f"{'path':>8}{'ms/request':>12}{'updates':>9}{'us/token':>10}")
+        for name, run in (
+            ("direct", lambda: (base, args.tokens + 1)),
+            ("api", lambda: run_api(url, args.requests)),
+            ("gradio", lambda: run_gradio(url, args.requests)),
+        ):
+            elapsed, updates = run()
+            overhead: float = (elapsed - base) / args.tokens * 1e6
+            print(f"{name:>8}{elapsed * 1000:>12.1f}{updates:>9}{overhead:>10.1f}")
+
+        # gradio_client 的事件流连接不会主动断开，不等待 uvicorn 退出
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""模型目录缓存的基准测试
+
+模拟部署后大量页面同时刷新：N 个线程同时为新会话创建非思考模型和思考模型的 OllamaLLM，
+比较不使用和使用 ModelCatalogue 时，Ollama 收到的 /api/tags、/api/show 请求数和总耗时
+
+用法：
+
+    python benchmarks/bench_catalogue.py --sessions 200
+"""
+
+import argparse
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+
+import ollama  # noqa: E402
+
+from fake_ollama import DEFAULT_MODELS, FakeOllamaServer  # noqa: E402
+from model_catalogue import ModelCatalogue  # noqa: E402
+from ollama_llm import OllamaLLM  # noqa: E402
+
+# Gradio 同步处理函数默认使用的线程数
+GRADIO_THREADS: int = 40
+
+
+def run(sessions: int, cached: bool) -> tuple[float, int, int]:
+    """并发创建会话，返回 (总耗时, /api/tags 请求数, /api/show 请求数)"""
+    with FakeOllamaServer() as server:
+        client = ollama.Client(host=server.host)
+        catalogue: ModelCatalogue | None = ModelCatalogue(client) if cached else None
+
+        def create_session(_: int) -> None:
+            for model in DEFAULT_MODELS:
+                llm = OllamaLLM(client, catalogue=catalogue)
+                llm.set_model(model)
+                llm.set_num_ctx(8192)
+
+        started: float = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=GRADIO_THREADS) as pool:
+            list(pool.map(create_session, range(sessions)))
+        elapsed: float = time.perf_counter() - started
+
+        return (
+            elapsed,
+            server.stats.requests.get("/api/tags", 0),
+            server.stats.requests.get("/api/show", 0),
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'mode':<8}{'wall':>9}{'/api/tags':>11}{'/api/show':>11}")
+    for mode, cached in (("direct", False), ("cached", True)):
+        elapsed, tags, show = run(args.sessions, cached)
+        print(f"{mode:<8}{elapsed:>8.2f}s{tags:>11}{show:>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""HTTP 连接池的基准测试
+
+在本机启动一个 Ollama 替身服务端，分几轮突发地并发生成，两轮之间空闲 gap 秒，
+分别使用 httpx 的默认连接池设置和 config.yaml 中 http 的设置，比较：
+
+- opened / reused：节点池统计的新建连接数和复用空闲连接的请求数
+- accepted：替身服务端实际接受的 TCP 连接数，应与 opened 一致
+- ttft p50 / p99：首个分块的延迟，第一轮之后的各轮
+
+用法：
+
+    python benchmarks/bench_connections.py --sessions 8 --bursts 6 --gap 6
+"""
+
+import argparse
+import asyncio
+import httpx
+import statistics
+import sys
+import time
+
+from pathlib import Path
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+
+import yaml  # noqa: E402
+
+from backend_pool import AsyncPoolClient, Backend, BackendPool  # noqa: E402
+from fake_ollama import DEFAULT_MODELS, FakeOllamaServer  # noqa: E402
+
+APP_DIR: Path = Path(__file__).resolve().parent.parent
+
+
+async def burst(client: AsyncPoolClient, sessions: int) -> list[float]:
+    """并发生成一轮，返回每个请求首个分块的延迟（秒）"""
+
+    async def session() -> float:
+        started: float = time.perf_counter()
+        ttft: float = 0.0
+        async for _ in await client.chat(
+            model=DEFAULT_MODELS[0],
+            messages=[{"role": "user", "content": "Hello"}],
+            stream=True,
+        ):
+            if not ttft:
+                ttft = time.perf_counter() - started
+
+        return ttft
+
+    return list(await asyncio.gather(*(session() for _ in range(sessions))))
+
+
+async def run(
+    name: str,
+    server: FakeOllamaServer,
+    backend: Backend,
+    sessions: int,
+    bursts: int,
+    gap: float,
+) -> None:
+    accepted: int = server.stats.connections
+    pool: BackendPool = BackendPool([backend])
+    pool.check()
+    client: AsyncPoolClient = AsyncPoolClient(pool)
+    ttfts: list[float] = []
+
+    for index in range(bursts):
+        if index:
+            await asyncio.sleep(gap)
+        result: list[float] = await burst(client, sessions)
+        if index:
+            ttfts.extend(result)
+
+    stats: dict[str, int] = backend.connections.get_stats()
+    quantiles: list[float] = statistics.quantiles(ttfts, n=100)
+    print(
+        f"{name:<8}{stats['opened']:>8}{stats['reused']:>8}"
+        + f"{server.stats.connections - accepted:>10}{stats['in_use']:>8}"
+        + f"{quantiles[49] * 1000:>10.1f}ms{quantiles[98] * 1000:>8.1f}ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--bursts", type=int, default=6)
+    parser.add_argument("--gap", type=float, default=6.0)
+    args = parser.parse_args()
+
+    with open(APP_DIR / "config.yaml", "r", encoding="utf-8") as f:
+        http_config: dict = yaml.safe_load(f).get("http") or {}
+
+    print(
+        f"{'pool':<8}{'opened':>8}{'reused':>8}{'accepted':>10}{'in_use':>8}"
+        + f"{'ttft p50':>12}{'p99':>10}"
+    )
+
+    with FakeOllamaServer(
+        ttft=0.05, tokens_per_second=200, content_tokens=20
+    ) as server:
+        asyncio.run(
+            run("default", server, Backend(server.host), **vars(args)),
+        )
+        asyncio.run(
+            run(
+                "config",
+                server,
+                Backend(
+                    server.host,
+                    limits=httpx.Limits(
+                        max_connections=int(http_config.get("max_connections", 64)),
+                        max_keepalive_connections=int(
+                            http_config.get("max_keepalive_connections", 32)
+                        ),
+                        keepalive_expiry=float(
+                            http_config.get("keepalive_expiry_seconds", 60)
+                        ),
+                    ),
+                ),
+                **vars(args),
+            ),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""对话日志的基准测试
+
+1. 追加吞吐量：向对话日志写入 T 轮对话，比较批量 fsync 和每条消息立即 fsync 的吞吐量
+2. 恢复延迟：从有 T 轮对话的日志恢复会话，比较只读取上下文窗口放得下的末尾和读取整个日志的耗时
+
+用法：
+
+    python benchmarks/bench_conversation_log.py --turns 10000 --num-ctx 8192
+"""
+
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+
+from conversation_log import ConversationStore  # noqa: E402
+from memory import Memory  # noqa: E402
+
+QUESTION: str = "How does the append-only log keep resume fast? " * 4
+ANSWER: str = "It reads the index backwards and only decodes the tail. " * 12
+THINKING: str = "Let me think about the index layout. " * 20
+
+
+def append(directory: Path, turns: int, fsync_interval: float) -> float:
+    """写入 turns 轮对话，返回每秒写入的消息数"""
+    store = ConversationStore(directory, fsync_interval)
+    store.start()
+    memory = Memory()
+    memory.set_system_message("You are a helpful assistant.")
+    memory.attach_log(store.open(f"append-{int(fsync_interval * 1000)}"))
+
+    started: float = time.perf_counter()
+    for turn in range(turns):
+        memory.add_user_message(QUESTION)
+        memory.add_assistant_message(ANSWER, THINKING if turn % 2 else None)
+    store.stop()
+    elapsed: float = time.perf_counter() - started
+
+    return 2 * turns / elapsed
+
+
+def resume(
+    directory: Path, conversation_id: str, num_ctx: int | None, repeat: int
+) -> tuple[float, int]:
+    """重复恢复会话，返回 (恢复耗时的中位数（毫秒）, 恢复的消息数)"""
+    store = ConversationStore(directory)
+    timings: list[float] = []
+    messages: int = 0
+
+    for _ in range(repeat):
+        memory = Memory()
+        memory.set_system_message("You are a helpful assistant.")
+        started: float = time.perf_counter()
+        messages = memory.attach_log(store.open(conversation_id), num_ctx)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    return statistics.median(timings), messages
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=10000)
+    parser.add_argument("--sync-turns", type=int, default=500)
+    parser.add_argument("--num-ctx", type=int, default=8192)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory)
+
+        print(f"{'fsync':<12}{'turns':>7}{'messages/s':>12}")
+        for name, turns, interval in (
+            ("every 1s", args.turns, 1.0),
+            ("every msg", args.sync_turns, 0.0),
+        ):
+            rate: float = append(path, turns, interval)
+            print(f"{name:<12}{turns:>7}{rate:>12.0f}")
+
+        size: int = sum(p.stat().st_size for p in path.glob("append-1000.*"))
+        print(f"\nlog size for {args.turns} turns: {size / 1024 / 1024:.1f} MiB")
+        print(f"{'resume':<12}{'ms p50':>9}{'messages':>10}")
+        for name, num_ctx in (("tail", args.num_ctx), ("full", None)):
+            ms, messages = resume(path, "append-1000", num_ctx, args.repeat)
+            print(f"{name:<12}{ms:>9.2f}{messages:>10}")
+
+
+if __name__ == "__main__":
+    main()
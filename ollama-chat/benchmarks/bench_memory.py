@@ -0,0 +1,73 @@
+"""记忆模块的内存占用基准测试
+
+为 N 个会话各模拟 T 轮对话（思考模式和非思考模式交替），用 tracemalloc 统计每个会话常驻的内存，
+并统计每轮获取对话历史和上下文的耗时
+
+用法：
+
+    python benchmarks/bench_memory.py --sessions 100 --turns 200 --max-chars 100000
+"""
+
+import argparse
+import sys
+import time
+import tracemalloc
+
+from pathlib import Path
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+
+from memory import Memory  # noqa: E402
+from token_estimator import TokenCalibrator  # noqa: E402
+
+
+def run(sessions: int, turns: int, max_chars: int | None) -> tuple[float, float, int]:
+    """模拟对话，返回 (每个会话的内存占用（KiB）, 每轮的平均耗时（毫秒）, 每个会话保留的消息数)"""
+    calibrator = TokenCalibrator()
+    memories: list[Memory] = []
+    elapsed: float = 0.0
+
+    tracemalloc.start()
+    before: int = tracemalloc.get_traced_memory()[0]
+
+    for _ in range(sessions):
+        memory = Memory(calibrator, max_chars)
+        memory.set_system_message("You are a helpful assistant.")
+        for turn in range(turns):
+            memory.add_user_message(f"Question {turn}: " + "How does it work? " * 10)
+            started: float = time.perf_counter()
+            history = memory.get_history()
+            context = [*memory.get_context(8192)]
+            elapsed += time.perf_counter() - started
+            thinking: str | None = "Let me think. " * 40 if turn % 2 else None
+            memory.add_assistant_message(
+                f"Answer {turn}: " + "It works. " * 60, thinking
+            )
+            del history, context
+        memories.append(memory)
+
+    after: int = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return (
+        (after - before) / sessions / 1024,
+        elapsed / sessions / turns * 1000,
+        len(memories[0]),
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--max-chars", type=int, default=100_000)
+    args = parser.parse_args()
+
+    print(f"{'max_chars':>10}{'KiB/session':>13}{'ms/turn':>9}{'messages':>10}")
+    for max_chars in (None, args.max_chars):
+        kib, ms, messages = run(args.sessions, args.turns, max_chars)
+        print(f"{str(max_chars):>10}{kib:>13.1f}{ms:>9.3f}{messages:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""模型驻留管理的基准测试
+
+在模拟加载耗时的 Ollama 替身服务端上，交替使用非思考模型和思考模型（模拟反复切换 Think 开关），
+比较三种情况下每次生成的首 token 延迟：
+
+- cold：不预热，请求不带 keep_alive
+- warm：启动时用 ResidencyManager 预热，请求带上相同的 keep_alive 和 num_ctx
+- evict：同 warm，但服务端最多只能同时加载一个模型，切换模型时另一个模型被换出
+
+用法：
+
+    python benchmarks/bench_residency.py --load-time 2 --requests 6
+"""
+
+import argparse
+import statistics
+import sys
+import time
+
+from pathlib import Path
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+
+from backend_pool import Backend, BackendPool, PoolClient  # noqa: E402
+from fake_ollama import DEFAULT_MODELS, FakeOllamaServer  # noqa: E402
+from ollama_llm import OllamaLLM  # noqa: E402
+from residency import ResidencyManager  # noqa: E402
+
+MESSAGES: list[dict[str, str]] = [{"role": "user", "content": "Hello"}]
+# 生成请求的上下文窗口，预热时使用相同的值，否则第一次生成时会重新加载
+NUM_CTX: int = 8192
+
+
+def run(
+    load_time: float, requests: int, warm: bool, max_loaded: int
+) -> tuple[list[float], int, dict[str, int | float]]:
+    """交替请求两个模型，返回 (首 token 延迟列表, 服务端加载次数, 管理器统计信息)"""
+    with FakeOllamaServer(load_time=load_time, max_loaded=max_loaded) as server:
+        pool = BackendPool([Backend(server.host)])
+        pool.check()
+        manager = ResidencyManager(
+            pool, list(DEFAULT_MODELS), options={"num_ctx": NUM_CTX}
+        )
+        if warm:
+            manager.warm()
+
+        client = PoolClient(pool)
+        ttfts: list[float] = []
+        for i in range(requests):
+            llm = OllamaLLM(
+                client, keep_alive=manager.get_keep_alive() if warm else None
+            )
+            llm._model = DEFAULT_MODELS[i % len(DEFAULT_MODELS)]
+            llm.set_num_ctx(NUM_CTX)
+            started: float = time.perf_counter()
+            ttft: float = 0.0
+            for _, content in llm.chat(MESSAGES, False):
+                if content and not ttft:
+                    ttft = time.perf_counter() - started
+            ttfts.append(ttft)
+            manager.observe(llm.get_last_stats())
+
+        return ttfts, server.stats.loads, manager.get_stats()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--load-time", type=float, default=2.0)
+    parser.add_argument("--requests", type=int, default=6)
+    args = parser.parse_args()
+
+    print(
+        f"{'mode':<6}{'ttft mean':>11}{'ttft max':>10}{'loads':>7}"
+        + f"{'cold':>6}{'warm-up p50':>13}"
+    )
+    for mode, warm, max_loaded in (
+        ("cold", False, 0),
+        ("warm", True, 0),
+        ("evict", True, 1),
+    ):
+        ttfts, loads, stats = run(args.load_time, args.requests, warm, max_loaded)
+        print(
+            f"{mode:<6}{statistics.mean(ttfts):>10.2f}s{max(ttfts):>9.2f}s"
+            + f"{loads:>7}{stats['cold_loads']:>6}{stats['load_p50']:>12.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
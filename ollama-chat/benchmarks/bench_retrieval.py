@@ -0,0 +1,106 @@
+"""检索记忆的基准测试
+
+为一个有 N 条消息的长会话建立向量索引，统计一次性批量计算向量的耗时和请求数，
+再模拟若干轮对话，统计每轮检索（不包括计算查询向量）和增量更新索引的耗时
+
+默认使用本地的词袋向量；指定 --ollama 时通过 Ollama 替身服务端的 /api/embed 计算向量
+
+用法：
+
+    python benchmarks/bench_retrieval.py --messages 100000 --turns 100
+    python benchmarks/bench_retrieval.py --messages 10000 --ollama
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+from pathlib import Path
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+
+import ollama  # noqa: E402
+
+from fake_ollama import FakeOllamaServer  # noqa: E402
+from memory import Memory  # noqa: E402
+from retrieval import HashingEmbedder, OllamaEmbedder, Retriever  # noqa: E402
+
+TOPICS: tuple[str, ...] = (
+    "python",
+    "cooking",
+    "travel",
+    "music",
+    "finance",
+    "gardening",
+    "chess",
+    "astronomy",
+)
+
+
+async def run(
+    embedder: HashingEmbedder | OllamaEmbedder, messages: int, turns: int
+) -> None:
+    """模拟长会话并输出统计信息"""
+    retriever = Retriever(embedder, top_k=4, max_tokens=1024, min_score=0.1)
+    memory = Memory()
+    memory.set_system_message("You are a helpful assistant.")
+
+    for i in range(messages // 2):
+        topic: str = TOPICS[i % len(TOPICS)]
+        memory.add_user_message(f"Question {i} about {topic}: what should I know?")
+        memory.add_assistant_message(f"Answer {i}: some notes on {topic} and {i}.")
+
+    started: float = time.perf_counter()
+    await retriever.update(memory)
+    elapsed: float = time.perf_counter() - started
+    stats: dict[str, int | float] = retriever.get_stats()
+    print(
+        f"index {stats['vectors']} messages: {elapsed:.2f} s, "
+        + f"{stats['embed_requests']} requests, {stats['index_bytes'] / 2**20:.1f} MiB"
+    )
+
+    update_time: float = 0.0
+    for turn in range(turns):
+        query: str = f"Tell me more about {TOPICS[turn % len(TOPICS)]}."
+        memory.add_user_message(query)
+        memory.get_context(8192, None, 0.75, retriever.get_max_tokens())
+        await retriever.retrieve(memory, query)
+        memory.add_assistant_message(f"Here is more about {query}")
+        started = time.perf_counter()
+        await retriever.update(memory)
+        update_time += time.perf_counter() - started
+
+    stats = retriever.get_stats()
+    print(
+        f"search over {stats['vectors']} messages: "
+        + f"mean {stats['search_mean'] * 1000:.2f} ms, "
+        + f"p50 {stats['search_p50'] * 1000:.2f} ms, "
+        + f"p95 {stats['search_p95'] * 1000:.2f} ms, "
+        + f"max {stats['search_max'] * 1000:.2f} ms, "
+        + f"hits {stats['hits']}/{stats['retrievals']}"
+    )
+    print(
+        f"incremental update: {update_time / turns * 1000:.2f} ms/turn, "
+        + f"{stats['embedded'] - messages} vectors in {turns} turns"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--turns", type=int, default=100)
+    parser.add_argument("--ollama", action="store_true")
+    args = parser.parse_args()
+
+    if not args.ollama:
+        asyncio.run(run(HashingEmbedder(), args.messages, args.turns))
+        return
+
+    with FakeOllamaServer(embedding_dim=256) as server:
+        embedder = OllamaEmbedder(ollama.AsyncClient(host=server.host), "embed")
+        asyncio.run(run(embedder, args.messages, args.turns))
+
+
+if __name__ == "__main__":
+    main()
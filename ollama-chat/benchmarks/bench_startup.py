@@ -0,0 +1,162 @@
+"""启动耗时的基准测试
+
+以子进程运行 app.py，在 config.yaml 配置的 Ollama 地址上分别模拟三种情况：
+
+- up：替身服务端正常响应
+- down：端口上没有服务，连接立即被拒绝
+- hung：端口接受连接但从不响应，例如节点正在重启或网络故障
+
+对每种情况输出（取多次运行的中位数）：
+
+- import：导入 app 模块的耗时，进程在导入时退出则显示 exited
+- ui：从启动进程到网页界面返回 200 的耗时，进程提前退出时显示 exited
+- ready：从启动进程到指标端点的 /health 返回 200 的耗时，即可以开始生成
+
+用法：
+
+    python benchmarks/bench_startup.py --runs 3
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from pathlib import Path
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+
+import yaml  # noqa: E402
+
+from fake_ollama import FakeOllamaProcess  # noqa: E402
+
+APP_DIR: Path = Path(__file__).resolve().parent.parent
+# 等待网页界面或就绪的最长时间（秒）
+DEADLINE: float = 30.0
+
+
+def free_port() -> int:
+    """选择一个空闲端口"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get_status(url: str) -> int | None:
+    """请求 url，返回状态码，连接失败时返回 None"""
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+
+def measure_import() -> float | None:
+    """在子进程中导入 app 模块，返回导入耗时（秒），导入时进程退出则返回 None"""
+    output: str = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import time; started = time.perf_counter(); import app; "
+            + "print(time.perf_counter() - started)",
+        ],
+        cwd=APP_DIR,
+        capture_output=True,
+        text=True,
+        timeout=DEADLINE,
+    ).stdout
+
+    try:
+        return float(output.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        return None
+
+
+def measure_launch(metrics_port: int) -> tuple[float | None, float | None]:
+    """启动 app.py，返回 (网页界面可用的耗时, 就绪的耗时)，没有等到时为 None"""
+    port: int = free_port()
+    started: float = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "app.py"],
+        cwd=APP_DIR,
+        env={**os.environ, "GRADIO_SERVER_PORT": str(port)},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    ui: float | None = None
+    ready: float | None = None
+    try:
+        while time.perf_counter() - started < DEADLINE and process.poll() is None:
+            now: float = time.perf_counter() - started
+            if ui is None and get_status(f"http://127.0.0.1:{port}/") == 200:
+                ui = now
+            if (
+                ready is None
+                and get_status(f"http://127.0.0.1:{metrics_port}/health") == 200
+            ):
+                ready = now
+            if ui is not None and ready is not None:
+                break
+            # 界面可用但 Ollama 不可用时，不等到超时
+            if ui is not None and now > ui + 3:
+                break
+            time.sleep(0.02)
+    finally:
+        process.terminate()
+        process.wait()
+
+    return ui, ready
+
+
+def run(name: str, runs: int, metrics_port: int) -> None:
+    imports: list[float | None] = [measure_import() for _ in range(runs)]
+    launches: list[tuple[float | None, float | None]] = [
+        measure_launch(metrics_port) for _ in range(runs)
+    ]
+
+    def median(values: list[float | None], missing: str) -> str:
+        present: list[float] = [value for value in values if value is not None]
+        if len(present) < len(values):
+            return f"{missing:>10}"
+        return f"{statistics.median(present):>9.2f}s"
+
+    print(
+        f"{name:<6}"
+        + median(imports, "exited")
+        + median([ui for ui, _ in launches], "exited")
+        + median([ready for _, ready in launches], "-")
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    with open(APP_DIR / "config.yaml", "r", encoding="utf-8") as f:
+        config: dict = yaml.safe_load(f)
+    metrics_port: int = int((config.get("metrics") or {}).get("port") or 9464)
+
+    print(f"{'ollama':<6}{'import':>10}{'ui':>10}{'ready':>10}")
+
+    with FakeOllamaProcess(port=config["port"], ttft=0, tokens_per_second=0):
+        run("up", args.runs, metrics_port)
+
+    run("down", args.runs, metrics_port)
+
+    # 监听但从不 accept，连接停在 backlog 中，请求一直等不到响应
+    with socket.socket() as sock:
+        sock.bind((config["ip"], config["port"]))
+        sock.listen(64)
+        run("hung", args.runs, metrics_port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+"""可复现的基准测试套件
+
+在 config.yaml 配置的 Ollama 地址上以子进程启动替身服务端（替身服务端的 CPU 不计入被测进程），
+用 N 个并发会话、每个会话 M 轮对话，依次驱动三层代码：
+
+- client：直接用 ollama.AsyncClient 流式生成，自己维护消息列表，作为基准
+- classes：Memory.get_context + PromptBuilder.build + OllamaLLM.achat，即 chat_stream 用到的底层类
+- chat_stream：完整的 app.chat_stream，包括请求调度、界面刷新合并、生成指标等
+
+每轮对话是否使用思考模式由 --think-ratio 和固定的随机种子决定，三层代码使用相同的计划。
+请求调度器的并发数设为会话数，三层代码的延迟差异只来自应用自身的开销，不包括排队
+
+对每层代码输出：
+
+- cpu us/token：被测进程消耗的 CPU 时间平均到每个生成的 token，即应用侧每个 token 的开销
+- cpu %：CPU 时间占墙钟时间的比例
+- ttft / total p50、p99：每次生成的首 token 延迟和总耗时
+- KiB/session：所有会话结束后仍被引用的内存平均到每个会话（单独跑一遍并用 tracemalloc 统计）
+
+结果与仓库中的 benchmarks/baseline.json 对比，输出相对变化，超过 --tolerance 的变化标记为回归；
+基准值与机器相关，更换测试机器或调整负载参数后用 --save 重新生成
+
+用法：
+
+    python benchmarks/bench_suite.py
+    python benchmarks/bench_suite.py --sessions 50 --turns 10 --tokens-per-second 500
+    python benchmarks/bench_suite.py --save
+    python benchmarks/bench_suite.py --check
+"""
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+
+import yaml  # noqa: E402
+
+from fake_ollama import FakeOllamaProcess  # noqa: E402
+
+CONFIG_PATH: Path = Path(__file__).resolve().parent.parent / "config.yaml"
+BASELINE_PATH: Path = Path(__file__).resolve().parent / "baseline.json"
+# 决定每轮对话是否使用思考模式的随机种子
+SEED: int = 0
+# 与基准值对比的指标，数值越小越好
+METRICS: tuple[str, ...] = (
+    "cpu_us_per_token",
+    "ttft_p50_ms",
+    "ttft_p99_ms",
+    "total_p50_ms",
+    "total_p99_ms",
+    "kib_per_session",
+)
+
+
+@dataclass
+class Sample:
+    """一次生成的测量结果"""
+
+    # 首 token 延迟（秒）
+    ttft: float
+    # 总耗时（秒）
+    total: float
+    # 生成的 token 数
+    tokens: int
+
+
+# 一个会话：(会话序号, 每轮是否思考) -> (测量结果, 会话状态)，会话状态用于统计内存
+Session = Callable[[int, list[bool]], Awaitable[tuple[list[Sample], Any]]]
+
+
+def percentile(values: list[float], q: float) -> float:
+    """计算分位数"""
+    ordered: list[float] = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def question(session: int, turn: int) -> str:
+    """第 session 个会话第 turn 轮的用户消息"""
+    return f"Session {session}, question {turn}: please explain the previous answer."
+
+
+def make_plan(sessions: int, turns: int, think_ratio: float) -> list[list[bool]]:
+    """生成每个会话每轮对话是否使用思考模式的计划"""
+    rng = random.Random(SEED)
+
+    return [[rng.random() < think_ratio for _ in range(turns)] for _ in range(sessions)]
+
+
+def client_session(app: Any, host: str) -> Session:
+    """直接使用 ollama.AsyncClient 的会话"""
+    import ollama
+
+    client = ollama.AsyncClient(host=host)
+    models: tuple[str, str] = (
+        app.DEFAULT_CONFIG["model"]["instruct"],
+        app.DEFAULT_CONFIG["model"]["thinking"],
+    )
+    options: dict = dict(app.DEFAULT_CONFIG["model"]["options"])
+
+    async def run(session: int, thinks: list[bool]) -> tuple[list[Sample], Any]:
+        messages: list[dict[str, str]] = [
+            {"role": "system", "content": app.DEFAULT_SYSTEM_PROMPT}
+        ]
+        samples: list[Sample] = []
+        for turn, think in enumerate(thinks):
+            messages.append({"role": "user", "content": question(session, turn)})
+            started: float = time.perf_counter()
+            ttft: float = 0.0
+            tokens: int = 0
+            answer: list[str] = []
+            async for part in await client.chat(
+                model=models[think],
+                messages=messages,
+                options=options,
+                stream=True,
+                think=think,
+            ):
+                if not ttft and (part.message.content or part.message.thinking):
+                    ttft = time.perf_counter() - started
+                answer.append(part.message.content or "")
+                if part.done:
+                    tokens = part.eval_count or 0
+            samples.append(Sample(ttft, time.perf_counter() - started, tokens))
+            messages.append({"role": "assistant", "content": "".join(answer)})
+
+        return samples, messages
+
+    return run
+
+
+def classes_session(app: Any) -> Session:
+    """使用 Memory、PromptBuilder 和 OllamaLLM 的会话"""
+
+    async def run(session: int, thinks: list[bool]) -> tuple[list[Sample], Any]:
+        memory = app.create_memory()
+        prompt_builder = app.create_prompt_builder()
+        llms = (app.create_instruct_ollama_llm(), app.create_thinking_ollama_llm())
+        samples: list[Sample] = []
+        for turn, think in enumerate(thinks):
+            started: float = time.perf_counter()
+            ttft: float = 0.0
+            thinking: list[str] = []
+            answer: list[str] = []
+            memory.add_user_message(question(session, turn))
+            llm = llms[think]
+            context = memory.get_context(
+                llms[0].get_num_ctx(), llm.get_model(), app.CONTEXT_REFILL
+            )
+            messages = prompt_builder.build(memory.get_system_message(), context)
+            async for think_word, answer_word in llm.achat(messages, think):
+                if not ttft and (think_word or answer_word):
+                    ttft = time.perf_counter() - started
+                thinking.append(think_word)
+                answer.append(answer_word)
+            memory.add_assistant_message("".join(answer), "".join(thinking))
+            tokens: int = int(llm.get_last_stats().get("eval_count", 0))
+            samples.append(Sample(ttft, time.perf_counter() - started, tokens))
+
+        return samples, (memory, prompt_builder, llms)
+
+    return run
+
+
+def chat_stream_session(app: Any) -> Session:
+    """使用 app.chat_stream 的会话"""
+
+    async def run(session: int, thinks: list[bool]) -> tuple[list[Sample], Any]:
+        memory = app.create_memory()
+        prompt_builder = app.create_prompt_builder()
+        instruct_ollama_llm = app.create_instruct_ollama_llm()
+        thinking_ollama_llm = app.create_thinking_ollama_llm()
+        samples: list[Sample] = []
+        for turn, think in enumerate(thinks):
+            started: float = time.perf_counter()
+            ttft: float = 0.0
+            async for history, *_ in app.chat_stream(
+                question(session, turn),
+                think,
+                memory,
+                prompt_builder,
+                instruct_ollama_llm,
+                thinking_ollama_llm,
+            ):
+                if not ttft and history[-1]["content"]:
+                    ttft = time.perf_counter() - started
+            llm = thinking_ollama_llm if think else instruct_ollama_llm
+            tokens: int = int(llm.get_last_stats().get("eval_count", 0))
+            samples.append(Sample(ttft, time.perf_counter() - started, tokens))
+
+        return samples, (
+            memory,
+            prompt_builder,
+            instruct_ollama_llm,
+            thinking_ollama_llm,
+        )
+
+    return run
+
+
+async def measure(session: Session, plan: list[list[bool]]) -> dict[str, float]:
+    """用并发会话跑一遍计划，统计 CPU 时间和延迟"""
+    gc.collect()
+    wall_started: float = time.perf_counter()
+    cpu_started: float = time.process_time()
+    results = await asyncio.gather(
+        *(session(index, thinks) for index, thinks in enumerate(plan))
+    )
+    cpu: float = time.process_time() - cpu_started
+    wall: float = time.perf_counter() - wall_started
+
+    samples: list[Sample] = [sample for result in results for sample in result[0]]
+    tokens: int = sum(sample.tokens for sample in samples)
+
+    return {
+        "generations": len(samples),
+        "tokens": tokens,
+        "wall_seconds": round(wall, 3),
+        "cpu_percent": round(cpu / wall * 100, 1),
+        "cpu_us_per_token": round(cpu / max(1, tokens) * 1e6, 2),
+        "ttft_p50_ms": round(percentile([s.ttft for s in samples], 0.5) * 1000, 2),
+        "ttft_p99_ms": round(percentile([s.ttft for s in samples], 0.99) * 1000, 2),
+        "total_p50_ms": round(percentile([s.total for s in samples], 0.5) * 1000, 2),
+        "total_p99_ms": round(percentile([s.total for s in samples], 0.99) * 1000, 2),
+    }
+
+
+async def measure_memory(session: Session, plan: list[list[bool]]) -> float:
+    """在 tracemalloc 下跑一遍计划，返回所有会话结束后仍被引用的内存平均到每个会话（KiB）
+
+    tracemalloc 会明显拖慢执行，与 measure 分开跑
+    """
+    gc.collect()
+    tracemalloc.start()
+    before: int = tracemalloc.get_traced_memory()[0]
+    # 会话状态在 results 中保持引用
+    results = await asyncio.gather(
+        *(session(index, thinks) for index, thinks in enumerate(plan))
+    )
+    gc.collect()
+    retained: int = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del results
+
+    return round(retained / len(plan) / 1024, 1)
+
+
+async def run_suite(
+    app: Any, host: str, plan: list[list[bool]], repeat: int
+) -> dict[str, dict]:
+    """依次测量三层代码，重复 repeat 轮，各指标取中位数"""
+    from scheduler import RequestScheduler
+
+    # 所有会话同时执行，不排队
+    app.REQUEST_SCHEDULER = RequestScheduler(len(plan), len(plan))
+    scenarios: dict[str, Session] = {
+        "client": client_session(app, host),
+        "classes": classes_session(app),
+        "chat_stream": chat_stream_session(app),
+    }
+    runs: dict[str, list[dict]] = {name: [] for name in scenarios}
+    results: dict[str, dict] = {}
+    # 生成指标逐条输出到标准输出，测量期间丢弃
+    with contextlib.redirect_stdout(io.StringIO()):
+        # 预热：建立连接、加载模型、初始化各模块
+        for session in scenarios.values():
+            await asyncio.gather(
+                *(session(index, [False]) for index in range(len(plan)))
+            )
+        # 三层代码轮流测量，机器负载的变化对各层的影响相同
+        for _ in range(repeat):
+            for name, session in scenarios.items():
+                runs[name].append(await measure(session, plan))
+        for name, session in scenarios.items():
+            results[name] = {
+                key: statistics.median(run[key] for run in runs[name])
+                for key in runs[name][0]
+            }
+            results[name]["kib_per_session"] = await measure_memory(session, plan)
+
+    return results
+
+
+def print_results(results: dict[str, dict]) -> None:
+    """输出各层代码的测量结果"""
+    print(
+        f"{'scenario':<12}{'tokens':>8}{'cpu us/token':>14}{'cpu %':>7}"
+        + f"{'ttft p50':>10}{'ttft p99':>10}{'total p50':>11}{'total p99':>11}"
+        + f"{'KiB/session':>13}"
+    )
+    for name, result in results.items():
+        print(
+            f"{name:<12}{result['tokens']:>8}{result['cpu_us_per_token']:>14.2f}"
+            + f"{result['cpu_percent']:>7.1f}"
+            + f"{result['ttft_p50_ms']:>8.1f}ms{result['ttft_p99_ms']:>8.1f}ms"
+            + f"{result['total_p50_ms']:>9.1f}ms{result['total_p99_ms']:>9.1f}ms"
+            + f"{result['kib_per_session']:>13.1f}"
+        )
+
+    overhead: float = (
+        results["chat_stream"]["cpu_us_per_token"]
+        - results["client"]["cpu_us_per_token"]
+    )
+    print(f"\napp overhead over the client: {overhead:.2f} us/token")
+
+
+def compare(
+    results: dict[str, dict], baseline: dict[str, dict], tolerance: float
+) -> list[str]:
+    """输出相对基准值的变化，返回超过容差的回归"""
+    regressions: list[str] = []
+    print(
+        f"\n{'scenario':<12}{'metric':<18}{'baseline':>10}{'current':>10}{'change':>9}"
+    )
+    for name, result in results.items():
+        for metric in METRICS:
+            if metric not in baseline.get(name, {}):
+                continue
+            old: float = baseline[name][metric]
+            new: float = result[metric]
+            change: float = (new - old) / old if old else 0.0
+            mark: str = ""
+            if change > tolerance:
+                mark = "  regression"
+                regressions.append(f"{name} {metric}")
+            print(
+                f"{name:<12}{metric:<18}{old:>10.2f}{new:>10.2f}{change:>+9.1%}{mark}"
+            )
+
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--ttft", type=float, default=0.05)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--content-tokens", type=int, default=100)
+    parser.add_argument("--thinking-tokens", type=int, default=50)
+    parser.add_argument(
+        "--think-ratio", type=float, default=0.3, help="share of turns in thinking mode"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="runs per scenario, medians are kept"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="relative increase over the baseline reported as a regression",
+    )
+    parser.add_argument(
+        "--save", action="store_true", help="write the results as the new baseline"
+    )
+    parser.add_argument(
+        "--check", action="store_true", help="exit with status 1 on any regression"
+    )
+    args = parser.parse_args()
+
+    settings: dict[str, float] = {
+        "sessions": args.sessions,
+        "turns": args.turns,
+        "ttft": args.ttft,
+        "tokens_per_second": args.tokens_per_second,
+        "content_tokens": args.content_tokens,
+        "thinking_tokens": args.thinking_tokens,
+        "think_ratio": args.think_ratio,
+        "repeat": args.repeat,
+    }
+
+    with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+        config: dict = yaml.safe_load(f)
+
+    with FakeOllamaProcess(
+        port=config["port"],
+        ttft=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        content_tokens=args.content_tokens,
+        thinking_tokens=args.thinking_tokens,
+    ) as server:
+        import app
+
+        app.start_services()
+        app.BACKEND_POOL.wait_available(10)
+        plan: list[list[bool]] = make_plan(args.sessions, args.turns, args.think_ratio)
+        results: dict[str, dict] = asyncio.run(
+            run_suite(app, server.host, plan, args.repeat)
+        )
+
+    print()
+    print_results(results)
+
+    if args.save:
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "settings": settings,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+            f.write("\n")
+        print(f"\n[INFO] Baseline written to {BASELINE_PATH}")
+        return
+
+    if not BASELINE_PATH.exists():
+        print("\n[WARNING] No baseline found, run with --save to create one")
+        return
+
+    with open(BASELINE_PATH, "r", encoding="utf-8") as f:
+        baseline: dict = json.load(f)
+    if baseline.get("settings") != settings:
+        print("\n[WARNING] The baseline was recorded with different settings")
+        return
+
+    regressions: list[str] = compare(results, baseline["results"], args.tolerance)
+    if regressions:
+        print(
+            f"\n[WARNING] Regressions over {args.tolerance:.0%}: {', '.join(regressions)}"
+        )
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""token 估计的微基准测试
+
+对比 token_estimator.conservative_token_estimate 与原先基于三次 re.findall 的实现，
+语料为中文、英文、表情混合的字符串，大小从 1 KB 到 1 MB
+
+用法：
+
+    python benchmarks/bench_token_estimate.py
+"""
+
+import math
+import random
+import re
+import sys
+import timeit
+
+from pathlib import Path
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+
+from token_estimator import (  # noqa: E402
+    conservative_token_estimate,
+    conservative_token_estimate_batch,
+)
+
+
+def legacy_conservative_token_estimate(text: str) -> int:
+    """原先的实现，三次 re.findall，表情同时计入非中文字符和表情"""
+    chinese_chars = len(re.findall(r"[\u4e00-\u9fff\u3000-\u303f\uff00-\uffef]", text))
+    non_chinese_chars = len(
+        re.findall(r"[^\u4e00-\u9fff\u3000-\u303f\uff00-\uffef]", text)
+    )
+    emoji_count = len(re.findall(r"[\U00010000-\U0010ffff]", text))
+
+    chinese_tokens = int(math.ceil(chinese_chars * 1.3))
+    non_chinese_tokens = (
+        max(1, int(math.ceil(non_chinese_chars * 0.6))) if non_chinese_chars > 0 else 0
+    )
+    emoji_tokens = emoji_count * 2
+
+    total = chinese_tokens + non_chinese_tokens + emoji_tokens
+
+    return int(total * 1.05 + 1)
+
+
+# 语料的组成：(名称, 中文比例, 表情比例)
+CORPORA: list[tuple[str, float, float]] = [
+    ("english", 0.0, 0.0),
+    ("chinese", 0.95, 0.0),
+    ("mixed", 0.4, 0.02),
+]
+SIZES: list[int] = [1024, 16 * 1024, 256 * 1024, 1024 * 1024]
+
+ENGLISH: str = "The quick brown fox jumps over the lazy dog, 0123456789! "
+CHINESE: str = "我们在长时间运行的客服会话中发现提示词组装明显变慢了。，"
+EMOJI: str = "😀🚀🎉👍🔥"
+
+
+def make_corpus(size: int, chinese_ratio: float, emoji_ratio: float) -> str:
+    """生成指定字符数的混合语料"""
+    rng: random.Random = random.Random(size)
+    chars: list[str] = []
+
+    for _ in range(size):
+        r: float = rng.random()
+        if r < emoji_ratio:
+            chars.append(rng.choice(EMOJI))
+        elif r < emoji_ratio + chinese_ratio:
+            chars.append(rng.choice(CHINESE))
+        else:
+            chars.append(rng.choice(ENGLISH))
+
+    return "".join(chars)
+
+
+def best_of(func, repeat: int = 5) -> float:
+    """返回多次运行中最快的一次，单位为秒"""
+    number: int = 1
+    # 小语料单次太快，增加每轮次数以降低计时误差
+    while timeit.timeit(func, number=number) < 0.05:
+        number *= 4
+
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def main() -> None:
+    print(f"{'corpus':<10}{'size':>10}{'legacy':>14}{'new':>14}{'speedup':>10}")
+
+    for name, chinese_ratio, emoji_ratio in CORPORA:
+        for size in SIZES:
+            text: str = make_corpus(size, chinese_ratio, emoji_ratio)
+            legacy: float = best_of(lambda: legacy_conservative_token_estimate(text))
+            new: float = best_of(lambda: conservative_token_estimate(text))
+            print(
+                f"{name:<10}{size:>10}{legacy * 1e6:>12.1f}us{new * 1e6:>12.1f}us"
+                + f"{legacy / new:>9.1f}x"
+            )
+
+    # 批量估计：模拟导入 10000 条聊天消息
+    messages: list[str] = [make_corpus(200 + i % 300, 0.4, 0.02) for i in range(10000)]
+    legacy = best_of(
+        lambda: [legacy_conservative_token_estimate(m) for m in messages], repeat=3
+    )
+    new = best_of(lambda: conservative_token_estimate_batch(messages), repeat=3)
+    print(
+        f"{'batch':<10}{len(messages):>10}{legacy * 1e3:>12.1f}ms{new * 1e3:>12.1f}ms"
+        + f"{legacy / new:>9.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,504 @@
+"""本地的 Ollama 替身服务端
+
+实现 Ollama HTTP API 中本项目用到的部分（/api/chat、/api/tags、/api/ps、/api/show 等），
+按配置的首 token 延迟和 token 速率流式返回固定内容，用于负载测试和基准测试，不需要真实模型
+
+基于 asyncio，单线程即可同时服务上千个流式连接，支持 HTTP/1.1 keep-alive 和分块传输编码
+
+既可以在测试脚本中以后台线程启动：
+
+    with FakeOllamaServer(ttft=0.2, tokens_per_second=50) as server:
+        client = ollama.Client(host=server.host)
+
+也可以作为独立进程启动，让 app.py 连接它：
+
+    python benchmarks/fake_ollama.py --port 11434
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from dataclasses import dataclass, field
+
+DEFAULT_MODELS: tuple[str, ...] = ("qwen3:4b-instruct", "qwen3:4b-thinking")
+
+
+@dataclass
+class FakeOllamaStats:
+    """替身服务端的统计信息"""
+
+    # 各路径收到的请求数
+    requests: dict[str, int] = field(default_factory=dict)
+    # 当前正在流式返回的 /api/chat 请求数
+    in_flight: int = 0
+    # /api/chat 请求的最大并发数
+    max_in_flight: int = 0
+    # 客户端在流结束前断开的 /api/chat 请求数
+    cancelled: int = 0
+    # 加载模型的次数
+    loads: int = 0
+    # 累计接受的 TCP 连接数
+    connections: int = 0
+
+
+class FakeOllamaServer:
+    """Ollama 替身服务端
+
+    :param host: 监听地址
+    :param port: 监听端口，为 0 时由操作系统分配
+    :param models: 已拉取的模型列表
+    :param ttft: 首 token 延迟（秒）
+    :param tokens_per_second: 每个流的 token 速率
+    :param content_tokens: 每次响应的内容 token 数
+    :param thinking_tokens: 思考模式下每次响应的思考 token 数
+    :param context_length: /api/show 返回的模型最大上下文长度
+    :param embedding_dim: /api/embed 返回的向量维度
+    :param load_time: 加载一个未加载的模型需要的时间（秒）
+    :param max_loaded: 最多同时加载的模型数，加载新模型时卸载其他模型，为 0 时不限制
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        models: tuple[str, ...] = DEFAULT_MODELS,
+        ttft: float = 0.0,
+        tokens_per_second: float = 0.0,
+        content_tokens: int = 32,
+        thinking_tokens: int = 32,
+        context_length: int = 40960,
+        embedding_dim: int = 64,
+        load_time: float = 0.0,
+        max_loaded: int = 0,
+    ) -> None:
+        self._bind_host: str = host
+        self._bind_port: int = port
+        self.models: list[str] = list(models)
+        # 模型 -> /api/tags 返回的摘要，没有设置时由模型名计算；修改后模拟重新拉取同名模型
+        self.digests: dict[str, str] = {}
+        self.ttft: float = ttft
+        self.tokens_per_second: float = tokens_per_second
+        self.content_tokens: int = content_tokens
+        self.thinking_tokens: int = thinking_tokens
+        self.context_length: int = context_length
+        self.embedding_dim: int = embedding_dim
+        self.load_time: float = load_time
+        self.max_loaded: int = max_loaded
+        # 为 True 时所有请求返回 503，模拟服务端故障
+        self.failing: bool = False
+        # 当前加载在内存中的模型
+        self.running: set[str] = set()
+        # 已加载的模型使用的 num_ctx，请求的 num_ctx 不同时与 Ollama 一样重新加载
+        self.num_ctx: dict[str, int | None] = {}
+        self.stats: FakeOllamaStats = FakeOllamaStats()
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._server: asyncio.base_events.Server | None = None
+        self._thread: threading.Thread | None = None
+        self._ready: threading.Event = threading.Event()
+        self.port: int = port
+
+    @property
+    def host(self) -> str:
+        """ollama.Client 可用的服务端地址"""
+        return f"http://{self._bind_host}:{self.port}"
+
+    def start(self) -> "FakeOllamaServer":
+        """在后台线程中启动服务端，返回时已开始监听"""
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+        return self
+
+    def stop(self) -> None:
+        """停止服务端，重复调用不会产生影响"""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def __enter__(self) -> "FakeOllamaServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _run(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(
+                self._handle_connection, self._bind_host, self._bind_port, backlog=4096
+            )
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+
+        # 关闭监听，取消仍在处理的连接
+        self._server.close()
+        tasks: set[asyncio.Task] = asyncio.all_tasks(self._loop)
+        for task in tasks:
+            task.cancel()
+        self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self._loop.close()
+
+    async def serve_forever(self) -> None:
+        """在当前事件循环中运行服务端，直到被取消"""
+        self._server = await asyncio.start_server(
+            self._handle_connection, self._bind_host, self._bind_port, backlog=4096
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self.stats.connections += 1
+        try:
+            while True:
+                request_line: bytes = await reader.readline()
+                if not request_line:
+                    break
+
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers: dict[str, str] = {}
+                while True:
+                    line: bytes = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                body: bytes = await reader.readexactly(
+                    int(headers.get("content-length", "0"))
+                )
+                payload: dict = json.loads(body) if body else {}
+                self.stats.requests[path] = self.stats.requests.get(path, 0) + 1
+
+                await self._dispatch(method, path, payload, writer)
+
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(
+        self, method: str, path: str, payload: dict, writer: asyncio.StreamWriter
+    ) -> None:
+        if self.failing:
+            await self._send_json(writer, {"error": "unavailable"}, status=503)
+        elif path == "/" or path == "/api/version":
+            await self._send_json(writer, {"version": "0.0.0-fake"})
+        elif path == "/api/tags":
+            await self._send_json(
+                writer,
+                {
+                    "models": [
+                        {
+                            "model": m,
+                            "name": m,
+                            "digest": self.digests.get(m)
+                            or hashlib.sha256(m.encode()).hexdigest(),
+                        }
+                        for m in self.models
+                    ]
+                },
+            )
+        elif path == "/api/ps":
+            await self._send_json(
+                writer,
+                {
+                    "models": [
+                        {"model": m, "name": m, "context_length": self.context_length}
+                        for m in sorted(self.running)
+                    ]
+                },
+            )
+        elif path == "/api/show":
+            await self._show(payload, writer)
+        elif path == "/api/chat":
+            await self._chat(payload, writer)
+        elif path == "/api/generate":
+            await self._generate(payload, writer)
+        elif path == "/api/embed":
+            await self._embed(payload, writer)
+        else:
+            await self._send_json(writer, {"error": "not found"}, status=404)
+
+    async def _send_json(
+        self, writer: asyncio.StreamWriter, obj: dict, status: int = 200
+    ) -> None:
+        body: bytes = json.dumps(obj).encode()
+        writer.write(
+            f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n".encode()
+            + f"Content-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+
+    async def _show(self, payload: dict, writer: asyncio.StreamWriter) -> None:
+        model: str = payload.get("model", "")
+        if model not in self.models:
+            await self._send_json(writer, {"error": "model not found"}, status=404)
+            return
+
+        await self._send_json(
+            writer,
+            {
+                "model_info": {"general.context_length": self.context_length},
+                "capabilities": ["completion"]
+                + (["thinking"] if "thinking" in model else []),
+            },
+        )
+
+    async def _generate(self, payload: dict, writer: asyncio.StreamWriter) -> None:
+        """/api/generate 只用于加载和卸载模型"""
+        model: str = payload.get("model", "")
+        if payload.get("keep_alive") in (0, "0", "0s"):
+            self.running.discard(model)
+        else:
+            await self._ensure_loaded(model, payload.get("options"))
+
+        await self._send_json(
+            writer,
+            {"model": model, "response": "", "done": True, "done_reason": "load"},
+        )
+
+    async def _embed(self, payload: dict, writer: asyncio.StreamWriter) -> None:
+        inputs = payload.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+
+        embeddings: list[list[float]] = []
+        for text in inputs:
+            # 按字符哈希分桶的词袋向量，相同文本得到相同向量，相似文本向量接近
+            vector: list[float] = [0.0] * self.embedding_dim
+            for word in text.split():
+                vector[hash(word) % self.embedding_dim] += 1.0
+            embeddings.append(vector)
+
+        await self._send_json(
+            writer, {"model": payload.get("model", ""), "embeddings": embeddings}
+        )
+
+    async def _chat(self, payload: dict, writer: asyncio.StreamWriter) -> None:
+        model: str = payload.get("model", "")
+        if model not in self.models:
+            await self._send_json(writer, {"error": "model not found"}, status=404)
+            return
+
+        load_duration: int = await self._ensure_loaded(model, payload.get("options"))
+        think: bool = bool(payload.get("think"))
+        messages: list[dict] = payload.get("messages", [])
+        prompt_chars: int = sum(len(m.get("content") or "") for m in messages)
+        started: float = time.perf_counter()
+
+        chunks: list[tuple[str, str]] = []
+        if think:
+            chunks += [("thinking", f"think{i} ") for i in range(self.thinking_tokens)]
+        chunks += [("content", f"word{i} ") for i in range(self.content_tokens)]
+
+        if not payload.get("stream", True):
+            await asyncio.sleep(self.ttft + len(chunks) * self._token_interval())
+            message: dict = {"role": "assistant", "content": "", "thinking": ""}
+            for kind, text in chunks:
+                message[kind] += text
+            await self._send_json(
+                writer,
+                self._final_chunk(
+                    model, message, prompt_chars, len(chunks), started, load_duration
+                ),
+            )
+            return
+
+        self.stats.in_flight += 1
+        self.stats.max_in_flight = max(self.stats.max_in_flight, self.stats.in_flight)
+        try:
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+                + b"Transfer-Encoding: chunked\r\n\r\n"
+            )
+            await asyncio.sleep(self.ttft)
+
+            interval: float = self._token_interval()
+            for kind, text in chunks:
+                await self._write_chunk(
+                    writer,
+                    {
+                        "model": model,
+                        "message": {"role": "assistant", "content": "", kind: text},
+                        "done": False,
+                    },
+                )
+                if interval:
+                    await asyncio.sleep(interval)
+
+            await self._write_chunk(
+                writer,
+                self._final_chunk(
+                    model,
+                    {"role": "assistant", "content": ""},
+                    prompt_chars,
+                    len(chunks),
+                    started,
+                    load_duration,
+                ),
+            )
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        except ConnectionError:
+            self.stats.cancelled += 1
+            raise
+        finally:
+            self.stats.in_flight -= 1
+
+    async def _ensure_loaded(self, model: str, options: dict | None = None) -> int:
+        """加载模型，返回加载耗时（纳秒），已按相同的 num_ctx 加载时为 0"""
+        num_ctx: int | None = (options or {}).get("num_ctx")
+        if model in self.running and self.num_ctx.get(model, num_ctx) == num_ctx:
+            return 0
+
+        self.stats.loads += 1
+        await asyncio.sleep(self.load_time)
+        if self.max_loaded:
+            # 显存不足时卸载其他模型
+            while len(self.running) >= self.max_loaded:
+                self.running.pop()
+        self.running.add(model)
+        self.num_ctx[model] = num_ctx
+
+        return int(self.load_time * 1e9)
+
+    def _token_interval(self) -> float:
+        return 1.0 / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def _final_chunk(
+        self,
+        model: str,
+        message: dict,
+        prompt_chars: int,
+        eval_count: int,
+        started: float,
+        load_duration: int = 0,
+    ) -> dict:
+        total: int = int((time.perf_counter() - started) * 1e9)
+        prefill: int = int(self.ttft * 1e9)
+
+        return {
+            "model": model,
+            "message": message,
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": total,
+            "load_duration": load_duration,
+            # 约 4 个字符一个 token
+            "prompt_eval_count": max(1, prompt_chars // 4),
+            "prompt_eval_duration": prefill,
+            "eval_count": eval_count,
+            "eval_duration": max(0, total - prefill),
+        }
+
+    async def _write_chunk(self, writer: asyncio.StreamWriter, obj: dict) -> None:
+        data: bytes = json.dumps(obj).encode() + b"\n"
+        writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        await writer.drain()
+
+
+class FakeOllamaProcess:
+    """在子进程中运行的 Ollama 替身服务端
+
+    与被测代码不共享 GIL，高并发时测得的是应用自身的开销
+
+    :param port: 监听端口，为 0 时选择一个空闲端口
+    :param kwargs: 命令行参数，与 main 的参数对应，例如 ttft=0.2、tokens_per_second=50
+    """
+
+    def __init__(self, port: int = 0, **kwargs) -> None:
+        if not port:
+            with socket.socket() as sock:
+                sock.bind(("127.0.0.1", 0))
+                port = sock.getsockname()[1]
+        self.port: int = port
+
+        self._args: list[str] = [f"--port={self.port}"] + [
+            f"--{name.replace('_', '-')}={value}" for name, value in kwargs.items()
+        ]
+        self._process: subprocess.Popen | None = None
+
+    @property
+    def host(self) -> str:
+        """ollama.Client 可用的服务端地址"""
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self) -> "FakeOllamaProcess":
+        """启动子进程，返回时已开始监听"""
+        self._process = subprocess.Popen(
+            [sys.executable, __file__] + self._args, stdout=subprocess.DEVNULL
+        )
+        deadline: float = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=1).close()
+                return self
+            except OSError:
+                time.sleep(0.05)
+
+        raise RuntimeError("[ERROR] Fake Ollama server did not start")
+
+    def stop(self) -> None:
+        """停止子进程"""
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait()
+
+    def __enter__(self) -> "FakeOllamaProcess":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake Ollama server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--ttft", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--content-tokens", type=int, default=64)
+    parser.add_argument("--thinking-tokens", type=int, default=64)
+    parser.add_argument("--load-time", type=float, default=0.0)
+    parser.add_argument("--max-loaded", type=int, default=0)
+    args = parser.parse_args()
+
+    server = FakeOllamaServer(
+        host=args.host,
+        port=args.port,
+        ttft=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        content_tokens=args.content_tokens,
+        thinking_tokens=args.thinking_tokens,
+        load_time=args.load_time,
+        max_loaded=args.max_loaded,
+    )
+    print(f"[INFO] Fake Ollama server listening on {args.host}:{args.port}")
+
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""异步流式生成的负载测试
+
+在本地 Ollama 替身服务端上，用 N 个并发会话分别驱动：
+
+- async：OllamaLLM.achat，所有会话在同一个事件循环上
+- sync：OllamaLLM.chat，放在 40 个工作线程的线程池中（Gradio 同步处理函数默认的线程数）
+
+输出总耗时、首 token 延迟和峰值线程数，观察并发扩展性
+
+用法：
+
+    python benchmarks/load_async.py --sessions 1 10 100 300
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+
+import httpx  # noqa: E402
+import ollama  # noqa: E402
+
+from fake_ollama import FakeOllamaProcess  # noqa: E402
+from ollama_llm import OllamaLLM  # noqa: E402
+
+MODEL: str = "qwen3:4b-instruct"
+MESSAGES: list[dict[str, str]] = [{"role": "user", "content": "Hello"}]
+# Gradio 同步处理函数默认使用的线程数
+GRADIO_THREADS: int = 40
+
+
+def percentile(values: list[float], q: float) -> float:
+    """计算分位数"""
+    ordered: list[float] = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run_async(host: str, sessions: int) -> tuple[float, list[float], int]:
+    """用异步客户端并发生成，返回 (总耗时, 首 token 延迟列表, 峰值线程数)"""
+    client = ollama.Client(host=host)
+    async_client = ollama.AsyncClient(
+        host=host, limits=httpx.Limits(max_connections=None)
+    )
+    peak_threads: int = threading.active_count()
+
+    async def one() -> float:
+        nonlocal peak_threads
+        llm = OllamaLLM(client, async_client)
+        llm._model = MODEL
+        started: float = time.perf_counter()
+        ttft: float = 0.0
+        async for _, content in llm.achat(MESSAGES, False):
+            if content and not ttft:
+                ttft = time.perf_counter() - started
+                peak_threads = max(peak_threads, threading.active_count())
+
+        return ttft
+
+    started: float = time.perf_counter()
+    ttfts: list[float] = await asyncio.gather(*(one() for _ in range(sessions)))
+    elapsed: float = time.perf_counter() - started
+    await async_client.close()
+
+    return elapsed, ttfts, peak_threads
+
+
+def run_sync(host: str, sessions: int) -> tuple[float, list[float], int]:
+    """用同步客户端在线程池中并发生成，返回 (总耗时, 首 token 延迟列表, 峰值线程数)"""
+    client = ollama.Client(host=host)
+    peak_threads: int = threading.active_count()
+    submitted: float = time.perf_counter()
+
+    def one() -> float:
+        nonlocal peak_threads
+        llm = OllamaLLM(client)
+        llm._model = MODEL
+        ttft: float = 0.0
+        for _, content in llm.chat(MESSAGES, False):
+            if content and not ttft:
+                # 从提交时刻算起，包括在线程池中排队的时间
+                ttft = time.perf_counter() - submitted
+                peak_threads = max(peak_threads, threading.active_count())
+
+        return ttft
+
+    with ThreadPoolExecutor(max_workers=GRADIO_THREADS) as pool:
+        ttfts: list[float] = list(pool.map(lambda _: one(), range(sessions)))
+    elapsed: float = time.perf_counter() - submitted
+
+    return elapsed, ttfts, peak_threads
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 10, 100, 300])
+    parser.add_argument("--ttft", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--content-tokens", type=int, default=50)
+    args = parser.parse_args()
+
+    with FakeOllamaProcess(
+        ttft=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        content_tokens=args.content_tokens,
+    ) as server:
+        print(
+            f"{'mode':<6}{'sessions':>10}{'wall':>10}{'ttft p50':>10}"
+            + f"{'ttft p99':>10}{'threads':>9}"
+        )
+        for sessions in args.sessions:
+            for mode in ("async", "sync"):
+                if mode == "async":
+                    elapsed, ttfts, threads = asyncio.run(
+                        run_async(server.host, sessions)
+                    )
+                else:
+                    elapsed, ttfts, threads = run_sync(server.host, sessions)
+
+                print(
+                    f"{mode:<6}{sessions:>10}{elapsed:>9.2f}s"
+                    + f"{statistics.median(ttfts):>9.2f}s"
+                    + f"{percentile(ttfts, 0.99):>9.2f}s{threads:>9}"
+                )
+
+
+if __name__ == "__main__":
+    main()
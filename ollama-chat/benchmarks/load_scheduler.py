@@ -0,0 +1,113 @@
+"""请求调度器的负载测试
+
+在本地 Ollama 替身服务端上，一个“贪心”会话同时提交大量请求，其余会话每次只提交一个请求，
+所有请求经过 RequestScheduler 后再用 OllamaLLM.achat 生成。输出：
+
+- 贪心会话和普通会话各自的平均等待时间，观察按会话轮流分配是否公平
+- 调度器统计的等待时间和服务时间分位数，以及被拒绝的请求数
+
+用法：
+
+    python benchmarks/load_scheduler.py --max-concurrency 4 --max-queue 64 --sessions 20
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+from pathlib import Path
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+
+import ollama  # noqa: E402
+
+from fake_ollama import FakeOllamaProcess  # noqa: E402
+from ollama_llm import OllamaLLM  # noqa: E402
+from scheduler import QueueFullError, RequestScheduler  # noqa: E402
+
+MODEL: str = "qwen3:4b-instruct"
+MESSAGES: list[dict[str, str]] = [{"role": "user", "content": "Hello"}]
+
+
+async def run(
+    host: str,
+    max_concurrency: int,
+    max_queue: int,
+    sessions: int,
+    greedy_requests: int,
+) -> tuple[dict[str, list[float]], dict[str, int | float]]:
+    """运行一轮负载测试，返回 (会话类别 -> 等待时间列表, 调度器统计信息)"""
+    client = ollama.Client(host=host)
+    async_client = ollama.AsyncClient(host=host)
+    scheduler = RequestScheduler(max_concurrency, max_queue)
+    waits: dict[str, list[float]] = {"greedy": [], "normal": []}
+
+    async def one(session_id: str, kind: str) -> None:
+        try:
+            ticket = scheduler.submit(session_id)
+        except QueueFullError:
+            return
+
+        try:
+            await scheduler.wait(ticket)
+            waits[kind].append(time.monotonic() - ticket.submitted)
+            llm = OllamaLLM(client, async_client)
+            llm._model = MODEL
+            async for _ in llm.achat(MESSAGES, False):
+                pass
+        finally:
+            scheduler.release(ticket)
+
+    tasks: list = [one("greedy", "greedy") for _ in range(greedy_requests)]
+    tasks += [one(f"session-{i}", "normal") for i in range(sessions)]
+    await asyncio.gather(*tasks)
+    await async_client.close()
+
+    return waits, scheduler.get_metrics()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--greedy-requests", type=int, default=20)
+    parser.add_argument("--ttft", type=float, default=0.1)
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--content-tokens", type=int, default=20)
+    args = parser.parse_args()
+
+    with FakeOllamaProcess(
+        ttft=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        content_tokens=args.content_tokens,
+    ) as server:
+        waits, metrics = asyncio.run(
+            run(
+                server.host,
+                args.max_concurrency,
+                args.max_queue,
+                args.sessions,
+                args.greedy_requests,
+            )
+        )
+
+    for kind, values in waits.items():
+        mean: float = statistics.mean(values) if values else 0.0
+        print(f"{kind:<8}requests={len(values):<5}mean wait={mean:.2f}s")
+
+    print(
+        f"wait    p50={metrics['wait_p50']:.2f}s p95={metrics['wait_p95']:.2f}s "
+        + f"max={metrics['wait_max']:.2f}s"
+    )
+    print(
+        f"service p50={metrics['service_p50']:.2f}s "
+        + f"p95={metrics['service_p95']:.2f}s max={metrics['service_max']:.2f}s"
+    )
+    print(f"admitted={metrics['admitted']} rejected={metrics['rejected']}")
+
+
+if __name__ == "__main__":
+    main()
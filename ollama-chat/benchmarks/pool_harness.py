@@ -0,0 +1,160 @@
+"""Ollama 节点池的测试工具
+
+在本机启动若干个 Ollama 替身服务端作为节点，通过 AsyncPoolClient 并发生成，依次检查：
+
+1. 负载分布：模型在所有节点上都未加载时，并发请求应大致均匀地分布到各节点
+2. 加载优先：空闲时，请求应发送到已加载该模型的节点
+3. 故障转移：一个节点返回 503、另一个节点停止监听后，所有请求仍应成功，
+   故障节点被标记为不健康
+4. 恢复：故障节点恢复后，主动检查应将其重新标记为健康
+
+用法：
+
+    python benchmarks/pool_harness.py --backends 3 --sessions 30
+"""
+
+import argparse
+import asyncio
+import sys
+
+from pathlib import Path
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+
+from backend_pool import AsyncPoolClient, Backend, BackendPool  # noqa: E402
+from fake_ollama import DEFAULT_MODELS, FakeOllamaServer  # noqa: E402
+
+INSTRUCT_MODEL: str = DEFAULT_MODELS[0]
+THINKING_MODEL: str = DEFAULT_MODELS[1]
+
+
+async def generate(
+    client: AsyncPoolClient, model: str, sessions: int, turns: int = 1
+) -> int:
+    """并发运行多个会话，每个会话依次生成 turns 次，返回失败的生成次数"""
+
+    async def session() -> int:
+        errors: int = 0
+        for _ in range(turns):
+            try:
+                async for _ in await client.chat(
+                    model=model,
+                    messages=[{"role": "user", "content": "Hello"}],
+                    stream=True,
+                ):
+                    pass
+            except Exception:
+                errors += 1
+
+        return errors
+
+    return sum(await asyncio.gather(*(session() for _ in range(sessions))))
+
+
+def report(name: str, passed: bool, detail: str) -> bool:
+    """输出一项检查的结果"""
+    print(f"[{'PASS' if passed else 'FAIL'}] {name}: {detail}")
+
+    return passed
+
+
+async def run_checks(
+    pool: BackendPool, servers: list[FakeOllamaServer], sessions: int
+) -> list[bool]:
+    """依次运行各项检查，返回每项检查是否通过"""
+    client = AsyncPoolClient(pool)
+    results: list[bool] = []
+
+    def chat_counts() -> list[int]:
+        return [server.stats.requests.get("/api/chat", 0) for server in servers]
+
+    # 1. 负载分布
+    errors: int = await generate(client, THINKING_MODEL, sessions)
+    counts: list[int] = chat_counts()
+    even: int = sessions // len(servers)
+    results.append(
+        report(
+            "spread",
+            errors == 0 and max(counts) - min(counts) <= max(2, even // 2),
+            f"requests per backend {counts}, errors {errors}",
+        )
+    )
+
+    # 2. 加载优先
+    before: list[int] = chat_counts()
+    for _ in range(5):
+        await generate(client, INSTRUCT_MODEL, 1)
+    delta: list[int] = [a - b for a, b in zip(chat_counts(), before)]
+    results.append(
+        report("resident first", delta[0] == 5, f"new requests per backend {delta}")
+    )
+
+    # 3. 故障转移
+    servers[1].failing = True
+    servers[2].stop()
+    errors = await generate(client, THINKING_MODEL, sessions, turns=3)
+    stats: list[dict] = pool.get_stats()
+    results.append(
+        report(
+            "failover",
+            errors == 0 and not stats[1]["healthy"] and not stats[2]["healthy"],
+            f"errors {errors}, healthy {[s['healthy'] for s in stats]}, "
+            + f"backend errors {[s['errors'] for s in stats]}",
+        )
+    )
+
+    # 4. 恢复
+    servers[1].failing = False
+    pool.start()
+    await asyncio.sleep(1.5)
+    stats = pool.get_stats()
+    results.append(
+        report(
+            "recovery",
+            stats[1]["healthy"] and not stats[2]["healthy"],
+            f"healthy {[s['healthy'] for s in stats]}",
+        )
+    )
+
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", type=int, default=3)
+    parser.add_argument("--sessions", type=int, default=30)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--content-tokens", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.backends < 3:
+        parser.error("--backends must be at least 3")
+
+    servers: list[FakeOllamaServer] = [
+        FakeOllamaServer(
+            tokens_per_second=args.tokens_per_second,
+            content_tokens=args.content_tokens,
+        ).start()
+        for _ in range(args.backends)
+    ]
+    # 只有第一个节点加载了非思考模型
+    servers[0].running.add(INSTRUCT_MODEL)
+
+    pool = BackendPool(
+        [Backend(server.host, probe_timeout=1.0) for server in servers],
+        check_interval=0.5,
+    )
+    pool.check()
+
+    try:
+        results: list[bool] = asyncio.run(run_checks(pool, servers, args.sessions))
+    finally:
+        pool.stop()
+        for server in servers:
+            server.stop()
+
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
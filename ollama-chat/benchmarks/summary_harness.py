@@ -0,0 +1,125 @@
+"""滚动摘要的测试工具
+
+在 Ollama 替身服务端上模拟一个很长的会话，上下文窗口很小，每轮对话结束后压缩移出上下文窗口的消息，依次检查：
+
+1. 摘要：上下文窗口滑动后，会话有了摘要，且摘要出现在发送给模型的消息列表中
+2. 增量：每条移出的消息只被压缩一次，生成摘要的请求数远小于对话轮数
+3. 提示词长度：发送给模型的提示词的 token 估计数始终不超过上下文窗口
+
+用法：
+
+    python benchmarks/summary_harness.py --turns 60 --num-ctx 2048
+"""
+
+import argparse
+import asyncio
+import sys
+
+from contextlib import aclosing
+from pathlib import Path
+
+sys.path.insert(0, Path(__file__).resolve().parent.parent.as_posix())
+
+import ollama  # noqa: E402
+
+from fake_ollama import DEFAULT_MODELS, FakeOllamaServer  # noqa: E402
+from memory import Memory  # noqa: E402
+from ollama_llm import OllamaLLM  # noqa: E402
+from prompt_builder import PromptBuilder  # noqa: E402
+from scheduler import RequestScheduler  # noqa: E402
+from summarizer import ConversationSummarizer  # noqa: E402
+from token_estimator import conservative_token_estimate  # noqa: E402
+
+
+def report(name: str, passed: bool, detail: str) -> bool:
+    """输出一项检查的结果"""
+    print(f"[{'PASS' if passed else 'FAIL'}] {name}: {detail}")
+
+    return passed
+
+
+async def run_checks(host: str, turns: int, num_ctx: int) -> list[bool]:
+    """模拟会话并依次检查，返回每项检查是否通过"""
+    client = ollama.Client(host=host)
+    async_client = ollama.AsyncClient(host=host)
+
+    def create_llm() -> OllamaLLM:
+        llm = OllamaLLM(client, async_client)
+        llm.set_model(DEFAULT_MODELS[0])
+        llm.set_num_ctx(num_ctx)
+        return llm
+
+    chat_llm: OllamaLLM = create_llm()
+    summarizer = ConversationSummarizer(
+        create_llm(), RequestScheduler(), max_tokens=128, max_input_tokens=2048
+    )
+    memory = Memory()
+    memory.set_system_message("You are a helpful assistant.")
+    prompt_builder = PromptBuilder(None)
+    prompt_tokens: list[int] = []
+    with_summary: int = 0
+
+    for turn in range(turns):
+        memory.add_user_message(f"Fact {turn}: the code word is {turn * 7}. " * 8)
+        context = memory.get_context(num_ctx, None, 0.75)
+        summary_message = memory.get_summary_message()
+        messages = prompt_builder.build(
+            memory.get_system_message(), context, summary_message
+        )
+        with_summary += summary_message is not None
+        prompt_tokens.append(
+            sum(conservative_token_estimate(m["content"]) for m in messages)
+        )
+
+        parts: list[str] = []
+        async with aclosing(chat_llm.achat(messages, False)) as stream:
+            async for _, answer_word in stream:
+                parts.append(answer_word)
+        memory.add_assistant_message("".join(parts) + " Noted. " * 30)
+
+        summarizer.schedule(memory, "harness")
+        # 模拟用户阅读回答的时间，后台任务在此期间完成
+        await summarizer.wait()
+
+    stats: dict[str, int | float] = summarizer.get_stats()
+    evicted: int = memory._summarized + memory._dropped
+    results: list[bool] = [
+        report(
+            "summary",
+            bool(memory.get_summary()) and with_summary > 0,
+            f"turns with summary {with_summary}/{turns}, "
+            + f"summary {len(memory.get_summary())} chars",
+        ),
+        report(
+            "incremental",
+            stats["summarized_messages"] == evicted and 0 < stats["runs"] < turns,
+            f"summarized {stats['summarized_messages']} messages in {stats['runs']} "
+            + f"requests, evicted {evicted}, failures {stats['failures']}",
+        ),
+        report(
+            "prompt size",
+            max(prompt_tokens) <= num_ctx,
+            f"max prompt {max(prompt_tokens)} / num_ctx {num_ctx} tokens (estimated), "
+            + f"last {prompt_tokens[-1]}",
+        ),
+    ]
+
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=60)
+    parser.add_argument("--num-ctx", type=int, default=2048)
+    args = parser.parse_args()
+
+    with FakeOllamaServer(tokens_per_second=0.0, content_tokens=20) as server:
+        results: list[bool] = asyncio.run(
+            run_checks(server.host, args.turns, args.num_ctx)
+        )
+
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import asyncio
+import time
+
+from collections.abc import AsyncIterator
+from contextlib import aclosing
+
+from ollama_llm import OllamaLLM
+from scheduler import QueueFullError, RequestScheduler
+from streaming import ResponseBuffer, render_response
+
+
+class CompareResult:
+    """对比模式中一个模型的回答
+
+    累积回答并记录应用测量的各阶段耗时，供界面显示和记录生成指标
+    """
+
+    def __init__(self, ollama_llm: OllamaLLM, think: bool) -> None:
+        """
+        :param ollama_llm: 生成回答的模型
+        :type ollama_llm: OllamaLLM
+        :param think: 思考模式开关
+        :type think: bool
+        """
+        self.ollama_llm: OllamaLLM = ollama_llm
+        self.think: bool = think
+        self.response: ResponseBuffer = ResponseBuffer()
+        # 应用测量的各阶段耗时（秒），从提交请求算起
+        self.timings: dict[str, float] = {}
+        # 生成被中断的原因，正常结束时置为 None
+        self.notice: str | None = "Generation interrupted"
+        # 生成是否已结束，包括出错和被中断
+        self.done: bool = False
+
+    def get_tokens_per_second(self) -> float | None:
+        """获取生成速度
+
+        :returns: Ollama 统计的每秒生成 token 数，生成未结束时为 None
+        :rtype: float | None
+        """
+        stats: dict[str, int | str] = self.ollama_llm.get_last_stats()
+        count: int | str | None = stats.get("eval_count")
+        duration: int | str | None = stats.get("eval_duration")
+        if not isinstance(count, int) or not isinstance(duration, int) or not duration:
+            return None
+
+        return count / (duration / 1e9)
+
+    def render(self) -> str:
+        """生成 gradio.Chatbot 组件显示的 AI 响应
+
+        :returns: 目前为止的 AI 响应，被中断时在末尾追加提示
+        :rtype: str
+        """
+        answer: str = self.response.get_answer()
+        if self.done and self.notice is not None:
+            answer = (
+                f"{answer}\n\n*[{self.notice}]*"
+                if answer.strip()
+                else f"*[{self.notice}]*"
+            )
+
+        return render_response(self.response.get_thinking(), answer)
+
+    def render_stats(self) -> str:
+        """生成显示在回答下方的指标
+
+        :returns: 首 token 延迟、生成速度和总耗时，还没有开始生成时显示排队状态
+        :rtype: str
+        """
+        if "ttft_seconds" not in self.timings:
+            if self.done:
+                return "No response"
+            return (
+                "Queued" if "queue_wait_seconds" not in self.timings else "Generating"
+            )
+
+        parts: list[str] = [f"TTFT {self.timings['ttft_seconds']:.2f} s"]
+        tokens_per_second: float | None = self.get_tokens_per_second()
+        if tokens_per_second is not None:
+            parts.append(f"{tokens_per_second:.1f} tok/s")
+        if "total_seconds" in self.timings:
+            parts.append(f"total {self.timings['total_seconds']:.2f} s")
+
+        return " · ".join(parts)
+
+
+async def fan_out(
+    results: list[CompareResult],
+    messages: list[dict[str, str]],
+    scheduler: RequestScheduler,
+    session_id: str,
+) -> AsyncIterator[None]:
+    """将同一份消息列表同时发送给多个模型
+
+    每个模型一个任务，各自向请求调度器申请执行槽位并流式生成，回答累积到对应的 CompareResult；
+    任一模型收到分块或结束时 yield 一次，由调用方决定是否刷新界面。总耗时取决于最慢的模型
+
+    生成器被关闭时取消所有任务，关闭到 Ollama 的流并释放执行槽位
+
+    :param results: 各模型的回答，fan_out 在其中累积回答和耗时
+    :type results: list[CompareResult]
+    :param messages: 发送给所有模型的消息列表，只构建一次
+    :type messages: list[dict[str, str]]
+    :param scheduler: 请求调度器
+    :type scheduler: RequestScheduler
+    :param session_id: 发起请求的会话 id，同一会话的请求在调度器中轮流获得槽位
+    :type session_id: str
+    :returns: 每收到一个分块或一个模型结束时 yield None
+    :rtype: AsyncIterator[None]
+    """
+    updates: asyncio.Queue[None] = asyncio.Queue()
+    submitted: float = time.perf_counter()
+
+    async def run(result: CompareResult) -> None:
+        ticket = None
+        try:
+            ticket = scheduler.submit(session_id)
+            await scheduler.wait(ticket)
+            result.timings["queue_wait_seconds"] = time.perf_counter() - submitted
+            updates.put_nowait(None)
+            async with aclosing(
+                result.ollama_llm.achat(messages, result.think)
+            ) as stream:
+                async for think_word, answer_word in stream:
+                    result.response.add(think_word, answer_word)
+                    if "ttft_seconds" not in result.timings and (
+                        think_word or answer_word
+                    ):
+                        result.timings["ttft_seconds"] = time.perf_counter() - submitted
+                    updates.put_nowait(None)
+            result.notice = None
+        except QueueFullError:
+            result.notice = "The server is busy, please try again later"
+        except TimeoutError:
+            result.notice = "Generation timed out"
+        except Exception as e:
+            # 一个模型出错不影响其他模型
+            print(
+                f"[WARNING] Failed to generate with {result.ollama_llm.get_model()}: {e}"
+            )
+            result.notice = f"Generation failed: {e}"
+        finally:
+            if ticket is not None:
+                scheduler.release(ticket)
+            result.timings["total_seconds"] = time.perf_counter() - submitted
+            result.done = True
+            updates.put_nowait(None)
+
+    tasks: list[asyncio.Task] = [asyncio.create_task(run(result)) for result in results]
+    try:
+        while not all(result.done for result in results):
+            await updates.get()
+            yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
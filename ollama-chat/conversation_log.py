@@ -0,0 +1,498 @@
+import os
+import struct
+import threading
+import time
+import weakref
+
+from pathlib import Path
+from typing import BinaryIO
+
+# 消息角色的编号，与 memory.ROLES 中的下标一致
+USER: int = 0
+ASSISTANT: int = 1
+# 每条消息的记录头：角色、token 估计数、内容字节数、思考过程字节数（-1 表示没有思考过程），
+# 之后依次是内容和思考过程的 UTF-8 编码
+RECORD: struct.Struct = struct.Struct("<BIIi")
+# 索引文件中每条消息的索引项：记录在日志文件中的偏移量、token 估计数
+INDEX_ENTRY: struct.Struct = struct.Struct("<QI")
+# 倒序读取索引时每次读取的索引项数
+INDEX_BLOCK: int = 4096
+
+
+def encode_record(role: int, tokens: int, content: str, thinking: str | None) -> bytes:
+    """将一条消息编码为长度前缀的记录
+
+    :param role: 消息角色的编号
+    :type role: int
+    :param tokens: 消息的 token 估计数
+    :type tokens: int
+    :param content: 消息内容
+    :type content: str
+    :param thinking: 思考过程
+    :type thinking: str | None
+    :returns: 编码后的记录
+    :rtype: bytes
+    """
+    content_bytes: bytes = content.encode("utf-8")
+    thinking_bytes: bytes = thinking.encode("utf-8") if thinking is not None else b""
+
+    return (
+        RECORD.pack(
+            role,
+            tokens,
+            len(content_bytes),
+            len(thinking_bytes) if thinking is not None else -1,
+        )
+        + content_bytes
+        + thinking_bytes
+    )
+
+
+def decode_records(
+    data: bytes, offset: int = 0, count: int | None = None
+) -> list[tuple[int, int, str, str | None]]:
+    """从 data 的 offset 处开始依次解码记录
+
+    :param data: 若干条连续的记录
+    :type data: bytes
+    :param offset: 第一条记录的偏移量
+    :type offset: int
+    :param count: 解码的记录数，为 None 时解码到 data 末尾
+    :type count: int | None
+    :returns: (角色, token 估计数, 内容, 思考过程) 列表
+    :rtype: list[tuple[int, int, str, str | None]]
+    :raises ValueError: 如果记录不完整
+    """
+    view: memoryview = memoryview(data)
+    records: list[tuple[int, int, str, str | None]] = []
+
+    while (count is None and offset < len(data)) or (
+        count is not None and len(records) < count
+    ):
+        if offset + RECORD.size > len(data):
+            raise ValueError(f"[ERROR] The record at offset={offset} is truncated")
+        role, tokens, content_size, thinking_size = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        end: int = offset + content_size + max(0, thinking_size)
+        if end > len(data):
+            raise ValueError(f"[ERROR] The record at offset={offset} is truncated")
+        content: str = str(view[offset : offset + content_size], "utf-8")
+        offset += content_size
+        thinking: str | None = None
+        if thinking_size >= 0:
+            thinking = str(view[offset:end], "utf-8")
+        offset = end
+        records.append((role, tokens, content, thinking))
+
+    return records
+
+
+class ConversationLog:
+    """一个对话的只追加日志
+
+    由两个文件组成：
+
+    - <id>.log：依次追加的消息记录
+    - <id>.idx：每条消息一个定长索引项，记录消息在日志文件中的偏移量和 token 估计数
+
+    恢复对话时从索引文件末尾倒序读取，只读取上下文窗口放得下的最后若干条消息。
+    追加时先写日志文件再写索引文件，打开时丢弃不完整的尾部，以及没有 AI 回答的最后一条用户消息。
+    消息的角色以记录中保存的角色为准，不假设偶数下标的消息是用户消息
+
+    不长期占用文件描述符，每次追加时打开文件，由 ConversationStore 的后台线程批量 fsync
+    """
+
+    def __init__(self, store: "ConversationStore", conversation_id: str) -> None:
+        """
+        :param store: 所属的对话存储
+        :type store: ConversationStore
+        :param conversation_id: 对话 id，也是文件名
+        :type conversation_id: str
+        """
+        self._store: ConversationStore = store
+        self._id: str = conversation_id
+        self._log_path: Path = store.get_directory() / f"{conversation_id}.log"
+        self._index_path: Path = store.get_directory() / f"{conversation_id}.idx"
+        self._lock: threading.Lock = threading.Lock()
+        # 被其他页面接管后不再写入
+        self._closed: bool = False
+        # 消息数和日志文件大小
+        self._count: int = 0
+        self._size: int = 0
+        self._recover()
+
+    def get_id(self) -> str:
+        """获取对话 id
+
+        :returns: 对话 id
+        :rtype: str
+        """
+        return self._id
+
+    def is_closed(self) -> bool:
+        """判断日志是否已关闭
+
+        :returns: 是否已关闭
+        :rtype: bool
+        """
+        return self._closed
+
+    def append(
+        self, role: int, tokens: int, content: str, thinking: str | None
+    ) -> None:
+        """追加一条消息，写入操作系统缓冲区后返回，不等待 fsync
+
+        日志已关闭时忽略
+
+        :param role: 消息角色的编号
+        :type role: int
+        :param tokens: 消息的 token 估计数
+        :type tokens: int
+        :param content: 消息内容
+        :type content: str
+        :param thinking: 思考过程
+        :type thinking: str | None
+        :returns: 无
+        :rtype: None
+        :raises OSError: 如果写入文件失败
+        """
+        record: bytes = encode_record(role, tokens, content, thinking)
+
+        with self._lock:
+            if self._closed:
+                return
+            with open(self._log_path, "ab") as f:
+                f.write(record)
+            with open(self._index_path, "ab") as f:
+                f.write(INDEX_ENTRY.pack(self._size, tokens))
+            self._size += len(record)
+            self._count += 1
+
+        self._store.mark_dirty(self, len(record) + INDEX_ENTRY.size)
+
+    def read_tail(
+        self, budget: float | None = None
+    ) -> list[tuple[int, int, str, str | None]]:
+        """读取 token 估计数之和不超过 budget 的最后若干轮对话
+
+        :param budget: token 估计数的预算，为 None 时读取所有消息
+        :type budget: float | None
+        :returns: (角色, token 估计数, 内容, 思考过程) 列表，从一条用户消息开始
+        :rtype: list[tuple[int, int, str, str | None]]
+        """
+        with self._lock:
+            count: int = self._count
+            size: int = self._size
+            if count == 0:
+                return []
+
+            with open(self._index_path, "rb") as f:
+                start: int = 0 if budget is None else self._find_start(f, count, budget)
+                if start >= count:
+                    return []
+                f.seek(start * INDEX_ENTRY.size)
+                offset: int = INDEX_ENTRY.unpack(f.read(INDEX_ENTRY.size))[0]
+
+            with open(self._log_path, "rb") as f:
+                f.seek(offset)
+                data: bytes = f.read(size - offset)
+
+        records: list[tuple[int, int, str, str | None]] = decode_records(
+            data, 0, count - start
+        )
+        # 保证从用户消息开始
+        first: int = 0
+        while first < len(records) and records[first][0] != USER:
+            first += 1
+
+        return records[first:]
+
+    def rotate(self) -> None:
+        """归档当前的对话，之后从空日志开始
+
+        归档文件名带有时间戳，不会被恢复
+
+        :returns: 无
+        :rtype: None
+        """
+        with self._lock:
+            if self._closed or self._count == 0:
+                return
+            # 同一秒内多次归档时用纳秒区分
+            suffix: str = (
+                time.strftime("%Y%m%d-%H%M%S") + f"-{time.time_ns() % 10**9:09d}"
+            )
+            self._log_path.replace(self._log_path.with_suffix(f".{suffix}.log"))
+            self._index_path.replace(self._index_path.with_suffix(f".{suffix}.idx"))
+            self._count = 0
+            self._size = 0
+
+    def close(self) -> None:
+        """关闭日志，之后的追加被忽略
+
+        :returns: 无
+        :rtype: None
+        """
+        with self._lock:
+            self._closed = True
+
+    def sync(self) -> None:
+        """将日志文件和索引文件 fsync 到磁盘
+
+        :returns: 无
+        :rtype: None
+        :raises OSError: 如果 fsync 失败
+        """
+        for path in (self._log_path, self._index_path):
+            try:
+                fd: int = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                # 已归档
+                continue
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _find_start(self, f: BinaryIO, count: int, budget: float) -> int:
+        """从索引文件末尾倒序累加 token 估计数，找出预算内最早的消息
+
+        :param f: 以二进制模式打开的索引文件
+        :type f: BinaryIO
+        :param count: 消息数
+        :type count: int
+        :param budget: token 估计数的预算
+        :type budget: float
+        :returns: 预算内最早的消息的下标
+        :rtype: int
+        """
+        total: int = 0
+        stop: int = count
+
+        while stop > 0:
+            begin: int = max(0, stop - INDEX_BLOCK)
+            f.seek(begin * INDEX_ENTRY.size)
+            block: bytes = f.read((stop - begin) * INDEX_ENTRY.size)
+            for i in range(stop - begin - 1, -1, -1):
+                total += INDEX_ENTRY.unpack_from(block, i * INDEX_ENTRY.size)[1]
+                if total > budget:
+                    return begin + i + 1
+            stop = begin
+
+        return 0
+
+    def _recover(self) -> None:
+        """打开时检查日志文件和索引文件，截断不完整的尾部
+
+        :returns: 无
+        :rtype: None
+        """
+        if not self._index_path.exists() or not self._log_path.exists():
+            self._index_path.unlink(missing_ok=True)
+            self._log_path.unlink(missing_ok=True)
+            return
+
+        log_size: int = self._log_path.stat().st_size
+        count: int = self._index_path.stat().st_size // INDEX_ENTRY.size
+        end: int = 0
+
+        with open(self._index_path, "rb") as index, open(self._log_path, "rb") as log:
+            # 从后往前找到最后一条完整的记录
+            while count > 0:
+                index.seek((count - 1) * INDEX_ENTRY.size)
+                offset: int = INDEX_ENTRY.unpack(index.read(INDEX_ENTRY.size))[0]
+                log.seek(offset)
+                header: bytes = log.read(RECORD.size)
+                if len(header) == RECORD.size:
+                    role, _, content_size, thinking_size = RECORD.unpack(header)
+                    end = offset + RECORD.size + content_size + max(0, thinking_size)
+                    if end <= log_size:
+                        # 丢弃没有 AI 回答的最后一条用户消息
+                        if role == USER:
+                            count -= 1
+                            end = offset
+                        break
+                count -= 1
+                end = 0
+
+        os.truncate(self._index_path, count * INDEX_ENTRY.size)
+        os.truncate(self._log_path, end)
+        self._count = count
+        self._size = end
+
+    def __len__(self) -> int:
+        """返回日志中的消息数
+
+        :return: 消息数
+        :rtype: int
+        """
+        return self._count
+
+
+class ConversationStore:
+    """对话存储
+
+    管理一个目录下所有对话的只追加日志，由后台线程每隔 fsync_interval 秒将有新消息的日志批量 fsync，
+    多条消息共用一次 fsync
+
+    同一个对话同一时刻只由一个页面写入：同一个浏览器重新打开页面时，新页面接管对话，旧页面的日志被关闭
+
+    所有会话共享同一个实例，线程安全
+    """
+
+    def __init__(self, directory: Path, fsync_interval: float = 1.0) -> None:
+        """
+        :param directory: 日志文件所在的目录，不存在时在 start 中以 0o700 权限创建
+        :type directory: Path
+        :param fsync_interval: 批量 fsync 的时间间隔（秒），为 0 时每次追加后立即 fsync
+        :type fsync_interval: float
+        :raises ValueError: 如果 fsync_interval 小于 0
+        """
+        if fsync_interval < 0.0:
+            raise ValueError(
+                f"[ERROR] The number of fsync_interval={fsync_interval} is negative"
+            )
+
+        self._directory: Path = directory
+        self._fsync_interval: float = fsync_interval
+        self._lock: threading.Lock = threading.Lock()
+        # 对话 id -> 打开的日志，日志随 Memory 一起回收
+        self._logs: weakref.WeakValueDictionary[str, ConversationLog] = (
+            weakref.WeakValueDictionary()
+        )
+        # 有新消息、尚未 fsync 的日志
+        self._dirty: dict[str, ConversationLog] = {}
+        # 计数
+        self._appends: int = 0
+        self._appended_bytes: int = 0
+        self._syncs: int = 0
+        self._failures: int = 0
+        self._thread: threading.Thread | None = None
+        self._stopped: threading.Event = threading.Event()
+
+    def get_directory(self) -> Path:
+        """获取日志文件所在的目录
+
+        :returns: 日志文件所在的目录
+        :rtype: Path
+        """
+        return self._directory
+
+    def open(self, conversation_id: str) -> ConversationLog:
+        """打开对话的日志，对话已被其他页面打开时接管
+
+        :param conversation_id: 对话 id，只能包含字母、数字、- 和 _
+        :type conversation_id: str
+        :returns: 对话的日志
+        :rtype: ConversationLog
+        :raises ValueError: 如果对话 id 不合法
+        """
+        if not conversation_id or not all(
+            c.isascii() and (c.isalnum() or c in "-_") for c in conversation_id
+        ):
+            raise ValueError(
+                f"[ERROR] The conversation id={conversation_id} is invalid"
+            )
+
+        with self._lock:
+            previous: ConversationLog | None = self._logs.get(conversation_id)
+            if previous is not None:
+                previous.close()
+            log: ConversationLog = ConversationLog(self, conversation_id)
+            self._logs[conversation_id] = log
+
+        return log
+
+    def mark_dirty(self, log: ConversationLog, size: int) -> None:
+        """记录日志有尚未 fsync 的新消息
+
+        :param log: 对话的日志
+        :type log: ConversationLog
+        :param size: 新写入的字节数
+        :type size: int
+        :returns: 无
+        :rtype: None
+        """
+        with self._lock:
+            self._appends += 1
+            self._appended_bytes += size
+            self._dirty[log.get_id()] = log
+
+        if self._fsync_interval == 0.0:
+            self.sync()
+
+    def sync(self) -> int:
+        """将所有有新消息的日志 fsync 到磁盘
+
+        :returns: fsync 的日志数
+        :rtype: int
+        """
+        with self._lock:
+            dirty: list[ConversationLog] = list(self._dirty.values())
+            self._dirty.clear()
+
+        synced: int = 0
+        for log in dirty:
+            try:
+                log.sync()
+                synced += 1
+            except OSError as e:
+                print(f"[WARNING] Failed to sync conversation={log.get_id()}: {e}")
+                with self._lock:
+                    self._failures += 1
+
+        with self._lock:
+            self._syncs += synced
+
+        return synced
+
+    def get_stats(self) -> dict[str, int]:
+        """获取对话存储的统计信息
+
+        :returns: open 为打开的日志数，appends / appended_bytes 为累计追加的消息数 / 字节数，
+            syncs / failures 为累计 fsync 的日志数 / 失败次数
+        :rtype: dict[str, int]
+        """
+        with self._lock:
+            return {
+                "open": len(self._logs),
+                "appends": self._appends,
+                "appended_bytes": self._appended_bytes,
+                "syncs": self._syncs,
+                "failures": self._failures,
+            }
+
+    def start(self) -> None:
+        """创建日志目录，启动批量 fsync 的后台线程
+
+        :returns: 无
+        :rtype: None
+        """
+        # 对话日志包括完整的对话内容，只允许当前用户访问
+        self._directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        if self._directory.stat().st_mode & 0o077:
+            self._directory.chmod(0o700)
+
+        if self._thread is not None or self._fsync_interval == 0.0:
+            return
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """停止后台线程，并 fsync 剩余的日志
+
+        :returns: 无
+        :rtype: None
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.sync()
+
+    def _run(self) -> None:
+        """批量 fsync 的后台线程"""
+        while not self._stopped.wait(self._fsync_interval):
+            self.sync()
@@ -1,57 +1,205 @@
-import re
-import math
+import bisect
+import os
+import struct
+import sys
+import threading
 
+from collections.abc import Sequence
+from pathlib import Path
+from typing import overload
 
-def conservative_token_estimate(text: str) -> int:
-    """保守估计字符串分词后所占的 token 数
+from conversation_log import (
+    ASSISTANT,
+    USER,
+    ConversationLog,
+    decode_records,
+    encode_record,
+)
+from streaming import render_response
+from token_estimator import TokenCalibrator, conservative_token_estimate
 
-    在无法提取模型的分词器的情况下，用该函数保守估计 token 数
+# 消息角色，存储时只记录下标，构造消息时总是使用同一个字符串对象
+ROLES: tuple[str, ...] = (sys.intern("user"), sys.intern("assistant"))
 
-    :param text: 待估计的字符串
-    :type text: str
-    :returns: 保守估计的 token 数
-    :rtype: int
+# 换出文件的文件头：魔数、消息数，之后是与对话日志相同格式的消息记录
+SPILL_HEADER: struct.Struct = struct.Struct("<4sI")
+SPILL_MAGIC: bytes = b"OCM1"
+
+
+class MessageView(Sequence):
+    """消息列表中连续若干条消息的只读视图
+
+    不复制消息列表，访问某条消息时才构造 ollama 和 gradio.Chatbot 需要的 dict，
+    消息内容是记忆模块中的同一个字符串对象
+
+    消息只会追加到视图之后，丢弃、清空和换出都替换记忆模块中的列表，视图始终指向创建时的消息
     """
-    # 中文字符数
-    chinese_chars = len(re.findall(r"[\u4e00-\u9fff\u3000-\u303f\uff00-\uffef]", text))
-    # 非中文字符数
-    non_chinese_chars = len(
-        re.findall(r"[^\u4e00-\u9fff\u3000-\u303f\uff00-\uffef]", text)
-    )
-    # 表情数
-    emoji_count = len(re.findall(r"[\U00010000-\U0010ffff]", text))
-
-    # 平均每个中文字符占 1.3 token
-    chinese_tokens = int(math.ceil(chinese_chars * 1.3))
-    # 平均每个非中文字符占 0.6 token
-    non_chinese_tokens = (
-        max(1, int(math.ceil(non_chinese_chars * 0.6))) if non_chinese_chars > 0 else 0
-    )
-    # 平均每个表情占 2 token
-    emoji_tokens = emoji_count * 2
-
-    total = chinese_tokens + non_chinese_tokens + emoji_tokens
-
-    # 额外加 5% buffer 防边界情况
-    return int(total * 1.05 + 1)
+
+    def __init__(
+        self,
+        roles: bytearray,
+        contents: list[str],
+        thinking: list[str | None],
+        start: int,
+        stop: int,
+        with_thinking: bool,
+    ) -> None:
+        """
+        :param roles: 消息角色在 ROLES 中的下标
+        :type roles: bytearray
+        :param contents: 消息内容，不包括思考过程
+        :type contents: list[str]
+        :param thinking: 消息的思考过程，没有思考过程时为 None
+        :type thinking: list[str | None]
+        :param start: 视图的第一条消息的下标
+        :type start: int
+        :param stop: 视图的最后一条消息的下一个下标
+        :type stop: int
+        :param with_thinking: 是否将思考过程拼接到消息内容中，供 gradio.Chatbot 组件显示
+        :type with_thinking: bool
+        """
+        self._roles: bytearray = roles
+        self._contents: list[str] = contents
+        self._thinking: list[str | None] = thinking
+        self._start: int = start
+        self._stop: int = stop
+        self._with_thinking: bool = with_thinking
+
+    @overload
+    def __getitem__(self, index: int) -> dict[str, str]: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> Sequence[dict[str, str]]: ...
+
+    def __getitem__(
+        self, index: int | slice
+    ) -> dict[str, str] | Sequence[dict[str, str]]:
+        """获取一条消息，或用切片获取子视图
+
+        :param index: 消息在视图中的下标或切片
+        :type index: int | slice
+        :returns: 消息，或切片对应的视图（步长不为 1 时为列表）
+        :rtype: dict[str, str] | Sequence[dict[str, str]]
+        :raises IndexError: 如果下标越界
+        """
+        n: int = self._stop - self._start
+
+        if isinstance(index, slice):
+            start, stop, step = index.indices(n)
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return MessageView(
+                self._roles,
+                self._contents,
+                self._thinking,
+                self._start + start,
+                self._start + max(start, stop),
+                self._with_thinking,
+            )
+
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError(f"[ERROR] The index={index} is out of range")
+
+        i: int = self._start + index
+        content: str = self._contents[i]
+        thinking: str | None = self._thinking[i]
+        if self._with_thinking and thinking is not None:
+            content = render_response(thinking, content)
+
+        return {"role": ROLES[self._roles[i]], "content": content}
+
+    def __len__(self) -> int:
+        """返回视图中的消息数
+
+        :return: 视图中的消息数
+        :rtype: int
+        """
+        return self._stop - self._start
 
 
 class Memory:
     """记忆模块
 
     针对 ollama 和 gradio.Chatbot 组件设计，管理系统提示词和对话历史
+
+    每条消息只存储一次：角色为一个字节，内容为一个字符串，AI 消息的思考过程单独存储，
+    发送给模型的上下文是这份存储上的视图；gradio.Chatbot 组件显示的对话历史在第一次显示时构造并缓存，
+    之后每轮只构造新增的消息
+
+    设置了 max_chars 时，消息总字符数（包括思考过程）超出上限后从最早的一轮对话开始丢弃，
+    限制每个会话常驻的内存，显示缓存中拼接了思考过程的消息不计入字符数
+
+    会话闲置时可以调用 spill 将消息列表换出到磁盘，同时释放显示缓存，下一次访问消息列表时自动换入
+
+    关联了对话日志时，添加的消息同时追加到日志中，重启后可以从日志恢复对话
+
+    移出上下文窗口的消息可以由后台任务压缩为滚动摘要，摘要作为系统消息放在历史消息之前，
+    选取上下文时为摘要预留预算
     """
 
-    def __init__(self) -> None:
+    def __init__(
+        self, calibrator: TokenCalibrator | None = None, max_chars: int | None = None
+    ) -> None:
+        """
+        :param calibrator: token 估计校准器，为 None 时创建一个新的校准器
+        :type calibrator: TokenCalibrator | None
+        :param max_chars: 消息总字符数（包括思考过程）的上限，为 None 时不限制
+        :type max_chars: int | None
+        :raises ValueError: 如果 max_chars 不大于 0
+        """
+        if max_chars is not None and max_chars <= 0:
+            raise ValueError(
+                f"[ERROR] The number of max_chars={max_chars} is not positive"
+            )
+
         # 系统消息
         self._system_message: dict = {
             "role": "system",
             "content": "",
         }
-        # AI 回答不包括思考过程的消息列表
-        self._messages: list[dict[str, str]] = []
-        # AI 回答包括思考过程的消息列表
-        self._history: list[dict[str, str]] = []
+        # 消息角色在 ROLES 中的下标
+        self._roles: bytearray = bytearray()
+        # 消息内容，AI 消息不包括思考过程
+        self._contents: list[str] = []
+        # AI 消息的思考过程，用户消息和没有思考过程的 AI 消息为 None
+        self._thinking: list[str | None] = []
+        # 消息总字符数（包括思考过程）及其上限
+        self._chars: int = 0
+        self._max_chars: int | None = max_chars
+        # 系统提示词的 token 估计数，设置系统消息时计算一次
+        self._system_tokens: int = 0
+        # 消息列表的前缀和，_prefix_tokens[i] 为前 i 条消息的 token 估计数之和
+        # 每条消息的 token 数只在添加时估计一次，后缀和 = 总和 - 前缀和
+        self._prefix_tokens: list[int] = [0]
+        # token 估计校准器，一般由多个会话共享
+        self._calibrator: TokenCalibrator = (
+            calibrator if calibrator is not None else TokenCalibrator()
+        )
+        # 最近一次 get_context 选取的消息（含系统提示词）的 token 估计数，未经校准
+        self._last_context_tokens: int = 0
+        # 最近一次 get_context 选取的第一条消息在消息列表中的下标
+        self._context_start: int = 0
+        # 换出文件的路径，没有换出时为 None
+        self._spill_path: Path | None = None
+        # 换出时的消息数
+        self._spilled_messages: int = 0
+        # 换出和换入可能在不同线程中进行
+        self._spill_lock: threading.Lock = threading.Lock()
+        # 对话日志，添加的消息同时写入日志，为 None 时只保存在内存中
+        self._log: ConversationLog | None = None
+        # 移出上下文窗口的消息的滚动摘要及其 token 估计数
+        self._summary: str = ""
+        self._summary_tokens: int = 0
+        # 消息列表的前 _summarized 条消息已包括在摘要中
+        self._summarized: int = 0
+        # 清空消息列表的次数，清空前开始生成的摘要不再有效
+        self._epoch: int = 0
+        # 清空后因超出字符数上限丢弃的消息数，换算消息的绝对下标
+        self._dropped: int = 0
+        # gradio.Chatbot 组件显示的前若干条消息，已拼接思考过程，每条消息只构造一次
+        self._rendered: list[dict[str, str]] = []
 
     def set_system_message(self, content: str) -> None:
         """设置系统消息
@@ -66,6 +214,7 @@ class Memory:
             raise ValueError("[ERROR] The content of system messsage is empty")
 
         self._system_message["content"] = content
+        self._system_tokens = conservative_token_estimate(content)
 
     def add_user_message(self, content: str) -> None:
         """添加用户消息
@@ -79,36 +228,60 @@ class Memory:
         if content is None or not content.strip():
             raise ValueError("[ERROR] The content of user message is empty")
 
-        self._messages.append({"role": "user", "content": content})
-        self._history.append({"role": "user", "content": content})
+        self._restore()
+        self._append(USER, content, None)
 
-    def add_assistant_message(self, content: str) -> None:
-        """添加 AI 消息
+    def check_user_message(
+        self,
+        content: str,
+        num_ctx: int,
+        model: str | None = None,
+        reserve: int = 0,
+    ) -> None:
+        """检查用户消息添加后能否放入上下文窗口，不修改消息列表
 
-        :param content: AI 消息内容，不包括思考过程
+        与 get_context 的条件相同，在 add_user_message 之前调用，放不下时不会留下没有回答的用户消息
+
+        :param content: 用户消息内容
         :type content: str
+        :param num_ctx: 上下文窗口大小
+        :type num_ctx: int
+        :param model: ollama 模型 id，不为 None 时用该模型的修正系数校准 token 估计数
+        :type model: str | None
+        :param reserve: 为其他消息（例如检索到的早期对话）预留的 token 估计数
+        :type reserve: int
         :returns: 无
         :rtype: None
-        :raises ValueError: 如果 content 为 None 或空
+        :raises ValueError: 如果 content 为空，或 num_ctx 太小，以至于无法容纳系统提示词 + 摘要 + 用户消息
         """
         if content is None or not content.strip():
-            raise ValueError("[ERROR] The content of assistant message is empty")
+            raise ValueError("[ERROR] The content of user message is empty")
 
-        self._messages.append({"role": "assistant", "content": content})
+        factor: float = 1.0 if model is None else self._calibrator.get_factor(model)
+        reserved: int = self._system_tokens + self._summary_tokens + reserve
 
-    def add_assistant_response(self, content: str) -> None:
-        """添加 AI 响应
+        if reserved + conservative_token_estimate(content) >= num_ctx / factor:
+            raise ValueError(f"[ERROR] The number of num_ctx={num_ctx} is too small")
+
+    def add_assistant_message(self, content: str, thinking: str | None = None) -> None:
+        """添加 AI 消息
 
-        :param content: AI 响应内容，包括思考过程
+        添加后如果消息总字符数超出上限，从最早的一轮对话开始丢弃
+
+        :param content: AI 消息内容，不包括思考过程
         :type content: str
+        :param thinking: 思考过程，只用于 gradio.Chatbot 组件显示，不发送给模型
+        :type thinking: str | None
         :returns: 无
         :rtype: None
         :raises ValueError: 如果 content 为 None 或空
         """
         if content is None or not content.strip():
-            raise ValueError("[ERROR] The content of assistant response is empty")
+            raise ValueError("[ERROR] The content of assistant message is empty")
 
-        self._history.append({"role": "assistant", "content": content})
+        self._restore()
+        self._append(ASSISTANT, content, thinking or None)
+        self._trim()
 
     def get_system_message(self) -> dict[str, str]:
         """获取系统消息
@@ -121,45 +294,146 @@ class Memory:
     def get_history(self) -> list[dict[str, str]]:
         """获取 gradio.Chatbot 组件需要的消息列表
 
-        :returns: 包括思考过程的消息列表
+        已显示过的消息缓存在记忆模块中，每轮对话只构造新增的消息，不再重新拼接之前的思考过程
+
+        :returns: 包括思考过程的消息列表，列表是新的，其中的消息与缓存共享，调用方不应修改
         :rtype: list[dict[str, str]]
         """
-        return self._history.copy()
+        self._restore()
 
-    def get_context(self, num_ctx: int) -> list[dict[str, str]]:
+        self._rendered.extend(
+            self._view(len(self._rendered), len(self._contents), True)
+        )
+
+        return self._rendered.copy()
+
+    def get_context(
+        self,
+        num_ctx: int,
+        model: str | None = None,
+        refill: float = 1.0,
+        reserve: int = 0,
+    ) -> MessageView:
         """根据上下文窗口大小，获取消息列表的倒数 n 条消息
 
         消息列表不包括思考过程，限制 n 为奇数（多轮对话 + 最新用户消息）
 
+        refill 小于 1.0 时，只要上一次选取的第一条消息仍然放得下，就从同一条消息开始选取，
+        使发送给模型的前缀保持不变；放不下时，只用 refill 比例的预算重新选取，为后续几轮留出空间
+
         :param num_ctx: 上下文窗口大小
         :type num_ctx: int
-        :returns: 消息列表的倒数 n 条消息按顺序构成的列表
-        :rtype: list[dict[str, str]]
-        :raises ValueError: 如果 num_ctx 太小，以至于无法容纳系统提示词 + 最新用户消息
+        :param model: ollama 模型 id，不为 None 时用该模型的修正系数校准 token 估计数
+        :type model: str | None
+        :param refill: 上下文窗口滑动时重新填充的预算比例，1.0 表示总是选取尽可能多的消息
+        :type refill: float
+        :param reserve: 为其他消息（例如检索到的早期对话）预留的 token 估计数
+        :type reserve: int
+        :returns: 消息列表的倒数 n 条消息的视图
+        :rtype: MessageView
+        :raises ValueError: 如果 num_ctx 太小，以至于无法容纳系统提示词 + 摘要 + 最新用户消息
         """
-        n: int = 0
-        tokens: int = conservative_token_estimate(self._system_message["content"])
+        self._restore()
+
+        factor: float = 1.0 if model is None else self._calibrator.get_factor(model)
+        # 换算为未经校准的 token 估计数的预算
+        budget: float = num_ctx / factor
+
+        # 系统提示词、摘要和预留的预算
+        reserved: int = self._system_tokens + self._summary_tokens + reserve
 
         # 系统提示词字符数不能大于上下文窗口大小
-        if tokens > num_ctx:
+        if reserved > budget:
             raise ValueError(f"[ERROR] The number of num_ctx={num_ctx} is too small")
 
-        for message in reversed(self._messages):
-            tokens += conservative_token_estimate(message["content"])
-            if tokens >= num_ctx:
-                break
-            else:
-                n += 1
-
-        # 如果 n 为偶数，则减 1，不仅可以调整为奇数，而且可以留出上下文窗口以生成 AI 响应
-        if n > 0 and n % 2 == 0:
-            n -= 1
+        m: int = len(self._contents)
+        n: int = self._count_fitting(budget - reserved)
 
         # n 为 0 意味着剩下的上下文窗口无法容纳最新用户消息
         if n == 0:
             raise ValueError(f"[ERROR] The number of num_ctx={num_ctx} is too small")
 
-        return self._messages[-n:]
+        if refill < 1.0:
+            if m - n <= self._context_start:
+                # 上一次的起点仍然放得下，保持前缀不变
+                n = m - self._context_start
+                if n % 2 == 0:
+                    n -= 1
+            else:
+                n = max(1, self._count_fitting((budget - reserved) * refill))
+
+        self._context_start = m - n
+        self._last_context_tokens = (
+            reserved + self._prefix_tokens[m] - self._prefix_tokens[m - n]
+        )
+
+        return self._view(m - n, m, False)
+
+    def preview_context(
+        self,
+        content: str,
+        num_ctx: int,
+        model: str | None = None,
+        reserve: int = 0,
+    ) -> list[dict[str, str]]:
+        """获取在消息列表末尾追加一条用户消息后的上下文，不修改消息列表
+
+        用于对比模式：同一个问题发给多个模型，回答不保存到记忆模块。
+        不影响 get_context 记录的起点和 calibrate 使用的估计数
+
+        :param content: 用户消息内容
+        :type content: str
+        :param num_ctx: 上下文窗口大小
+        :type num_ctx: int
+        :param model: ollama 模型 id，不为 None 时用该模型的修正系数校准 token 估计数
+        :type model: str | None
+        :param reserve: 为其他消息（例如检索到的早期对话）预留的 token 估计数
+        :type reserve: int
+        :returns: 倒数若干轮完整对话 + 用户消息
+        :rtype: list[dict[str, str]]
+        :raises ValueError: 如果 content 为空，或 num_ctx 太小，以至于无法容纳系统提示词 + 摘要 + 用户消息
+        """
+        if content is None or not content.strip():
+            raise ValueError("[ERROR] The content of user message is empty")
+
+        self._restore()
+
+        factor: float = 1.0 if model is None else self._calibrator.get_factor(model)
+        budget: float = num_ctx / factor
+        reserved: int = (
+            self._system_tokens
+            + self._summary_tokens
+            + reserve
+            + conservative_token_estimate(content)
+        )
+
+        if reserved > budget:
+            raise ValueError(f"[ERROR] The number of num_ctx={num_ctx} is too small")
+
+        # 正在生成回答时最后一条是用户消息，只取完整的对话
+        m: int = len(self._contents) - len(self._contents) % 2
+        threshold: float = self._prefix_tokens[m] - (budget - reserved)
+        n: int = m - bisect.bisect_right(self._prefix_tokens, threshold, hi=m)
+        # 只保留完整的若干轮对话，保证用户消息和 AI 消息交替出现
+        n -= n % 2
+
+        return list(self._view(m - n, m, False)) + [
+            {"role": ROLES[USER], "content": content}
+        ]
+
+    def calibrate(self, model: str, prompt_eval_count: int) -> bool:
+        """用 Ollama 返回的真实 token 数校准最近一次 get_context 的估计
+
+        :param model: 生成 AI 响应的 ollama 模型 id
+        :type model: str
+        :param prompt_eval_count: Ollama 返回的提示词 token 数
+        :type prompt_eval_count: int
+        :returns: 样本是否被校准器采用
+        :rtype: bool
+        """
+        return self._calibrator.update(
+            model, self._last_context_tokens, prompt_eval_count
+        )
 
     def clear(self) -> None:
         """清空消息列表
@@ -169,8 +443,413 @@ class Memory:
         :returns: 无
         :rtype: None
         """
-        self._messages.clear()
-        self._history.clear()
+        with self._spill_lock:
+            # 换出的消息列表不再需要换入
+            if self._spill_path is not None:
+                self._spill_path.unlink(missing_ok=True)
+                self._spill_path = None
+
+        # 对话日志中的对话被归档，之后从空日志开始
+        if self._log is not None:
+            try:
+                self._log.rotate()
+            except OSError as e:
+                print(
+                    f"[WARNING] Failed to archive conversation={self._log.get_id()}: {e}"
+                )
+
+        # 替换而不是原地清空，已有的视图仍然指向原来的消息
+        self._roles = bytearray()
+        self._contents = []
+        self._thinking = []
+        self._rendered = []
+        self._chars = 0
+        self._prefix_tokens = [0]
+        self._context_start = 0
+        self._summary = ""
+        self._summary_tokens = 0
+        self._summarized = 0
+        self._epoch += 1
+        self._dropped = 0
+
+    def attach_log(self, log: ConversationLog, num_ctx: int | None = None) -> int:
+        """关联对话日志，用日志中最后若干轮对话替换消息列表，之后添加的消息同时写入日志
+
+        只读取上下文窗口放得下的最后若干轮对话，不读取整个日志
+
+        :param log: 对话日志
+        :type log: ConversationLog
+        :param num_ctx: 上下文窗口大小，为 None 时读取整个日志
+        :type num_ctx: int | None
+        :returns: 恢复的消息数
+        :rtype: int
+        """
+        self._log = None
+        self.clear()
+
+        budget: float | None = (
+            None if num_ctx is None else max(0, num_ctx - self._system_tokens)
+        )
+        records: list[tuple[int, int, str, str | None]] = log.read_tail(budget)
+        self._load(records)
+        self._chars = sum(
+            len(content) + (len(thinking) if thinking else 0)
+            for _, _, content, thinking in records
+        )
+        self._log = log
+        self._trim()
+
+        return len(self._contents)
+
+    def get_summary_message(self) -> dict[str, str] | None:
+        """获取滚动摘要构成的系统消息
+
+        :returns: 摘要构成的系统消息，还没有摘要时为 None
+        :rtype: dict[str, str] | None
+        """
+        if not self._summary:
+            return None
+
+        return {
+            "role": "system",
+            "content": f"Summary of the earlier conversation:\n{self._summary}",
+        }
+
+    def get_summary(self) -> str:
+        """获取滚动摘要
+
+        :returns: 移出上下文窗口的消息的摘要，还没有摘要时为空字符串
+        :rtype: str
+        """
+        return self._summary
+
+    def get_evicted(self, max_tokens: float) -> tuple[int, int, MessageView] | None:
+        """获取已移出上下文窗口、还没有包括在摘要中的消息
+
+        最近一次 get_context 选取的第一条消息之前的消息都已移出上下文窗口。
+        每次最多返回 token 估计数之和不超过 max_tokens 的若干轮对话，至少一轮
+
+        :param max_tokens: 返回的消息的 token 估计数之和的上限
+        :type max_tokens: float
+        :returns: (清空次数, 最后一条消息之后的绝对下标, 消息视图)，传给 set_summary；没有这样的消息时为 None
+        :rtype: tuple[int, int, MessageView] | None
+        """
+        self._restore()
+
+        start: int = self._summarized
+        # 上下文窗口的第一条消息总是用户消息，只压缩完整的对话
+        end: int = self._context_start - self._context_start % 2
+        if end <= start:
+            return None
+
+        stop: int = start + 2
+        while (
+            stop + 2 <= end
+            and self._prefix_tokens[stop + 2] - self._prefix_tokens[start] <= max_tokens
+        ):
+            stop += 2
+
+        return (self._epoch, self._dropped + stop, self._view(start, stop, False))
+
+    def set_summary(self, summary: str, epoch: int, stop: int) -> bool:
+        """更新滚动摘要
+
+        :param summary: 包括了 get_evicted 返回的消息的新摘要
+        :type summary: str
+        :param epoch: get_evicted 返回的清空次数
+        :type epoch: int
+        :param stop: get_evicted 返回的绝对下标
+        :type stop: int
+        :returns: 是否更新，生成摘要期间消息列表被清空时不更新
+        :rtype: bool
+        """
+        if epoch != self._epoch or stop - self._dropped <= self._summarized:
+            return False
+
+        self._summary = summary.strip()
+        self._summary_tokens = (
+            conservative_token_estimate(self._summary) if self._summary else 0
+        )
+        self._summarized = stop - self._dropped
+
+        return True
+
+    def get_epoch(self) -> int:
+        """获取清空消息列表的次数
+
+        :returns: 清空次数，变化后之前获取的绝对下标不再有效
+        :rtype: int
+        """
+        return self._epoch
+
+    def get_window(self) -> tuple[int, int, int]:
+        """获取消息列表在本次清空以来所有消息中的位置
+
+        绝对下标从清空时开始计数，不受超出字符数上限丢弃消息的影响
+
+        :returns: (第一条消息的绝对下标, 最近一次 get_context 选取的第一条消息的绝对下标, 消息总数)
+        :rtype: tuple[int, int, int]
+        """
+        self._restore()
+
+        return (
+            self._dropped,
+            self._dropped + self._context_start,
+            self._dropped + len(self._contents),
+        )
+
+    def get_range(self, start: int, stop: int) -> MessageView:
+        """按绝对下标获取若干条消息，已丢弃的消息被跳过
+
+        :param start: 第一条消息的绝对下标
+        :type start: int
+        :param stop: 最后一条消息之后的绝对下标
+        :type stop: int
+        :returns: 消息视图，不包括思考过程
+        :rtype: MessageView
+        """
+        self._restore()
+
+        m: int = len(self._contents)
+        begin: int = min(m, max(0, start - self._dropped))
+        end: int = min(m, max(begin, stop - self._dropped))
+
+        return self._view(begin, end, False)
+
+    def get_range_tokens(self, start: int, stop: int) -> int:
+        """按绝对下标获取若干条消息的 token 估计数之和，已丢弃的消息不计入
+
+        :param start: 第一条消息的绝对下标
+        :type start: int
+        :param stop: 最后一条消息之后的绝对下标
+        :type stop: int
+        :returns: token 估计数之和
+        :rtype: int
+        """
+        self._restore()
+
+        m: int = len(self._contents)
+        begin: int = min(m, max(0, start - self._dropped))
+        end: int = min(m, max(begin, stop - self._dropped))
+
+        return self._prefix_tokens[end] - self._prefix_tokens[begin]
+
+    def get_log(self) -> ConversationLog | None:
+        """获取关联的对话日志
+
+        :returns: 对话日志，没有关联时为 None
+        :rtype: ConversationLog | None
+        """
+        return self._log
+
+    def get_size(self) -> int:
+        """获取消息总字符数
+
+        :returns: 消息总字符数（包括思考过程），换出后仍为换出前的字符数
+        :rtype: int
+        """
+        return self._chars
+
+    def is_spilled(self) -> bool:
+        """判断消息列表是否已换出到磁盘
+
+        :returns: 是否已换出
+        :rtype: bool
+        """
+        return self._spill_path is not None
+
+    def spill(self, path: Path) -> int:
+        """将消息列表换出到磁盘，并释放内存中的消息列表
+
+        文件为长度前缀的二进制格式，权限为 0o600，先写入临时文件再重命名，写入失败时消息列表保留在内存中
+
+        :param path: 换出文件的路径
+        :type path: Path
+        :returns: 写入的字节数，已经换出时为 0
+        :rtype: int
+        :raises OSError: 如果写入文件失败
+        """
+        with self._spill_lock:
+            if self._spill_path is not None:
+                return 0
+
+            m: int = len(self._contents)
+            chunks: list[bytes] = [SPILL_HEADER.pack(SPILL_MAGIC, m)]
+            for i in range(m):
+                chunks.append(
+                    encode_record(
+                        self._roles[i],
+                        self._prefix_tokens[i + 1] - self._prefix_tokens[i],
+                        self._contents[i],
+                        self._thinking[i],
+                    )
+                )
+
+            data: bytes = b"".join(chunks)
+            temp: Path = path.with_name(path.name + ".tmp")
+            # 换出文件包括完整的对话内容，只允许当前用户读写；上次残留的临时文件可能有其他权限
+            temp.unlink(missing_ok=True)
+            fd: int = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with open(fd, "wb") as f:
+                f.write(data)
+            temp.replace(path)
+
+            self._spill_path = path
+            self._spilled_messages = m
+            self._roles = bytearray()
+            self._contents = []
+            self._thinking = []
+            self._rendered = []
+            self._prefix_tokens = [0]
+
+            return len(data)
+
+    def _restore(self) -> None:
+        """如果消息列表已换出，从磁盘换入并删除换出文件
+
+        :returns: 无
+        :rtype: None
+        :raises ValueError: 如果换出文件已损坏
+        """
+        if self._spill_path is None:
+            return
+
+        with self._spill_lock:
+            # 等待期间其他线程可能已经换入
+            if self._spill_path is None:
+                return
+
+            data: bytes = self._spill_path.read_bytes()
+            magic, m = SPILL_HEADER.unpack_from(data, 0)
+            if magic != SPILL_MAGIC:
+                raise ValueError(
+                    f"[ERROR] The spill file {self._spill_path} is corrupt"
+                )
+
+            self._load(decode_records(data, SPILL_HEADER.size, m))
+            self._spill_path.unlink(missing_ok=True)
+            self._spill_path = None
+
+    def _load(self, records: list[tuple[int, int, str, str | None]]) -> None:
+        """用解码后的记录替换消息列表，不写入对话日志
+
+        :param records: (角色, token 估计数, 内容, 思考过程) 列表
+        :type records: list[tuple[int, int, str, str | None]]
+        :returns: 无
+        :rtype: None
+        """
+        roles: bytearray = bytearray()
+        contents: list[str] = []
+        thinking: list[str | None] = []
+        prefix_tokens: list[int] = [0]
+        for role, tokens, content, thinking_text in records:
+            roles.append(role)
+            contents.append(content)
+            thinking.append(thinking_text)
+            prefix_tokens.append(prefix_tokens[-1] + tokens)
+
+        self._roles = roles
+        self._contents = contents
+        self._thinking = thinking
+        self._rendered = []
+        self._prefix_tokens = prefix_tokens
+
+    def _count_fitting(self, budget: float) -> int:
+        """计算在预算内最多能容纳消息列表的倒数多少条消息
+
+        :param budget: 消息可用的 token 估计数预算
+        :type budget: float
+        :returns: 消息数 n，为奇数或 0
+        :rtype: int
+        """
+        # 倒数 n 条消息的 token 数 = total - _prefix_tokens[m - n]，需满足
+        # 倒数 n 条消息 < budget，即 _prefix_tokens[m - n] > threshold
+        # 每条消息至少估计为 1 token，前缀和严格递增，可以二分查找
+        m: int = len(self._contents)
+        threshold: float = self._prefix_tokens[m] - budget
+        n: int = m - bisect.bisect_right(self._prefix_tokens, threshold, hi=m)
+
+        # 如果 n 为偶数，则减 1，不仅可以调整为奇数，而且可以留出上下文窗口以生成 AI 响应
+        if n > 0 and n % 2 == 0:
+            n -= 1
+
+        return n
+
+    def _append(self, role: int, content: str, thinking: str | None) -> None:
+        """追加一条消息，估计其 token 数并追加到前缀和列表，关联了对话日志时同时写入日志
+
+        :param role: 消息角色在 ROLES 中的下标
+        :type role: int
+        :param content: 消息内容
+        :type content: str
+        :param thinking: 思考过程
+        :type thinking: str | None
+        :returns: 无
+        :rtype: None
+        """
+        self._roles.append(role)
+        self._contents.append(content)
+        self._thinking.append(thinking)
+        self._chars += len(content) + (len(thinking) if thinking else 0)
+        tokens: int = conservative_token_estimate(content)
+        self._prefix_tokens.append(self._prefix_tokens[-1] + tokens)
+
+        if self._log is not None:
+            try:
+                self._log.append(role, tokens, content, thinking)
+            except OSError as e:
+                # 写入日志失败不影响对话
+                print(f"[WARNING] Failed to log conversation={self._log.get_id()}: {e}")
+
+    def _trim(self) -> None:
+        """消息总字符数超出上限时，成对丢弃最早的用户消息和 AI 消息
+
+        至少保留最近一轮对话，丢弃后用户消息和 AI 消息仍然交替出现
+
+        :returns: 无
+        :rtype: None
+        """
+        if self._max_chars is None or self._chars <= self._max_chars:
+            return
+
+        k: int = 0
+        chars: int = self._chars
+        while chars > self._max_chars and len(self._contents) - k > 2:
+            for i in (k, k + 1):
+                thinking: str | None = self._thinking[i]
+                chars -= len(self._contents[i]) + (len(thinking) if thinking else 0)
+            k += 2
+
+        if k == 0:
+            return
+
+        # 替换而不是原地删除，已有的视图（例如正在生成摘要的消息）仍然有效
+        self._roles = self._roles[k:]
+        self._contents = self._contents[k:]
+        self._thinking = self._thinking[k:]
+        self._rendered = self._rendered[k:]
+        # 前缀和只使用差值，丢弃开头的 k 项后仍然有效
+        self._prefix_tokens = self._prefix_tokens[k:]
+        self._chars = chars
+        self._context_start = max(0, self._context_start - k)
+        self._summarized = max(0, self._summarized - k)
+        self._dropped += k
+
+    def _view(self, start: int, stop: int, with_thinking: bool) -> MessageView:
+        """创建消息列表的视图
+
+        :param start: 视图的第一条消息的下标
+        :type start: int
+        :param stop: 视图的最后一条消息的下一个下标
+        :type stop: int
+        :param with_thinking: 是否将思考过程拼接到消息内容中
+        :type with_thinking: bool
+        :returns: 消息列表的视图
+        :rtype: MessageView
+        """
+        return MessageView(
+            self._roles, self._contents, self._thinking, start, stop, with_thinking
+        )
 
     def __len__(self) -> int:
         """返回消息列表的长度
@@ -178,4 +857,7 @@ class Memory:
         :return: 消息列表的长度，不包括系统消息
         :rtype: int
         """
-        return len(self._messages)
+        if self._spill_path is not None:
+            return self._spilled_messages
+
+        return len(self._contents)
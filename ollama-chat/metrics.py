@@ -0,0 +1,603 @@
+import bisect
+import json
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, TextIO
+
+# 耗时（秒）直方图的桶上界
+LATENCY_BUCKETS: tuple[float, ...] = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    300.0,
+)
+# 速率（token/秒）直方图的桶上界
+RATE_BUCKETS: tuple[float, ...] = (
+    1.0,
+    2.0,
+    5.0,
+    10.0,
+    20.0,
+    50.0,
+    100.0,
+    200.0,
+    500.0,
+    1000.0,
+    2000.0,
+    5000.0,
+    10000.0,
+)
+# 比例直方图的桶上界
+RATIO_BUCKETS: tuple[float, ...] = (
+    0.1,
+    0.25,
+    0.5,
+    0.75,
+    0.9,
+    0.95,
+    0.99,
+    1.0,
+)
+
+# 每次生成记录的指标：名称 -> (说明, 桶上界)
+GENERATION_METRICS: dict[str, tuple[str, tuple[float, ...]]] = {
+    "queue_wait_seconds": (
+        "Time from submitting a request to acquiring an execution slot",
+        LATENCY_BUCKETS,
+    ),
+    "prompt_build_seconds": (
+        "Time spent assembling the prompt (get_context, retrieval and build)",
+        LATENCY_BUCKETS,
+    ),
+    "ttft_seconds": (
+        "Time from submitting a request to the first generated token",
+        LATENCY_BUCKETS,
+    ),
+    "total_seconds": (
+        "Time from submitting a request to the end of generation",
+        LATENCY_BUCKETS,
+    ),
+    "prefix_reuse_ratio": (
+        "Share of prompt characters in the prefix reused from the previous turn",
+        RATIO_BUCKETS,
+    ),
+    "ui_stream_seconds": (
+        "Time spent rendering and flushing the chat window during generation",
+        LATENCY_BUCKETS,
+    ),
+    "load_seconds": ("Model load time reported by Ollama", LATENCY_BUCKETS),
+    "prefill_tokens_per_second": (
+        "Prompt evaluation throughput reported by Ollama",
+        RATE_BUCKETS,
+    ),
+    "decode_tokens_per_second": (
+        "Generation throughput reported by Ollama",
+        RATE_BUCKETS,
+    ),
+}
+
+# 各组件统计信息中导出的指标：组件 -> (键, 类型, 说明)
+# 类型为 counter / gauge 时直接导出键对应的值；为 window 时导出最近样本的
+# 键_mean / 键_p50 / 键_p95 / 键_max，以 stat 标签区分
+COMPONENT_METRICS: dict[str, tuple[tuple[str, str, str], ...]] = {
+    "scheduler": (
+        ("max_concurrency", "gauge", "Maximum number of concurrent generations"),
+        ("max_queue", "gauge", "Maximum number of queued generations"),
+        ("running", "gauge", "Generations holding an execution slot"),
+        ("queued", "gauge", "Generations waiting for an execution slot"),
+        ("admitted", "counter", "Generations that acquired an execution slot"),
+        ("rejected", "counter", "Generations rejected because the queue was full"),
+        ("abandoned", "counter", "Generations abandoned while queued"),
+        ("completed", "counter", "Generations that released their execution slot"),
+        ("wait", "window", "Recent time spent queued before acquiring a slot"),
+        ("service", "window", "Recent time spent holding an execution slot"),
+    ),
+    "residency": (
+        ("loads", "counter", "Models loaded by the residency manager"),
+        ("unloads", "counter", "Models unloaded by the residency manager"),
+        ("failures", "counter", "Failed model loads and unloads"),
+        ("cold_loads", "counter", "Generations that waited for a cold model load"),
+        ("load", "window", "Recent model load latency"),
+        ("unload", "window", "Recent model unload latency"),
+    ),
+    "cache": (
+        ("entries", "gauge", "Responses held in memory by the response cache"),
+        ("hits", "counter", "Response cache hits, including disk hits"),
+        ("disk_hits", "counter", "Response cache hits served from disk"),
+        ("misses", "counter", "Response cache misses"),
+        ("hit_rate", "gauge", "Fraction of response cache lookups that hit"),
+        ("stores", "counter", "Responses stored in the response cache"),
+        ("evictions", "counter", "Responses evicted from memory by the LRU limit"),
+        ("expirations", "counter", "Responses dropped after their TTL expired"),
+    ),
+}
+
+
+class Histogram:
+    """直方图
+
+    按固定的桶上界计数，内存占用与样本数无关；分位数在桶内线性插值估计
+    """
+
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        """
+        :param buckets: 升序排列的桶上界，最后隐含一个 +Inf 桶
+        :type buckets: tuple[float, ...]
+        :raises ValueError: 如果 buckets 为空或不是升序
+        """
+        if not buckets or any(a >= b for a, b in zip(buckets, buckets[1:])):
+            raise ValueError("[ERROR] The buckets of a histogram are not increasing")
+
+        self._buckets: tuple[float, ...] = buckets
+        # 每个桶（不累计）的样本数，最后一个为 +Inf 桶
+        self._counts: list[int] = [0] * (len(buckets) + 1)
+        self._sum: float = 0.0
+        self._count: int = 0
+
+    def observe(self, value: float) -> None:
+        """记录一个样本
+
+        :param value: 样本
+        :type value: float
+        :returns: 无
+        :rtype: None
+        """
+        self._counts[bisect.bisect_left(self._buckets, value)] += 1
+        self._sum += value
+        self._count += 1
+
+    def quantile(self, q: float) -> float:
+        """估计分位数
+
+        :param q: 分位，0.0 ~ 1.0
+        :type q: float
+        :returns: 分位数，没有样本时为 0.0；落在 +Inf 桶时为最大的桶上界
+        :rtype: float
+        """
+        if self._count == 0:
+            return 0.0
+
+        rank: float = q * self._count
+        seen: int = 0
+        for i, count in enumerate(self._counts):
+            if count and seen + count >= rank:
+                if i == len(self._buckets):
+                    return self._buckets[-1]
+                low: float = self._buckets[i - 1] if i > 0 else 0.0
+                return low + (self._buckets[i] - low) * (rank - seen) / count
+            seen += count
+
+        return self._buckets[-1]
+
+    def get_buckets(self) -> list[tuple[float, int]]:
+        """获取累计计数
+
+        :returns: (桶上界, 不大于该上界的样本数) 列表，最后一项的上界为 inf
+        :rtype: list[tuple[float, int]]
+        """
+        cumulative: list[tuple[float, int]] = []
+        total: int = 0
+        for bound, count in zip((*self._buckets, float("inf")), self._counts):
+            total += count
+            cumulative.append((bound, total))
+
+        return cumulative
+
+    def get_sum(self) -> float:
+        """获取样本之和
+
+        :returns: 样本之和
+        :rtype: float
+        """
+        return self._sum
+
+    def get_count(self) -> int:
+        """获取样本数
+
+        :returns: 样本数
+        :rtype: int
+        """
+        return self._count
+
+
+class MetricsRegistry:
+    """生成指标
+
+    按模型汇总每次生成的排队等待、首个 token 延迟、预填充和解码速率、模型加载时间，
+    以及应用自身组装提示词和刷新对话窗口的耗时，以直方图的形式提供给指标端点；
+    每次生成的原始指标同时以 JSON 行的形式写入结构化日志
+
+    所有会话共享同一个实例，线程安全
+    """
+
+    def __init__(self, log_path: Path | None = None, log: bool = True) -> None:
+        """
+        :param log_path: 结构化日志文件的路径，第一次记录时打开，为 None 或打开失败时写入标准输出
+        :type log_path: Path | None
+        :param log: 是否输出结构化日志
+        :type log: bool
+        """
+        self._lock: threading.Lock = threading.Lock()
+        # (指标名称, 模型) -> 直方图
+        self._histograms: dict[tuple[str, str], Histogram] = {}
+        # (模型, 结果) -> 生成次数
+        self._requests: dict[tuple[str, str], int] = {}
+        # (模型, 类型) -> token 数
+        self._tokens: dict[tuple[str, str], int] = {}
+        self._log: bool = log
+        # 创建实例时不打开文件，导入 app 时没有文件操作
+        self._log_path: Path | None = log_path if log else None
+        self._log_file: TextIO | None = None
+
+    def record(self, model: str, outcome: str, values: dict[str, float | int]) -> None:
+        """记录一次生成的指标
+
+        :param model: ollama 模型 id
+        :type model: str
+        :param outcome: 生成的结果，例如 ok / timeout / interrupted / cached
+        :type outcome: str
+        :param values: 指标名称 -> 值，GENERATION_METRICS 中的指标计入直方图，
+            prompt_tokens / completion_tokens 计入 token 总数，其余只写入结构化日志
+        :type values: dict[str, float | int]
+        :returns: 无
+        :rtype: None
+        """
+        with self._lock:
+            self._requests[(model, outcome)] = (
+                self._requests.get((model, outcome), 0) + 1
+            )
+            for name, value in values.items():
+                if name in ("prompt_tokens", "completion_tokens"):
+                    key: tuple[str, str] = (model, name.removesuffix("_tokens"))
+                    self._tokens[key] = self._tokens.get(key, 0) + int(value)
+                if name not in GENERATION_METRICS:
+                    continue
+                histogram: Histogram | None = self._histograms.get((name, model))
+                if histogram is None:
+                    histogram = Histogram(GENERATION_METRICS[name][1])
+                    self._histograms[(name, model)] = histogram
+                histogram.observe(value)
+
+            if self._log:
+                line: str = json.dumps(
+                    {
+                        "ts": round(time.time(), 3),
+                        "event": "generation",
+                        "model": model,
+                        "outcome": outcome,
+                        **{
+                            name: round(value, 6) if isinstance(value, float) else value
+                            for name, value in values.items()
+                        },
+                    },
+                    ensure_ascii=False,
+                )
+                if self._log_file is None and self._log_path is not None:
+                    try:
+                        self._log_path.parent.mkdir(parents=True, exist_ok=True)
+                        self._log_file = open(
+                            self._log_path, "a", encoding="utf-8", buffering=1
+                        )
+                    except OSError as e:
+                        print(
+                            f"[WARNING] Failed to open the metrics log {self._log_path}, using stdout: {e}"
+                        )
+                    # 只尝试打开一次
+                    self._log_path = None
+                print(line, file=self._log_file or sys.stdout, flush=True)
+
+    def render(self) -> str:
+        """以 Prometheus 文本格式输出所有指标
+
+        :returns: Prometheus 文本格式的指标
+        :rtype: str
+        """
+        lines: list[str] = [
+            "# HELP ollama_chat_requests_total Generations by model and outcome",
+            "# TYPE ollama_chat_requests_total counter",
+        ]
+        with self._lock:
+            for (model, outcome), count in sorted(self._requests.items()):
+                lines.append(
+                    f'ollama_chat_requests_total{{model="{model}",outcome="{outcome}"}} {count}'
+                )
+
+            lines.append("# HELP ollama_chat_tokens_total Tokens by model and kind")
+            lines.append("# TYPE ollama_chat_tokens_total counter")
+            for (model, kind), count in sorted(self._tokens.items()):
+                lines.append(
+                    f'ollama_chat_tokens_total{{model="{model}",kind="{kind}"}} {count}'
+                )
+
+            for name, (description, _) in GENERATION_METRICS.items():
+                metric: str = f"ollama_chat_{name}"
+                lines.append(f"# HELP {metric} {description}")
+                lines.append(f"# TYPE {metric} histogram")
+                for (histogram_name, model), histogram in sorted(
+                    self._histograms.items()
+                ):
+                    if histogram_name != name:
+                        continue
+                    for bound, count in histogram.get_buckets():
+                        le: str = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        lines.append(
+                            f'{metric}_bucket{{model="{model}",le="{le}"}} {count}'
+                        )
+                    lines.append(
+                        f'{metric}_sum{{model="{model}"}} {histogram.get_sum():.6f}'
+                    )
+                    lines.append(
+                        f'{metric}_count{{model="{model}"}} {histogram.get_count()}'
+                    )
+
+        return "\n".join(lines) + "\n"
+
+    def get_stats(self) -> dict[str, dict[str, dict[str, float | int]]]:
+        """获取各模型的指标摘要
+
+        :returns: ollama 模型 id -> 指标名称 -> count / mean / p50 / p95 / p99，
+            另有 requests 为各结果的生成次数
+        :rtype: dict[str, dict[str, dict[str, float | int]]]
+        """
+        stats: dict[str, dict[str, dict[str, float | int]]] = {}
+
+        with self._lock:
+            for (model, outcome), count in self._requests.items():
+                stats.setdefault(model, {}).setdefault("requests", {})[outcome] = count
+            for (name, model), histogram in self._histograms.items():
+                count: int = histogram.get_count()
+                stats.setdefault(model, {})[name] = {
+                    "count": count,
+                    "mean": histogram.get_sum() / count if count else 0.0,
+                    "p50": histogram.quantile(0.50),
+                    "p95": histogram.quantile(0.95),
+                    "p99": histogram.quantile(0.99),
+                }
+
+        return stats
+
+    def close(self) -> None:
+        """关闭结构化日志文件
+
+        :returns: 无
+        :rtype: None
+        """
+        with self._lock:
+            if self._log_file is not None:
+                self._log_file.close()
+                self._log_file = None
+                self._log = False
+
+
+def render_connections(backends: list[dict[str, Any]]) -> str:
+    """以 Prometheus 文本格式输出每个 Ollama 节点的 HTTP 连接统计
+
+    :param backends: 每个节点的状态，connections 为 ConnectionStats.get_stats 的结果
+    :type backends: list[dict[str, Any]]
+    :returns: Prometheus 文本格式的指标
+    :rtype: str
+    """
+    lines: list[str] = []
+    for name, kind, description, key in (
+        (
+            "backend_connections_in_use",
+            "gauge",
+            "HTTP connections to the backend in use",
+            "in_use",
+        ),
+        (
+            "backend_connections_opened_total",
+            "counter",
+            "HTTP connections opened to the backend",
+            "opened",
+        ),
+        (
+            "backend_connections_reused_total",
+            "counter",
+            "Requests that reused an idle HTTP connection to the backend",
+            "reused",
+        ),
+    ):
+        metric: str = f"ollama_chat_{name}"
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for backend in backends:
+            lines.append(
+                f'{metric}{{host="{backend["host"]}"}} {backend["connections"][key]}'
+            )
+
+    return "\n".join(lines) + "\n"
+
+
+def render_stats(
+    component: str,
+    stats: dict[str, int | float],
+    metrics: tuple[tuple[str, str, str], ...],
+) -> str:
+    """以 Prometheus 文本格式输出一个组件的统计信息
+
+    :param component: 组件名称，用作指标名称的前缀，例如 scheduler
+    :type component: str
+    :param stats: 组件的统计信息，例如 RequestScheduler.get_metrics 的结果
+    :type stats: dict[str, int | float]
+    :param metrics: 导出的指标，格式与 COMPONENT_METRICS 的值相同
+    :type metrics: tuple[tuple[str, str, str], ...]
+    :returns: Prometheus 文本格式的指标
+    :rtype: str
+    """
+    lines: list[str] = []
+    for key, kind, description in metrics:
+        metric: str = f"ollama_chat_{component}_{key}"
+        if kind == "counter":
+            metric += "_total"
+        elif kind == "window":
+            metric += "_seconds"
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} {'gauge' if kind == 'window' else kind}")
+        if kind == "window":
+            for stat in ("mean", "p50", "p95", "max"):
+                lines.append(f'{metric}{{stat="{stat}"}} {stats[f"{key}_{stat}"]:.6f}')
+        else:
+            lines.append(f"{metric} {stats[key]}")
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """本地指标端点
+
+    在独立的线程中提供 HTTP 服务：
+
+    - GET /metrics：Prometheus 文本格式的指标
+    - GET /metrics.json：各模型的指标摘要，以及各组件的统计信息
+    - GET /health：应用的健康状态，ready 为 False 时返回 503，供容器的就绪检查使用
+
+    提供 backends 时，/metrics 中还包括每个 Ollama 节点的 HTTP 连接统计；
+    提供 scheduler / residency / cache 时，/metrics 和 /metrics.json 中还包括请求调度器的等待时间和服务时间、
+    模型加载和卸载的耗时、回答缓存的命中和淘汰次数
+    """
+
+    def __init__(
+        self,
+        registry: MetricsRegistry,
+        host: str = "127.0.0.1",
+        port: int = 9464,
+        health: Callable[[], dict[str, Any]] | None = None,
+        backends: Callable[[], list[dict[str, Any]]] | None = None,
+        scheduler: Callable[[], dict[str, int | float]] | None = None,
+        residency: Callable[[], dict[str, int | float]] | None = None,
+        cache: Callable[[], dict[str, int | float]] | None = None,
+    ) -> None:
+        """
+        :param registry: 生成指标
+        :type registry: MetricsRegistry
+        :param host: 监听的地址，默认只允许本机访问
+        :type host: str
+        :param port: 监听的端口，为 0 时由系统分配
+        :type port: int
+        :param health: 返回健康状态的函数，结果中的 ready 决定状态码，为 None 时不提供 /health
+        :type health: Callable[[], dict[str, Any]] | None
+        :param backends: 返回每个节点状态的函数，例如 BackendPool.get_stats
+        :type backends: Callable[[], list[dict[str, Any]]] | None
+        :param scheduler: 返回请求调度器统计信息的函数，例如 RequestScheduler.get_metrics
+        :type scheduler: Callable[[], dict[str, int | float]] | None
+        :param residency: 返回模型驻留统计信息的函数，例如 ResidencyManager.get_stats
+        :type residency: Callable[[], dict[str, int | float]] | None
+        :param cache: 返回回答缓存统计信息的函数，例如 ResponseCache.get_stats
+        :type cache: Callable[[], dict[str, int | float]] | None
+        """
+        self._registry: MetricsRegistry = registry
+        self._health: Callable[[], dict[str, Any]] | None = health
+        self._backends: Callable[[], list[dict[str, Any]]] | None = backends
+        # 组件名称 -> 返回统计信息的函数，名称为 COMPONENT_METRICS 的键
+        self._components: dict[str, Callable[[], dict[str, int | float]]] = {
+            name: function
+            for name, function in (
+                ("scheduler", scheduler),
+                ("residency", residency),
+                ("cache", cache),
+            )
+            if function is not None
+        }
+        self._host: str = host
+        self._port: int = port
+        self._server: ThreadingHTTPServer | None = None
+        self._thread: threading.Thread | None = None
+
+    def get_port(self) -> int:
+        """获取监听的端口
+
+        :returns: 端口，启动后为实际监听的端口
+        :rtype: int
+        """
+        return self._port
+
+    def start(self) -> None:
+        """启动 HTTP 服务
+
+        :returns: 无
+        :rtype: None
+        :raises OSError: 如果端口已被占用
+        """
+        if self._server is not None:
+            return
+
+        registry: MetricsRegistry = self._registry
+        health: Callable[[], dict[str, Any]] | None = self._health
+        backends: Callable[[], list[dict[str, Any]]] | None = self._backends
+        components: dict[str, Callable[[], dict[str, int | float]]] = self._components
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                status: int = 200
+                if self.path == "/metrics":
+                    text: str = registry.render()
+                    if backends is not None:
+                        text += render_connections(backends())
+                    for name, function in components.items():
+                        text += render_stats(name, function(), COMPONENT_METRICS[name])
+                    body: bytes = text.encode("utf-8")
+                    content_type: str = "text/plain; version=0.0.4; charset=utf-8"
+                elif self.path == "/metrics.json":
+                    stats: dict[str, Any] = registry.get_stats()
+                    for name, function in components.items():
+                        stats[name] = function()
+                    body = json.dumps(stats).encode("utf-8")
+                    content_type = "application/json"
+                elif self.path == "/health" and health is not None:
+                    state: dict[str, Any] = health()
+                    status = 200 if state.get("ready") else 503
+                    body = json.dumps(state).encode("utf-8")
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                # 不输出访问日志
+                pass
+
+        self._server = ThreadingHTTPServer((self._host, self._port), Handler)
+        self._server.daemon_threads = True
+        self._port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """停止 HTTP 服务
+
+        :returns: 无
+        :rtype: None
+        """
+        if self._server is None:
+            return
+
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,207 @@
+import threading
+import time
+
+from typing import Any
+
+
+class ModelCatalogue:
+    """模型目录缓存
+
+    缓存 Ollama 已拉取的模型列表、每个模型的摘要（digest）和元数据（最大上下文长度、能力），
+    避免每个新会话创建 OllamaLLM 时都请求一次 /api/tags
+
+    - 缓存在 ttl 秒后过期，也可以调用 invalidate 立即失效，例如拉取了新模型之后
+    - 缓存过期时只有一个线程请求 Ollama，其他线程等待并复用结果，页面集中刷新时不会同时发出大量请求
+    - 刷新失败时，如果有过期的缓存，则继续使用过期的缓存
+
+    所有会话共享同一个实例，线程安全
+    """
+
+    def __init__(self, client: Any, ttl: float = 60.0) -> None:
+        """
+        :param client: 提供 list 和 show 方法的 Ollama 客户端，例如 ollama.Client 或 PoolClient
+        :type client: Any
+        :param ttl: 缓存的有效期（秒）
+        :type ttl: float
+        :raises ValueError: 如果 ttl 小于 0
+        """
+        if ttl < 0.0:
+            raise ValueError(f"[ERROR] The number of ttl={ttl} is negative")
+
+        self._client: Any = client
+        self._ttl: float = ttl
+        # 保护缓存内容
+        self._lock: threading.Lock = threading.Lock()
+        # 同一时刻只有一个线程请求 Ollama
+        self._refresh_lock: threading.Lock = threading.Lock()
+        # 模型列表及其过期时间
+        self._models: list[str] | None = None
+        self._models_expires: float = 0.0
+        # ollama 模型 id -> 模型的摘要，随模型列表一起刷新，重新拉取模型后摘要改变
+        self._digests: dict[str, str] = {}
+        # ollama 模型 id -> (元数据, 过期时间)
+        self._info: dict[str, tuple[dict[str, Any], float]] = {}
+        # 请求 Ollama 的次数
+        self._fetches: int = 0
+
+    def list_models(self) -> list[str]:
+        """获取已拉取的模型列表
+
+        :returns: ollama 模型 id 列表
+        :rtype: list[str]
+        :raises Exception: 如果请求 Ollama 失败且没有缓存
+        """
+        with self._lock:
+            if self._models is not None and time.monotonic() < self._models_expires:
+                return list(self._models)
+
+        with self._refresh_lock:
+            # 等待期间其他线程可能已经刷新
+            with self._lock:
+                if self._models is not None and time.monotonic() < self._models_expires:
+                    return list(self._models)
+                self._fetches += 1
+
+            try:
+                elems: list[Any] = [
+                    elem for elem in self._client.list().models if elem.model
+                ]
+            except Exception as e:
+                with self._lock:
+                    if self._models is None:
+                        raise
+                    print(
+                        f"[WARNING] Failed to refresh the model list, using cache: {e}"
+                    )
+                    return list(self._models)
+
+            models: list[str] = [elem.model for elem in elems]
+            with self._lock:
+                self._models = models
+                self._digests = {
+                    elem.model: elem.digest for elem in elems if elem.digest
+                }
+                self._models_expires = time.monotonic() + self._ttl
+
+            return list(models)
+
+    def has_model(self, model: str) -> bool:
+        """判断模型是否已拉取
+
+        :param model: ollama 模型 id
+        :type model: str
+        :returns: 模型是否在已拉取的模型列表中
+        :rtype: bool
+        """
+        return model in self.list_models()
+
+    def get_digest(self, model: str) -> str | None:
+        """获取模型的摘要，缓存过期时随模型列表一起刷新
+
+        :param model: ollama 模型 id
+        :type model: str
+        :returns: 模型的摘要，模型不在已拉取的模型列表中或 Ollama 没有返回摘要时为 None
+        :rtype: str | None
+        :raises Exception: 如果请求 Ollama 失败且没有缓存
+        """
+        self.list_models()
+
+        with self._lock:
+            return self._digests.get(model)
+
+    def get_info(self, model: str) -> dict[str, Any]:
+        """获取模型的元数据
+
+        :param model: ollama 模型 id
+        :type model: str
+        :returns: context_length 为模型支持的最大上下文长度，无法获取时为 None；
+            capabilities 为模型的能力列表，例如 completion、thinking
+        :rtype: dict[str, Any]
+        :raises Exception: 如果请求 Ollama 失败且没有缓存
+        """
+        with self._lock:
+            cached: tuple[dict[str, Any], float] | None = self._info.get(model)
+            if cached is not None and time.monotonic() < cached[1]:
+                return dict(cached[0])
+
+        with self._refresh_lock:
+            with self._lock:
+                cached = self._info.get(model)
+                if cached is not None and time.monotonic() < cached[1]:
+                    return dict(cached[0])
+                self._fetches += 1
+
+            try:
+                response = self._client.show(model)
+            except Exception as e:
+                if cached is None:
+                    raise
+                print(
+                    f"[WARNING] Failed to refresh model={model} info, using cache: {e}"
+                )
+                return dict(cached[0])
+
+            info: dict[str, Any] = {
+                "context_length": _find_context_length(response.modelinfo or {}),
+                "capabilities": list(response.capabilities or []),
+            }
+            with self._lock:
+                self._info[model] = (info, time.monotonic() + self._ttl)
+
+            return dict(info)
+
+    def get_context_length(self, model: str) -> int | None:
+        """获取模型支持的最大上下文长度
+
+        :param model: ollama 模型 id
+        :type model: str
+        :returns: 最大上下文长度，无法获取时为 None
+        :rtype: int | None
+        """
+        try:
+            return self.get_info(model)["context_length"]
+        except Exception as e:
+            print(f"[WARNING] Failed to get the context length of model={model}: {e}")
+            return None
+
+    def invalidate(self, model: str | None = None) -> None:
+        """使缓存立即失效
+
+        :param model: 为 None 时清除模型列表和所有元数据，否则只清除该模型的元数据
+        :type model: str | None
+        :returns: 无
+        :rtype: None
+        """
+        with self._lock:
+            if model is None:
+                self._models = None
+                self._digests = {}
+                self._info.clear()
+            else:
+                self._info.pop(model, None)
+
+    def get_stats(self) -> dict[str, int]:
+        """获取缓存的统计信息
+
+        :returns: fetches 为请求 Ollama 的次数，cached_models 为缓存了元数据的模型数
+        :rtype: dict[str, int]
+        """
+        with self._lock:
+            return {"fetches": self._fetches, "cached_models": len(self._info)}
+
+
+def _find_context_length(modelinfo: dict[str, Any]) -> int | None:
+    """从 /api/show 返回的 model_info 中找出最大上下文长度
+
+    键名为 "<架构>.context_length"，例如 qwen3.context_length
+
+    :param modelinfo: /api/show 返回的 model_info
+    :type modelinfo: dict[str, Any]
+    :returns: 最大上下文长度，没有该字段时为 None
+    :rtype: int | None
+    """
+    for key, value in modelinfo.items():
+        if key.endswith(".context_length") and isinstance(value, int):
+            return value
+
+    return None
@@ -1,34 +1,104 @@
+import asyncio
 import ollama
+import time
 
-from typing import Iterator
+from contextlib import aclosing, closing
+from typing import AsyncIterator, Iterator
+
+from model_catalogue import ModelCatalogue
+from response_cache import ResponseCache
 
 
 class OllamaLLM:
     """Ollama LLM 模块
 
     为方便使用，再次封装 ollama 库
+
+    同时提供同步的 chat 和基于 ollama.AsyncClient 的异步 achat，
+    异步版本在事件循环上流式生成，不会在生成期间占用一个工作线程
+
+    关闭 chat / achat 返回的生成器（包括提前退出、取消和超时）会同时关闭到 Ollama 的 HTTP 流，
+    Ollama 检测到连接断开后停止生成，释放推理槽位
+
+    温度为 0 且提供了回答缓存时，完整生成的回答写入缓存，相同的请求直接从缓存重放；
+    缓存的键包括模型的摘要，重新拉取同名模型后不会重放旧模型的回答
     """
 
-    def __init__(self, client: ollama.Client) -> None:
+    def __init__(
+        self,
+        client: ollama.Client,
+        async_client: ollama.AsyncClient | None = None,
+        idle_timeout: float | None = None,
+        total_timeout: float | None = None,
+        keep_alive: str | int | None = None,
+        catalogue: ModelCatalogue | None = None,
+        cache: ResponseCache | None = None,
+    ) -> None:
+        """
+        :param client: Ollama 同步客户端
+        :type client: ollama.Client
+        :param async_client: Ollama 异步客户端，为 None 时不能使用 achat
+        :type async_client: ollama.AsyncClient | None
+        :param idle_timeout: 两个分块之间（包括首个分块之前）最长等待时间（秒），为 None 时不限制
+        :type idle_timeout: float | None
+        :param total_timeout: 一次生成的最长时间（秒），为 None 时不限制
+        :type total_timeout: float | None
+        :param keep_alive: 随生成请求发送的 keep_alive，控制模型闲置多久后被 Ollama 卸载，为 None 时使用 Ollama 的默认值
+        :type keep_alive: str | int | None
+        :param catalogue: 模型目录缓存，为 None 时每次设置模型都请求 Ollama 的模型列表，且不检查模型的最大上下文长度
+        :type catalogue: ModelCatalogue | None
+        :param cache: 回答缓存，只用于温度为 0 的请求，为 None 时不缓存
+        :type cache: ResponseCache | None
+        :raises ValueError: 如果 idle_timeout 或 total_timeout 不大于 0
+        """
+        for name, timeout in (
+            ("idle_timeout", idle_timeout),
+            ("total_timeout", total_timeout),
+        ):
+            if timeout is not None and timeout <= 0.0:
+                raise ValueError(
+                    f"[ERROR] The number of {name}={timeout} is not positive"
+                )
+
         self._client: ollama.Client = client
+        self._async_client: ollama.AsyncClient | None = async_client
+        self._idle_timeout: float | None = idle_timeout
+        self._total_timeout: float | None = total_timeout
+        self._keep_alive: str | int | None = keep_alive
+        self._catalogue: ModelCatalogue | None = catalogue
+        self._cache: ResponseCache | None = cache
         self._model: str = ""
         self._num_ctx: int = 2048
         self._temperature: float = 0.7
+        # 最近一次生成的统计信息，来自流式响应的最后一个分块
+        self._last_stats: dict[str, int | str] = {}
+        # 最近一次生成是否从回答缓存重放
+        self._last_cached: bool = False
 
     def set_model(self, model: str) -> None:
         """设置模型
 
+        Ollama 暂时不可用、无法获取模型列表时不检查模型是否存在，生成时再报告错误
+
         :param model: ollama 模型 id
         :type model: str
         :returns: 无
         :rtype: None
-        :raises ValueError: 如果 model 不在 Ollama 服务端已拉取的模型列表中
+        :raises ValueError: 如果 model 为空，或不在 Ollama 服务端已拉取的模型列表中
         """
-        model_list: list[str | None] = [
-            elem.model for elem in self._client.list().models
-        ]
+        if not model.strip():
+            raise ValueError(f"[ERROR] model={model} not found")
 
-        if model not in model_list or not model.strip():
+        try:
+            if self._catalogue is not None:
+                model_list: list[str | None] = self._catalogue.list_models()
+            else:
+                model_list = [elem.model for elem in self._client.list().models]
+        except Exception as e:
+            print(f"[WARNING] Failed to verify model={model}: {e}")
+            model_list = [model]
+
+        if model not in model_list:
             raise ValueError(f"[ERROR] model={model} not found")
 
         self._model: str = model
@@ -40,12 +110,33 @@ class OllamaLLM:
         :type num_ctx: int
         :returns: 无
         :rtype: None
-        :raises ValueError: 如果 num_ctx 小于 2048
+        :raises ValueError: 如果 num_ctx 小于 2048 或大于模型支持的最大上下文长度
+        """
+        self.check_num_ctx(num_ctx)
+
+        self._num_ctx: int = num_ctx
+
+    def check_num_ctx(self, num_ctx: int) -> None:
+        """检查上下文窗口大小是否可用于当前模型
+
+        :param num_ctx: 上下文窗口大小
+        :type num_ctx: int
+        :returns: 无
+        :rtype: None
+        :raises ValueError: 如果 num_ctx 小于 2048 或大于模型支持的最大上下文长度
         """
         if num_ctx < 2048:
             raise ValueError(f"[ERROR] The number of num_ctx={num_ctx} is too small")
 
-        self._num_ctx: int = num_ctx
+        if self._catalogue is None or not self._model:
+            return
+
+        max_num_ctx: int | None = self._catalogue.get_context_length(self._model)
+        if max_num_ctx is not None and num_ctx > max_num_ctx:
+            raise ValueError(
+                f"[ERROR] The number of num_ctx={num_ctx} exceeds the context length "
+                + f"{max_num_ctx} of model={self._model}"
+            )
 
     def set_temperature(self, temperature: float) -> None:
         """设置温度
@@ -65,6 +156,14 @@ class OllamaLLM:
 
         self._temperature: float = temperature
 
+    def get_model(self) -> str:
+        """获取模型
+
+        :return: ollama 模型 id
+        :rtype: str
+        """
+        return self._model
+
     def get_num_ctx(self) -> int:
         """获取上下文窗口大小
 
@@ -73,8 +172,37 @@ class OllamaLLM:
         """
         return self._num_ctx
 
+    def get_temperature(self) -> float:
+        """获取温度
+
+        :return: 温度大小
+        :rtype: float
+        """
+        return self._temperature
+
+    def get_last_stats(self) -> dict[str, int | str]:
+        """获取最近一次生成的统计信息
+
+        包括 prompt_eval_count、eval_count 等计数和各阶段耗时（纳秒），生成未结束时为空字典
+
+        :return: 统计信息
+        :rtype: dict[str, int | str]
+        """
+        return self._last_stats.copy()
+
+    def is_last_cached(self) -> bool:
+        """获取最近一次生成是否从回答缓存重放
+
+        :return: 是否命中回答缓存
+        :rtype: bool
+        """
+        return self._last_cached
+
     def chat(
-        self, messages: list[dict[str, str]], think: bool
+        self,
+        messages: list[dict[str, str]],
+        think: bool,
+        temperature: float | None = None,
     ) -> Iterator[tuple[str, str]]:
         """生成 AI 响应流
 
@@ -82,21 +210,305 @@ class OllamaLLM:
 
         如果一个流不为空，则另一个流必为空
 
+        流结束后，可以通过 get_last_stats 获取 Ollama 返回的统计信息；
+        命中回答缓存时，思考过程和回答各作为一个分块重放，统计信息不包括各阶段耗时
+
+        分块之间的等待时间由 ollama.Client 的 HTTP 读超时限制，这里只检查 total_timeout
+
         :param messages: 消息列表
         :type messages: list[dict[str, str]]
         :param think: 思考模式开关
         :type think: bool
+        :param temperature: 本次请求的温度，为 None 时使用 set_temperature 设置的温度
+        :type temperature: float | None
         :return: (思考流, 内容流) 的迭代器
         :rtype: Iterator[tuple[str, str]]
+        :raises TimeoutError: 如果生成时间超过 total_timeout
         """
-        for part in self._client.chat(
-            model=self._model,
-            options={"num_ctx": self._num_ctx, "temperature": self._temperature},
-            messages=messages,
-            stream=True,
-            think=think,
-        ):
-            yield (
-                part["message"].get("thinking", ""),
-                part["message"].get("content", ""),
-            )
+        self._last_stats = {}
+        self._last_cached = False
+        started: float = time.monotonic()
+        kwargs: dict = self._chat_kwargs(messages, think, temperature)
+        key: str | None = self._cache_key(kwargs)
+
+        if key is not None and (cached := self._cache.get(key)) is not None:
+            thinking, content, self._last_stats = cached
+            self._last_cached = True
+            yield from _replay(thinking, content)
+            return
+
+        thinking_parts: list[str] = []
+        content_parts: list[str] = []
+
+        with closing(self._client.chat(**kwargs)) as stream:
+            for part in stream:
+                if part.get("done"):
+                    self._last_stats = _extract_stats(part)
+                elif (
+                    self._total_timeout is not None
+                    and time.monotonic() - started > self._total_timeout
+                ):
+                    error: TimeoutError = TimeoutError(
+                        f"[ERROR] No response from model={self._model} within "
+                        + f"total_timeout={self._total_timeout}"
+                    )
+                    # 抛进响应流，节点池据此把这次生成记为节点故障
+                    stream.throw(error)
+                    raise error
+
+                thinking_parts.append(part["message"].get("thinking") or "")
+                content_parts.append(part["message"].get("content") or "")
+
+                yield (thinking_parts[-1], content_parts[-1])
+
+        self._store(key, thinking_parts, content_parts)
+
+    async def achat(
+        self,
+        messages: list[dict[str, str]],
+        think: bool,
+        temperature: float | None = None,
+    ) -> AsyncIterator[tuple[str, str]]:
+        """异步生成 AI 响应流
+
+        与 chat 相同，但通过 ollama.AsyncClient 在事件循环上流式生成
+
+        超时只作用于等待 Ollama 的时间，不包括调用方处理每个分块的时间
+
+        :param messages: 消息列表
+        :type messages: list[dict[str, str]]
+        :param think: 思考模式开关
+        :type think: bool
+        :param temperature: 本次请求的温度，为 None 时使用 set_temperature 设置的温度，不修改实例的温度
+        :type temperature: float | None
+        :return: (思考流, 内容流) 的异步迭代器
+        :rtype: AsyncIterator[tuple[str, str]]
+        :raises ValueError: 如果创建实例时没有提供 async_client
+        :raises TimeoutError: 如果等待分块的时间超过 idle_timeout，或生成时间超过 total_timeout
+        """
+        if self._async_client is None:
+            raise ValueError("[ERROR] The async client of OllamaLLM is not set")
+
+        self._last_stats = {}
+        self._last_cached = False
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        started: float = loop.time()
+        kwargs: dict = self._chat_kwargs(messages, think, temperature)
+        # 模型目录缓存过期时获取模型的摘要会请求 Ollama，不阻塞事件循环
+        key: str | None = (
+            await asyncio.to_thread(self._cache_key, kwargs)
+            if self._cache is not None and kwargs["options"]["temperature"] == 0.0
+            else None
+        )
+
+        if key is not None and (cached := self._cache.get(key)) is not None:
+            thinking, content, self._last_stats = cached
+            self._last_cached = True
+            for chunk in _replay(thinking, content):
+                yield chunk
+            return
+
+        thinking_parts: list[str] = []
+        content_parts: list[str] = []
+
+        task: asyncio.Task = asyncio.current_task()
+        timeout: TimeoutError = TimeoutError(
+            f"[ERROR] No response from model={self._model} within "
+            + f"idle_timeout={self._idle_timeout} or "
+            + f"total_timeout={self._total_timeout}"
+        )
+
+        async with aclosing(await self._async_client.chat(**kwargs)) as stream:
+            while True:
+                # 不在超时的作用域内 yield，否则调用方的耗时也会计入超时
+                # 超时时以 timeout 为消息取消任务，节点池据此区分超时和调用方取消
+                deadline: float | None = self._deadline(started, loop.time())
+                handle: asyncio.TimerHandle | None = (
+                    None
+                    if deadline is None
+                    else loop.call_at(deadline, task.cancel, timeout)
+                )
+                try:
+                    part: ollama.ChatResponse = await anext(stream)
+                except StopAsyncIteration:
+                    break
+                except asyncio.CancelledError as e:
+                    if not e.args or e.args[0] is not timeout or task.uncancel():
+                        raise
+                    raise timeout from None
+                finally:
+                    if handle is not None:
+                        handle.cancel()
+
+                if part.get("done"):
+                    self._last_stats = _extract_stats(part)
+
+                thinking_parts.append(part["message"].get("thinking") or "")
+                content_parts.append(part["message"].get("content") or "")
+
+                yield (thinking_parts[-1], content_parts[-1])
+
+        self._store(key, thinking_parts, content_parts)
+
+    def _deadline(self, started: float, now: float) -> float | None:
+        """计算等待下一个分块的截止时间
+
+        :param started: 开始生成的时间
+        :type started: float
+        :param now: 当前时间
+        :type now: float
+        :return: 截止时间，与 started 和 now 使用同一个时钟；不限制时为 None
+        :rtype: float | None
+        """
+        deadlines: list[float] = []
+        if self._idle_timeout is not None:
+            deadlines.append(now + self._idle_timeout)
+        if self._total_timeout is not None:
+            deadlines.append(started + self._total_timeout)
+
+        return min(deadlines, default=None)
+
+    def _cache_key(self, kwargs: dict) -> str | None:
+        """计算请求在回答缓存中的键
+
+        :param kwargs: chat 请求的参数
+        :type kwargs: dict
+        :return: 请求的规范化哈希，没有回答缓存、请求的温度不为 0 或无法获取模型的摘要时为 None
+        :rtype: str | None
+        """
+        if self._cache is None or kwargs["options"]["temperature"] != 0.0:
+            return None
+
+        # 同名模型重新拉取后摘要改变，磁盘上的旧回答不再命中
+        digest: str | None = None
+        if self._catalogue is not None:
+            try:
+                digest = self._catalogue.get_digest(kwargs["model"])
+            except Exception as e:
+                print(
+                    f"[WARNING] Skipped the response cache for model={kwargs['model']}: {e}"
+                )
+                return None
+
+        # keep_alive 和 stream 不影响回答
+        return self._cache.make_key(
+            {
+                "model": kwargs["model"],
+                "digest": digest,
+                "options": kwargs["options"],
+                "messages": kwargs["messages"],
+                "think": kwargs["think"],
+            }
+        )
+
+    def _store(
+        self, key: str | None, thinking_parts: list[str], content_parts: list[str]
+    ) -> None:
+        """将完整生成的回答写入回答缓存
+
+        因长度上限等原因截断的回答不缓存
+
+        :param key: 请求在回答缓存中的键，为 None 时不缓存
+        :type key: str | None
+        :param thinking_parts: 思考过程的分块
+        :type thinking_parts: list[str]
+        :param content_parts: 回答的分块
+        :type content_parts: list[str]
+        :return: 无
+        :rtype: None
+        """
+        if key is None or self._last_stats.get("done_reason") != "stop":
+            return
+
+        self._cache.put(
+            key,
+            "".join(thinking_parts),
+            "".join(content_parts),
+            {
+                field: value
+                for field, value in self._last_stats.items()
+                if field in CACHED_STATS_FIELDS
+            },
+        )
+
+    def _chat_kwargs(
+        self,
+        messages: list[dict[str, str]],
+        think: bool,
+        temperature: float | None = None,
+    ) -> dict:
+        """构建 chat 请求的参数
+
+        :param messages: 消息列表
+        :type messages: list[dict[str, str]]
+        :param think: 思考模式开关
+        :type think: bool
+        :param temperature: 本次请求的温度，为 None 时使用实例的温度
+        :type temperature: float | None
+        :return: ollama.Client.chat / ollama.AsyncClient.chat 的关键字参数
+        :rtype: dict
+        """
+        kwargs: dict = {
+            "model": self._model,
+            "options": {
+                "num_ctx": self._num_ctx,
+                "temperature": (
+                    self._temperature if temperature is None else temperature
+                ),
+            },
+            "messages": messages,
+            "stream": True,
+            "think": think,
+        }
+        if self._keep_alive is not None:
+            kwargs["keep_alive"] = self._keep_alive
+
+        return kwargs
+
+
+# 流式响应最后一个分块中的统计字段
+STATS_FIELDS: tuple[str, ...] = (
+    "done_reason",
+    "total_duration",
+    "load_duration",
+    "prompt_eval_count",
+    "prompt_eval_duration",
+    "eval_count",
+    "eval_duration",
+)
+
+# 回答缓存中保存的统计字段，各阶段耗时只对实际生成的请求有意义
+CACHED_STATS_FIELDS: tuple[str, ...] = (
+    "done_reason",
+    "prompt_eval_count",
+    "eval_count",
+)
+
+
+def _replay(thinking: str, content: str) -> Iterator[tuple[str, str]]:
+    """将缓存的回答重放为 AI 响应流
+
+    :param thinking: 思考过程
+    :type thinking: str
+    :param content: 回答
+    :type content: str
+    :return: (思考流, 内容流) 的迭代器
+    :rtype: Iterator[tuple[str, str]]
+    """
+    if thinking:
+        yield (thinking, "")
+    if content:
+        yield ("", content)
+
+
+def _extract_stats(part: ollama.ChatResponse) -> dict[str, int | str]:
+    """从流式响应的最后一个分块提取统计信息
+
+    :param part: 流式响应的最后一个分块
+    :type part: ollama.ChatResponse
+    :return: 统计信息，省略 Ollama 未返回的字段
+    :rtype: dict[str, int | str]
+    """
+    return {
+        field: part.get(field) for field in STATS_FIELDS if part.get(field) is not None
+    }
@@ -0,0 +1,419 @@
+import asyncio
+import json
+import threading
+import uuid
+
+from collections import OrderedDict
+from typing import Any, Callable
+
+from memory import Memory
+from ollama_llm import OllamaLLM
+from prompt_builder import PromptBuilder
+
+
+class ChatRequest:
+    """解析后的 OpenAI 兼容 chat completions 请求"""
+
+    def __init__(
+        self,
+        model: str,
+        think: bool,
+        system: str | None,
+        messages: list[dict[str, str]],
+        stream: bool,
+        temperature: float | None,
+        session_id: str | None,
+        include_usage: bool = False,
+    ) -> None:
+        """
+        :param model: ollama 模型 id
+        :type model: str
+        :param think: 是否使用思考模型
+        :type think: bool
+        :param system: 请求中的系统消息，为 None 时使用默认系统提示词
+        :type system: str | None
+        :param messages: 用户消息和 AI 消息交替的消息列表，最后一条为用户消息
+        :type messages: list[dict[str, str]]
+        :param stream: 是否以 SSE 流式返回
+        :type stream: bool
+        :param temperature: 温度，为 None 时使用配置的温度
+        :type temperature: float | None
+        :param session_id: 服务端会话 id，为 None 时为无状态请求
+        :type session_id: str | None
+        :param include_usage: 流式返回时是否在最后附加 token 用量
+        :type include_usage: bool
+        """
+        self.model: str = model
+        self.think: bool = think
+        self.system: str | None = system
+        self.messages: list[dict[str, str]] = messages
+        self.stream: bool = stream
+        self.temperature: float | None = temperature
+        self.session_id: str | None = session_id
+        self.include_usage: bool = include_usage
+
+
+def parse_chat_request(
+    body: Any, instruct_model: str, thinking_model: str, session_id: str | None
+) -> ChatRequest:
+    """解析并校验 chat completions 请求体
+
+    model 为思考模型时使用思考模式，否则使用非思考模型；请求体中的 session_id 优先于请求头
+
+    :param body: JSON 请求体
+    :type body: Any
+    :param instruct_model: 配置的非思考模型
+    :type instruct_model: str
+    :param thinking_model: 配置的思考模型
+    :type thinking_model: str
+    :param session_id: 请求头 X-Session-Id 的值
+    :type session_id: str | None
+    :returns: 解析后的请求
+    :rtype: ChatRequest
+    :raises ValueError: 如果请求体不合法
+    """
+    if not isinstance(body, dict):
+        raise ValueError("[ERROR] The request body is not a JSON object")
+
+    model: Any = body.get("model") or instruct_model
+    if model not in (instruct_model, thinking_model):
+        raise ValueError(
+            f"[ERROR] model={model} is not one of {instruct_model}, {thinking_model}"
+        )
+
+    raw_messages: Any = body.get("messages")
+    if not isinstance(raw_messages, list) or not raw_messages:
+        raise ValueError("[ERROR] messages must be a non-empty list")
+
+    system_parts: list[str] = []
+    messages: list[dict[str, str]] = []
+    for message in raw_messages:
+        if not isinstance(message, dict) or not isinstance(message.get("content"), str):
+            raise ValueError("[ERROR] Each message must have a string content")
+        if not message["content"].strip():
+            raise ValueError("[ERROR] The content of each message must not be empty")
+        role: Any = message.get("role")
+        if role in ("system", "developer"):
+            system_parts.append(message["content"])
+            continue
+        # 用户消息和 AI 消息交替出现，从用户消息开始
+        expected: str = "user" if len(messages) % 2 == 0 else "assistant"
+        if role != expected:
+            raise ValueError(
+                f"[ERROR] The role of message {len(messages)} is {role}, expected {expected}"
+            )
+        messages.append({"role": role, "content": message["content"]})
+
+    if not messages or messages[-1]["role"] != "user":
+        raise ValueError("[ERROR] The last message must be a user message")
+
+    temperature: Any = body.get("temperature")
+    if temperature is not None and (
+        not isinstance(temperature, (int, float)) or not 0.0 <= temperature <= 1.0
+    ):
+        raise ValueError(
+            f"[ERROR] The number of temperature={temperature} is not between 0.0 and 1.0"
+        )
+
+    session_id = body.get("session_id") or session_id
+    if session_id is not None and not isinstance(session_id, str):
+        raise ValueError("[ERROR] session_id must be a string")
+
+    stream_options: Any = body.get("stream_options")
+    include_usage: bool = isinstance(stream_options, dict) and bool(
+        stream_options.get("include_usage")
+    )
+
+    return ChatRequest(
+        model,
+        model == thinking_model,
+        "\n\n".join(system_parts) if system_parts else None,
+        messages,
+        bool(body.get("stream", False)),
+        float(temperature) if temperature is not None else None,
+        session_id,
+        include_usage,
+    )
+
+
+def format_chunk(
+    completion_id: str,
+    created: int,
+    model: str,
+    delta: dict[str, str],
+    finish_reason: str | None = None,
+) -> str:
+    """构建一个 SSE 事件
+
+    :param completion_id: 本次生成的 id
+    :type completion_id: str
+    :param created: 本次生成开始的时间（Unix 时间戳）
+    :type created: int
+    :param model: ollama 模型 id
+    :type model: str
+    :param delta: 增量内容，思考过程放在 reasoning_content 中
+    :type delta: dict[str, str]
+    :param finish_reason: 结束原因，生成未结束时为 None
+    :type finish_reason: str | None
+    :returns: data: 开头、空行结尾的 SSE 事件
+    :rtype: str
+    """
+    chunk: dict[str, Any] = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+    return format_event(chunk)
+
+
+def format_usage_chunk(
+    completion_id: str, created: int, model: str, stats: dict[str, int | str]
+) -> str:
+    """构建流式返回最后附加的 token 用量事件
+
+    :param completion_id: 本次生成的 id
+    :type completion_id: str
+    :param created: 本次生成开始的时间（Unix 时间戳）
+    :type created: int
+    :param model: ollama 模型 id
+    :type model: str
+    :param stats: OllamaLLM.get_last_stats 返回的统计信息
+    :type stats: dict[str, int | str]
+    :returns: SSE 事件
+    :rtype: str
+    """
+    return format_event(
+        {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [],
+            "usage": format_usage(stats),
+        }
+    )
+
+
+def format_event(data: dict[str, Any] | str) -> str:
+    """构建 SSE 事件
+
+    :param data: 事件的 JSON 对象，或 [DONE] 等原样发送的字符串
+    :type data: dict[str, Any] | str
+    :returns: data: 开头、空行结尾的 SSE 事件
+    :rtype: str
+    """
+    if not isinstance(data, str):
+        data = json.dumps(data, ensure_ascii=False)
+
+    return f"data: {data}\n\n"
+
+
+def format_completion(
+    completion_id: str,
+    created: int,
+    model: str,
+    thinking: str,
+    content: str,
+    finish_reason: str,
+    stats: dict[str, int | str],
+) -> dict[str, Any]:
+    """构建非流式响应
+
+    :param completion_id: 本次生成的 id
+    :type completion_id: str
+    :param created: 本次生成开始的时间（Unix 时间戳）
+    :type created: int
+    :param model: ollama 模型 id
+    :type model: str
+    :param thinking: 思考过程
+    :type thinking: str
+    :param content: 回答
+    :type content: str
+    :param finish_reason: 结束原因
+    :type finish_reason: str
+    :param stats: OllamaLLM.get_last_stats 返回的统计信息
+    :type stats: dict[str, int | str]
+    :returns: chat.completion 对象
+    :rtype: dict[str, Any]
+    """
+    message: dict[str, str] = {"role": "assistant", "content": content}
+    if thinking:
+        message["reasoning_content"] = thinking
+
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+        "usage": format_usage(stats),
+    }
+
+
+def format_usage(stats: dict[str, int | str]) -> dict[str, int]:
+    """用 Ollama 的统计信息构建 token 用量
+
+    :param stats: OllamaLLM.get_last_stats 返回的统计信息
+    :type stats: dict[str, int | str]
+    :returns: prompt_tokens / completion_tokens / total_tokens
+    :rtype: dict[str, int]
+    """
+    prompt_tokens: int | str = stats.get("prompt_eval_count", 0)
+    completion_tokens: int | str = stats.get("eval_count", 0)
+    prompt_tokens = prompt_tokens if isinstance(prompt_tokens, int) else 0
+    completion_tokens = completion_tokens if isinstance(completion_tokens, int) else 0
+
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def format_error(message: str, error_type: str) -> dict[str, Any]:
+    """构建错误响应
+
+    :param message: 错误信息
+    :type message: str
+    :param error_type: 错误类型，例如 invalid_request_error
+    :type error_type: str
+    :returns: OpenAI 格式的错误对象
+    :rtype: dict[str, Any]
+    """
+    return {"error": {"message": message, "type": error_type}}
+
+
+def new_completion_id() -> str:
+    """生成本次生成的 id
+
+    :returns: chatcmpl- 开头的 id
+    :rtype: str
+    """
+    return f"chatcmpl-{uuid.uuid4().hex}"
+
+
+def finish_reason(stats: dict[str, int | str]) -> str:
+    """将 Ollama 的 done_reason 转换为 OpenAI 的 finish_reason
+
+    :param stats: OllamaLLM.get_last_stats 返回的统计信息
+    :type stats: dict[str, int | str]
+    :returns: length 或 stop
+    :rtype: str
+    """
+    return "length" if stats.get("done_reason") == "length" else "stop"
+
+
+class ApiSession:
+    """API 的服务端会话"""
+
+    def __init__(
+        self,
+        memory: Memory,
+        prompt_builder: PromptBuilder,
+        instruct_ollama_llm: OllamaLLM,
+        thinking_ollama_llm: OllamaLLM,
+    ) -> None:
+        """
+        :param memory: 记忆模块
+        :type memory: Memory
+        :param prompt_builder: 提示词构建器
+        :type prompt_builder: PromptBuilder
+        :param instruct_ollama_llm: 非思考模型
+        :type instruct_ollama_llm: OllamaLLM
+        :param thinking_ollama_llm: 思考模型
+        :type thinking_ollama_llm: OllamaLLM
+        """
+        self.memory: Memory = memory
+        self.prompt_builder: PromptBuilder = prompt_builder
+        self.instruct_ollama_llm: OllamaLLM = instruct_ollama_llm
+        self.thinking_ollama_llm: OllamaLLM = thinking_ollama_llm
+        # 同一会话的请求依次执行，保证用户消息和 AI 消息交替出现
+        self.lock: asyncio.Lock = asyncio.Lock()
+
+
+class ApiSessionStore:
+    """API 的服务端会话
+
+    会话 id 由调用方指定，第一次使用时创建；最多保留 max_sessions 个会话，超出时丢弃最近最少使用的会话。
+    会话的消息列表和网页的会话一样由会话管理器换出到磁盘
+
+    线程安全
+    """
+
+    def __init__(
+        self, create_session: Callable[[], ApiSession], max_sessions: int = 1024
+    ) -> None:
+        """
+        :param create_session: 创建新会话的工厂函数
+        :type create_session: Callable[[], ApiSession]
+        :param max_sessions: 最多保留的会话数
+        :type max_sessions: int
+        :raises ValueError: 如果 max_sessions 不大于 0
+        """
+        if max_sessions <= 0:
+            raise ValueError(
+                f"[ERROR] The number of max_sessions={max_sessions} is not positive"
+            )
+
+        self._create_session: Callable[[], ApiSession] = create_session
+        self._max_sessions: int = max_sessions
+        self._lock: threading.Lock = threading.Lock()
+        # 会话 id -> 会话，最近使用的会话在末尾
+        self._sessions: OrderedDict[str, ApiSession] = OrderedDict()
+        self._created: int = 0
+        self._dropped: int = 0
+
+    def get(self, session_id: str) -> ApiSession:
+        """获取会话，不存在时创建
+
+        :param session_id: 会话 id
+        :type session_id: str
+        :returns: 会话
+        :rtype: ApiSession
+        """
+        with self._lock:
+            session: ApiSession | None = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                return session
+
+        # 创建会话需要查询模型目录，不持有锁
+        created: ApiSession = self._create_session()
+
+        with self._lock:
+            session = self._sessions.setdefault(session_id, created)
+            self._sessions.move_to_end(session_id)
+            if session is created:
+                self._created += 1
+            while len(self._sessions) > self._max_sessions:
+                self._sessions.popitem(last=False)
+                self._dropped += 1
+
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        """删除会话
+
+        :param session_id: 会话 id
+        :type session_id: str
+        :returns: 会话是否存在
+        :rtype: bool
+        """
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def get_stats(self) -> dict[str, int]:
+        """获取会话的统计信息
+
+        :returns: sessions 为当前的会话数，created / dropped 为累计创建 / 因超出上限丢弃的会话数
+        :rtype: dict[str, int]
+        """
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "created": self._created,
+                "dropped": self._dropped,
+            }
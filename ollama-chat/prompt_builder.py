@@ -0,0 +1,140 @@
+import datetime
+
+from collections.abc import Sequence
+
+# 时间上下文的粒度 -> 时间格式，粒度越粗，时间上下文变化越少
+TIME_FORMATS: dict[str, str] = {
+    "day": "%Y-%m-%d",
+    "hour": "%Y-%m-%d %H:00",
+    "minute": "%Y-%m-%d %H:%M",
+    "second": "%Y-%m-%d %H:%M:%S",
+}
+
+
+def get_time_context(granularity: str) -> str:
+    """获取当前时间的上下文信息
+
+    :param granularity: 时间粒度，取值为 TIME_FORMATS 的键
+    :type granularity: str
+    :returns: 当前时间的上下文信息字符串，包括按粒度截断的日期时间、星期和周数
+    :rtype: str
+    """
+    now = datetime.datetime.now()
+
+    return (
+        f"# Time Context\n\n"
+        + f"Current date and time: {now.strftime(TIME_FORMATS[granularity])} "
+        + f"({now.strftime('%A')}, Week {now.strftime('%U')})."
+    )
+
+
+class PromptBuilder:
+    """提示词构建器
+
+    Ollama 只能复用与上一次请求前缀完全相同的部分的 KV 缓存，因此构建的消息列表分为两部分：
+
+    - 稳定前缀：系统消息 + 按顺序排列的历史消息，只在对话推进时向后追加
+    - 易变尾部：时间等易变的上下文，作为一条系统消息放在最后
+
+    每次构建后记录与上一次构建相比复用的前缀长度
+    """
+
+    def __init__(self, time_granularity: str | None = "hour") -> None:
+        """
+        :param time_granularity: 时间上下文的粒度，为 None 时不注入时间上下文
+        :type time_granularity: str | None
+        :raises ValueError: 如果 time_granularity 不是 TIME_FORMATS 的键
+        """
+        if time_granularity is not None and time_granularity not in TIME_FORMATS:
+            raise ValueError(
+                f"[ERROR] The time_granularity={time_granularity} is not one of "
+                + f"{', '.join(TIME_FORMATS)}"
+            )
+
+        self._time_granularity: str | None = time_granularity
+        # 上一次构建的消息列表
+        self._previous: list[dict[str, str]] = []
+        # 上一次构建的前缀复用情况
+        self._last_reuse: dict[str, int] = {}
+
+    def build(
+        self,
+        system_message: dict[str, str],
+        context: Sequence[dict[str, str]],
+        summary_message: dict[str, str] | None = None,
+        retrieved_message: dict[str, str] | None = None,
+    ) -> list[dict[str, str]]:
+        """构建发送给模型的消息列表
+
+        :param system_message: 系统消息
+        :type system_message: dict[str, str]
+        :param context: 上下文窗口内的消息列表，最后一条为最新用户消息
+        :type context: Sequence[dict[str, str]]
+        :param summary_message: 移出上下文窗口的消息的摘要，为 None 时没有摘要
+        :type summary_message: dict[str, str] | None
+        :param retrieved_message: 检索到的早期对话，为 None 时没有检索结果
+        :type retrieved_message: dict[str, str] | None
+        :returns: 系统消息 + 摘要 + 上下文（检索结果在最新用户消息之前）+ 易变上下文
+        :rtype: list[dict[str, str]]
+        """
+        messages: list[dict[str, str]] = [system_message]
+        # 摘要只在窗口滑动时变化，放在历史消息之前
+        if summary_message is not None:
+            messages.append(summary_message)
+        messages.extend(context)
+        # 检索结果每轮都可能变化，放在最新用户消息之前，不影响历史消息前缀的复用
+        if retrieved_message is not None:
+            messages.insert(len(messages) - 1, retrieved_message)
+
+        if self._time_granularity is not None:
+            messages.append(
+                {
+                    "role": "system",
+                    "content": get_time_context(self._time_granularity),
+                }
+            )
+
+        self._last_reuse = _measure_reuse(self._previous, messages)
+        self._previous = messages
+
+        return messages
+
+    def get_last_reuse(self) -> dict[str, int]:
+        """获取上一次构建的前缀复用情况
+
+        :returns: reused_messages / total_messages 为复用的消息数 / 总消息数，
+            reused_chars / total_chars 为复用的字符数 / 总字符数
+        :rtype: dict[str, int]
+        """
+        return self._last_reuse.copy()
+
+
+def _measure_reuse(
+    previous: list[dict[str, str]], current: list[dict[str, str]]
+) -> dict[str, int]:
+    """统计两次构建的消息列表的公共前缀
+
+    :param previous: 上一次构建的消息列表
+    :type previous: list[dict[str, str]]
+    :param current: 本次构建的消息列表
+    :type current: list[dict[str, str]]
+    :returns: 前缀复用情况
+    :rtype: dict[str, int]
+    """
+    reused_messages: int = 0
+    reused_chars: int = 0
+
+    for old, new in zip(previous, current):
+        # 内容通常是同一个字符串对象，比较时直接短路
+        if old["role"] != new["role"] or old["content"] != new["content"]:
+            break
+
+        reused_messages += 1
+        reused_chars += len(new["content"])
+
+    return {
+        "reused_messages": reused_messages,
+        "total_messages": len(current),
+        "reused_chars": reused_chars,
+        "total_chars": sum(len(message["content"]) for message in current),
+    }
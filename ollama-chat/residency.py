@@ -0,0 +1,297 @@
+import threading
+import time
+
+from collections import deque
+from typing import Any
+
+from backend_pool import Backend, BackendPool
+from scheduler import percentile
+
+
+class ResidencyManager:
+    """模型驻留管理器
+
+    Ollama 只在收到请求时加载模型，闲置超过 keep_alive 后卸载，加载一次通常需要数秒。
+    管理器负责让配置的模型（非思考模型和思考模型）常驻在每个节点上：
+
+    - 预热：节点池的主动检查发现健康的节点后，在每个健康节点上加载所有配置的模型，不阻塞应用启动
+    - 保持：加载时带上 keep_alive，生成请求也应带上相同的 keep_alive，避免被 Ollama 按默认的 5 分钟卸载
+    - 补位：pin 为 True 时定时重新加载被卸载的模型，例如切换思考模式时另一个模型因显存不足被换出；
+      已加载的模型由节点池的主动检查（/api/ps）刷新，管理器不再单独请求节点
+    - 释放：unload_on_stop 为 True 时，停止时在每个节点上卸载已加载的配置模型，不等 keep_alive 到期
+
+    加载时带上与生成请求相同的运行参数（例如 num_ctx），否则 Ollama 会在第一次生成时按新的参数重新加载模型
+
+    同时记录每次加载和卸载的耗时，以及生成时遇到的冷加载次数
+
+    所有会话共享同一个实例，线程安全
+    """
+
+    def __init__(
+        self,
+        pool: BackendPool,
+        models: list[str],
+        keep_alive: str | int = "30m",
+        options: dict[str, Any] | None = None,
+        preload: bool = True,
+        pin: bool = True,
+        unload_on_stop: bool = False,
+        check_interval: float = 30.0,
+        cold_load_threshold: float = 0.5,
+        window: int = 1000,
+    ) -> None:
+        """
+        :param pool: Ollama 节点池
+        :type pool: BackendPool
+        :param models: 需要常驻的 ollama 模型 id
+        :type models: list[str]
+        :param keep_alive: 模型闲置多久后卸载，格式与 Ollama 相同，例如 "30m"，-1 表示永不卸载
+        :type keep_alive: str | int
+        :param options: 生成请求使用的模型参数，例如 {"num_ctx": 8192}，为 None 时使用 Ollama 的默认值
+        :type options: dict[str, Any] | None
+        :param preload: 启动后台线程时是否先预热
+        :type preload: bool
+        :param pin: 是否重新加载被卸载的模型
+        :type pin: bool
+        :param unload_on_stop: 停止时是否卸载已加载的配置模型，多个应用共用 Ollama 节点时不应开启
+        :type unload_on_stop: bool
+        :param check_interval: 检查已加载模型的时间间隔（秒）
+        :type check_interval: float
+        :param cold_load_threshold: 生成时 load_duration 超过多少秒视为冷加载
+        :type cold_load_threshold: float
+        :param window: 计算耗时分位数时保留的最近样本数
+        :type window: int
+        :raises ValueError: 如果 check_interval 不大于 0
+        """
+        if check_interval <= 0.0:
+            raise ValueError(
+                f"[ERROR] The number of check_interval={check_interval} is not positive"
+            )
+
+        self._pool: BackendPool = pool
+        # 去重并保持顺序
+        self._models: list[str] = list(dict.fromkeys(models))
+        self._keep_alive: str | int = keep_alive
+        self._options: dict[str, Any] | None = options
+        self._preload: bool = preload
+        self._pin: bool = pin
+        self._unload_on_stop: bool = unload_on_stop
+        self._check_interval: float = check_interval
+        self._cold_load_threshold: float = cold_load_threshold
+        self._lock: threading.Lock = threading.Lock()
+        # 最近若干次加载、卸载的耗时（秒）
+        self._load_times: deque[float] = deque(maxlen=window)
+        self._unload_times: deque[float] = deque(maxlen=window)
+        # 计数
+        self._loads: int = 0
+        self._unloads: int = 0
+        self._failures: int = 0
+        self._cold_loads: int = 0
+        self._thread: threading.Thread | None = None
+        self._stopped: threading.Event = threading.Event()
+
+    def get_keep_alive(self) -> str | int:
+        """获取 keep_alive
+
+        :returns: 生成请求应带上的 keep_alive
+        :rtype: str | int
+        """
+        return self._keep_alive
+
+    def load(self, backend: Backend, model: str) -> bool:
+        """在节点上加载模型
+
+        发送不带提示词的 /api/generate 请求，Ollama 只加载模型、不生成；
+        带上生成请求的模型参数，使 Ollama 按相同的上下文窗口加载
+
+        :param backend: 节点
+        :type backend: Backend
+        :param model: ollama 模型 id
+        :type model: str
+        :returns: 是否加载成功
+        :rtype: bool
+        """
+        started: float = time.perf_counter()
+        try:
+            backend.client.generate(
+                model=model, keep_alive=self._keep_alive, options=self._options
+            )
+        except Exception as e:
+            print(f"[WARNING] Failed to load model={model} on {backend.host}: {e}")
+            with self._lock:
+                self._failures += 1
+            return False
+
+        with self._lock:
+            self._loads += 1
+            self._load_times.append(time.perf_counter() - started)
+        self._pool.set_resident(backend, model, True)
+
+        return True
+
+    def unload(self, backend: Backend, model: str) -> bool:
+        """在节点上卸载模型
+
+        :param backend: 节点
+        :type backend: Backend
+        :param model: ollama 模型 id
+        :type model: str
+        :returns: 是否卸载成功
+        :rtype: bool
+        """
+        started: float = time.perf_counter()
+        try:
+            backend.client.generate(model=model, keep_alive=0)
+        except Exception as e:
+            print(f"[WARNING] Failed to unload model={model} on {backend.host}: {e}")
+            with self._lock:
+                self._failures += 1
+            return False
+
+        with self._lock:
+            self._unloads += 1
+            self._unload_times.append(time.perf_counter() - started)
+        self._pool.set_resident(backend, model, False)
+
+        return True
+
+    def warm(self) -> int:
+        """在每个健康节点上加载尚未加载的配置模型
+
+        :returns: 本次加载的模型数
+        :rtype: int
+        """
+        loaded: int = 0
+
+        for backend in self._pool.get_backends():
+            if not backend.healthy:
+                continue
+            for model in self._models:
+                # 节点没有拉取该模型时跳过
+                if backend.models is not None and model not in backend.models:
+                    continue
+                if model in backend.resident:
+                    continue
+                loaded += self.load(backend, model)
+
+        return loaded
+
+    def unload_all(self) -> int:
+        """在每个节点上卸载已加载的配置模型
+
+        :returns: 本次卸载的模型数
+        :rtype: int
+        """
+        unloaded: int = 0
+
+        for backend in self._pool.get_backends():
+            if not backend.healthy:
+                continue
+            for model in self._models:
+                if model in backend.resident:
+                    unloaded += self.unload(backend, model)
+
+        return unloaded
+
+    def observe(self, stats: dict[str, int | str]) -> bool:
+        """记录一次生成的统计信息，判断是否遇到了冷加载
+
+        :param stats: OllamaLLM.get_last_stats 返回的统计信息
+        :type stats: dict[str, int | str]
+        :returns: 是否为冷加载
+        :rtype: bool
+        """
+        load_duration: int | str | None = stats.get("load_duration")
+        if not isinstance(load_duration, int):
+            return False
+
+        cold: bool = load_duration / 1e9 > self._cold_load_threshold
+        if cold:
+            with self._lock:
+                self._cold_loads += 1
+
+        return cold
+
+    def get_resident(self) -> dict[str, list[str]]:
+        """获取配置的模型在各节点上的驻留情况
+
+        :returns: ollama 模型 id -> 已加载该模型的节点地址
+        :rtype: dict[str, list[str]]
+        """
+        resident: dict[str, list[str]] = {model: [] for model in self._models}
+        for stats in self._pool.get_stats():
+            for model in self._models:
+                if model in stats["resident"]:
+                    resident[model].append(stats["host"])
+
+        return resident
+
+    def get_stats(self) -> dict[str, int | float]:
+        """获取加载和卸载的统计信息
+
+        :returns: loads / unloads / failures 为累计加载 / 卸载 / 失败次数，cold_loads 为生成时遇到的冷加载次数；
+            load_* 和 unload_* 为最近加载和卸载耗时（秒）的平均值、p50、p95 和最大值
+        :rtype: dict[str, int | float]
+        """
+        with self._lock:
+            stats: dict[str, int | float] = {
+                "loads": self._loads,
+                "unloads": self._unloads,
+                "failures": self._failures,
+                "cold_loads": self._cold_loads,
+            }
+            samples: list[tuple[str, list[float]]] = [
+                ("load", sorted(self._load_times)),
+                ("unload", sorted(self._unload_times)),
+            ]
+
+        for name, ordered in samples:
+            stats[f"{name}_mean"] = sum(ordered) / len(ordered) if ordered else 0.0
+            stats[f"{name}_p50"] = percentile(ordered, 0.50)
+            stats[f"{name}_p95"] = percentile(ordered, 0.95)
+            stats[f"{name}_max"] = ordered[-1] if ordered else 0.0
+
+        return stats
+
+    def start(self) -> None:
+        """启动后台线程：preload 为 True 时先预热，之后定时检查
+
+        :returns: 无
+        :rtype: None
+        """
+        if self._thread is not None:
+            return
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """停止后台线程，unload_on_stop 为 True 时卸载已加载的配置模型
+
+        :returns: 无
+        :rtype: None
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        if self._unload_on_stop:
+            self.unload_all()
+
+    def _run(self) -> None:
+        """预热和定时检查的后台线程"""
+        if self._preload:
+            # 节点在第一次主动检查之前默认健康且模型列表未知，Ollama 启动时不可用则预热全部失败；
+            # 等节点池发现健康的节点后再预热
+            while not self._pool.wait_available(1.0):
+                if self._stopped.is_set():
+                    return
+            self.warm()
+
+        while not self._stopped.wait(self._check_interval):
+            if not self._pin:
+                continue
+            # 各节点已加载的模型由节点池的后台线程刷新，这里只补上被卸载的模型
+            self.warm()
@@ -0,0 +1,301 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+
+class ResponseCache:
+    """回答缓存
+
+    温度为 0 时，模型、选项和消息列表都相同的请求得到相同的回答。缓存以这些参数的规范化哈希为键，
+    保存完整生成的回答，命中时不再请求 Ollama
+
+    - 内存中最多保存 max_entries 个回答，超出时淘汰最近最少使用的回答
+    - 回答保存超过 ttl 后过期
+    - 指定 directory 时，回答同时写入磁盘，内存中淘汰的回答和重启前的回答仍可命中
+
+    所有会话共享同一个实例，线程安全
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float | None = 3600.0,
+        directory: Path | None = None,
+    ) -> None:
+        """
+        :param max_entries: 内存中最多保存的回答数
+        :type max_entries: int
+        :param ttl: 回答的有效期（秒），为 None 时不过期
+        :type ttl: float | None
+        :param directory: 磁盘缓存所在的目录，为 None 时只缓存在内存中
+        :type directory: Path | None
+        :raises ValueError: 如果 max_entries 或 ttl 不大于 0
+        """
+        if max_entries <= 0:
+            raise ValueError(
+                f"[ERROR] The number of max_entries={max_entries} is not positive"
+            )
+        if ttl is not None and ttl <= 0.0:
+            raise ValueError(f"[ERROR] The number of ttl={ttl} is not positive")
+
+        self._max_entries: int = max_entries
+        self._ttl: float | None = ttl
+        self._directory: Path | None = directory
+        if directory is not None:
+            directory.mkdir(parents=True, exist_ok=True)
+        self._lock: threading.Lock = threading.Lock()
+        # 键 -> 回答，最近使用的回答在末尾
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        # 计数
+        self._hits: int = 0
+        self._disk_hits: int = 0
+        self._misses: int = 0
+        self._stores: int = 0
+        self._evictions: int = 0
+        self._expirations: int = 0
+
+    @staticmethod
+    def make_key(request: dict[str, Any]) -> str:
+        """计算请求的规范化哈希
+
+        :param request: 决定回答的请求参数，例如模型、选项、消息列表和思考模式开关
+        :type request: dict[str, Any]
+        :returns: 十六进制的 SHA-256 哈希
+        :rtype: str
+        """
+        canonical: str = json.dumps(
+            request,
+            sort_keys=True,
+            ensure_ascii=False,
+            separators=(",", ":"),
+            default=dict,
+        )
+
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> tuple[str, str, dict[str, int | str]] | None:
+        """查找缓存的回答
+
+        :param key: 请求的规范化哈希
+        :type key: str
+        :returns: (思考过程, 回答, 统计信息)，没有命中时为 None
+        :rtype: tuple[str, str, dict[str, int | str]] | None
+        """
+        now: float = time.time()
+
+        with self._lock:
+            entry: _Entry | None = self._entries.get(key)
+            if entry is not None and self._expired(entry, now):
+                del self._entries[key]
+                self._expirations += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return (entry.thinking, entry.content, entry.stats.copy())
+
+        entry = self._read(key, now)
+
+        with self._lock:
+            if entry is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._disk_hits += 1
+            self._insert(key, entry)
+
+        return (entry.thinking, entry.content, entry.stats.copy())
+
+    def put(
+        self, key: str, thinking: str, content: str, stats: dict[str, int | str]
+    ) -> None:
+        """保存完整生成的回答
+
+        :param key: 请求的规范化哈希
+        :type key: str
+        :param thinking: 思考过程
+        :type thinking: str
+        :param content: 回答
+        :type content: str
+        :param stats: 生成的统计信息
+        :type stats: dict[str, int | str]
+        :returns: 无
+        :rtype: None
+        """
+        entry: _Entry = _Entry(time.time(), thinking, content, stats.copy())
+
+        with self._lock:
+            self._insert(key, entry)
+            self._stores += 1
+
+        if self._directory is None:
+            return
+
+        path: Path = self._directory / f"{key}.json"
+        tmp_path: Path = path.with_suffix(".tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "created": entry.created,
+                        "thinking": thinking,
+                        "content": content,
+                        "stats": entry.stats,
+                    },
+                    f,
+                    ensure_ascii=False,
+                )
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"[WARNING] Failed to write the response cache {path}: {e}")
+
+    def purge(self) -> int:
+        """删除磁盘上已过期的回答
+
+        :returns: 删除的文件数
+        :rtype: int
+        """
+        if self._directory is None or self._ttl is None:
+            return 0
+
+        now: float = time.time()
+        removed: int = 0
+        for path in self._directory.glob("*.json"):
+            try:
+                if now - path.stat().st_mtime > self._ttl:
+                    path.unlink()
+                    removed += 1
+            except OSError:
+                continue
+
+        return removed
+
+    def clear(self) -> None:
+        """清空内存和磁盘上的所有回答
+
+        :returns: 无
+        :rtype: None
+        """
+        with self._lock:
+            self._entries.clear()
+
+        if self._directory is not None:
+            for path in self._directory.glob("*.json"):
+                path.unlink(missing_ok=True)
+
+    def get_stats(self) -> dict[str, int | float]:
+        """获取缓存的统计信息
+
+        :returns: entries 为内存中的回答数，hits / disk_hits / misses 为累计命中次数 / 其中从磁盘命中的次数 /
+            未命中次数，hit_rate 为命中率，stores / evictions / expirations 为累计保存 / 淘汰 / 过期的回答数
+        :rtype: dict[str, int | float]
+        """
+        with self._lock:
+            lookups: int = self._hits + self._misses
+
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "stores": self._stores,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+            }
+
+    def _insert(self, key: str, entry: "_Entry") -> None:
+        """将回答放入内存，超出上限时淘汰最近最少使用的回答，调用时需持有锁
+
+        :param key: 请求的规范化哈希
+        :type key: str
+        :param entry: 回答
+        :type entry: _Entry
+        :returns: 无
+        :rtype: None
+        """
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def _read(self, key: str, now: float) -> "_Entry | None":
+        """从磁盘读取回答，过期的回答随之删除
+
+        :param key: 请求的规范化哈希
+        :type key: str
+        :param now: 当前时间
+        :type now: float
+        :returns: 回答，没有磁盘缓存、文件不存在、已过期或已损坏时为 None
+        :rtype: _Entry | None
+        """
+        if self._directory is None:
+            return None
+
+        path: Path = self._directory / f"{key}.json"
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data: dict = json.load(f)
+            entry: _Entry = _Entry(
+                float(data["created"]),
+                data["thinking"],
+                data["content"],
+                data["stats"],
+            )
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"[WARNING] Failed to read the response cache {path}: {e}")
+            path.unlink(missing_ok=True)
+            return None
+
+        if self._expired(entry, now):
+            path.unlink(missing_ok=True)
+            with self._lock:
+                self._expirations += 1
+            return None
+
+        return entry
+
+    def _expired(self, entry: "_Entry", now: float) -> bool:
+        """判断回答是否过期
+
+        :param entry: 回答
+        :type entry: _Entry
+        :param now: 当前时间
+        :type now: float
+        :returns: 是否过期
+        :rtype: bool
+        """
+        return self._ttl is not None and now - entry.created > self._ttl
+
+
+class _Entry:
+    """缓存的回答"""
+
+    __slots__ = ("created", "thinking", "content", "stats")
+
+    def __init__(
+        self, created: float, thinking: str, content: str, stats: dict[str, int | str]
+    ) -> None:
+        """
+        :param created: 保存的时间（Unix 时间戳）
+        :type created: float
+        :param thinking: 思考过程
+        :type thinking: str
+        :param content: 回答
+        :type content: str
+        :param stats: 生成的统计信息，不包括各阶段耗时
+        :type stats: dict[str, int | str]
+        """
+        self.created: float = created
+        self.thinking: str = thinking
+        self.content: str = content
+        self.stats: dict[str, int | str] = stats
@@ -0,0 +1,642 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+import weakref
+import zlib
+
+from collections import deque
+from collections.abc import Sequence
+from contextlib import nullcontext
+from typing import Any
+
+from memory import Memory
+from scheduler import QueueFullError, RequestScheduler, Ticket, percentile
+from session_manager import SessionManager
+
+# 检索是可选功能，numpy 在第一次创建索引或检索器时才导入，不拖慢应用启动；没有安装 numpy 时不启用
+np: Any = None
+
+
+def import_numpy() -> bool:
+    """导入 numpy
+
+    :returns: 是否已安装 numpy
+    :rtype: bool
+    """
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+
+    return True
+
+
+class VectorIndex:
+    """向量索引
+
+    所有向量归一化后按行连续存放在一个 float32 矩阵中，容量不足时翻倍扩容；
+    检索时对一段连续的行做一次矩阵乘法得到余弦相似度，再用 argpartition 取出前 k 个
+
+    向量的 id 必须递增，按 id 范围检索时用二分查找确定行的范围
+    """
+
+    def __init__(self, dim: int, capacity: int = 1024) -> None:
+        """
+        :param dim: 向量维度
+        :type dim: int
+        :param capacity: 初始容量（行数）
+        :type capacity: int
+        :raises RuntimeError: 如果没有安装 numpy
+        :raises ValueError: 如果 dim 或 capacity 不大于 0
+        """
+        if not import_numpy():
+            raise RuntimeError("[ERROR] Retrieval requires numpy")
+        if dim <= 0:
+            raise ValueError(f"[ERROR] The number of dim={dim} is not positive")
+        if capacity <= 0:
+            raise ValueError(
+                f"[ERROR] The number of capacity={capacity} is not positive"
+            )
+
+        self._dim: int = dim
+        self._vectors: np.ndarray = np.zeros((capacity, dim), dtype=np.float32)
+        self._ids: np.ndarray = np.zeros(capacity, dtype=np.int64)
+        self._size: int = 0
+
+    def add(self, ids: Sequence[int], vectors: np.ndarray) -> None:
+        """追加若干个向量
+
+        :param ids: 向量的 id，必须大于已有的 id 且递增
+        :type ids: Sequence[int]
+        :param vectors: 形状为 (len(ids), dim) 的向量，不需要归一化
+        :type vectors: np.ndarray
+        :returns: 无
+        :rtype: None
+        :raises ValueError: 如果向量的形状不对，或 id 不递增
+        """
+        n: int = len(ids)
+        if n == 0:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.shape != (n, self._dim):
+            raise ValueError(
+                f"[ERROR] The shape of vectors={vectors.shape} is not ({n}, {self._dim})"
+            )
+        if (self._size and ids[0] <= self._ids[self._size - 1]) or any(
+            a >= b for a, b in zip(ids, ids[1:])
+        ):
+            raise ValueError("[ERROR] The ids of vectors are not increasing")
+
+        if self._size + n > len(self._vectors):
+            capacity: int = max(2 * len(self._vectors), self._size + n)
+            self._vectors = np.resize(self._vectors, (capacity, self._dim))
+            self._ids = np.resize(self._ids, capacity)
+
+        norms: np.ndarray = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(
+            vectors,
+            norms,
+            out=self._vectors[self._size : self._size + n],
+            where=norms > 0,
+        )
+        self._vectors[self._size : self._size + n][norms[:, 0] == 0] = 0.0
+        self._ids[self._size : self._size + n] = ids
+        self._size += n
+
+    def search(
+        self, query: np.ndarray, k: int, low: int = 0, high: int | None = None
+    ) -> list[tuple[int, float]]:
+        """检索与 query 余弦相似度最高的 k 个向量
+
+        :param query: 查询向量，不需要归一化
+        :type query: np.ndarray
+        :param k: 返回的向量数
+        :type k: int
+        :param low: 只检索 id 不小于 low 的向量
+        :type low: int
+        :param high: 只检索 id 小于 high 的向量，为 None 时不限制
+        :type high: int | None
+        :returns: (id, 相似度) 列表，按相似度从高到低排序
+        :rtype: list[tuple[int, float]]
+        """
+        ids: np.ndarray = self._ids[: self._size]
+        begin: int = int(np.searchsorted(ids, low, side="left"))
+        end: int = (
+            self._size if high is None else int(np.searchsorted(ids, high, "left"))
+        )
+        if k <= 0 or end <= begin:
+            return []
+
+        query = np.asarray(query, dtype=np.float32)
+        norm: float = float(np.linalg.norm(query))
+        if norm == 0.0:
+            return []
+
+        scores: np.ndarray = self._vectors[begin:end] @ (query / norm)
+        if end - begin > k:
+            top: np.ndarray = np.argpartition(scores, -k)[-k:]
+        else:
+            top = np.arange(end - begin)
+        top = top[np.argsort(-scores[top])]
+
+        return [(int(ids[begin + i]), float(scores[i])) for i in top]
+
+    def drop_before(self, low: int) -> int:
+        """删除 id 小于 low 的向量
+
+        :param low: 保留的最小 id
+        :type low: int
+        :returns: 删除的向量数
+        :rtype: int
+        """
+        n: int = int(np.searchsorted(self._ids[: self._size], low, side="left"))
+        if n == 0:
+            return 0
+
+        self._vectors[: self._size - n] = self._vectors[n : self._size]
+        self._ids[: self._size - n] = self._ids[n : self._size]
+        self._size -= n
+
+        return n
+
+    def get_nbytes(self) -> int:
+        """获取索引占用的内存
+
+        :returns: 向量矩阵和 id 数组的字节数
+        :rtype: int
+        """
+        return self._vectors.nbytes + self._ids.nbytes
+
+    def __len__(self) -> int:
+        """返回索引中的向量数
+
+        :return: 向量数
+        :rtype: int
+        """
+        return self._size
+
+
+class OllamaEmbedder:
+    """用 Ollama 的 /api/embed 计算嵌入向量"""
+
+    def __init__(self, async_client: Any, model: str) -> None:
+        """
+        :param async_client: 提供 embed 方法的异步客户端，例如 ollama.AsyncClient 或 AsyncPoolClient
+        :type async_client: Any
+        :param model: 嵌入模型的 ollama 模型 id
+        :type model: str
+        """
+        self._async_client: Any = async_client
+        self._model: str = model
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        """批量计算嵌入向量
+
+        :param texts: 文本列表
+        :type texts: list[str]
+        :returns: 形状为 (len(texts), dim) 的向量
+        :rtype: np.ndarray
+        """
+        response = await self._async_client.embed(model=self._model, input=texts)
+
+        return np.asarray(response.embeddings, dtype=np.float32)
+
+
+class HashingEmbedder:
+    """没有配置嵌入模型时使用的本地替代
+
+    按词哈希分桶的词袋向量，不需要模型，只能匹配字面上相同的词
+    """
+
+    def __init__(self, dim: int = 256) -> None:
+        """
+        :param dim: 向量维度
+        :type dim: int
+        """
+        self._dim: int = dim
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        """批量计算嵌入向量
+
+        :param texts: 文本列表
+        :type texts: list[str]
+        :returns: 形状为 (len(texts), dim) 的向量
+        :rtype: np.ndarray
+        """
+        vectors: np.ndarray = np.zeros((len(texts), self._dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            buckets: list[int] = [
+                zlib.crc32(word.encode()) % self._dim for word in text.lower().split()
+            ]
+            np.add.at(vectors[i], buckets, 1.0)
+
+        return vectors
+
+
+class Retriever:
+    """检索记忆
+
+    为每个会话维护一个向量索引，每条消息只计算一次嵌入向量：每轮对话结束后在后台批量计算新消息的向量，
+    最新用户消息的向量在检索时计算并复用。生成回答前，用最新用户消息检索已移出上下文窗口的早期对话，
+    将最相关的若干轮对话在预算内按时间顺序放在最新用户消息之前
+
+    检索在生成回答的请求获得执行槽位之后进行，后台计算向量的请求和生成摘要的请求一样通过请求调度器排队，
+    嵌入请求不会绕过调度器占用 Ollama
+
+    后台计算向量期间通过会话管理器标记会话正在使用，读取消息列表时不会被换出
+
+    所有会话共享同一个实例，会话的索引随 Memory 一起回收
+    """
+
+    def __init__(
+        self,
+        embedder: OllamaEmbedder | HashingEmbedder,
+        scheduler: RequestScheduler | None = None,
+        top_k: int = 4,
+        max_tokens: int = 1024,
+        min_score: float = 0.5,
+        batch_size: int = 32,
+        window: int = 1000,
+        session_manager: SessionManager | None = None,
+    ) -> None:
+        """
+        :param embedder: 计算嵌入向量的对象
+        :type embedder: OllamaEmbedder | HashingEmbedder
+        :param scheduler: 请求调度器，后台计算向量时排队；为 None 时直接计算，例如使用本地的词袋向量时
+        :type scheduler: RequestScheduler | None
+        :param top_k: 最多放入的对话轮数
+        :type top_k: int
+        :param max_tokens: 检索结果的最大 token 估计数，从上下文窗口中预留
+        :type max_tokens: int
+        :param min_score: 放入的对话与最新用户消息的最低余弦相似度
+        :type min_score: float
+        :param batch_size: 每次请求计算的最大向量数
+        :type batch_size: int
+        :param window: 计算耗时分位数时保留的最近样本数
+        :type window: int
+        :param session_manager: 会话管理器，后台计算向量期间标记会话正在使用；为 None 时不标记
+        :type session_manager: SessionManager | None
+        :raises RuntimeError: 如果没有安装 numpy
+        :raises ValueError: 如果 top_k、max_tokens 或 batch_size 不大于 0
+        """
+        if not import_numpy():
+            raise RuntimeError("[ERROR] Retrieval requires numpy")
+        for name, value in (
+            ("top_k", top_k),
+            ("max_tokens", max_tokens),
+            ("batch_size", batch_size),
+        ):
+            if value <= 0:
+                raise ValueError(
+                    f"[ERROR] The number of {name}={value} is not positive"
+                )
+
+        self._embedder: OllamaEmbedder | HashingEmbedder = embedder
+        self._scheduler: RequestScheduler | None = scheduler
+        self._top_k: int = top_k
+        self._max_tokens: int = max_tokens
+        self._min_score: float = min_score
+        self._batch_size: int = batch_size
+        self._session_manager: SessionManager | None = session_manager
+        self._lock: threading.Lock = threading.Lock()
+        # Memory -> 会话的索引
+        self._sessions: weakref.WeakKeyDictionary[Memory, _SessionIndex] = (
+            weakref.WeakKeyDictionary()
+        )
+        # 正在后台计算向量的任务，防止任务被垃圾回收
+        self._tasks: set[asyncio.Task] = set()
+        # 最近若干次检索（不包括计算查询向量）的耗时（秒）
+        self._search_times: deque[float] = deque(maxlen=window)
+        # 计数
+        self._embedded: int = 0
+        self._embed_requests: int = 0
+        self._retrievals: int = 0
+        self._hits: int = 0
+        self._failures: int = 0
+
+    def get_max_tokens(self) -> int:
+        """获取检索结果的最大 token 估计数
+
+        :returns: 需要从上下文窗口中预留的 token 估计数
+        :rtype: int
+        """
+        return self._max_tokens
+
+    async def retrieve(self, memory: Memory, query: str) -> dict[str, str] | None:
+        """用最新用户消息检索已移出上下文窗口的早期对话
+
+        需要在 get_context 之后、生成回答的请求获得执行槽位之后调用，只检索 get_context 没有选取的消息；
+        计算查询向量使用生成回答的执行槽位，不再单独排队
+
+        :param memory: 会话的记忆模块，最后一条消息为 query
+        :type memory: Memory
+        :param query: 最新用户消息
+        :type query: str
+        :returns: 检索到的对话构成的系统消息，没有相关的对话或检索失败时为 None
+        :rtype: dict[str, str] | None
+        """
+        session: _SessionIndex = self._get_session(memory)
+
+        try:
+            async with session.lock:
+                # 最新用户消息的向量随其他新消息一起加入索引，不重复计算
+                vector: np.ndarray = (await self._embed([query]))[0]
+                total: int = memory.get_window()[2]
+                latest: Sequence[dict[str, str]] = memory.get_range(total - 1, total)
+                if latest and latest[0]["content"] == query:
+                    session.pending = (total - 1, vector)
+                await self._update(memory, session)
+                first, context_start, _ = memory.get_window()
+
+                started: float = time.perf_counter()
+                hits: list[tuple[int, float]] = session.index.search(
+                    vector, 2 * self._top_k, first, context_start
+                )
+                message: dict[str, str] | None = self._build_message(
+                    memory, hits, first, context_start
+                )
+        except Exception as e:
+            print(f"[WARNING] Failed to retrieve earlier conversation: {e}")
+            with self._lock:
+                self._failures += 1
+            return None
+
+        with self._lock:
+            self._retrievals += 1
+            self._hits += message is not None
+            self._search_times.append(time.perf_counter() - started)
+
+        return message
+
+    def schedule(self, memory: Memory, session_id: str) -> None:
+        """在后台计算新消息的向量，需要在事件循环中调用
+
+        :param memory: 会话的记忆模块
+        :type memory: Memory
+        :param session_id: 会话 id，计算向量的请求按会话排队
+        :type session_id: str
+        :returns: 无
+        :rtype: None
+        """
+        task: asyncio.Task = asyncio.get_running_loop().create_task(
+            self.update(memory, session_id)
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def update(self, memory: Memory, session_id: str = "") -> int:
+        """计算还没有向量的消息的向量，加入会话的索引
+
+        提供了请求调度器时先排队获得执行槽位，排队已满时放弃，下一轮对话再计算
+
+        :param memory: 会话的记忆模块
+        :type memory: Memory
+        :param session_id: 会话 id
+        :type session_id: str
+        :returns: 本次加入索引的向量数
+        :rtype: int
+        """
+        session: _SessionIndex = self._get_session(memory)
+        ticket: Ticket | None = None
+
+        try:
+            # 先获得执行槽位再加锁，检索时持有槽位等待同一把锁，顺序相反会互相等待
+            if self._scheduler is not None:
+                # 单独排队，不占用会话生成回答的队列
+                ticket = self._scheduler.submit(f"{session_id}:embed")
+                await self._scheduler.wait(ticket)
+            # 换出会清空消息列表，读取新消息期间会话不能被换出
+            with (
+                self._session_manager.use(memory)
+                if self._session_manager is not None
+                else nullcontext()
+            ):
+                async with session.lock:
+                    return await self._update(memory, session)
+        except QueueFullError:
+            return 0
+        except Exception as e:
+            print(f"[WARNING] Failed to embed messages: {e}")
+            with self._lock:
+                self._failures += 1
+            return 0
+        finally:
+            if ticket is not None:
+                self._scheduler.release(ticket)
+
+    async def wait(self) -> None:
+        """等待所有正在运行的后台任务结束
+
+        :returns: 无
+        :rtype: None
+        """
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def get_stats(self) -> dict[str, int | float]:
+        """获取检索的统计信息
+
+        :returns: sessions / vectors / index_bytes 为会话数 / 向量数 / 索引占用的字节数，
+            embedded / embed_requests 为累计计算的向量数 / 请求数，retrievals / hits / failures 为累计检索次数 /
+            放入了检索结果的次数 / 失败次数，search_* 为最近检索耗时（秒）的平均值、p50、p95 和最大值
+        :rtype: dict[str, int | float]
+        """
+        with self._lock:
+            sessions: list[_SessionIndex] = list(self._sessions.values())
+            stats: dict[str, int | float] = {
+                "sessions": len(sessions),
+                "vectors": sum(len(session.index or ()) for session in sessions),
+                "index_bytes": sum(
+                    session.index.get_nbytes()
+                    for session in sessions
+                    if session.index is not None
+                ),
+                "embedded": self._embedded,
+                "embed_requests": self._embed_requests,
+                "retrievals": self._retrievals,
+                "hits": self._hits,
+                "failures": self._failures,
+            }
+            ordered: list[float] = sorted(self._search_times)
+
+        stats["search_mean"] = sum(ordered) / len(ordered) if ordered else 0.0
+        stats["search_p50"] = percentile(ordered, 0.50)
+        stats["search_p95"] = percentile(ordered, 0.95)
+        stats["search_max"] = ordered[-1] if ordered else 0.0
+
+        return stats
+
+    def _get_session(self, memory: Memory) -> "_SessionIndex":
+        """获取会话的索引，没有时创建
+
+        :param memory: 会话的记忆模块
+        :type memory: Memory
+        :returns: 会话的索引
+        :rtype: _SessionIndex
+        """
+        with self._lock:
+            session: _SessionIndex | None = self._sessions.get(memory)
+            if session is None:
+                session = _SessionIndex()
+                self._sessions[memory] = session
+
+        return session
+
+    async def _update(self, memory: Memory, session: "_SessionIndex") -> int:
+        """计算还没有向量的消息的向量，调用时需持有会话的锁
+
+        :param memory: 会话的记忆模块
+        :type memory: Memory
+        :param session: 会话的索引
+        :type session: _SessionIndex
+        :returns: 本次加入索引的向量数
+        :rtype: int
+        """
+        # 消息列表被清空后重建索引
+        if session.epoch != memory.get_epoch():
+            session.reset(memory.get_epoch())
+
+        first, _, total = memory.get_window()
+        start: int = max(session.embedded, first)
+        added: int = 0
+
+        while start < total:
+            stop: int = min(total, start + self._batch_size)
+            ids: list[int] = list(range(start, stop))
+            texts: list[str] = [
+                message["content"] for message in memory.get_range(start, stop)
+            ]
+
+            # 检索时已经计算过的向量直接复用
+            vectors: np.ndarray
+            pending: tuple[int, np.ndarray] | None = session.pending
+            if pending is not None and start <= pending[0] < stop:
+                reused: int = pending[0] - start
+                vectors = np.empty((len(ids), len(pending[1])), dtype=np.float32)
+                vectors[reused] = pending[1]
+                rest: list[int] = [i for i in range(len(ids)) if i != reused]
+                if rest:
+                    vectors[rest] = await self._embed([texts[i] for i in rest])
+                session.pending = None
+            else:
+                vectors = await self._embed(texts)
+
+            if session.index is None:
+                session.index = VectorIndex(vectors.shape[1])
+            session.index.add(ids, vectors)
+            session.embedded = stop
+            added += len(ids)
+            start = stop
+
+        # 超出字符数上限丢弃的消息较多时，同时从索引中删除
+        if session.index is not None and first - session.first > len(session.index):
+            session.index.drop_before(first)
+            session.first = first
+
+        with self._lock:
+            self._embedded += added
+
+        return added
+
+    async def _embed(self, texts: list[str]) -> np.ndarray:
+        """计算嵌入向量并计数
+
+        :param texts: 文本列表
+        :type texts: list[str]
+        :returns: 形状为 (len(texts), dim) 的向量
+        :rtype: np.ndarray
+        """
+        vectors: np.ndarray = await self._embedder.embed(texts)
+        with self._lock:
+            self._embed_requests += 1
+
+        return vectors
+
+    def _build_message(
+        self,
+        memory: Memory,
+        hits: list[tuple[int, float]],
+        first: int,
+        context_start: int,
+    ) -> dict[str, str] | None:
+        """将检索到的消息扩展为完整的对话，在预算内按时间顺序拼接为系统消息
+
+        :param memory: 会话的记忆模块
+        :type memory: Memory
+        :param hits: (消息的绝对下标, 相似度) 列表，按相似度从高到低排序
+        :type hits: list[tuple[int, float]]
+        :param first: 消息列表第一条消息的绝对下标
+        :type first: int
+        :param context_start: 上下文窗口第一条消息的绝对下标
+        :type context_start: int
+        :returns: 系统消息，没有相关的对话时为 None
+        :rtype: dict[str, str] | None
+        """
+        turns: list[int] = []
+        tokens: int = 0
+
+        for message_id, score in hits:
+            if score < self._min_score or len(turns) >= self._top_k:
+                break
+            # 用户消息的绝对下标为偶数，一轮对话从用户消息开始
+            turn: int = message_id - (message_id - first) % 2
+            if turn in turns or turn + 2 > context_start:
+                continue
+            turn_tokens: int = memory.get_range_tokens(turn, turn + 2)
+            if tokens + turn_tokens > self._max_tokens:
+                continue
+            turns.append(turn)
+            tokens += turn_tokens
+
+        if not turns:
+            return None
+
+        blocks: list[str] = []
+        for turn in sorted(turns):
+            blocks.append(
+                "\n".join(
+                    f"{message['role'].capitalize()}: {message['content']}"
+                    for message in memory.get_range(turn, turn + 2)
+                )
+            )
+
+        return {
+            "role": "system",
+            "content": "Relevant earlier conversation:\n\n" + "\n\n".join(blocks),
+        }
+
+
+class _SessionIndex:
+    """会话的索引"""
+
+    def __init__(self) -> None:
+        # 同一会话的检索和后台更新不能同时进行
+        self.lock: asyncio.Lock = asyncio.Lock()
+        self.index: VectorIndex | None = None
+        # 建立索引时 Memory 的清空次数
+        self.epoch: int = 0
+        # 已计算向量的消息数（绝对下标）
+        self.embedded: int = 0
+        # 索引中最早的消息的绝对下标
+        self.first: int = 0
+        # 检索时计算的最新用户消息的向量：(绝对下标, 向量)
+        self.pending: tuple[int, np.ndarray] | None = None
+
+    def reset(self, epoch: int) -> None:
+        """消息列表被清空后重置索引
+
+        :param epoch: Memory 当前的清空次数
+        :type epoch: int
+        :returns: 无
+        :rtype: None
+        """
+        self.index = None
+        self.epoch = epoch
+        self.embedded = 0
+        self.first = 0
+        self.pending = None
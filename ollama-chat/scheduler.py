@@ -0,0 +1,266 @@
+import asyncio
+import time
+
+from collections import deque
+
+
+class QueueFullError(RuntimeError):
+    """排队的请求数已达上限，新请求被拒绝"""
+
+
+class Ticket:
+    """请求调度器发放的排队凭证
+
+    一个凭证对应一次生成，从提交开始排队，获得执行槽位后开始生成，释放后结束
+    """
+
+    def __init__(self, session_id: str) -> None:
+        """
+        :param session_id: 发起请求的会话 id
+        :type session_id: str
+        """
+        self.session_id: str = session_id
+        # 提交、获得执行槽位的时间，未获得时为 None
+        self.submitted: float = time.monotonic()
+        self.granted: float | None = None
+        # 获得执行槽位时完成
+        self._future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._released: bool = False
+
+
+class RequestScheduler:
+    """请求调度器
+
+    位于会话和 Ollama 客户端之间，所有会话的生成请求先在这里排队：
+
+    - 同时执行的请求数不超过 max_concurrency，一般与 Ollama 的 OLLAMA_NUM_PARALLEL 一致
+    - 排队的请求数达到 max_queue 时，新请求立即被拒绝，而不是在 Ollama 中无限排队
+    - 每个会话有自己的队列，执行槽位空出时按会话轮流分配，一个会话的多个请求不会阻塞其他会话
+
+    同时记录每个请求的等待时间（排队）和服务时间（生成），用于评估硬件是否够用，
+    由指标端点导出
+
+    只能在同一个事件循环中使用；get_metrics 只读取计数和样本的快照，可以在指标端点的线程中调用
+    """
+
+    def __init__(
+        self, max_concurrency: int = 4, max_queue: int = 64, window: int = 1000
+    ) -> None:
+        """
+        :param max_concurrency: 同时执行的最大请求数
+        :type max_concurrency: int
+        :param max_queue: 排队的最大请求数，为 0 时不排队，没有空闲槽位即拒绝
+        :type max_queue: int
+        :param window: 计算等待时间和服务时间分位数时保留的最近样本数
+        :type window: int
+        :raises ValueError: 如果 max_concurrency 小于 1、max_queue 小于 0 或 window 小于 1
+        """
+        if max_concurrency < 1:
+            raise ValueError(
+                f"[ERROR] The number of max_concurrency={max_concurrency} is too small"
+            )
+        if max_queue < 0:
+            raise ValueError(f"[ERROR] The number of max_queue={max_queue} is negative")
+        if window < 1:
+            raise ValueError(f"[ERROR] The number of window={window} is too small")
+
+        self._max_concurrency: int = max_concurrency
+        self._max_queue: int = max_queue
+        # 正在执行的请求数
+        self._running: int = 0
+        # 会话 id -> 该会话排队中的凭证
+        self._queues: dict[str, deque[Ticket]] = {}
+        # 有排队请求的会话，按轮流分配的顺序排列
+        self._rotation: deque[str] = deque()
+        # 排队中的请求总数
+        self._queued: int = 0
+        # 计数
+        self._admitted: int = 0
+        self._rejected: int = 0
+        self._abandoned: int = 0
+        self._completed: int = 0
+        # 最近若干请求的等待时间和服务时间（秒）
+        self._wait_times: deque[float] = deque(maxlen=window)
+        self._service_times: deque[float] = deque(maxlen=window)
+
+    def submit(self, session_id: str) -> Ticket:
+        """提交一个请求
+
+        有空闲槽位且没有其他请求排队时立即获得槽位，否则进入该会话的队列
+
+        :param session_id: 发起请求的会话 id
+        :type session_id: str
+        :returns: 排队凭证，用完后必须调用 release 释放
+        :rtype: Ticket
+        :raises QueueFullError: 如果需要排队但排队的请求数已达 max_queue
+        """
+        ticket: Ticket = Ticket(session_id)
+
+        if self._running < self._max_concurrency and self._queued == 0:
+            self._grant(ticket)
+            return ticket
+
+        if self._queued >= self._max_queue:
+            self._rejected += 1
+            raise QueueFullError(
+                f"[ERROR] The request queue is full (max_queue={self._max_queue})"
+            )
+
+        if session_id not in self._queues:
+            self._queues[session_id] = deque()
+            self._rotation.append(session_id)
+        self._queues[session_id].append(ticket)
+        self._queued += 1
+
+        return ticket
+
+    async def wait(self, ticket: Ticket, timeout: float | None = None) -> bool:
+        """等待请求获得执行槽位
+
+        :param ticket: 排队凭证
+        :type ticket: Ticket
+        :param timeout: 最长等待时间（秒），为 None 时一直等待
+        :type timeout: float | None
+        :returns: 是否已获得执行槽位，超时返回 False，凭证仍在排队
+        :rtype: bool
+        """
+        if not ticket._future.done():
+            await asyncio.wait({ticket._future}, timeout=timeout)
+
+        return ticket.granted is not None
+
+    def position(self, ticket: Ticket) -> int:
+        """获取请求的排队位置
+
+        按轮流分配的规则推算：凭证在本会话队列中排第 k 个（从 0 开始），则在第 k 轮被分配，
+        同一轮中排在轮转顺序靠前的会话之后
+
+        :param ticket: 排队凭证
+        :type ticket: Ticket
+        :returns: 排队位置，1 表示下一个获得槽位；已获得槽位或已释放时返回 0
+        :rtype: int
+        """
+        if ticket.granted is not None or ticket._released:
+            return 0
+
+        k: int = self._queues[ticket.session_id].index(ticket)
+        # 前面还有多少个请求
+        ahead: int = k
+        before: bool = True
+        for session_id in self._rotation:
+            if session_id == ticket.session_id:
+                before = False
+                continue
+            ahead += min(len(self._queues[session_id]), k + 1 if before else k)
+
+        return ahead + 1
+
+    def release(self, ticket: Ticket) -> None:
+        """释放请求
+
+        已获得槽位的请求释放槽位并分配给下一个排队的请求；仍在排队的请求直接移出队列。
+        重复释放不会产生影响
+
+        :param ticket: 排队凭证
+        :type ticket: Ticket
+        :returns: 无
+        :rtype: None
+        """
+        if ticket._released:
+            return
+        ticket._released = True
+
+        if ticket.granted is None:
+            queue: deque[Ticket] = self._queues[ticket.session_id]
+            queue.remove(ticket)
+            self._queued -= 1
+            self._abandoned += 1
+            if not queue:
+                del self._queues[ticket.session_id]
+                self._rotation.remove(ticket.session_id)
+            ticket._future.cancel()
+            return
+
+        self._running -= 1
+        self._completed += 1
+        self._service_times.append(time.monotonic() - ticket.granted)
+        self._dispatch()
+
+    def get_metrics(self) -> dict[str, int | float]:
+        """获取调度器的统计信息
+
+        :returns: running / queued 为正在执行 / 排队的请求数；admitted / rejected / abandoned / completed
+            为累计获得槽位 / 被拒绝 / 排队时放弃 / 执行完毕的请求数；wait_* 和 service_* 为最近请求的
+            等待时间和服务时间（秒）的平均值、p50、p95 和最大值
+        :rtype: dict[str, int | float]
+        """
+        metrics: dict[str, int | float] = {
+            "max_concurrency": self._max_concurrency,
+            "max_queue": self._max_queue,
+            "running": self._running,
+            "queued": self._queued,
+            "admitted": self._admitted,
+            "rejected": self._rejected,
+            "abandoned": self._abandoned,
+            "completed": self._completed,
+        }
+        for name, samples in (
+            ("wait", self._wait_times),
+            ("service", self._service_times),
+        ):
+            ordered: list[float] = sorted(samples)
+            metrics[f"{name}_mean"] = sum(ordered) / len(ordered) if ordered else 0.0
+            metrics[f"{name}_p50"] = percentile(ordered, 0.50)
+            metrics[f"{name}_p95"] = percentile(ordered, 0.95)
+            metrics[f"{name}_max"] = ordered[-1] if ordered else 0.0
+
+        return metrics
+
+    def _grant(self, ticket: Ticket) -> None:
+        """为请求分配执行槽位
+
+        :param ticket: 排队凭证
+        :type ticket: Ticket
+        :returns: 无
+        :rtype: None
+        """
+        ticket.granted = time.monotonic()
+        ticket._future.set_result(None)
+        self._running += 1
+        self._admitted += 1
+        self._wait_times.append(ticket.granted - ticket.submitted)
+
+    def _dispatch(self) -> None:
+        """按会话轮流把空闲槽位分配给排队的请求
+
+        :returns: 无
+        :rtype: None
+        """
+        while self._running < self._max_concurrency and self._rotation:
+            session_id: str = self._rotation.popleft()
+            queue: deque[Ticket] = self._queues[session_id]
+            ticket: Ticket = queue.popleft()
+            self._queued -= 1
+
+            if queue:
+                self._rotation.append(session_id)
+            else:
+                del self._queues[session_id]
+
+            self._grant(ticket)
+
+
+def percentile(ordered: list[float], q: float) -> float:
+    """计算已排序样本的分位数
+
+    :param ordered: 升序排列的样本
+    :type ordered: list[float]
+    :param q: 分位，0.0 ~ 1.0
+    :type q: float
+    :returns: 分位数，没有样本时为 0.0
+    :rtype: float
+    """
+    if not ordered:
+        return 0.0
+
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
@@ -0,0 +1,416 @@
+from __future__ import annotations
+
+import os
+import stat
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from memory import Memory
+
+
+def _prepare_directory(directory: Path) -> None:
+    """创建只有当前用户可以访问的目录
+
+    换出文件包括完整的对话内容，默认目录位于所有用户共享的系统临时目录下。
+    目录已存在时，确认它是当前用户所有的真实目录（不是符号链接），并收紧为 0o700
+
+    :param directory: 目录
+    :type directory: Path
+    :returns: 无
+    :rtype: None
+    :raises PermissionError: 如果路径不是目录（包括符号链接）或目录属于其他用户
+    """
+    directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+
+    status: os.stat_result = directory.lstat()
+    if not stat.S_ISDIR(status.st_mode):
+        raise PermissionError(
+            f"[ERROR] The spill directory {directory} is not a directory"
+        )
+    if hasattr(os, "getuid") and status.st_uid != os.getuid():
+        raise PermissionError(
+            f"[ERROR] The spill directory {directory} is owned by another user"
+        )
+    if stat.S_IMODE(status.st_mode) & 0o077:
+        directory.chmod(0o700)
+
+
+def _default_directory_name() -> str:
+    """默认换出目录的名称，按用户区分，避免多个用户共用系统临时目录下的同一个目录"""
+    # Windows 的系统临时目录本身就在用户目录下
+    if not hasattr(os, "getuid"):
+        return "ollama-chat-sessions"
+
+    return f"ollama-chat-sessions-{os.getuid()}"
+
+
+class SessionManager:
+    """会话管理器
+
+    每个浏览器会话通过 gr.State 持有一个 Memory 实例，会话不关闭时会一直留在进程内存中。
+    管理器记录每个会话最近一次活动的时间，由后台线程将会话的消息列表换出到磁盘：
+
+    - 闲置超过 idle_timeout 的会话被换出
+    - 所有会话常驻内存的消息总字符数超过 max_chars 时，按最近最少使用的顺序换出，直到不超过预算
+
+    正在使用的会话不会被换出，换出的会话在下一次访问消息列表时自动换入。
+    写入换出文件时不持有管理器的锁，换出期间开始使用该会话的处理函数等待换出完成。
+    会话关闭或 Memory 被回收时删除换出文件
+
+    所有会话共享同一个实例，线程安全
+    """
+
+    def __init__(
+        self,
+        directory: Path | None = None,
+        idle_timeout: float | None = 600.0,
+        max_chars: int | None = 50_000_000,
+        check_interval: float = 30.0,
+    ) -> None:
+        """
+        :param directory: 换出文件所在的目录，在 start 中创建，为 None 时使用系统临时目录下当前用户的 ollama-chat-sessions-<uid>
+        :type directory: Path | None
+        :param idle_timeout: 会话闲置多久（秒）后换出，为 None 时不按闲置时间换出
+        :type idle_timeout: float | None
+        :param max_chars: 所有会话常驻内存的消息总字符数的预算，为 None 时不限制
+        :type max_chars: int | None
+        :param check_interval: 检查闲置会话的时间间隔（秒）
+        :type check_interval: float
+        :raises ValueError: 如果 idle_timeout、max_chars 或 check_interval 不大于 0
+        """
+        if idle_timeout is not None and idle_timeout <= 0.0:
+            raise ValueError(
+                f"[ERROR] The number of idle_timeout={idle_timeout} is not positive"
+            )
+        if max_chars is not None and max_chars <= 0:
+            raise ValueError(
+                f"[ERROR] The number of max_chars={max_chars} is not positive"
+            )
+        if check_interval <= 0.0:
+            raise ValueError(
+                f"[ERROR] The number of check_interval={check_interval} is not positive"
+            )
+
+        self._directory: Path = (
+            directory
+            if directory is not None
+            else Path(tempfile.gettempdir()) / _default_directory_name()
+        )
+        self._idle_timeout: float | None = idle_timeout
+        self._max_chars: int | None = max_chars
+        self._check_interval: float = check_interval
+        self._lock: threading.Lock = threading.Lock()
+        # id(Memory) -> 会话，按最近一次活动的时间排序，最近活动的会话在末尾
+        self._sessions: OrderedDict[int, _Session] = OrderedDict()
+        # 常驻内存的消息总字符数，在会话登记、结束使用、换出和删除时增量更新
+        self._resident: int = 0
+        # 换出完成时通知等待的 acquire
+        self._spilled: threading.Condition = threading.Condition(self._lock)
+        # 计数
+        self._spills: int = 0
+        self._spilled_bytes: int = 0
+        self._failures: int = 0
+        self._thread: threading.Thread | None = None
+        self._stopped: threading.Event = threading.Event()
+        # 超出预算时立即唤醒后台线程
+        self._wakeup: threading.Event = threading.Event()
+        # 已被回收、等待清理的会话 (键, 换出文件的路径)；回收可能发生在任何持有锁的线程中，不能在回调中加锁
+        self._forgotten: deque[tuple[int, Path]] = deque()
+
+    def register(self, memory: Memory) -> Memory:
+        """登记新会话的 Memory 实例
+
+        :param memory: 新会话的记忆模块
+        :type memory: Memory
+        :returns: 传入的记忆模块，方便在 gr.State 的工厂函数中使用
+        :rtype: Memory
+        """
+        key: int = id(memory)
+        path: Path = self._directory / f"{uuid.uuid4().hex}.bin"
+
+        session: _Session = _Session(weakref.ref(memory), path)
+        with self._lock:
+            # id 可能复用了已被回收、还没有清理的 Memory
+            previous: _Session | None = self._sessions.get(key)
+            if previous is not None:
+                self._resident -= previous.size
+            self._sessions[key] = session
+            self._update_size(session, memory)
+
+        # Gradio 没有调用 discard 就丢弃了会话时，随 Memory 一起清理
+        weakref.finalize(memory, self._forget, key, path)
+
+        return memory
+
+    def acquire(self, memory: Memory) -> None:
+        """标记会话开始使用，使用期间不会被换出，会话正在换出时等待换出完成
+
+        :param memory: 会话的记忆模块
+        :type memory: Memory
+        :returns: 无
+        :rtype: None
+        """
+        with self._lock:
+            session: _Session | None = self._sessions.get(id(memory))
+            if session is None:
+                return
+            while session.spilling:
+                self._spilled.wait()
+            session.in_use += 1
+            session.last_active = time.monotonic()
+            self._sessions.move_to_end(id(memory))
+
+    def release(self, memory: Memory) -> None:
+        """标记会话结束使用
+
+        :param memory: 会话的记忆模块
+        :type memory: Memory
+        :returns: 无
+        :rtype: None
+        """
+        with self._lock:
+            session: _Session | None = self._sessions.get(id(memory))
+            if session is None:
+                return
+            session.in_use = max(0, session.in_use - 1)
+            session.last_active = time.monotonic()
+            # 使用期间消息列表可能增加、清空或换入
+            self._update_size(session, memory)
+            over_budget: bool = (
+                self._max_chars is not None and self._resident > self._max_chars
+            )
+
+        if over_budget:
+            self._wakeup.set()
+
+    @contextmanager
+    def use(self, memory: Memory) -> Iterator[Memory]:
+        """在 with 语句中使用会话
+
+        :param memory: 会话的记忆模块
+        :type memory: Memory
+        :returns: 传入的记忆模块
+        :rtype: Iterator[Memory]
+        """
+        self.acquire(memory)
+        try:
+            yield memory
+        finally:
+            self.release(memory)
+
+    def discard(self, memory: Memory) -> None:
+        """会话关闭时删除其换出文件，用作 gr.State 的 delete_callback
+
+        :param memory: 会话的记忆模块
+        :type memory: Memory
+        :returns: 无
+        :rtype: None
+        """
+        with self._lock:
+            session: _Session | None = self._sessions.pop(id(memory), None)
+            if session is not None:
+                self._resident -= session.size
+
+        if session is not None:
+            session.path.unlink(missing_ok=True)
+
+    def evict(self) -> int:
+        """换出闲置的会话，再按最近最少使用的顺序换出会话直到不超过预算
+
+        在锁内将会话标记为正在换出，在锁外写入换出文件，写入期间不阻塞其他会话的 acquire 和 release
+
+        :returns: 本次换出的会话数
+        :rtype: int
+        """
+        self._purge()
+
+        now: float = time.monotonic()
+        with self._lock:
+            # 按最近一次活动的时间从早到晚
+            candidates: list[tuple[Memory, _Session]] = []
+            for session in self._sessions.values():
+                memory: Memory | None = session.memory()
+                if memory is not None and not memory.is_spilled():
+                    candidates.append((memory, session))
+            excess: int = (
+                self._resident - self._max_chars if self._max_chars is not None else 0
+            )
+
+        spilled: int = 0
+        for memory, session in candidates:
+            idle: bool = (
+                self._idle_timeout is not None
+                and now - session.last_active > self._idle_timeout
+            )
+            if not idle and excess <= 0:
+                continue
+
+            with self._lock:
+                # 检查期间会话可能开始使用
+                if session.in_use or self._sessions.get(id(memory)) is not session:
+                    continue
+                session.spilling = True
+
+            written: int | None = None
+            try:
+                written = memory.spill(session.path)
+            except OSError as e:
+                print(f"[WARNING] Failed to spill a session to {session.path}: {e}")
+
+            with self._lock:
+                session.spilling = False
+                self._spilled.notify_all()
+                if written is None:
+                    self._failures += 1
+                    continue
+                self._spills += 1
+                self._spilled_bytes += written
+                size: int = session.size
+                # 换出期间会话可能已经关闭
+                if self._sessions.get(id(memory)) is session:
+                    self._update_size(session, memory)
+
+            spilled += 1
+            excess -= size
+
+        return spilled
+
+    def get_stats(self) -> dict[str, int]:
+        """获取会话的统计信息
+
+        :returns: sessions / resident / spilled 为会话数 / 常驻内存的会话数 / 已换出的会话数，
+            resident_chars 为常驻内存的消息总字符数，spills / spilled_bytes / failures 为累计换出次数 / 字节数 / 失败次数
+        :rtype: dict[str, int]
+        """
+        self._purge()
+
+        with self._lock:
+            memories: list[Memory] = [
+                memory
+                for session in self._sessions.values()
+                if (memory := session.memory()) is not None
+            ]
+            spilled: int = sum(memory.is_spilled() for memory in memories)
+
+            return {
+                "sessions": len(memories),
+                "resident": len(memories) - spilled,
+                "spilled": spilled,
+                "resident_chars": self._resident,
+                "spills": self._spills,
+                "spilled_bytes": self._spilled_bytes,
+                "failures": self._failures,
+            }
+
+    def start(self) -> None:
+        """准备换出目录，启动定时换出会话的后台线程
+
+        :returns: 无
+        :rtype: None
+        :raises PermissionError: 如果换出目录不是目录或属于其他用户
+        """
+        if self._thread is not None:
+            return
+
+        _prepare_directory(self._directory)
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """停止后台线程
+
+        :returns: 无
+        :rtype: None
+        """
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._purge()
+
+    def _update_size(self, session: _Session, memory: Memory) -> None:
+        """按会话当前的状态更新常驻内存的消息总字符数，调用时需持有锁
+
+        :param session: 会话记录
+        :type session: _Session
+        :param memory: 会话的记忆模块
+        :type memory: Memory
+        :returns: 无
+        :rtype: None
+        """
+        size: int = 0 if memory.is_spilled() else memory.get_size()
+        self._resident += size - session.size
+        session.size = size
+
+    def _forget(self, key: int, path: Path) -> None:
+        """Memory 被回收时记录待清理的会话，由 _purge 删除会话记录和换出文件
+
+        垃圾回收可能在持有锁的线程中触发本回调，加锁会死锁，这里只追加到队列
+
+        :param key: 会话的键
+        :type key: int
+        :param path: 换出文件的路径
+        :type path: Path
+        :returns: 无
+        :rtype: None
+        """
+        self._forgotten.append((key, path))
+
+    def _purge(self) -> None:
+        """删除已被回收的会话的记录和换出文件，调用时不能持有锁
+
+        :returns: 无
+        :rtype: None
+        """
+        while self._forgotten:
+            key, path = self._forgotten.popleft()
+            with self._lock:
+                session: _Session | None = self._sessions.get(key)
+                # id 可能已被新的 Memory 复用
+                if session is not None and session.path == path:
+                    del self._sessions[key]
+                    self._resident -= session.size
+
+            path.unlink(missing_ok=True)
+
+    def _run(self) -> None:
+        """定时换出会话的后台线程"""
+        while not self._stopped.is_set():
+            self._wakeup.wait(self._check_interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            self.evict()
+
+
+class _Session:
+    """会话记录"""
+
+    def __init__(self, memory: weakref.ref, path: Path) -> None:
+        """
+        :param memory: 会话记忆模块的弱引用，不阻止 Gradio 回收会话状态
+        :type memory: weakref.ref
+        :param path: 换出文件的路径
+        :type path: Path
+        """
+        self.memory: weakref.ref = memory
+        self.path: Path = path
+        # 最近一次活动的时间
+        self.last_active: float = time.monotonic()
+        # 正在使用该会话的处理函数数
+        self.in_use: int = 0
+        # 是否正在写入换出文件
+        self.spilling: bool = False
+        # 上次更新时常驻内存的消息字符数，已换出时为 0
+        self.size: int = 0
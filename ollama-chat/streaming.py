@@ -0,0 +1,142 @@
+import time
+
+
+class StreamCoalescer:
+    """流式输出合并器
+
+    模型每输出一个 token 就刷新一次界面，会让 Gradio 每秒多次序列化并推送整个对话历史。
+    合并器累积 token，满足以下任一条件时才通知调用方刷新：
+
+    - 第一个 token，保证首 token 延迟不受影响
+    - 距上次刷新超过 interval 秒
+    - 累积的 token 数达到 max_tokens
+
+    只在收到 token 时判断，流结束后调用方需要自行做最后一次刷新
+    """
+
+    def __init__(self, interval: float = 0.05, max_tokens: int = 32) -> None:
+        """
+        :param interval: 两次刷新的最短时间间隔（秒）
+        :type interval: float
+        :param max_tokens: 累积多少个 token 后立即刷新
+        :type max_tokens: int
+        :raises ValueError: 如果 interval 小于 0 或 max_tokens 小于 1
+        """
+        if interval < 0.0:
+            raise ValueError(f"[ERROR] The number of interval={interval} is negative")
+        if max_tokens < 1:
+            raise ValueError(
+                f"[ERROR] The number of max_tokens={max_tokens} is too small"
+            )
+
+        self._interval: float = interval
+        self._max_tokens: int = max_tokens
+        # 上次刷新的时间，None 表示还没有刷新过
+        self._last_flush: float | None = None
+        # 上次刷新后累积的 token 数
+        self._pending: int = 0
+
+    def push(self) -> bool:
+        """记录收到一个 token
+
+        :returns: 是否应该立即刷新，返回 True 时视为已刷新
+        :rtype: bool
+        """
+        self._pending += 1
+        now: float = time.monotonic()
+
+        if (
+            self._last_flush is None
+            or self._pending >= self._max_tokens
+            or now - self._last_flush >= self._interval
+        ):
+            self._last_flush = now
+            self._pending = 0
+            return True
+
+        return False
+
+
+def render_response(thinking: str, answer: str) -> str:
+    """生成 gradio.Chatbot 组件显示的 AI 响应
+
+    :param thinking: 思考过程
+    :type thinking: str
+    :param answer: 回答
+    :type answer: str
+    :returns: 有思考过程时，将思考过程包括在 <details> 标签内并放在回答之前；否则只有回答
+    :rtype: str
+    """
+    if not thinking:
+        return answer
+
+    return (
+        "<details>\n"
+        + "<summary>Thinking</summary>\n"
+        + thinking
+        + "\n<hr>\n</details>\n\n"
+        + answer
+    )
+
+
+class ResponseBuffer:
+    """AI 响应缓冲区
+
+    思考过程和回答分别累积在两个缓冲区中，收到 token 时只做追加，
+    需要显示或保存时才拼接，避免每个 token 都重建整段文本
+    """
+
+    def __init__(self) -> None:
+        # 已拼接的思考过程和回答
+        self._thinking: str = ""
+        self._answer: str = ""
+        # 上次拼接后收到的思考 token 和回答 token
+        self._pending_thinking: list[str] = []
+        self._pending_answer: list[str] = []
+
+    def add(self, think_word: str | None, answer_word: str | None) -> None:
+        """追加 AI 响应流中的一个分块
+
+        :param think_word: 思考 token，可以为空
+        :type think_word: str | None
+        :param answer_word: 回答 token，可以为空
+        :type answer_word: str | None
+        :returns: 无
+        :rtype: None
+        """
+        if think_word:
+            self._pending_thinking.append(think_word)
+        if answer_word:
+            self._pending_answer.append(answer_word)
+
+    def get_thinking(self) -> str:
+        """获取思考过程
+
+        :returns: 目前为止的思考过程
+        :rtype: str
+        """
+        if self._pending_thinking:
+            self._thinking += "".join(self._pending_thinking)
+            self._pending_thinking.clear()
+
+        return self._thinking
+
+    def get_answer(self) -> str:
+        """获取回答
+
+        :returns: 目前为止的回答，不包括思考过程
+        :rtype: str
+        """
+        if self._pending_answer:
+            self._answer += "".join(self._pending_answer)
+            self._pending_answer.clear()
+
+        return self._answer
+
+    def render(self) -> str:
+        """生成 gradio.Chatbot 组件显示的 AI 响应
+
+        :returns: 目前为止的 AI 响应，包括思考过程
+        :rtype: str
+        """
+        return render_response(self.get_thinking(), self.get_answer())
@@ -0,0 +1,261 @@
+import asyncio
+import threading
+import time
+
+from collections import deque
+from contextlib import aclosing, nullcontext
+
+from memory import Memory, MessageView
+from ollama_llm import OllamaLLM
+from scheduler import QueueFullError, RequestScheduler, percentile
+from session_manager import SessionManager
+from token_estimator import conservative_token_estimate
+
+# 生成摘要的系统提示词
+SUMMARY_PROMPT: str = (
+    "You maintain a running summary of an earlier part of a conversation "
+    + "between a user and an AI assistant. Merge the new messages into the "
+    + "current summary. Keep facts, names, numbers, preferences, decisions and "
+    + "open questions; drop greetings and small talk. Write in the language of "
+    + "the conversation. Reply with the updated summary only, in at most "
+    + "{words} words."
+)
+
+
+class ConversationSummarizer:
+    """滚动摘要
+
+    上下文窗口滑动时，最早的若干轮对话被移出上下文窗口。每轮对话结束后，在后台用非思考模型
+    将新移出的消息合并到会话的滚动摘要中，摘要作为系统消息放在历史消息之前，
+    使长对话既保留早期的信息，又不增加发送给模型的提示词长度
+
+    - 每次只压缩新移出的消息，和上一次的摘要一起发送给模型，不重复压缩
+    - 每个会话同一时刻最多一个压缩任务，生成摘要的请求和生成回答的请求一样通过请求调度器排队
+    - 摘要超过 max_tokens 时截断，不会挤占上下文窗口
+    - 压缩期间通过会话管理器标记会话正在使用，读取消息列表时不会被换出
+
+    所有会话共享同一个实例
+    """
+
+    def __init__(
+        self,
+        ollama_llm: OllamaLLM,
+        scheduler: RequestScheduler,
+        max_tokens: int = 512,
+        max_input_tokens: int = 4096,
+        window: int = 1000,
+        session_manager: SessionManager | None = None,
+    ) -> None:
+        """
+        :param ollama_llm: 生成摘要的非思考模型，所有会话共享
+        :type ollama_llm: OllamaLLM
+        :param scheduler: 请求调度器
+        :type scheduler: RequestScheduler
+        :param max_tokens: 摘要的最大 token 估计数
+        :type max_tokens: int
+        :param max_input_tokens: 每次请求最多压缩的消息的 token 估计数
+        :type max_input_tokens: int
+        :param window: 计算耗时分位数时保留的最近样本数
+        :type window: int
+        :param session_manager: 会话管理器，压缩期间标记会话正在使用；为 None 时不标记
+        :type session_manager: SessionManager | None
+        :raises ValueError: 如果 max_tokens 或 max_input_tokens 不大于 0
+        """
+        if max_tokens <= 0:
+            raise ValueError(
+                f"[ERROR] The number of max_tokens={max_tokens} is not positive"
+            )
+        if max_input_tokens <= 0:
+            raise ValueError(
+                f"[ERROR] The number of max_input_tokens={max_input_tokens} is not positive"
+            )
+
+        self._ollama_llm: OllamaLLM = ollama_llm
+        self._scheduler: RequestScheduler = scheduler
+        self._max_tokens: int = max_tokens
+        self._max_input_tokens: int = max_input_tokens
+        self._session_manager: SessionManager | None = session_manager
+        self._lock: threading.Lock = threading.Lock()
+        # 正在压缩的会话，id(Memory) -> 后台任务，同时防止任务被垃圾回收
+        self._tasks: dict[int, asyncio.Task] = {}
+        # 最近若干次生成摘要的耗时（秒）
+        self._durations: deque[float] = deque(maxlen=window)
+        # 计数
+        self._runs: int = 0
+        self._summarized_messages: int = 0
+        self._failures: int = 0
+
+    def schedule(self, memory: Memory, session_id: str) -> bool:
+        """如果有新移出上下文窗口的消息，启动后台任务压缩，需要在事件循环中调用
+
+        :param memory: 会话的记忆模块
+        :type memory: Memory
+        :param session_id: 会话 id，生成摘要的请求按会话排队
+        :type session_id: str
+        :returns: 是否启动了后台任务，已有任务在运行或没有需要压缩的消息时为 False
+        :rtype: bool
+        """
+        key: int = id(memory)
+
+        with self._lock:
+            if key in self._tasks:
+                return False
+            if memory.get_evicted(self._max_input_tokens) is None:
+                return False
+            task: asyncio.Task = asyncio.get_running_loop().create_task(
+                self.compact(memory, session_id)
+            )
+            self._tasks[key] = task
+
+        task.add_done_callback(lambda _: self._forget(key))
+
+        return True
+
+    async def compact(self, memory: Memory, session_id: str) -> int:
+        """将已移出上下文窗口的消息依次合并到摘要中
+
+        :param memory: 会话的记忆模块
+        :type memory: Memory
+        :param session_id: 会话 id
+        :type session_id: str
+        :returns: 本次压缩的消息数
+        :rtype: int
+        """
+        # 换出会清空消息列表，读取移出的消息和写入摘要期间会话不能被换出
+        with (
+            self._session_manager.use(memory)
+            if self._session_manager is not None
+            else nullcontext()
+        ):
+            return await self._compact(memory, session_id)
+
+    async def _compact(self, memory: Memory, session_id: str) -> int:
+        """将已移出上下文窗口的消息依次合并到摘要中，调用时会话已标记为正在使用
+
+        :param memory: 会话的记忆模块
+        :type memory: Memory
+        :param session_id: 会话 id
+        :type session_id: str
+        :returns: 本次压缩的消息数
+        :rtype: int
+        """
+        compacted: int = 0
+
+        while True:
+            job = memory.get_evicted(self._max_input_tokens)
+            if job is None:
+                break
+            epoch, stop, messages = job
+
+            # 单独排队，不占用会话生成回答的队列
+            try:
+                ticket = self._scheduler.submit(f"{session_id}:summary")
+            except QueueFullError:
+                break
+            started: float = time.perf_counter()
+            summary: str = ""
+            try:
+                if await self._scheduler.wait(ticket):
+                    summary = await self._summarize(memory.get_summary(), messages)
+            except Exception as e:
+                print(f"[WARNING] Failed to summarize session={session_id}: {e}")
+                with self._lock:
+                    self._failures += 1
+                break
+            finally:
+                self._scheduler.release(ticket)
+
+            if not summary or not memory.set_summary(summary, epoch, stop):
+                break
+
+            compacted += len(messages)
+            with self._lock:
+                self._runs += 1
+                self._summarized_messages += len(messages)
+                self._durations.append(time.perf_counter() - started)
+
+        return compacted
+
+    async def wait(self) -> None:
+        """等待所有正在运行的压缩任务结束
+
+        :returns: 无
+        :rtype: None
+        """
+        with self._lock:
+            tasks: list[asyncio.Task] = list(self._tasks.values())
+
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get_stats(self) -> dict[str, int | float]:
+        """获取压缩的统计信息
+
+        :returns: running 为正在压缩的会话数，runs / summarized_messages / failures 为累计生成摘要的次数 /
+            压缩的消息数 / 失败次数，duration_* 为最近生成摘要耗时（秒）的平均值、p50、p95 和最大值
+        :rtype: dict[str, int | float]
+        """
+        with self._lock:
+            stats: dict[str, int | float] = {
+                "running": len(self._tasks),
+                "runs": self._runs,
+                "summarized_messages": self._summarized_messages,
+                "failures": self._failures,
+            }
+            ordered: list[float] = sorted(self._durations)
+
+        stats["duration_mean"] = sum(ordered) / len(ordered) if ordered else 0.0
+        stats["duration_p50"] = percentile(ordered, 0.50)
+        stats["duration_p95"] = percentile(ordered, 0.95)
+        stats["duration_max"] = ordered[-1] if ordered else 0.0
+
+        return stats
+
+    async def _summarize(self, summary: str, messages: MessageView) -> str:
+        """用非思考模型将消息合并到摘要中
+
+        :param summary: 当前的摘要
+        :type summary: str
+        :param messages: 新移出上下文窗口的消息
+        :type messages: MessageView
+        :returns: 新的摘要，超过 max_tokens 时截断
+        :rtype: str
+        """
+        transcript: str = "\n\n".join(
+            f"{message['role'].capitalize()}: {message['content']}"
+            for message in messages
+        )
+        prompt: list[dict[str, str]] = [
+            {
+                "role": "system",
+                "content": SUMMARY_PROMPT.format(words=self._max_tokens * 3 // 4),
+            },
+            {
+                "role": "user",
+                "content": f"Current summary:\n{summary or '(empty)'}\n\n"
+                + f"New messages:\n{transcript}",
+            },
+        ]
+
+        parts: list[str] = []
+        tokens: int = 0
+        async with aclosing(self._ollama_llm.achat(prompt, False)) as stream:
+            async for _, answer_word in stream:
+                parts.append(answer_word)
+                tokens += conservative_token_estimate(answer_word)
+                # 超出上限时关闭流，Ollama 随即停止生成
+                if tokens >= self._max_tokens:
+                    break
+
+        return "".join(parts).strip()
+
+    def _forget(self, key: int) -> None:
+        """后台任务结束时移除记录
+
+        :param key: id(Memory)
+        :type key: int
+        :returns: 无
+        :rtype: None
+        """
+        with self._lock:
+            self._tasks.pop(key, None)
@@ -0,0 +1,7 @@
+import sys
+
+from pathlib import Path
+
+# 被测模块和 benchmarks 中的替身服务端都不是安装的包，从 ollama-chat 目录直接导入
+APP_DIR: Path = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(APP_DIR), str(APP_DIR / "benchmarks")]
@@ -0,0 +1,131 @@
+import os
+
+from pathlib import Path
+
+import pytest
+
+from conversation_log import (
+    ASSISTANT,
+    INDEX_ENTRY,
+    USER,
+    ConversationLog,
+    ConversationStore,
+)
+from memory import Memory
+
+
+@pytest.fixture
+def store(tmp_path: Path) -> ConversationStore:
+    """每次追加后立即 fsync 的对话存储"""
+    store: ConversationStore = ConversationStore(tmp_path / "history", 0.0)
+    store.start()
+    yield store
+    store.stop()
+
+
+def append_turns(log: ConversationLog, turns: int, tokens: int = 10) -> None:
+    """追加若干轮对话，每条消息的 token 估计数相同"""
+    for i in range(turns):
+        log.append(USER, tokens, f"question {i}", None)
+        log.append(ASSISTANT, tokens, f"answer {i}", f"thinking {i}")
+
+
+def test_read_tail_reads_only_the_budget(store: ConversationStore) -> None:
+    """按预算只读取最后若干轮对话，总是从用户消息开始"""
+    log: ConversationLog = store.open("session")
+    append_turns(log, 100)
+
+    assert len(log.read_tail()) == 200
+    tail = log.read_tail(55)
+    assert len(tail) == 4
+    assert tail[0] == (USER, 10, "question 98", None)
+    assert tail[-1] == (ASSISTANT, 10, "answer 99", "thinking 99")
+    assert log.read_tail(5) == []
+
+
+def test_reopen_recovers_the_same_messages(store: ConversationStore) -> None:
+    """重新打开日志时读取到相同的消息"""
+    append_turns(store.open("session"), 3)
+
+    log: ConversationLog = store.open("session")
+    assert len(log) == 6
+    assert log.read_tail()[-1] == (ASSISTANT, 10, "answer 2", "thinking 2")
+
+
+def test_recovery_drops_a_torn_record(store: ConversationStore) -> None:
+    """日志文件的最后一条记录不完整时，丢弃该记录和没有回答的用户消息"""
+    append_turns(store.open("session"), 3)
+    log_path: Path = store.get_directory() / "session.log"
+    os.truncate(log_path, log_path.stat().st_size - 3)
+
+    log: ConversationLog = store.open("session")
+    assert len(log) == 4
+    assert log.read_tail()[-1][2] == "answer 1"
+    index_path: Path = store.get_directory() / "session.idx"
+    assert index_path.stat().st_size == 4 * INDEX_ENTRY.size
+
+    # 截断后可以继续追加
+    append_turns(log, 1)
+    assert len(store.open("session")) == 6
+
+
+def test_recovery_drops_log_bytes_without_an_index_entry(
+    store: ConversationStore,
+) -> None:
+    """写入日志文件后、写入索引文件前中断时，丢弃没有索引项的记录"""
+    append_turns(store.open("session"), 2)
+    index_path: Path = store.get_directory() / "session.idx"
+    log_path: Path = store.get_directory() / "session.log"
+    size: int = log_path.stat().st_size
+    os.truncate(index_path, 3 * INDEX_ENTRY.size)
+
+    log: ConversationLog = store.open("session")
+    assert len(log) == 2
+    assert log_path.stat().st_size < size
+
+
+def test_recovery_drops_an_unanswered_user_message(store: ConversationStore) -> None:
+    """没有 AI 回答的最后一条用户消息不会被恢复"""
+    log: ConversationLog = store.open("session")
+    append_turns(log, 2)
+    log.append(USER, 10, "unanswered", None)
+
+    assert len(store.open("session")) == 4
+
+
+def test_rotate_archives_the_conversation(store: ConversationStore) -> None:
+    """归档后从空日志开始，归档的对话不会被恢复"""
+    log: ConversationLog = store.open("session")
+    append_turns(log, 2)
+    log.rotate()
+
+    assert len(log) == 0
+    assert len(store.open("session")) == 0
+    assert len(list(store.get_directory().glob("session.*.log"))) == 1
+
+
+def test_open_rejects_invalid_ids(store: ConversationStore) -> None:
+    """对话 id 只能包含字母、数字、- 和 _"""
+    for conversation_id in ("", "../escape", "a/b", "名字"):
+        with pytest.raises(ValueError):
+            store.open(conversation_id)
+
+
+def test_memory_writes_through_and_resumes_the_tail(store: ConversationStore) -> None:
+    """记忆模块添加的消息写入日志，恢复时只读取上下文窗口放得下的最后若干轮"""
+    memory: Memory = Memory()
+    memory.set_system_message("system")
+    memory.attach_log(store.open("session"))
+    for i in range(50):
+        memory.add_user_message(f"question {i} " + "word " * 20)
+        memory.add_assistant_message(f"answer {i} " + "word " * 20, f"thinking {i}")
+
+    resumed: Memory = Memory()
+    resumed.set_system_message("system")
+    restored: int = resumed.attach_log(store.open("session"), 200)
+
+    assert 0 < restored < 100
+    assert restored % 2 == 0
+    history: list[dict[str, str]] = resumed.get_history()
+    assert history[0]["content"].startswith("question")
+    assert history[-1]["content"].endswith(memory.get_history()[-1]["content"])
@@ -0,0 +1,220 @@
+import random
+
+import pytest
+
+import memory as memory_module
+
+from memory import Memory
+from token_estimator import conservative_token_estimate
+
+
+def reference_count(tokens: list[int], budget: float) -> int:
+    """逐条累加 token 估计数，得到预算内最多能容纳的倒数消息数，调整为奇数"""
+    total: int = 0
+    n: int = 0
+    for count in reversed(tokens):
+        if total + count >= budget:
+            break
+        total += count
+        n += 1
+
+    if n > 0 and n % 2 == 0:
+        n -= 1
+
+    return n
+
+
+def fill(memory: Memory, turns: int, seed: int = 0) -> list[str]:
+    """添加若干轮长度随机的对话，返回所有消息内容"""
+    rng: random.Random = random.Random(seed)
+    contents: list[str] = []
+    for i in range(turns):
+        for role in ("user", "assistant"):
+            content: str = f"{role} {i} " + "word " * rng.randint(1, 80)
+            if role == "user":
+                memory.add_user_message(content)
+            else:
+                memory.add_assistant_message(content)
+            contents.append(content)
+
+    return contents
+
+
+@pytest.mark.parametrize("num_ctx", [64, 300, 1000, 5000, 100_000])
+def test_get_context_matches_linear_scan(num_ctx: int) -> None:
+    """二分查找选取的消息数与逐条累加的结果一致"""
+    memory: Memory = Memory()
+    memory.set_system_message("You are a helpful assistant.")
+    contents: list[str] = fill(memory, 50)
+    memory.add_user_message("latest question")
+    contents.append("latest question")
+
+    tokens: list[int] = [conservative_token_estimate(c) for c in contents]
+    budget: float = num_ctx - conservative_token_estimate(
+        "You are a helpful assistant."
+    )
+    expected: int = reference_count(tokens, budget)
+
+    if expected == 0:
+        with pytest.raises(ValueError):
+            memory.get_context(num_ctx)
+        return
+
+    context = memory.get_context(num_ctx)
+    assert len(context) == expected
+    assert [message["content"] for message in context] == contents[-expected:]
+    assert context[0]["role"] == "user"
+
+
+def test_tokens_are_estimated_once_per_message(monkeypatch) -> None:
+    """每条消息的 token 数只在添加时估计一次，选取上下文时不再重新估计"""
+    calls: list[str] = []
+
+    def counting_estimate(text: str) -> int:
+        calls.append(text)
+        return conservative_token_estimate(text)
+
+    monkeypatch.setattr(memory_module, "conservative_token_estimate", counting_estimate)
+
+    memory: Memory = Memory()
+    memory.set_system_message("system")
+    fill(memory, 20)
+    memory.add_user_message("question")
+    estimated: int = len(calls)
+    assert estimated == 1 + 41
+
+    for num_ctx in (256, 1024, 4096):
+        memory.get_context(num_ctx)
+    assert len(calls) == estimated
+
+
+def test_refill_keeps_the_previous_start() -> None:
+    """refill 小于 1.0 时，上一次的起点仍然放得下就保持前缀不变"""
+    memory: Memory = Memory()
+    memory.set_system_message("system")
+    fill(memory, 30)
+    memory.add_user_message("first question")
+    first = memory.get_context(1500, refill=0.5)
+    start: int = memory.get_window()[1]
+
+    memory.add_assistant_message("short answer")
+    memory.add_user_message("second question")
+    second = memory.get_context(1500, refill=0.5)
+
+    assert memory.get_window()[1] == start
+    assert len(second) == len(first) + 2
+
+
+def test_get_context_reserves_tokens() -> None:
+    """预留的 token 数从预算中扣除，放不下最新用户消息时报错"""
+    memory: Memory = Memory()
+    memory.set_system_message("system")
+    fill(memory, 10)
+    memory.add_user_message("question")
+
+    full: int = len(memory.get_context(2000))
+    reserved: int = len(memory.get_context(2000, reserve=1500))
+    assert reserved < full
+
+    with pytest.raises(ValueError):
+        memory.get_context(2000, reserve=2000)
+
+
+def test_message_view_shares_contents_without_copying() -> None:
+    """上下文视图不复制消息内容，思考过程只出现在对话历史中"""
+    memory: Memory = Memory()
+    memory.set_system_message("system")
+    question: str = "what is two plus two " * 3
+    answer: str = "four " * 5
+    memory.add_user_message(question)
+    memory.add_assistant_message(answer, thinking="add the numbers")
+    memory.add_user_message("and three plus three")
+
+    context = memory.get_context(4096)
+    assert [message["role"] for message in context] == ["user", "assistant", "user"]
+    assert context[0]["content"] is question
+    assert context[1]["content"] is answer
+    assert context[0]["role"] is memory_module.ROLES[0]
+
+    history: list[dict[str, str]] = memory.get_history()
+    assert "add the numbers" in history[1]["content"]
+    assert "add the numbers" not in context[1]["content"]
+
+
+def test_message_view_indexing_and_slicing() -> None:
+    """视图支持负下标和切片，越界时抛出 IndexError"""
+    memory: Memory = Memory()
+    contents: list[str] = fill(memory, 4)
+    view = memory.get_range(0, len(contents))
+
+    assert len(view) == len(contents)
+    assert view[-1]["content"] == contents[-1]
+    assert [message["content"] for message in view[2:5]] == contents[2:5]
+    assert [message["content"] for message in view[::3]] == contents[::3]
+    with pytest.raises(IndexError):
+        view[len(contents)]
+
+
+def test_views_survive_clear() -> None:
+    """清空后已有的视图仍然指向原来的消息"""
+    memory: Memory = Memory()
+    contents: list[str] = fill(memory, 3)
+    view = memory.get_range(0, len(contents))
+
+    memory.clear()
+    memory.add_user_message("new conversation")
+
+    assert [message["content"] for message in view] == contents
+    assert len(memory) == 1
+
+
+def test_history_is_rendered_once() -> None:
+    """对话历史中已显示过的消息只构造一次"""
+    memory: Memory = Memory()
+    fill(memory, 2)
+    first: list[dict[str, str]] = memory.get_history()
+    memory.add_user_message("another question")
+    second: list[dict[str, str]] = memory.get_history()
+
+    assert len(second) == len(first) + 1
+    assert all(a is b for a, b in zip(first, second))
+
+
+def test_max_chars_drops_the_oldest_turns() -> None:
+    """超出字符数上限时成对丢弃最早的对话，至少保留最近一轮"""
+    memory: Memory = Memory(max_chars=100)
+    for i in range(10):
+        memory.add_user_message(f"question {i:02d} " + "x" * 10)
+        memory.add_assistant_message(f"answer {i:02d} " + "y" * 10)
+
+    assert memory.get_size() <= 100
+    assert len(memory) % 2 == 0
+    history: list[dict[str, str]] = memory.get_history()
+    assert history[0]["role"] == "user"
+    assert history[-1]["content"].startswith("answer 09")
+    first, _, total = memory.get_window()
+    assert total == 20 and first == 20 - len(memory)
+
+    memory = Memory(max_chars=10)
+    memory.add_user_message("a long question " * 5)
+    memory.add_assistant_message("a long answer " * 5)
+    assert len(memory) == 2
+
+
+def test_spill_and_restore(tmp_path) -> None:
+    """换出到磁盘后释放消息列表，下一次访问时换入，内容和 token 估计数不变"""
+    memory: Memory = Memory()
+    memory.set_system_message("system")
+    contents: list[str] = fill(memory, 5)
+    tokens: int = memory.get_range_tokens(0, len(contents))
+    path = tmp_path / "session.bin"
+
+    assert memory.spill(path) > 0
+    assert memory.is_spilled()
+    assert len(memory) == len(contents)
+    assert memory.spill(path) == 0
+
+    assert [message["content"] for message in memory.get_range(0, 10)] == contents
+    assert not memory.is_spilled()
+    assert not path.exists()
+    assert memory.get_range_tokens(0, len(contents)) == tokens
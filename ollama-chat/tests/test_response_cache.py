@@ -0,0 +1,181 @@
+import os
+import time
+
+from pathlib import Path
+
+import ollama
+import pytest
+
+from fake_ollama import DEFAULT_MODELS, FakeOllamaServer
+from model_catalogue import ModelCatalogue
+from ollama_llm import OllamaLLM
+from response_cache import ResponseCache
+
+STATS: dict[str, int | str] = {"eval_count": 3, "done_reason": "stop"}
+
+
+class Clock:
+    """可手动推进的 time.time 替身"""
+
+    def __init__(self) -> None:
+        self.now: float = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock: Clock = Clock()
+    monkeypatch.setattr(time, "time", clock)
+    return clock
+
+
+def test_make_key_is_canonical() -> None:
+    """键与字典的顺序无关，请求参数不同时键不同"""
+    request: dict = {
+        "model": "qwen3:4b",
+        "options": {"temperature": 0.0, "num_ctx": 2048},
+        "messages": [{"role": "user", "content": "你好"}],
+        "think": False,
+    }
+    reordered: dict = {
+        "think": False,
+        "messages": [{"content": "你好", "role": "user"}],
+        "options": {"num_ctx": 2048, "temperature": 0.0},
+        "model": "qwen3:4b",
+    }
+
+    assert ResponseCache.make_key(request) == ResponseCache.make_key(reordered)
+    assert ResponseCache.make_key(request) != ResponseCache.make_key(
+        {**request, "think": True}
+    )
+    assert ResponseCache.make_key(request) != ResponseCache.make_key(
+        {**request, "digest": "sha256:abc"}
+    )
+
+
+def test_lru_eviction() -> None:
+    """超出上限时淘汰最近最少使用的回答"""
+    cache: ResponseCache = ResponseCache(max_entries=2, ttl=None)
+    cache.put("a", "", "answer a", STATS)
+    cache.put("b", "", "answer b", STATS)
+    assert cache.get("a") is not None
+    cache.put("c", "", "answer c", STATS)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == ("", "answer a", STATS)
+    assert cache.get("c") is not None
+    stats: dict[str, int | float] = cache.get_stats()
+    assert stats["entries"] == 2
+    assert stats["evictions"] == 1
+    assert stats["stores"] == 3
+    assert stats["hits"] == 3 and stats["misses"] == 1
+    assert stats["hit_rate"] == 0.75
+
+
+def test_get_returns_copies() -> None:
+    """修改返回的统计信息不影响缓存"""
+    cache: ResponseCache = ResponseCache(ttl=None)
+    stats: dict[str, int | str] = dict(STATS)
+    cache.put("a", "thinking", "answer", stats)
+    stats["eval_count"] = 0
+    cache.get("a")[2]["eval_count"] = 0
+
+    assert cache.get("a") == ("thinking", "answer", STATS)
+
+
+def test_ttl_expiry(clock: Clock) -> None:
+    """超过有效期的回答不再命中并计入过期数"""
+    cache: ResponseCache = ResponseCache(ttl=60.0)
+    cache.put("a", "", "answer", STATS)
+    clock.now += 59.0
+    assert cache.get("a") is not None
+
+    clock.now += 2.0
+    assert cache.get("a") is None
+    stats: dict[str, int | float] = cache.get_stats()
+    assert stats["expirations"] == 1
+    assert stats["entries"] == 0
+
+
+def test_disk_tier(tmp_path: Path) -> None:
+    """内存中淘汰或重新创建实例后从磁盘命中"""
+    cache: ResponseCache = ResponseCache(max_entries=1, ttl=None, directory=tmp_path)
+    cache.put("a", "thinking", "answer a", STATS)
+    cache.put("b", "", "answer b", STATS)
+
+    assert cache.get("a") == ("thinking", "answer a", STATS)
+    assert cache.get_stats()["disk_hits"] == 1
+
+    reopened: ResponseCache = ResponseCache(ttl=None, directory=tmp_path)
+    assert reopened.get("b") == ("", "answer b", STATS)
+    assert reopened.get_stats()["disk_hits"] == 1
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_disk_tier_drops_expired_and_corrupt_files(
+    tmp_path: Path, clock: Clock
+) -> None:
+    """磁盘上过期或损坏的回答不命中并被删除"""
+    cache: ResponseCache = ResponseCache(max_entries=1, ttl=60.0, directory=tmp_path)
+    cache.put("a", "", "answer a", STATS)
+    clock.now += 120.0
+
+    reopened: ResponseCache = ResponseCache(ttl=60.0, directory=tmp_path)
+    assert reopened.get("a") is None
+    assert not (tmp_path / "a.json").exists()
+    assert reopened.get_stats()["expirations"] == 1
+
+    (tmp_path / "b.json").write_text("{not json", encoding="utf-8")
+    assert reopened.get("b") is None
+    assert not (tmp_path / "b.json").exists()
+
+
+def test_purge_and_clear(tmp_path: Path) -> None:
+    """purge 只删除磁盘上已过期的回答，clear 删除所有回答"""
+    cache: ResponseCache = ResponseCache(ttl=60.0, directory=tmp_path)
+    cache.put("old", "", "old answer", STATS)
+    cache.put("new", "", "new answer", STATS)
+    old: float = time.time() - 120.0
+    os.utime(tmp_path / "old.json", (old, old))
+
+    assert cache.purge() == 1
+    assert [path.stem for path in tmp_path.glob("*.json")] == ["new"]
+
+    cache.clear()
+    assert cache.get("new") is None
+    assert not list(tmp_path.glob("*.json"))
+
+
+def test_invalid_arguments() -> None:
+    """max_entries 和 ttl 必须大于 0"""
+    with pytest.raises(ValueError):
+        ResponseCache(max_entries=0)
+    with pytest.raises(ValueError):
+        ResponseCache(ttl=0.0)
+
+
+def test_model_digest_invalidates_cached_answers(tmp_path: Path) -> None:
+    """同名模型重新拉取后摘要改变，之前缓存的回答不再命中"""
+    with FakeOllamaServer(content_tokens=5) as server:
+        client: ollama.Client = ollama.Client(host=server.host)
+        catalogue: ModelCatalogue = ModelCatalogue(client)
+        llm: OllamaLLM = OllamaLLM(
+            client,
+            catalogue=catalogue,
+            cache=ResponseCache(ttl=None, directory=tmp_path),
+        )
+        llm.set_model(DEFAULT_MODELS[0])
+        llm.set_temperature(0.0)
+        messages: list[dict[str, str]] = [{"role": "user", "content": "hello"}]
+
+        first: list[tuple[str, str]] = list(llm.chat(messages, False))
+        assert not llm.is_last_cached()
+        assert list(llm.chat(messages, False)) == [("", "".join(c for _, c in first))]
+        assert llm.is_last_cached()
+
+        server.digests[DEFAULT_MODELS[0]] = "sha256:" + "0" * 64
+        catalogue.invalidate()
+        list(llm.chat(messages, False))
+        assert not llm.is_last_cached()
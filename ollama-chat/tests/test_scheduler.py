@@ -0,0 +1,150 @@
+import asyncio
+
+import pytest
+
+from scheduler import QueueFullError, RequestScheduler, Ticket, percentile
+
+
+def drain(
+    scheduler: RequestScheduler, running: Ticket, tickets: list[Ticket]
+) -> list[Ticket]:
+    """依次释放正在执行的请求，返回排队的请求获得槽位的顺序"""
+    order: list[Ticket] = []
+    pending: list[Ticket] = list(tickets)
+    while pending:
+        scheduler.release(running)
+        running = next(ticket for ticket in pending if ticket.granted is not None)
+        pending.remove(running)
+        order.append(running)
+    scheduler.release(running)
+
+    return order
+
+
+def test_round_robin_across_sessions() -> None:
+    """排队的请求按会话轮流获得槽位，一个会话的大量请求不会饿死其他会话"""
+
+    async def run() -> None:
+        scheduler: RequestScheduler = RequestScheduler(max_concurrency=1)
+        running: Ticket = scheduler.submit("busy")
+        busy: list[Ticket] = [scheduler.submit("busy") for _ in range(4)]
+        quiet: Ticket = scheduler.submit("quiet")
+        other: Ticket = scheduler.submit("other")
+
+        order: list[Ticket] = drain(scheduler, running, busy + [quiet, other])
+        assert order[:3] == [busy[0], quiet, other]
+        assert order[3:] == busy[1:]
+
+    asyncio.run(run())
+
+
+def test_position_matches_the_grant_order() -> None:
+    """position 推算的排队位置与实际获得槽位的顺序一致"""
+
+    async def run() -> None:
+        scheduler: RequestScheduler = RequestScheduler(max_concurrency=1)
+        running: Ticket = scheduler.submit("a")
+        tickets: list[Ticket] = [
+            scheduler.submit(session_id) for session_id in "aaabbcab"
+        ]
+
+        positions: dict[Ticket, int] = {
+            ticket: scheduler.position(ticket) for ticket in tickets
+        }
+        order: list[Ticket] = drain(scheduler, running, tickets)
+        assert [positions[ticket] for ticket in order] == list(
+            range(1, len(tickets) + 1)
+        )
+        assert all(scheduler.position(ticket) == 0 for ticket in tickets)
+
+    asyncio.run(run())
+
+
+def test_queue_full_is_rejected() -> None:
+    """排队的请求数达到 max_queue 时拒绝新请求"""
+
+    async def run() -> None:
+        scheduler: RequestScheduler = RequestScheduler(max_concurrency=1, max_queue=2)
+        scheduler.submit("a")
+        scheduler.submit("a")
+        scheduler.submit("b")
+        with pytest.raises(QueueFullError):
+            scheduler.submit("c")
+
+        metrics: dict[str, int | float] = scheduler.get_metrics()
+        assert metrics["running"] == 1
+        assert metrics["queued"] == 2
+        assert metrics["rejected"] == 1
+
+        unqueued: RequestScheduler = RequestScheduler(max_concurrency=1, max_queue=0)
+        unqueued.submit("a")
+        with pytest.raises(QueueFullError):
+            unqueued.submit("b")
+
+    asyncio.run(run())
+
+
+def test_release_while_queued_is_abandoned() -> None:
+    """排队时释放的请求移出队列并计为放弃，不占用槽位"""
+
+    async def run() -> None:
+        scheduler: RequestScheduler = RequestScheduler(max_concurrency=1)
+        running: Ticket = scheduler.submit("a")
+        waiting: Ticket = scheduler.submit("b")
+        after: Ticket = scheduler.submit("c")
+
+        assert not await scheduler.wait(waiting, timeout=0.01)
+        scheduler.release(waiting)
+        scheduler.release(waiting)
+        assert not await scheduler.wait(waiting)
+        assert scheduler.position(after) == 1
+
+        scheduler.release(running)
+        assert await scheduler.wait(after)
+        scheduler.release(after)
+
+        metrics: dict[str, int | float] = scheduler.get_metrics()
+        assert metrics["admitted"] == 2
+        assert metrics["abandoned"] == 1
+        assert metrics["completed"] == 2
+        assert metrics["running"] == 0
+        assert metrics["queued"] == 0
+
+    asyncio.run(run())
+
+
+def test_wait_times_are_recorded() -> None:
+    """等待时间和服务时间计入分位数"""
+
+    async def run() -> dict[str, int | float]:
+        scheduler: RequestScheduler = RequestScheduler(max_concurrency=1)
+        running: Ticket = scheduler.submit("a")
+        waiting: Ticket = scheduler.submit("b")
+        await asyncio.sleep(0.05)
+        scheduler.release(running)
+        assert await scheduler.wait(waiting)
+        scheduler.release(waiting)
+        return scheduler.get_metrics()
+
+    metrics: dict[str, int | float] = asyncio.run(run())
+
+    assert metrics["wait_max"] >= 0.05
+    assert metrics["wait_p50"] <= metrics["wait_p95"] <= metrics["wait_max"]
+    assert metrics["service_max"] >= 0.05
+
+
+def test_percentile() -> None:
+    """空列表为 0，否则取下标为 int(q * 样本数) 的样本"""
+    assert percentile([], 0.5) == 0.0
+    assert percentile([1.0], 0.95) == 1.0
+    ordered: list[float] = [float(i) for i in range(1, 101)]
+    assert percentile(ordered, 0.50) == 51.0
+    assert percentile(ordered, 0.95) == 96.0
+    assert percentile(ordered, 1.0) == 100.0
+
+
+def test_invalid_arguments() -> None:
+    """max_concurrency 和 window 至少为 1，max_queue 不能为负"""
+    for kwargs in ({"max_concurrency": 0}, {"max_queue": -1}, {"window": 0}):
+        with pytest.raises(ValueError):
+            RequestScheduler(**kwargs)
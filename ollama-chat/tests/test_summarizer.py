@@ -0,0 +1,162 @@
+import asyncio
+
+import ollama
+import pytest
+
+from fake_ollama import DEFAULT_MODELS, FakeOllamaServer
+from memory import Memory
+from ollama_llm import OllamaLLM
+from scheduler import RequestScheduler
+from session_manager import SessionManager
+from summarizer import ConversationSummarizer
+
+# 上下文窗口很小，几轮对话后就有消息移出
+NUM_CTX: int = 512
+
+
+@pytest.fixture
+def server() -> FakeOllamaServer:
+    """不限速的 Ollama 替身服务端"""
+    with FakeOllamaServer(content_tokens=20) as server:
+        yield server
+
+
+def create_summarizer(
+    host: str, session_manager: SessionManager | None = None
+) -> ConversationSummarizer:
+    """创建连接替身服务端的摘要器，需要在事件循环中调用"""
+    llm: OllamaLLM = OllamaLLM(ollama.Client(host=host), ollama.AsyncClient(host=host))
+    llm.set_model(DEFAULT_MODELS[0])
+
+    return ConversationSummarizer(
+        llm,
+        RequestScheduler(),
+        max_tokens=64,
+        max_input_tokens=1024,
+        session_manager=session_manager,
+    )
+
+
+def create_memory(turns: int) -> Memory:
+    """添加若干轮对话并选取上下文，使较早的消息移出上下文窗口"""
+    memory: Memory = Memory()
+    memory.set_system_message("You are a helpful assistant.")
+    for i in range(turns):
+        memory.add_user_message(f"Fact {i}: the code word is {i * 7}. " * 4)
+        memory.add_assistant_message(f"Noted fact {i}. " * 8)
+    memory.add_user_message("What was the first code word?")
+    memory.get_context(NUM_CTX)
+
+    return memory
+
+
+def test_compact_summarizes_each_evicted_message_once(
+    server: FakeOllamaServer,
+) -> None:
+    """分多次请求压缩所有移出的消息，每条消息只压缩一次"""
+
+    async def run() -> tuple[Memory, int, dict[str, int | float]]:
+        summarizer: ConversationSummarizer = create_summarizer(server.host)
+        memory: Memory = create_memory(30)
+        compacted: int = await summarizer.compact(memory, "session")
+        # 没有新移出的消息时不再请求
+        assert await summarizer.compact(memory, "session") == 0
+        return memory, compacted, summarizer.get_stats()
+
+    memory, compacted, stats = asyncio.run(run())
+
+    assert memory.get_summary()
+    assert memory.get_summary_message() is not None
+    assert memory.get_evicted(1024) is None
+    assert compacted == stats["summarized_messages"] == memory._summarized
+    assert compacted % 2 == 0
+    assert 1 < stats["runs"] < compacted // 2
+    assert stats["failures"] == 0
+
+
+def test_schedule_runs_one_task_per_session(server: FakeOllamaServer) -> None:
+    """同一会话已有压缩任务时不再启动，没有移出的消息时不启动"""
+
+    async def run() -> None:
+        summarizer: ConversationSummarizer = create_summarizer(server.host)
+        memory: Memory = create_memory(30)
+
+        assert summarizer.schedule(memory, "session")
+        assert not summarizer.schedule(memory, "session")
+        assert summarizer.get_stats()["running"] == 1
+        await summarizer.wait()
+
+        assert summarizer.get_stats()["running"] == 0
+        assert not summarizer.schedule(memory, "session")
+        assert not summarizer.schedule(create_memory(1), "other")
+
+    asyncio.run(run())
+
+
+def test_summary_is_discarded_after_clear(server: FakeOllamaServer) -> None:
+    """生成摘要期间消息列表被清空时，旧对话的摘要不会写入"""
+    server.ttft = 0.3
+
+    async def run() -> tuple[Memory, dict[str, int | float]]:
+        summarizer: ConversationSummarizer = create_summarizer(server.host)
+        memory: Memory = create_memory(30)
+        assert summarizer.schedule(memory, "session")
+        await asyncio.sleep(0.1)
+        memory.clear()
+        await summarizer.wait()
+        return memory, summarizer.get_stats()
+
+    memory, stats = asyncio.run(run())
+
+    assert memory.get_summary() == ""
+    assert stats["runs"] == 0
+    assert stats["summarized_messages"] == 0
+
+
+def test_failures_are_counted(server: FakeOllamaServer) -> None:
+    """Ollama 出错时停止压缩并计数，摘要保持不变"""
+    server.failing = True
+
+    async def run() -> tuple[Memory, int, dict[str, int | float]]:
+        summarizer: ConversationSummarizer = create_summarizer(server.host)
+        memory: Memory = create_memory(30)
+        compacted: int = await summarizer.compact(memory, "session")
+        return memory, compacted, summarizer.get_stats()
+
+    memory, compacted, stats = asyncio.run(run())
+
+    assert compacted == 0
+    assert memory.get_summary() == ""
+    assert stats["failures"] == 1
+    assert stats["runs"] == 0
+
+
+def test_session_is_not_spilled_while_compacting(
+    server: FakeOllamaServer, tmp_path
+) -> None:
+    """压缩期间会话标记为正在使用，不会被换出；压缩结束后可以换出"""
+    server.ttft = 0.2
+
+    async def run() -> None:
+        session_manager: SessionManager = SessionManager(tmp_path, idle_timeout=0.01)
+        session_manager.start()
+        try:
+            summarizer: ConversationSummarizer = create_summarizer(
+                server.host, session_manager
+            )
+            memory: Memory = session_manager.register(create_memory(30))
+            assert summarizer.schedule(memory, "session")
+            await asyncio.sleep(0.1)
+
+            assert session_manager.evict() == 0
+            assert not memory.is_spilled()
+
+            await summarizer.wait()
+            assert memory.get_summary()
+            await asyncio.sleep(0.05)
+            assert session_manager.evict() == 1
+            assert memory.is_spilled()
+        finally:
+            session_manager.stop()
+
+    asyncio.run(run())
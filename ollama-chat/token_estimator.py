@@ -0,0 +1,224 @@
+import math
+import threading
+
+from typing import Iterable
+
+
+def _build_class_table() -> bytes:
+    """构建 UTF-8 字节到字符类别标记的转换表
+
+    每个字符只有一个首字节，根据首字节（必要时加上后续字节）即可判断字符类别：
+
+    - ``C``：E5 ~ E9，对应 U+5000 ~ U+9FFF，全部为中文字符
+    - ``a``：E4，对应 U+4000 ~ U+4FFF，第二字节为 B8 ~ BF 时是中文字符（U+4E00 起）
+    - ``b``：E3，对应 U+3000 ~ U+3FFF，第二字节为 80 时是中文标点（U+3000 ~ U+303F）
+    - ``c``：EF，对应 U+F000 ~ U+FFFF，第二字节为 BC ~ BE，或第二字节为 BF 且第三字节为 80 ~ AF 时是全角字符（U+FF00 ~ U+FFEF）
+    - ``E``：F0 ~ F4，4 字节字符，对应 U+10000 ~ U+10FFFF，视为表情
+
+    后续字节（80 ~ BF）按区间标记为 ``0`` ~ ``5``，其余字节标记为 ``.``
+
+    :returns: 长度为 256 的转换表，用于 bytes.translate
+    :rtype: bytes
+    """
+    table: bytearray = bytearray(b"." * 256)
+
+    for byte in range(0xE5, 0xEA):
+        table[byte] = ord("C")
+    table[0xE4] = ord("a")
+    table[0xE3] = ord("b")
+    table[0xEF] = ord("c")
+    for byte in range(0xF0, 0xF5):
+        table[byte] = ord("E")
+
+    table[0x80] = ord("0")
+    for byte in range(0x81, 0xB0):
+        table[byte] = ord("1")
+    for byte in range(0xB0, 0xB8):
+        table[byte] = ord("2")
+    for byte in range(0xB8, 0xBC):
+        table[byte] = ord("3")
+    for byte in range(0xBC, 0xBF):
+        table[byte] = ord("4")
+    table[0xBF] = ord("5")
+
+    return bytes(table)
+
+
+_CLASS_TABLE: bytes = _build_class_table()
+
+# 转换后表示中文字符的标记序列，每个中文字符恰好匹配其中一个
+# 按首字节标记分组，首字节标记不存在时跳过整组计数
+_CHINESE_MARKS: tuple[tuple[bytes, tuple[bytes, ...]], ...] = (
+    (b"a", (b"a3", b"a4", b"a5")),  # U+4E00 ~ U+4FFF
+    (b"b", (b"b0",)),  # U+3000 ~ U+303F
+    (b"c", (b"c4", b"c50", b"c51")),  # U+FF00 ~ U+FFEF
+)
+
+
+def count_char_classes(text: str) -> tuple[int, int, int]:
+    """统计字符串中各类字符的个数
+
+    纯 ASCII 字符串直接返回；否则将字符串编码为 UTF-8，用 bytes.translate 一次性把每个字节转换为类别标记，
+    再在 C 层计数，不会为匹配到的字符逐个构建列表
+
+    :param text: 待统计的字符串
+    :type text: str
+    :returns: (中文字符数, 非中文字符数, 表情数)，表情不计入非中文字符
+    :rtype: tuple[int, int, int]
+    """
+    if text.isascii():
+        return (0, len(text), 0)
+
+    marks: bytes = text.encode("utf-8", "surrogatepass").translate(_CLASS_TABLE)
+    # U+5000 ~ U+9FFF 只需看首字节
+    chinese_chars: int = marks.count(b"C")
+    for lead, patterns in _CHINESE_MARKS:
+        if lead in marks:
+            chinese_chars += sum(map(marks.count, patterns))
+    emoji_count: int = marks.count(b"E")
+
+    return (chinese_chars, len(text) - chinese_chars - emoji_count, emoji_count)
+
+
+def conservative_token_estimate(text: str) -> int:
+    """保守估计字符串分词后所占的 token 数
+
+    在无法提取模型的分词器的情况下，用该函数保守估计 token 数
+
+    :param text: 待估计的字符串
+    :type text: str
+    :returns: 保守估计的 token 数
+    :rtype: int
+    """
+    chinese_chars, non_chinese_chars, emoji_count = count_char_classes(text)
+
+    # 平均每个中文字符占 1.3 token
+    chinese_tokens = int(math.ceil(chinese_chars * 1.3))
+    # 平均每个非中文字符占 0.6 token
+    non_chinese_tokens = (
+        max(1, int(math.ceil(non_chinese_chars * 0.6))) if non_chinese_chars > 0 else 0
+    )
+    # 平均每个表情占 2 token
+    emoji_tokens = emoji_count * 2
+
+    total = chinese_tokens + non_chinese_tokens + emoji_tokens
+
+    # 额外加 5% buffer 防边界情况
+    return int(total * 1.05 + 1)
+
+
+def conservative_token_estimate_batch(texts: Iterable[str]) -> list[int]:
+    """批量保守估计多个字符串的 token 数
+
+    例如导入整段对话历史时，一次性估计所有消息
+
+    :param texts: 待估计的字符串
+    :type texts: Iterable[str]
+    :returns: 与 texts 一一对应的 token 估计数
+    :rtype: list[int]
+    """
+    return [conservative_token_estimate(text) for text in texts]
+
+
+class TokenCalibrator:
+    """token 估计校准器
+
+    conservative_token_estimate 的字符比例是经验值，不同模型的分词器差异很大。
+    校准器用 Ollama 返回的 prompt_eval_count（真实 token 数）与估计值之比，在线学习每个模型的修正系数
+
+    - 真实值大于估计值时快速上调系数，小于时缓慢下调，避免上下文溢出
+    - 比值超出 [min_ratio, max_ratio] 的样本视为异常（例如命中 Ollama 的提示词缓存时 prompt_eval_count 偏小），直接丢弃
+    - 修正系数限制在 [min_factor, max_factor] 范围内
+
+    多个会话共享同一个实例，线程安全
+    """
+
+    def __init__(
+        self,
+        alpha_up: float = 0.5,
+        alpha_down: float = 0.1,
+        min_ratio: float = 0.5,
+        max_ratio: float = 2.0,
+        min_factor: float = 0.5,
+        max_factor: float = 2.0,
+        min_tokens: int = 64,
+        safety_margin: float = 0.05,
+    ) -> None:
+        # 上调和下调修正系数时的平滑系数
+        self._alpha_up: float = alpha_up
+        self._alpha_down: float = alpha_down
+        # 单个样本 真实值 / 估计值 的合理范围
+        self._min_ratio: float = min_ratio
+        self._max_ratio: float = max_ratio
+        # 修正系数的范围
+        self._min_factor: float = min_factor
+        self._max_factor: float = max_factor
+        # 估计值太小的样本受聊天模板开销影响大，不参与校准
+        self._min_tokens: int = min_tokens
+        # 校准后的估计值额外留出的余量
+        self._safety_margin: float = safety_margin
+        # 模型 id -> 真实值 / 估计值 的平滑值
+        self._ratios: dict[str, float] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def get_factor(self, model: str) -> float:
+        """获取模型的修正系数
+
+        :param model: ollama 模型 id
+        :type model: str
+        :returns: 修正系数，估计值乘以该系数即为校准后的 token 数；尚未校准的模型返回 1.0
+        :rtype: float
+        """
+        with self._lock:
+            ratio: float | None = self._ratios.get(model)
+
+        if ratio is None:
+            return 1.0
+
+        return min(
+            self._max_factor,
+            max(self._min_factor, ratio * (1.0 + self._safety_margin)),
+        )
+
+    def update(self, model: str, estimated_tokens: int, actual_tokens: int) -> bool:
+        """用一次生成的真实 token 数更新模型的修正系数
+
+        :param model: ollama 模型 id
+        :type model: str
+        :param estimated_tokens: 发送给模型的消息列表的 token 估计数
+        :type estimated_tokens: int
+        :param actual_tokens: Ollama 返回的 prompt_eval_count
+        :type actual_tokens: int
+        :returns: 样本是否被采用
+        :rtype: bool
+        """
+        if estimated_tokens < self._min_tokens or actual_tokens <= 0:
+            return False
+
+        ratio: float = actual_tokens / estimated_tokens
+        if ratio < self._min_ratio or ratio > self._max_ratio:
+            return False
+
+        with self._lock:
+            previous: float | None = self._ratios.get(model)
+            if previous is None:
+                self._ratios[model] = ratio
+            else:
+                alpha: float = self._alpha_up if ratio > previous else self._alpha_down
+                self._ratios[model] = previous + alpha * (ratio - previous)
+
+        return True
+
+    def reset(self, model: str | None = None) -> None:
+        """清除修正系数
+
+        :param model: ollama 模型 id，为 None 时清除所有模型
+        :type model: str | None
+        :returns: 无
+        :rtype: None
+        """
+        with self._lock:
+            if model is None:
+                self._ratios.clear()
+            else:
+                self._ratios.pop(model, None)